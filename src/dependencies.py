@@ -9,8 +9,8 @@
 import sys
 
 import Crypto
-import fabric
 import netifaces
+import paramiko
 import pytest
 import requests
 import scapy
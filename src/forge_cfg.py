@@ -20,6 +20,7 @@
 # pylint: disable=unused-argument
 
 import os
+import pwd
 import threading
 import fcntl
 import socket
@@ -37,6 +38,9 @@ SETTINGS = {
     'LOGLEVEL': 'info',
     'SOFTWARE_UNDER_TEST': ('kea4_server', 'bind9_server'),
     'SHOW_PACKETS_FROM': 'both',
+    'SHOW_PACKETS': 'on-failure',
+    'PACKET_LOG_SIZE': 500,
+    'PACKET_CAPTURE': False,
     'SRV4_ADDR': None,
     'SRV4_ADDR_2': '',
     'REL4_ADDR': '0.0.0.0',
@@ -66,7 +70,14 @@ SETTINGS = {
     'MGMT_ADDRESS_3': '',
     'MGMT_USERNAME': None,
     'MGMT_PASSWORD': None,
+    'TRANSPORT': 'auto',
     'SAVE_LOGS': True,
+    'LOG_MIRROR': True,
+    'ARTIFACTS': 'always',
+    'ARTIFACTS_COMPRESSION': 'zstd',
+    'ARTIFACTS_STORE_COMPRESSED': False,
+    'PERSISTENT_PACKET_SOCKET': True,
+    'PACKET_TEMPLATES': True,
     'BIND_LOG_TYPE': 'INFO',
     'BIND_LOG_LVL': 0,
     'BIND_MODULE': '',
@@ -111,6 +122,10 @@ class ForgeConfiguration:
 
         self.multiple_tested_servers = [self.mgmt_address]
 
+        # addresses of this machine, systems under test reachable at them can be managed without ssh
+        self.local_addresses = self._get_local_addresses()
+        self._local_transport = {}
+
         self.proto = 'v4'  # default value but it is overriden by each test in terrain.declare_all()
 
         # change this at the beginning of the test and we have
@@ -189,6 +204,43 @@ class ForgeConfiguration:
             print(f"setting {key.lower()} = {value}")  # TODO turn it into forge parameter like --debug
             setattr(self, key.lower(), value)
 
+    @staticmethod
+    def _get_local_addresses():
+        addresses = {'localhost'}
+        for iface in netifaces.interfaces():
+            for family in (netifaces.AF_INET, netifaces.AF_INET6):
+                for addr in netifaces.ifaddresses(iface).get(family, []):
+                    addresses.add(addr['addr'].split('%')[0])
+        return addresses
+
+    def is_local_transport(self, address):
+        """
+        Check if system under test at management address should be managed by running commands
+        directly on this machine instead of over ssh. Controlled by TRANSPORT setting:
+        'ssh', 'local' or 'auto' - local if address belongs to this machine, ssh port is not given
+        or is 22 and forge runs as root or as MGMT_USERNAME.
+        :param address: management address, optionally with ssh port
+        :return: True if local transport should be used
+        """
+        if self.transport != 'auto':
+            return self.transport == 'local'
+        if address not in self._local_transport:
+            host, port = address, '22'
+            if address.count(':') == 1:
+                host, port = address.split(':')
+            if port != '22':
+                # other port on a local address is forwarded e.g. into a container or VM
+                self._local_transport[address] = False
+                return False
+            try:
+                resolved = {info[4][0] for info in socket.getaddrinfo(host, None)}
+            except socket.gaierror:
+                resolved = set()
+            resolved.add(host)
+            same_user = os.geteuid() == 0 or pwd.getpwuid(os.geteuid()).pw_name == self.mgmt_username
+            self._local_transport[address] = same_user and not resolved.isdisjoint(self.local_addresses)
+        return self._local_transport[address]
+
     def gethwaddr(self, ifname):
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         info = fcntl.ioctl(s.fileno(), 0x8927, struct.pack('256s', bytes(ifname, 'utf-8')[:15]))
@@ -204,6 +256,9 @@ class ForgeConfiguration:
             print("Configuration failure, mgmt_address is empty. "
                   "Please use ./src/forge_cfg.py -T to validate configuration.")
             sys.exit(-1)
+        if self.transport not in ('auto', 'ssh', 'local'):
+            print("Configuration failure, transport should be one of 'auto', 'ssh' or 'local'.")
+            sys.exit(-1)
 
     def set_env_val(self, env_name, env_val):
         """
@@ -24,7 +24,7 @@ def logger_initialize(loglevel):
         raise ValueError(f'Invalid log level: {loglevel}')
     logger.setLevel(numeric_level)
 
-    # make paramiko logger from fabric quiet
+    # make paramiko logger quiet
     paramiko_sftp_logger = logging.getLogger('paramiko')
     paramiko_sftp_logger.setLevel(logging.WARN)
 
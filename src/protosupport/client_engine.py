@@ -0,0 +1,395 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Many simulated DHCP clients exchanging messages with the server at once.
+
+Step functions exchange messages of one client at a time, and each exchange waits for its answer
+before the next one starts. ClientEngine keeps up to in_flight virtual clients (each with its own
+MAC address, client-id/DUID and IAIDs) in the middle of their exchanges over one socket: every
+message is sent with a new transaction ID, and received messages are passed to the client waiting
+for that transaction ID, which sends its next message right away. Messages are built and parsed
+with dhcp_codec, without scapy.
+
+Each client goes through the given steps:
+    DHCPv4: 'DORA' (DISCOVER, OFFER, REQUEST, ACK), 'DO' (DISCOVER, OFFER), 'renew' (REQUEST with
+            ciaddr, ACK), 'release' (RELEASE, no answer)
+    DHCPv6: 'SARR' (SOLICIT, ADVERTISE, REQUEST, REPLY), 'SA' (SOLICIT, ADVERTISE), 'renew' (RENEW, REPLY),
+            'release' (RELEASE, REPLY)
+Unanswered messages are retransmitted, a client that got no answer after all retries or got NAK
+(or error status in DHCPv6) stops and keeps the reason in client.failed.
+
+DHCPv4 messages are sent and received as Ethernet frames on a packet socket in promiscuous mode,
+as srp() does, so answers sent to MAC addresses of virtual clients are received as well.
+DHCPv6 uses UDP socket bound to the client link local address, answers are sent to it.
+"""
+
+import time
+import heapq
+import random
+import select
+import socket
+import struct
+import logging
+import dataclasses
+
+from scapy.arch import get_if_hwaddr
+
+from src.forge_cfg import world
+from src.protosupport import dhcp_codec as codec
+
+log = logging.getLogger('forge')
+
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_OUTGOING = 4
+RECV_BUFFER = 4 * 1024 * 1024
+
+STEPS = {False: ('DORA', 'DO', 'renew', 'release'), True: ('SARR', 'SA', 'renew', 'release')}
+# message sent at the start of each step and the answer expected to it
+_FIRST_MESSAGE = {'DORA': ('DISCOVER', 'OFFER'), 'renew': ('REQUEST', 'ACK'), 'release': ('RELEASE', None),
+                  'DO': ('DISCOVER', 'OFFER'), 'SARR': ('SOLICIT', 'ADVERTISE'), 'SA': ('SOLICIT', 'ADVERTISE')}
+_FIRST_MESSAGE_V6 = {'renew': ('RENEW', 'REPLY'), 'release': ('RELEASE', 'REPLY')}
+
+
+@dataclasses.dataclass
+class Exchange:
+    """
+    State of the exchange a virtual client is in: the step, the message sent last and its retransmissions.
+    """
+    steps: list = dataclasses.field(default_factory=list)
+    step: str = None
+    expected: str = None
+    message: str = None
+    xid: int = None
+    sent: int = 0
+    sent_at: float = None
+    seq: int = 0
+
+
+class VirtualClient:
+    """
+    One simulated client, its exchange and the leases it got.
+    """
+    def __init__(self, mac, client_id=None, duid=None, iaids=(), pd_iaids=(), options=()):
+        """
+        :param mac: MAC address (chaddr in DHCPv4)
+        :param client_id: DHCPv4 client identifier (option 61), 'xx:xx:..', not sent if None
+        :param duid: DHCPv6 client DUID, 'xx:xx:..'
+        :param iaids: IAIDs of IA_NA options sent by DHCPv6 client
+        :param pd_iaids: IAIDs of IA_PD options sent by DHCPv6 client
+        :param options: other options sent in every message, list of (code, bytes), e.g. vendor class
+        """
+        self.mac = mac
+        self.client_id = client_id
+        self.duid = duid
+        self.iaids = list(iaids)
+        self.pd_iaids = list(pd_iaids)
+        self.options = list(options)
+        self.exchange = Exchange()
+        # results
+        self.server_id = None
+        self.address = None
+        self.ia_na = []
+        self.ia_pd = []
+        self.leases = []
+        self.failed = None
+
+    def __repr__(self):
+        return f'<VirtualClient {self.mac} step={self.exchange.step} failed={self.failed}>'
+
+
+class ClientEngine:
+    """
+    Drives virtual clients over one socket on world.cfg["iface"].
+    """
+    def __init__(self, ipv6, in_flight=100, timeout=None, retries=2):
+        """
+        :param ipv6: True for DHCPv6 clients, False for DHCPv4
+        :param in_flight: how many clients may wait for an answer at the same time
+        :param timeout: time to wait for an answer before retransmission, world.cfg['wait_interval'] if None
+        :param retries: number of retransmissions of unanswered message
+        """
+        self.ipv6 = ipv6
+        self.in_flight = in_flight
+        self.timeout = timeout if timeout is not None else world.cfg['wait_interval']
+        self.retries = retries
+        self.iface = world.cfg["iface"]
+        self.sport = world.cfg["source_port"]
+        self.dport = world.cfg["destination_port"]
+        self._xid = random.randint(0, 0xffffff)
+        self._waiting = {}
+        self._deadlines = []
+        self.sent = 0
+        self.received = 0
+        self.socket = self._open()
+
+    def _open(self):
+        if self.ipv6:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            scope = socket.if_nametoindex(self.iface)
+            sock.bind((world.cfg["cli_link_local"], self.sport, 0, scope))
+            self._destination = (world.cfg["address_v6"], self.dport, 0, scope)
+        else:
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(codec.ETH_P_IP))
+            sock.bind((self.iface, codec.ETH_P_IP))
+            membership = struct.pack('iHH8s', socket.if_nametoindex(self.iface), PACKET_MR_PROMISC, 0, b'')
+            sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, membership)
+            self._hwaddr = get_if_hwaddr(self.iface)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        sock.setblocking(False)
+        return sock
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ---------------------------------------------------------------- sending
+
+    def _next_xid(self):
+        self._xid = (self._xid + 1) & 0xffffff
+        return self._xid
+
+    def _send(self, client, message, expected, xid=None):
+        """
+        Send message of the client, it waits for expected answer (if any) under new transaction ID.
+        """
+        exchange = client.exchange
+        exchange.message = message
+        exchange.expected = expected
+        exchange.xid = xid if xid is not None else self._next_xid()
+        exchange.sent = 0
+        self._transmit(client)
+
+    def _transmit(self, client):
+        exchange = client.exchange
+        data = self._encode(client, exchange.message, exchange.xid)
+        if self.ipv6:
+            self.socket.sendto(data, self._destination)
+        else:
+            self.socket.send(codec.udp4_frame(data, self._hwaddr, 'ff:ff:ff:ff:ff:ff', world.cfg["source_IP"],
+                                              world.cfg["destination_IP"], self.sport, self.dport))
+        self.sent += 1
+        exchange.sent += 1
+        exchange.sent_at = time.monotonic()
+        exchange.seq += 1
+        if exchange.expected is None:
+            self._next_step(client)
+            return
+        self._waiting[exchange.xid] = client
+        heapq.heappush(self._deadlines, (time.monotonic() + self.timeout, exchange.seq, id(client), client))
+
+    def _encode(self, client, message, xid):
+        if self.ipv6:
+            server_id = None if message == 'SOLICIT' else client.server_id
+            if message == 'SOLICIT':
+                ia_na, ia_pd = client.iaids, client.pd_iaids
+            else:
+                ia_na, ia_pd = client.ia_na, client.ia_pd
+            return codec.encode_v6(message, xid, client.duid, server_id=server_id, ia_na=ia_na, ia_pd=ia_pd,
+                                   elapsed_time=0, options=client.options)
+        if message == 'DISCOVER':
+            return codec.encode_v4(message, xid, client.mac, client_id=client.client_id, param_req_list=[1],
+                                   options=client.options)
+        if message == 'REQUEST' and client.exchange.step == 'DORA':
+            return codec.encode_v4(message, xid, client.mac, requested_addr=client.address,
+                                   server_id=client.server_id, client_id=client.client_id, param_req_list=[1],
+                                   options=client.options)
+        if message == 'REQUEST':
+            return codec.encode_v4(message, xid, client.mac, ciaddr=client.address, client_id=client.client_id,
+                                   param_req_list=[1], options=client.options)
+        return codec.encode_v4(message, xid, client.mac, ciaddr=client.address, server_id=client.server_id,
+                               client_id=client.client_id, options=client.options)
+
+    def _start(self, client, steps):
+        client.exchange.steps = list(steps)
+        client.failed = None
+        self._next_step(client)
+
+    def _next_step(self, client):
+        exchange = client.exchange
+        if client.failed or not exchange.steps:
+            exchange.step = None
+            return
+        exchange.step = exchange.steps.pop(0)
+        if self.ipv6 and exchange.step in _FIRST_MESSAGE_V6:
+            message, expected = _FIRST_MESSAGE_V6[exchange.step]
+        else:
+            message, expected = _FIRST_MESSAGE[exchange.step]
+        if exchange.step in ('renew', 'release') and not (client.address or client.ia_na or client.ia_pd):
+            client.failed = f'no lease to {exchange.step}'
+            exchange.step = None
+            return
+        self._send(client, message, expected)
+
+    # -------------------------------------------------------------- receiving
+
+    def _receive(self):
+        """
+        Read all waiting messages and pass them to their clients.
+        """
+        while True:
+            try:
+                if self.ipv6:
+                    data = self.socket.recv(65535)
+                else:
+                    data, address = self.socket.recvfrom(65535)
+                    if address[2] == PACKET_OUTGOING:
+                        continue
+                    data = codec.udp4_payload(data, self.sport)
+                    if data is None:
+                        continue
+            except BlockingIOError:
+                return
+            try:
+                msg = codec.decode_v6(data) if self.ipv6 else codec.decode_v4(data)
+            except (AssertionError, struct.error):
+                continue
+            if not self.ipv6 and msg.op != 2:
+                continue
+            client = self._waiting.get(msg.trid if self.ipv6 else msg.xid)
+            if client is None:
+                continue
+            self.received += 1
+            self._answer(client, msg)
+
+    def _answer(self, client, msg):
+        message_type = msg.message_type
+        if message_type not in (client.exchange.expected, 'NAK'):
+            # e.g. late OFFER of other server, the client keeps waiting
+            return
+        del self._waiting[client.exchange.xid]
+        client.exchange.seq += 1
+        done = False
+        if message_type == 'NAK':
+            client.failed = 'NAK'
+        elif self.ipv6:
+            done = self._answer_v6(client, msg)
+        else:
+            done = self._answer_v4(client, msg)
+        if client.failed:
+            client.exchange.step = None
+        elif done:
+            self._next_step(client)
+
+    def _answer_v4(self, client, msg):
+        """
+        :return: True if the step is done, False if the client sent next message of the step
+        """
+        if msg.message_type == 'OFFER':
+            client.address = msg.yiaddr
+            client.server_id = msg.server_id
+            if client.exchange.step == 'DO':
+                return True
+            # REQUEST keeps transaction ID of DISCOVER
+            self._send(client, 'REQUEST', 'ACK', xid=client.exchange.xid)
+            return False
+        lease = {"hwaddr": client.mac, "address": msg.yiaddr}
+        client_id = msg.options.get(codec.OPT4_CLIENT_ID)
+        if client_id is not None:
+            lease["client_id"] = client_id.hex()
+        if msg.lease_time is not None:
+            lease["valid_lifetime"] = msg.lease_time
+        if msg.server_id is not None:
+            lease["server_id"] = msg.server_id
+        client.address = msg.yiaddr
+        client.leases = [lease]
+        return True
+
+    def _answer_v6(self, client, msg):
+        """
+        :return: True if the step is done, False if the client sent next message of the step
+        """
+        status = msg.status
+        if status and status[0] != 0:
+            client.failed = f'status code {status[0]}: {status[1]}'
+            return True
+        if msg.message_type == 'ADVERTISE':
+            client.server_id = msg.server_id
+            client.ia_na, client.ia_pd = msg.ia_na, msg.ia_pd
+            if client.exchange.step == 'SA':
+                return True
+            self._send(client, 'REQUEST', 'REPLY')
+            return False
+        if client.exchange.step == 'release':
+            return True
+        client.ia_na, client.ia_pd = msg.ia_na, msg.ia_pd
+        duid = (msg.client_id or codec.hex_bytes(client.duid)).hex(':')
+        client.leases = [{"duid": duid, "iaid": ia.iaid, "valid_lifetime": addr.valid, "pref_lifetime": addr.preferred,
+                          "address": addr.address, "prefix_len": 0}
+                         for ia in client.ia_na for addr in ia.addresses]
+        client.leases += [{"duid": duid, "iaid": ia.iaid, "valid_lifetime": prefix.valid,
+                           "pref_lifetime": prefix.preferred, "address": prefix.prefix, "prefix_len": prefix.length}
+                          for ia in client.ia_pd for prefix in ia.prefixes]
+        return True
+
+    def _expire(self):
+        """
+        Retransmit messages whose answer did not come in time, fail clients out of retries.
+        """
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, seq, _, client = heapq.heappop(self._deadlines)
+            if seq != client.exchange.seq:
+                # answered or retransmitted since
+                continue
+            if client.exchange.sent > self.retries:
+                self._give_up(client)
+            else:
+                self._transmit(client)
+
+    def _give_up(self, client):
+        del self._waiting[client.exchange.xid]
+        client.failed = f'no answer to {client.exchange.message}'
+        client.exchange.step = None
+
+    # ---------------------------------------------------------------- running
+
+    def run(self, clients, steps=None):
+        """
+        Run the steps for all clients, at most in_flight of them wait for an answer at once.
+
+        :param clients: list of VirtualClient
+        :param steps: list of steps, ('DORA',) or ('SARR',) if None
+        :return: list of clients, with results in their leases and failed attributes
+        """
+        steps = list(steps or (STEPS[self.ipv6][0],))
+        for step in steps:
+            assert step in STEPS[self.ipv6], f"Unknown step {step}, use one of {STEPS[self.ipv6]}"
+        waiting_to_start = list(reversed(clients))
+        start = time.monotonic()
+        while waiting_to_start or self._waiting:
+            while waiting_to_start and len(self._waiting) < self.in_flight:
+                client = waiting_to_start.pop()
+                self._start(client, steps)
+            timeout = max(0.0, self._deadlines[0][0] - time.monotonic()) if self._deadlines else self.timeout
+            ready, _, _ = select.select([self.socket], [], [], timeout)
+            if ready:
+                self._receive()
+            self._expire()
+        failed = sum(1 for client in clients if client.failed)
+        log.info("%d clients done %s in %.2fs, %d messages sent, %d received, %d clients failed", len(clients),
+                 '/'.join(steps), time.monotonic() - start, self.sent, self.received, failed)
+        return clients
+
+
+def run_clients(clients, ipv6, steps=None, in_flight=100, timeout=None, retries=2):
+    """
+    Run clients in one ClientEngine and return their leases.
+
+    :return: list of lease dicts in the form returned by srv_msg.get_all_leases(), taken from the last
+             ACK/REPLY that assigned leases to each client
+    """
+    with ClientEngine(ipv6, in_flight=in_flight, timeout=timeout, retries=retries) as engine:
+        engine.run(clients, steps)
+    return [lease for client in clients for lease in client.leases]
@@ -0,0 +1,414 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Fast DHCP encoder and decoder for loops generating many leases.
+
+Building and dissecting packets with scapy layers costs far more CPU than the exchange itself
+once the sockets are fast. This module builds the common client messages (DHCPv4 DISCOVER,
+REQUEST, RELEASE; DHCPv6 SOLICIT, REQUEST, RENEW, RELEASE with IA_NA and IA_PD) directly into
+bytes with struct, and decodes server messages into light views whose options are split only
+when they are first accessed. Messages are UDP payloads, exactly what scapy's BOOTP()/DHCP()
+and DHCP6 layers produce for the same content.
+
+Step functions (srv_msg.*) stay on scapy, it checks much more details of the messages.
+"""
+
+import socket
+import struct
+from collections import namedtuple
+
+DHCP4_MESSAGE_TYPES = {'DISCOVER': 1, 'OFFER': 2, 'REQUEST': 3, 'DECLINE': 4, 'ACK': 5, 'NAK': 6,
+                       'RELEASE': 7, 'INFORM': 8}
+DHCP6_MESSAGE_TYPES = {'SOLICIT': 1, 'ADVERTISE': 2, 'REQUEST': 3, 'CONFIRM': 4, 'RENEW': 5, 'REBIND': 6,
+                       'REPLY': 7, 'RELEASE': 8, 'DECLINE': 9, 'INFOREQUEST': 11}
+_DHCP4_NAMES = {code: name for name, code in DHCP4_MESSAGE_TYPES.items()}
+_DHCP6_NAMES = {code: name for name, code in DHCP6_MESSAGE_TYPES.items()}
+
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+
+# DHCPv4 option codes
+OPT4_PAD = 0
+OPT4_REQUESTED_ADDR = 50
+OPT4_LEASE_TIME = 51
+OPT4_MESSAGE_TYPE = 53
+OPT4_SERVER_ID = 54
+OPT4_PARAM_REQ_LIST = 55
+OPT4_CLIENT_ID = 61
+OPT4_END = 255
+
+# DHCPv6 option codes
+OPT6_CLIENT_ID = 1
+OPT6_SERVER_ID = 2
+OPT6_IA_NA = 3
+OPT6_IA_ADDR = 5
+OPT6_ORO = 6
+OPT6_ELAPSED_TIME = 8
+OPT6_STATUS_CODE = 13
+OPT6_IA_PD = 25
+OPT6_IA_PREFIX = 26
+
+# op, htype, hlen, hops, xid, secs, flags, ciaddr, yiaddr, siaddr, giaddr, chaddr, sname, file
+_BOOTP = struct.Struct('!BBBBIHH4s4s4s4s16s64s128s')
+_OPT6 = struct.Struct('!HH')
+_IA = struct.Struct('!III')
+_IA_ADDR = struct.Struct('!16sII')
+_IA_PREFIX = struct.Struct('!IIB16s')
+_ETHER = struct.Struct('!6s6sH')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_UDP = struct.Struct('!HHHH')
+ETH_P_IP = 0x0800
+
+IANA = namedtuple('IANA', 'iaid t1 t2 addresses status')
+IAAddress = namedtuple('IAAddress', 'address preferred valid')
+IAPD = namedtuple('IAPD', 'iaid t1 t2 prefixes status')
+IAPrefix = namedtuple('IAPrefix', 'prefix length preferred valid')
+
+
+def hex_bytes(value):
+    """
+    MAC address or DUID written as 'xx:xx:..' (or plain hex) to bytes, bytes are returned as they are.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return bytes.fromhex(value.replace(':', ''))
+
+
+def _ipv4(address):
+    return socket.inet_aton(address) if address else b'\x00' * 4
+
+
+def _ipv6(address):
+    return socket.inet_pton(socket.AF_INET6, address)
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def udp4_frame(payload, src_mac, dst_mac, src_ip, dst_ip, sport, dport):
+    """
+    Ethernet frame with IPv4/UDP packet carrying the payload, as sent by srp() in DHCPv4 tests.
+    """
+    src_ip, dst_ip = _ipv4(src_ip), _ipv4(dst_ip)
+    udp_len = _UDP.size + len(payload)
+    pseudo_header = src_ip + dst_ip + struct.pack('!BBH', 0, socket.IPPROTO_UDP, udp_len)
+    udp_sum = _checksum(pseudo_header + _UDP.pack(sport, dport, udp_len, 0) + payload) or 0xffff
+    ip = _IPV4.pack(0x45, 0, 20 + udp_len, 1, 0, 64, socket.IPPROTO_UDP, 0, src_ip, dst_ip)
+    ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+    return _ETHER.pack(hex_bytes(dst_mac), hex_bytes(src_mac), ETH_P_IP) + ip + \
+        _UDP.pack(sport, dport, udp_len, udp_sum) + payload
+
+
+def udp4_payload(frame, dport):
+    """
+    Payload of IPv4/UDP packet to port dport in the Ethernet frame, None for any other frame.
+    """
+    if len(frame) < 42 or frame[12:14] != b'\x08\x00' or frame[23] != socket.IPPROTO_UDP:
+        return None
+    udp = 14 + (frame[14] & 0x0f) * 4
+    sport_dport_len = frame[udp:udp + 6]
+    if len(sport_dport_len) < 6:
+        return None
+    _, port, length = struct.unpack('!HHH', sport_dport_len)
+    if port != dport:
+        return None
+    return frame[udp + _UDP.size:udp + length]
+
+
+class OptionView:
+    """
+    Options of a received message: code -> list of values (bytes), split on first access.
+    DHCPv4 options have one byte code and length, DHCPv6 ones two bytes.
+    """
+    def __init__(self, data, start, end, wide):
+        self._data = data
+        self._start = start
+        self._end = end
+        self._wide = wide
+        self._options = None
+
+    def _parse(self):
+        options = {}
+        data, i, end = self._data, self._start, self._end
+        if self._wide:
+            while i + 4 <= end:
+                code, length = _OPT6.unpack_from(data, i)
+                options.setdefault(code, []).append(data[i + 4:i + 4 + length])
+                i += 4 + length
+        else:
+            while i < end:
+                code = data[i]
+                if code == OPT4_PAD:
+                    i += 1
+                    continue
+                if code == OPT4_END or i + 1 >= end:
+                    break
+                length = data[i + 1]
+                options.setdefault(code, []).append(data[i + 2:i + 2 + length])
+                i += 2 + length
+        self._options = options
+        return options
+
+    @property
+    def options(self):
+        return self._options if self._options is not None else self._parse()
+
+    def __contains__(self, code):
+        return code in self.options
+
+    def __iter__(self):
+        return iter(self.options)
+
+    def get(self, code, default=None):
+        """
+        Value of the first option with the code.
+        """
+        values = self.options.get(code)
+        return values[0] if values else default
+
+    def get_all(self, code):
+        return self.options.get(code, [])
+
+
+#########################################################################
+# DHCPv4
+
+
+# BOOTP fields of client messages which can be set in encode_v4()
+_BOOTP_DEFAULTS = {'ciaddr': None, 'yiaddr': None, 'siaddr': None, 'giaddr': None, 'flags': 0, 'secs': 0, 'hops': 0}
+
+
+def _option4(code, value):
+    return bytes((code, len(value))) + value
+
+
+def encode_v4(msg_type, xid, chaddr, requested_addr=None, server_id=None, client_id=None, param_req_list=None,
+              options=(), **fields):
+    """
+    Build DHCPv4 client message.
+
+    :param msg_type: message name (e.g. 'DISCOVER') or code
+    :param xid: transaction ID
+    :param chaddr: client hardware address, 'xx:xx:..' or bytes
+    :param requested_addr: value of option 50, e.g. in REQUEST
+    :param server_id: value of option 54
+    :param client_id: value of option 61, 'xx:xx:..' or bytes
+    :param param_req_list: list of requested option codes (option 55)
+    :param options: other options, list of (code, bytes)
+    :param fields: other BOOTP fields: ciaddr (e.g. in RELEASE), yiaddr, siaddr, giaddr, flags, secs, hops
+    :return: bytes of BOOTP message with options
+    """
+    unknown = set(fields) - set(_BOOTP_DEFAULTS)
+    assert not unknown, f"unknown BOOTP fields: {', '.join(sorted(unknown))}"
+    fields = dict(_BOOTP_DEFAULTS, **fields)
+    msg_type = DHCP4_MESSAGE_TYPES.get(msg_type, msg_type)
+    chaddr = hex_bytes(chaddr)
+    out = bytearray(_BOOTP.pack(1, 1, len(chaddr), fields['hops'], xid, fields['secs'], fields['flags'],
+                                _ipv4(fields['ciaddr']), _ipv4(fields['yiaddr']), _ipv4(fields['siaddr']),
+                                _ipv4(fields['giaddr']), chaddr, b'', b''))
+    out += MAGIC_COOKIE
+    out += bytes((OPT4_MESSAGE_TYPE, 1, msg_type))
+    if requested_addr:
+        out += _option4(OPT4_REQUESTED_ADDR, _ipv4(requested_addr))
+    if server_id:
+        out += _option4(OPT4_SERVER_ID, _ipv4(server_id))
+    if client_id is not None:
+        out += _option4(OPT4_CLIENT_ID, hex_bytes(client_id))
+    if param_req_list:
+        out += _option4(OPT4_PARAM_REQ_LIST, bytes(param_req_list))
+    for code, value in options:
+        out += _option4(code, value)
+    out.append(OPT4_END)
+    return bytes(out)
+
+
+class DHCP4View:
+    """
+    Received DHCPv4 message: fixed fields are unpacked right away, options on first access.
+    """
+    __slots__ = ('data', 'op', 'htype', 'hlen', 'hops', 'xid', 'secs', 'flags', '_addrs', '_chaddr', 'options')
+
+    def __init__(self, data):
+        assert len(data) >= _BOOTP.size + len(MAGIC_COOKIE), f"DHCPv4 message is too short: {len(data)} bytes"
+        self.data = data
+        (self.op, self.htype, self.hlen, self.hops, self.xid, self.secs, self.flags,
+         ciaddr, yiaddr, siaddr, giaddr, self._chaddr, _, _) = _BOOTP.unpack_from(data)
+        self._addrs = (ciaddr, yiaddr, siaddr, giaddr)
+        self.options = OptionView(data, _BOOTP.size + len(MAGIC_COOKIE), len(data), wide=False)
+
+    ciaddr = property(lambda self: socket.inet_ntoa(self._addrs[0]))
+    yiaddr = property(lambda self: socket.inet_ntoa(self._addrs[1]))
+    siaddr = property(lambda self: socket.inet_ntoa(self._addrs[2]))
+    giaddr = property(lambda self: socket.inet_ntoa(self._addrs[3]))
+
+    @property
+    def chaddr(self):
+        return self._chaddr[:self.hlen].hex(':')
+
+    @property
+    def message_type(self):
+        """
+        Name of the message type (option 53), 'UNKNOWN-TYPE' if it is not known.
+        """
+        value = self.options.get(OPT4_MESSAGE_TYPE)
+        return _DHCP4_NAMES.get(value[0], 'UNKNOWN-TYPE') if value else 'UNKNOWN-TYPE'
+
+    @property
+    def server_id(self):
+        value = self.options.get(OPT4_SERVER_ID)
+        return socket.inet_ntoa(value) if value else None
+
+    @property
+    def lease_time(self):
+        value = self.options.get(OPT4_LEASE_TIME)
+        return struct.unpack('!I', value)[0] if value else None
+
+
+def decode_v4(data):
+    return DHCP4View(data)
+
+
+#########################################################################
+# DHCPv6
+
+
+def _option6(code, value):
+    return _OPT6.pack(code, len(value)) + value
+
+
+def _ia_na(iana):
+    if isinstance(iana, int):
+        iana = IANA(iana, 0, 0, (), None)
+    body = b''.join(_option6(OPT6_IA_ADDR, _IA_ADDR.pack(_ipv6(addr.address), addr.preferred, addr.valid))
+                    for addr in iana.addresses)
+    return _option6(OPT6_IA_NA, _IA.pack(iana.iaid, iana.t1, iana.t2) + body)
+
+
+def _ia_pd(iapd):
+    if isinstance(iapd, int):
+        iapd = IAPD(iapd, 0, 0, (), None)
+    body = b''.join(_option6(OPT6_IA_PREFIX, _IA_PREFIX.pack(prefix.preferred, prefix.valid, prefix.length,
+                                                             _ipv6(prefix.prefix)))
+                    for prefix in iapd.prefixes)
+    return _option6(OPT6_IA_PD, _IA.pack(iapd.iaid, iapd.t1, iapd.t2) + body)
+
+
+def encode_v6(msg_type, trid, client_id, server_id=None, ia_na=(), ia_pd=(), elapsed_time=None, oro=None,
+              options=()):
+    """
+    Build DHCPv6 client message. Options are written in the order client-id, server-id,
+    IA_NA, IA_PD, elapsed time, ORO, others.
+
+    :param msg_type: message name (e.g. 'SOLICIT') or code
+    :param trid: transaction ID (3 bytes)
+    :param client_id: DUID, 'xx:xx:..' or bytes
+    :param server_id: DUID of the server, e.g. taken from ADVERTISE
+    :param ia_na: IA_NA options: IAIDs or IANA tuples (e.g. copied from ADVERTISE)
+    :param ia_pd: IA_PD options: IAIDs or IAPD tuples
+    :param elapsed_time: value of elapsed time option in hundredths of second, not included if None
+    :param oro: list of requested option codes
+    :param options: other options, list of (code, bytes)
+    :return: bytes of DHCPv6 message
+    """
+    msg_type = DHCP6_MESSAGE_TYPES.get(msg_type, msg_type)
+    out = bytearray(struct.pack('!I', (msg_type << 24) | (trid & 0xffffff)))
+    out += _option6(OPT6_CLIENT_ID, hex_bytes(client_id))
+    if server_id is not None:
+        out += _option6(OPT6_SERVER_ID, hex_bytes(server_id))
+    for iana in ia_na:
+        out += _ia_na(iana)
+    for iapd in ia_pd:
+        out += _ia_pd(iapd)
+    if elapsed_time is not None:
+        out += _option6(OPT6_ELAPSED_TIME, struct.pack('!H', elapsed_time))
+    if oro:
+        out += _option6(OPT6_ORO, struct.pack(f'!{len(oro)}H', *oro))
+    for code, value in options:
+        out += _option6(code, value)
+    return bytes(out)
+
+
+def _status(options):
+    """
+    (status code, message) of status code option in the options, None if there is none.
+    """
+    value = options.get(OPT6_STATUS_CODE)
+    if value is None:
+        return None
+    return struct.unpack_from('!H', value)[0], value[2:].decode('utf-8', 'replace')
+
+
+class DHCP6View:
+    """
+    Received DHCPv6 message: type and transaction ID are unpacked right away, options on first access.
+    """
+    __slots__ = ('data', 'msgtype', 'trid', 'options')
+
+    def __init__(self, data):
+        assert len(data) >= 4, f"DHCPv6 message is too short: {len(data)} bytes"
+        self.data = data
+        header = struct.unpack_from('!I', data)[0]
+        self.msgtype = header >> 24
+        self.trid = header & 0xffffff
+        self.options = OptionView(data, 4, len(data), wide=True)
+
+    @property
+    def message_type(self):
+        return _DHCP6_NAMES.get(self.msgtype, 'UNKNOWN-TYPE')
+
+    @property
+    def client_id(self):
+        return self.options.get(OPT6_CLIENT_ID)
+
+    @property
+    def server_id(self):
+        return self.options.get(OPT6_SERVER_ID)
+
+    @property
+    def status(self):
+        return _status(self.options)
+
+    @property
+    def ia_na(self):
+        """
+        IA_NA options as IANA tuples with IAAddress tuples, addresses as strings.
+        """
+        result = []
+        for value in self.options.get_all(OPT6_IA_NA):
+            iaid, t1, t2 = _IA.unpack_from(value)
+            sub = OptionView(value, _IA.size, len(value), wide=True)
+            addresses = []
+            for addr in sub.get_all(OPT6_IA_ADDR):
+                address, preferred, valid = _IA_ADDR.unpack_from(addr)
+                addresses.append(IAAddress(socket.inet_ntop(socket.AF_INET6, address), preferred, valid))
+            result.append(IANA(iaid, t1, t2, addresses, _status(sub)))
+        return result
+
+    @property
+    def ia_pd(self):
+        """
+        IA_PD options as IAPD tuples with IAPrefix tuples, prefixes as strings.
+        """
+        result = []
+        for value in self.options.get_all(OPT6_IA_PD):
+            iaid, t1, t2 = _IA.unpack_from(value)
+            sub = OptionView(value, _IA.size, len(value), wide=True)
+            prefixes = []
+            for pref in sub.get_all(OPT6_IA_PREFIX):
+                preferred, valid, length, prefix = _IA_PREFIX.unpack_from(pref)
+                prefixes.append(IAPrefix(socket.inet_ntop(socket.AF_INET6, prefix), length, preferred, valid))
+            result.append(IAPD(iaid, t1, t2, prefixes, _status(sub)))
+        return result
+
+
+def decode_v6(data):
+    return DHCP6View(data)
@@ -23,6 +23,7 @@ from scapy.layers.inet import IP, UDP
 from scapy.layers.dhcp6 import IPv6
 
 from src.forge_cfg import world
+from src.protosupport.packet_log import log_sent, log_received
 
 
 log = logging.getLogger('forge')
@@ -86,8 +87,7 @@ def send_wait_for_query(choose_must, expect_include, iface=None):
     if iface is None:
         iface = world.cfg["dns_iface"]
 
-    if world.f_cfg.show_packets_from in ['both', 'client']:
-        world.climsg[0].show()
+    log_sent(world.climsg)
 
     timeout = world.cfg["wait_interval"] + world.dns_send_query_time_out
 
@@ -115,12 +115,7 @@ def send_wait_for_query(choose_must, expect_include, iface=None):
     for x in ans:
         a, b = x
         world.srvmsg.append(b.getlayer(2))
-
-        if world.f_cfg.show_packets_from in ['both', 'server']:
-            try:  # that is temp solution until we have good respond system checking!
-                world.srvmsg[0].show()
-            except BaseException:
-                pass
+        log_received([b])
 
     if expect_include:
         # if message was not received but expected, resend query with higher timeout
@@ -0,0 +1,124 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Per exchange state of a client, for exchanges running concurrently in asyncio.
+
+Steps building and checking messages keep their state in world: the message being built
+(world.climsg, world.cliopts, world.cfg["values"], ...) and the received one (world.srvmsg).
+ExchangeContext holds its own copy of that state and puts it into world only for the
+synchronous parts of a scenario, between awaits:
+
+    async def scenario(ctx):
+        with ctx.active():
+            client_send_msg('DISCOVER')
+        await send_wait_for_message_async(ctx, 'MUST', True, 'OFFER')
+        with ctx.active():
+            response_check_content(True, 'yiaddr', '192.168.50.1')
+
+Nothing else runs in the event loop while the state is swapped in, so all steps work
+unchanged and every coroutine sees its own client. Scenarios with many clients:
+
+    await asyncio.gather(*[dora('192.168.50.%d' % i, chaddr=...) for i in range(1, 51)])
+
+The synchronous steps DORA(), SARR() etc. do not use a context, they work on world directly.
+"""
+
+from src.forge_cfg import world
+
+
+def exchange_defaults():
+    """
+    World attributes describing the current exchange, with their values at the start of a test.
+    terrain.declare_all() sets them in world and new ExchangeContext starts with them.
+    :return: dict {attribute name: value}, new containers each time
+    """
+    return {'climsg': [],  # Message(s) to be sent
+            'srvmsg': [],  # Server's response(s)
+            'rlymsg': [],  # Server's response(s) Relayed by Relay Agent
+            'tmpmsg': [],  # container for temporary stored messages
+            'tcpmsg': [],  # Server's response(s) via TCP
+            'cliopts': [],  # Option(s) to be included in the next message sent
+            'relayopts': [],  # option(s) to be included in Relay Forward message.
+            'rsoo': [],  # List of relay-supplied-options
+            'savedmsg': {0: []},  # Saved option(s)
+            'oro': None,
+            'prl': '',  # don't request anything by default
+            'vendor': [],
+            'iaad': [],
+            'iapd': [],
+            'opts': [],
+            'subopts': [],
+            'message_fields': [],
+            'sender_type': None,
+            'savedvalue': None}
+
+
+# world attributes describing the current exchange
+EXCHANGE_ATTRS = tuple(exchange_defaults())
+# world.cfg keys describing the current exchange
+EXCHANGE_CFG_KEYS = ('values', 'address_v6', 'source_port', 'relay')
+
+_MISSING = object()
+
+
+def _world_state():
+    return ({name: getattr(world, name, _MISSING) for name in EXCHANGE_ATTRS},
+            {key: world.cfg.get(key, _MISSING) for key in EXCHANGE_CFG_KEYS})
+
+
+class ExchangeContext:
+    """
+    State of exchanges of one client.
+    """
+    def __init__(self, **values):
+        """
+        New client starting with empty messages, like after terrain.declare_all(), and with
+        message field values world has now, except for the transaction ID which is the client's own.
+
+        :param values: message field values (world.cfg["values"] keys) of this client
+        """
+        self.attrs = exchange_defaults()
+        self.cfg = {key: world.cfg[key] for key in EXCHANGE_CFG_KEYS if key in world.cfg}
+        if 'values' in self.cfg:
+            self.cfg['values'] = self.cfg['values'].copy()
+            self.cfg['values']['tr_id'] = world.cfg.get('tr_id')
+            self.cfg['values'].update(values)
+        self._active = False
+
+    def _swap(self):
+        """
+        Exchange the state of the context with the one in world.
+        """
+        attrs, cfg = _world_state()
+        for name, value in self.attrs.items():
+            if value is not _MISSING:
+                setattr(world, name, value)
+            elif hasattr(world, name):
+                delattr(world, name)
+        for key, value in self.cfg.items():
+            if value is not _MISSING:
+                world.cfg[key] = value
+            else:
+                world.cfg.pop(key, None)
+        self.attrs, self.cfg = attrs, cfg
+
+    def __enter__(self):
+        assert not self._active, "Exchange context is already active"
+        self._swap()
+        self._active = True
+        return self
+
+    def __exit__(self, *exc):
+        self._swap()
+        self._active = False
+
+    def active(self):
+        """
+        Context manager putting the state of the context into world and taking it back on exit.
+        It must not be left open across an await, other coroutines would see the state.
+        """
+        return self
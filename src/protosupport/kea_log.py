@@ -0,0 +1,254 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Structured view of Kea logs.
+
+Kea log messages carry timestamp, severity, logger and message ID, e.g.:
+    2023-05-10 12:34:56.789 INFO  [kea-dhcp4.dhcp4/1234.139800] DHCP4_STARTED Kea DHCPv4 server version ...
+KeaLogIndex parses such lines (from kea.log, journalctl output or journalctl -o export)
+into columns of arrays, one row per message, and keeps for every message ID the rows
+and timestamps of its messages. Questions like "how many HA_STATE_TRANSITION messages
+were logged after the reconfiguration" are then answered by binary search.
+
+Lines without message ID (e.g. continuation of multi line messages) are not indexed.
+"""
+
+import re
+import bisect
+import datetime
+from array import array
+from collections import namedtuple
+
+SEVERITIES = ('DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL')
+
+# severity, optional [logger/pid.tid] (or [logger.tid]) and message ID, anywhere in the line
+_MESSAGE = re.compile(r'\b(?P<severity>DEBUG|INFO|WARN|ERROR|FATAL) +'
+                      r'(?:\[(?P<logger>[^\]/]+?)(?:[/.]\d[^\]]*)?\] +)?(?P<msgid>[A-Z][A-Z0-9]*_[A-Z0-9_]+)\b')
+# timestamp written by Kea
+_KEA_TIME = re.compile(r'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(?:\.(\d+))?')
+# timestamp written by journalctl -o short or short-precise, it has no year
+_JOURNAL_TIME = re.compile(r'^([A-Z][a-z]{2}) +(\d+) (\d\d):(\d\d):(\d\d)(?:\.(\d+))?')
+_MONTHS = {name: i + 1 for i, name in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))}
+
+LogRecord = namedtuple('LogRecord', 'row timestamp severity logger msgid offset line')
+
+
+def _fraction(digits):
+    return int(digits) / 10 ** len(digits) if digits else 0.0
+
+
+def parse_timestamp(line):
+    """
+    Timestamp of a log line as seconds since epoch (local time), None if there is none.
+    Kea timestamp is preferred, journald one is used for lines logged without it.
+    """
+    m = _KEA_TIME.search(line)
+    if m:
+        stamp = datetime.datetime(*(int(g) for g in m.groups()[:6])).timestamp()
+        return stamp + _fraction(m.group(7))
+    m = _JOURNAL_TIME.match(line)
+    if m:
+        now = datetime.datetime.now()
+        stamp = datetime.datetime(now.year, _MONTHS[m.group(1)], int(m.group(2)),
+                                  int(m.group(3)), int(m.group(4)), int(m.group(5)))
+        if stamp - now > datetime.timedelta(days=1):
+            # logged last year
+            stamp = stamp.replace(year=now.year - 1)
+        return stamp.timestamp() + _fraction(m.group(6))
+    return None
+
+
+class KeaLogIndex:
+    """
+    Columnar index of Kea log messages.
+
+    Columns are arrays indexed by row: timestamp, severity (index to SEVERITIES), logger and
+    message ID (indexes to lists of names), byte offset of the line in the source and line number.
+    """
+    def __init__(self, lines=None):
+        """
+        :param lines: list of source lines, kept to return text of messages; it may be extended
+                      later and new lines indexed with add_lines()
+        """
+        self.lines = lines if lines is not None else []
+        self.timestamps = array('d')
+        self.severities = array('B')
+        self.loggers = array('I')
+        self.msgids = array('I')
+        self.offsets = array('Q')
+        self.line_numbers = array('I')
+        self.logger_names = []
+        self.msgid_names = []
+        self._logger_ids = {}
+        self._msgid_ids = {}
+        # message ID -> (rows, timestamps) of its messages
+        self._postings = {}
+        self._last_time = 0.0
+        self._indexed_lines = 0
+        self._offset = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Index log in text form: kea.log or output of journalctl.
+        """
+        index = cls(text.splitlines())
+        index.add_lines()
+        return index
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return cls.from_text(f.read())
+
+    @classmethod
+    def from_journal_export(cls, text):
+        """
+        Index output of journalctl -o export: entries separated by empty lines, one field per line.
+        Timestamp of the entry is taken from __REALTIME_TIMESTAMP, binary fields are skipped.
+        """
+        index = cls()
+        offset = 0
+        entry = {}
+        entry_offset = 0
+        # the last entry may be missing its terminating empty line
+        for line in text.split('\n') + ['']:
+            if not line:
+                if 'MESSAGE' in entry:
+                    index.lines.append(entry['MESSAGE'])
+                    stamp = entry.get('__REALTIME_TIMESTAMP')
+                    index.add_line(entry['MESSAGE'], entry_offset, len(index.lines) - 1,
+                                   int(stamp) / 1e6 if stamp else None)
+                entry = {}
+                entry_offset = offset + 1
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                entry[key] = value
+            offset += len(line.encode()) + 1
+        index._indexed_lines = len(index.lines)
+        return index
+
+    def _intern(self, name, names, ids):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def add_line(self, line, offset, line_number, timestamp=None):
+        """
+        Index one line, it is ignored if it does not contain Kea message.
+
+        :param line: text of the line
+        :param offset: byte offset of the line in the source
+        :param line_number: index of the line in self.lines
+        :param timestamp: seconds since epoch, parsed from the line if None
+        """
+        m = _MESSAGE.search(line)
+        if m is None:
+            return
+        if timestamp is None:
+            timestamp = parse_timestamp(line)
+        if timestamp is None:
+            timestamp = self._last_time
+        row = len(self.timestamps)
+        msgid = self._intern(m.group('msgid'), self.msgid_names, self._msgid_ids)
+        self.timestamps.append(timestamp)
+        self.severities.append(SEVERITIES.index(m.group('severity')))
+        self.loggers.append(self._intern(m.group('logger') or '', self.logger_names, self._logger_ids))
+        self.msgids.append(msgid)
+        self.offsets.append(offset)
+        self.line_numbers.append(line_number)
+        # threads of one daemon may log slightly out of order, searches need sorted times
+        self._last_time = max(self._last_time, timestamp)
+        rows, times = self._postings.setdefault(msgid, (array('I'), array('d')))
+        rows.append(row)
+        times.append(self._last_time)
+
+    def add_lines(self, timestamps=None):
+        """
+        Index lines appended to self.lines since the last call.
+
+        :param timestamps: times of the lines (e.g. of journal entries) in parallel with self.lines,
+                           if None they are parsed from the lines
+        """
+        while self._indexed_lines < len(self.lines):
+            line = self.lines[self._indexed_lines]
+            self.add_line(line, self._offset, self._indexed_lines,
+                          timestamps[self._indexed_lines] if timestamps is not None else None)
+            self._offset += len(line.encode()) + 1
+            self._indexed_lines += 1
+
+    def record(self, row):
+        return LogRecord(row, self.timestamps[row], SEVERITIES[self.severities[row]],
+                         self.logger_names[self.loggers[row]], self.msgid_names[self.msgids[row]],
+                         self.offsets[row], self.line_numbers[row])
+
+    def text(self, record):
+        """
+        Full text of the line with the message.
+        """
+        return self.lines[record.line] if record.line < len(self.lines) else None
+
+    def _range(self, msgid, after, before):
+        """
+        Indexes into postings of msgid of messages logged after and before given points.
+        Points are times (seconds since epoch or datetime) or LogRecords (row order is used).
+        """
+        rows, times = self._postings.get(self._msgid_ids.get(msgid), (array('I'), array('d')))
+        lo, hi = 0, len(rows)
+        if after is not None:
+            if isinstance(after, LogRecord):
+                lo = bisect.bisect_right(rows, after.row)
+            else:
+                lo = bisect.bisect_right(times, _seconds(after))
+        if before is not None:
+            if isinstance(before, LogRecord):
+                hi = bisect.bisect_left(rows, before.row)
+            else:
+                hi = bisect.bisect_left(times, _seconds(before))
+        return rows, lo, max(lo, hi)
+
+    def count(self, msgid, after=None, before=None):
+        """
+        Number of messages with given ID logged after and before given points (both optional).
+        """
+        _, lo, hi = self._range(msgid, after, before)
+        return hi - lo
+
+    def first(self, msgid, after=None, before=None):
+        """
+        First message with given ID in the range or None.
+        """
+        rows, lo, hi = self._range(msgid, after, before)
+        return self.record(rows[lo]) if lo < hi else None
+
+    def last(self, msgid, after=None, before=None):
+        """
+        Last message with given ID in the range or None.
+        """
+        rows, lo, hi = self._range(msgid, after, before)
+        return self.record(rows[hi - 1]) if lo < hi else None
+
+    def all(self, msgid, after=None, before=None):
+        rows, lo, hi = self._range(msgid, after, before)
+        return [self.record(rows[i]) for i in range(lo, hi)]
+
+    def msgid_counts(self):
+        """
+        Number of messages per message ID.
+        """
+        return {self.msgid_names[msgid]: len(rows) for msgid, (rows, _) in self._postings.items()}
+
+
+def _seconds(point):
+    if isinstance(point, datetime.datetime):
+        return point.timestamp()
+    return float(point)
@@ -0,0 +1,231 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Load generator: DHCP exchanges started at exact rate, perfdhcp style.
+
+LoadGenerator is a ClientEngine whose clients are not started as fast as the window allows,
+but by a token bucket: tokens are added at the target rate (exchanges per second) up to
+the burst size and every started exchange takes one. Only the first message of an exchange
+(DISCOVER or SOLICIT) is paced, further messages are sent as soon as the answer comes, like
+perfdhcp does. Messages are not retransmitted, a message unanswered within timeout is a drop.
+
+Exchanges are chosen from the message mix, e.g. {'DO': 3, 'DORA': 1}, in exact proportions.
+
+LoadResult holds the counts, round trip times of answered messages and per second timeline:
+    result = LoadGenerator(ipv6=False, rate=100, duration=5, mix={'DO': 1}).run()
+    assert 95 <= result.received_per_second <= 105
+"""
+
+import time
+import math
+import select
+import logging
+
+from src.protosupport.client_engine import ClientEngine, VirtualClient, STEPS
+
+log = logging.getLogger('forge')
+
+
+def _default_client(number, ipv6):
+    """
+    Client with MAC address, DUID and IAID derived from its number, all different.
+    """
+    mac = '02:' + (number & 0xffffffffff).to_bytes(5, 'big').hex(':')
+    if ipv6:
+        return VirtualClient(mac, duid='00:03:00:01:' + mac, iaids=[number & 0xffffffff])
+    return VirtualClient(mac)
+
+
+class LoadResult:
+    """
+    Outcome of a load run.
+
+    sent, received, drops: messages sent, answers received, messages left without answer
+    started, completed: exchanges started and finished with all answers
+    latencies: round trip times of answered messages in seconds
+    timeline: list of per second dicts {'second', 'sent', 'received', 'drops'}, by time of sending
+    """
+    def __init__(self, rate, duration, mix):
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.sent = 0
+        self.received = 0
+        self.drops = 0
+        self.started = 0
+        self.completed = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        self.timeline = []
+
+    def at_second(self, second):
+        """
+        Timeline entry of the second of the run, created if needed.
+        """
+        while len(self.timeline) <= second:
+            self.timeline.append({'second': len(self.timeline), 'sent': 0, 'received': 0, 'drops': 0})
+        return self.timeline[second]
+
+    @property
+    def offered_rate(self):
+        """
+        Exchanges started per second.
+        """
+        return self.started / self.duration if self.duration else 0.0
+
+    @property
+    def received_per_second(self):
+        return self.received / self.duration if self.duration else 0.0
+
+    def percentile(self, percent):
+        """
+        Round trip time in seconds under which the given percent of answers came (nearest rank).
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    @property
+    def latency_percentiles(self):
+        """
+        50th, 90th, 99th percentile and maximum of round trip times in milliseconds.
+        """
+        return {p: None if self.percentile(p) is None else round(self.percentile(p) * 1000, 3)
+                for p in (50, 90, 99, 100)}
+
+    def summary(self):
+        return (f"offered {self.offered_rate:.1f}/s for {self.duration}s: {self.started} exchanges started, "
+                f"{self.completed} completed, {self.sent} messages sent, {self.received} received, "
+                f"{self.drops} dropped, latency ms (p50/p90/p99/max) "
+                f"{'/'.join(str(v) for v in self.latency_percentiles.values())}")
+
+
+class LoadGenerator(ClientEngine):
+    """
+    Exchanges started at given rate for given time on world.cfg["iface"].
+    """
+    def __init__(self, ipv6, rate, duration, mix=None, burst=1, timeout=None, max_outstanding=None,
+                 client_factory=None):
+        """
+        :param ipv6: True for DHCPv6, False for DHCPv4
+        :param rate: exchanges started per second
+        :param duration: how long exchanges are started, in seconds
+        :param mix: {steps: weight}, steps are a step name ('DO', 'DORA', 'SA', 'SARR', ...) or tuple of them;
+                    'DO' or 'SA' if None
+        :param burst: size of the token bucket, how many exchanges may start at once after a pause
+        :param timeout: time to wait for an answer, world.cfg['wait_interval'] if None
+        :param max_outstanding: do not start exchanges while that many messages wait for an answer
+        :param client_factory: function(number, ipv6) returning VirtualClient of the exchange with that number,
+                               e.g. the same client for each exchange; new client each time by default
+        """
+        super().__init__(ipv6, in_flight=max_outstanding, timeout=timeout, retries=0)
+        self.rate = rate
+        self.duration = duration
+        self.burst = max(1, burst)
+        self.mix = {}
+        for steps, weight in (mix or {STEPS[ipv6][1]: 1}).items():
+            steps = (steps,) if isinstance(steps, str) else tuple(steps)
+            for step in steps:
+                assert step in STEPS[ipv6], f"Unknown step {step}, use one of {STEPS[ipv6]}"
+            self.mix[steps] = weight
+        self.client_factory = client_factory or _default_client
+        self.result = LoadResult(rate, duration, {'+'.join(steps): weight for steps, weight in self.mix.items()})
+        self._chosen = {steps: 0 for steps in self.mix}
+        self._start_time = None
+
+    def _choose(self):
+        """
+        Steps of the next exchange, the one furthest below its share of the mix.
+        """
+        total = sum(self.mix.values())
+        count = sum(self._chosen.values()) + 1
+        steps = max(self.mix, key=lambda s: self.mix[s] / total * count - self._chosen[s])
+        self._chosen[steps] += 1
+        return steps
+
+    def _second_of(self, client):
+        """
+        Timeline entry of the second in which the last message of the client was sent.
+        """
+        return self.result.at_second(int(client.exchange.sent_at - self._start_time))
+
+    def _transmit(self, client):
+        super()._transmit(client)
+        self.result.sent += 1
+        self._second_of(client)['sent'] += 1
+
+    def _answer(self, client, msg):
+        if msg.message_type in (client.exchange.expected, 'NAK'):
+            self.result.latencies.append(time.monotonic() - client.exchange.sent_at)
+            self.result.received += 1
+            self._second_of(client)['received'] += 1
+        super()._answer(client, msg)
+        if client.exchange.step is None and not client.failed:
+            self.result.completed += 1
+
+    def _give_up(self, client):
+        super()._give_up(client)
+        self.result.drops += 1
+        self._second_of(client)['drops'] += 1
+
+    def run(self):  # pylint: disable=arguments-differ
+        """
+        Start exchanges at the rate for the duration, then wait for outstanding answers.
+
+        :return: LoadResult
+        """
+        self._start_time = start = last = time.monotonic()
+        end = start + self.duration
+        tokens = 1.0
+        number = 0
+        while True:
+            now = time.monotonic()
+            if now < end:
+                # the fraction of a token earned while waking up late is kept, the rate would drop otherwise
+                tokens = min(self.burst + 0.999, tokens + (now - last) * self.rate)
+                last = now
+                while tokens >= 1 and (self.in_flight is None or len(self._waiting) < self.in_flight):
+                    tokens -= 1
+                    client = self.client_factory(number, self.ipv6)
+                    number += 1
+                    self.result.started += 1
+                    self._start(client, self._choose())
+                    if client.exchange.step is None and not client.failed:
+                        # e.g. release without answer
+                        self.result.completed += 1
+            elif not self._waiting:
+                break
+            timeout = self.timeout
+            if now < end:
+                timeout = min(timeout, end - now)
+                if tokens < 1:
+                    timeout = min(timeout, (1 - tokens) / self.rate)
+            if self._deadlines:
+                timeout = min(timeout, max(0.0, self._deadlines[0][0] - time.monotonic()))
+            ready, _, _ = select.select([self.socket], [], [], timeout)
+            if ready:
+                self._receive()
+            self._expire()
+        self.result.elapsed = time.monotonic() - start
+        # seconds without any message are in the timeline as well
+        self.result.at_second(max(0, math.ceil(self.duration) - 1))
+        log.info("load %s", self.result.summary())
+        return self.result
+
+
+def generate_load(dhcp_version, rate, duration, mix=None, burst=1, timeout=None, max_outstanding=None,
+                  client_factory=None):
+    """
+    Run LoadGenerator on world.cfg["iface"] and return its LoadResult.
+
+    :param dhcp_version: 'v4' or 'v6'
+    """
+    with LoadGenerator(dhcp_version == 'v6', rate, duration, mix=mix, burst=burst, timeout=timeout,
+                       max_outstanding=max_outstanding, client_factory=client_factory) as generator:
+        return generator.run()
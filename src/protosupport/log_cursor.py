@@ -0,0 +1,122 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Incremental counting of matching lines in server logs.
+
+Counting is done by grep on the server, like it always was, but only over the part of a log
+that was not scanned yet for given pattern. For log files the cursor is the byte offset after
+the last complete line, together with file identity (inode and checksum of the first line) so
+a removed, rotated or truncated log is scanned from the beginning again. For journald the
+cursor is the journal cursor of the last scanned entry. Cursors are kept only for the current test.
+
+Journald is not emptied between tests, instead the cursor of the newest entry is recorded when
+the server is cleared and all journal queries start after it (see journal_scope).
+"""
+
+from src.forge_cfg import world
+from src.softwaresupport.multi_server_functions import fabric_sudo_command
+
+
+def _grep_count(line):
+    # pattern is passed through here-document exactly like in get_line_count_in_file
+    return 'grep -c "$(cat <<EOF\n' + f'{line}\n' + 'EOF\n' + ')"'
+
+
+class LogCursors:
+    """
+    Cursors per (host, log, pattern) with the number of matching lines found so far.
+    """
+    def __init__(self):
+        self._test = None
+        self._cursors = {}
+        # host -> journal cursor at the time server was cleared
+        self._journal_starts = {}
+
+    def _get(self, key):
+        if self._test != getattr(world, 'name', None):
+            # each test starts with empty logs
+            self._test = getattr(world, 'name', None)
+            self._cursors = {}
+        return self._cursors.get(key)
+
+    def reset(self, destination=None):
+        """
+        Forget cursors (of one host or all of them), next count scans whole logs.
+        """
+        if destination is None:
+            self._cursors = {}
+        else:
+            self._cursors = {k: v for k, v in self._cursors.items() if k[0] != destination}
+
+    def start_journal(self, cursor, destination=world.f_cfg.mgmt_address):
+        """
+        Remember where logs of current test start in the journal of the host.
+
+        :param cursor: journal cursor of the newest entry, None or empty if the journal is empty
+        """
+        self._journal_starts[destination] = cursor or None
+        self.reset(destination)
+
+    def journal_scope(self, destination=world.f_cfg.mgmt_address):
+        """
+        journalctl option limiting output to entries logged in current test, empty if not known.
+        """
+        cursor = self._journal_starts.get(destination)
+        return f" --after-cursor='{cursor}'" if cursor else ''
+
+    def count_in_file(self, line, log_file, destination=world.f_cfg.mgmt_address):
+        """
+        Number of lines matching the pattern in a single log file.
+        """
+        key = (destination, log_file, line)
+        identity, offset, count = self._get(key) or ('', 0, 0)
+        # Only complete lines are scanned, a line being just written is left for the next call.
+        cmd = f'f="{log_file}"; o={offset}\n'
+        cmd += 'set -- $(stat -c "%i %s" "$f" 2>/dev/null); s=${2:-0}\n'
+        cmd += 'id="${1:-0}-$(head -n 1 "$f" 2>/dev/null | md5sum | cut -c1-8)"\n'
+        cmd += f'[ "$id" = "{identity}" ] && [ "$s" -ge "$o" ] || o=0\n'
+        cmd += 'n=$((s-o))\n'
+        cmd += 'if [ "$(tail -c +$((o+1)) "$f" 2>/dev/null | head -c $n | tail -c 1 | wc -l)" = 0 ]; then\n'
+        cmd += '  n=$((n-$(tail -c +$((o+1)) "$f" 2>/dev/null | head -c $n | tail -n 1 | wc -c))); fi\n'
+        cmd += 'echo "$id $o $((o+n))"\n'
+        cmd += 'tail -c +$((o+1)) "$f" 2>/dev/null | head -c $n | ' + _grep_count(line) + '; true'
+        result = fabric_sudo_command(cmd, destination_host=destination, hide_all=True, ignore_errors=True,
+                                     combine_stderr=False)
+        assert result.succeeded, f'Counting "{line}" in {log_file} failed:\n{result}\n{result.stderr}'
+        header, new = result.splitlines()[-2:]
+        identity, start, end = header.split()
+        if int(start) != offset or int(start) == 0:
+            count = 0
+        count += int(new)
+        self._cursors[key] = (identity, int(end), count)
+        return count
+
+    def count_in_journal(self, line, unit, destination=world.f_cfg.mgmt_address):
+        """
+        Number of lines matching the pattern in journald logs of a systemd unit.
+        """
+        key = (destination, unit, line)
+        cursor, count = self._get(key) or (None, 0)
+        cmd = f'journalctl -u {unit} --output=cat --show-cursor'
+        if cursor is not None:
+            cmd += f" --after-cursor='{cursor}'"
+        else:
+            cmd += self.journal_scope(destination)
+        cmd = f'out=$({cmd})\n'
+        cmd += 'printf "%s\\n" "$out" | sed "/^-- cursor: /d" | ' + _grep_count(line) + '\n'
+        cmd += 'printf "%s\\n" "$out" | sed -n "s/^-- cursor: //p"; true'
+        result = fabric_sudo_command(cmd, destination_host=destination, hide_all=True, ignore_errors=True,
+                                     combine_stderr=False)
+        assert result.succeeded, f'Counting "{line}" in journal of {unit} failed:\n{result}\n{result.stderr}'
+        # count and then the cursor, which is missing when there are no new entries
+        lines = result.splitlines()
+        count += int(lines[0])
+        self._cursors[key] = (lines[1] if len(lines) > 1 else cursor, count)
+        return count
+
+
+log_cursors = LogCursors()
@@ -0,0 +1,150 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Following server logs as they are written.
+
+A follower is one long running command on the server (tail -F of a log file or journalctl -f
+of a systemd unit) piped to grep, so only lines matching the pattern travel over the network.
+Matching lines are counted locally as they come and threads waiting for a number of them
+are woken up right away, instead of polling the server.
+
+Followers are started on first use and live until the end of the test. The remote command
+finishes by itself when its stdin is closed, so nothing is left running on the server
+even if forge is killed.
+"""
+
+import time
+import threading
+
+from src.forge_cfg import world
+from src.protosupport.log_cursor import log_cursors
+from src.softwaresupport.multi_server_functions import fabric_stream_command
+
+
+def _follow_command(kind, location, line, destination):
+    """
+    Remote script: follow the log and print lines matching the pattern. A background job waits
+    for EOF on stdin and then stops everything started by the script.
+    """
+    if kind == 'journal':
+        source = f'journalctl -u {location} -f -n all --output=cat{log_cursors.journal_scope(destination)} 2>/dev/null'
+        notices = ''
+    else:
+        # tail reports replaced and truncated files on stderr, they are passed along to reset the count;
+        # file that did not exist at start is polled, so the interval is shortened
+        source = f'tail -n +1 -F -s 0.1 "{location}" 2>&1'
+        notices = '-e "^tail: .*truncated$" -e "^tail: .*following new file$" '
+    cmd = 'exec 3<&0\n'
+    cmd += '{ cat <&3 >/dev/null 2>&1; pkill -P $$; } &\n'
+    cmd += f'{source} | grep --line-buffered {notices}-e "$(cat <<EOF\n{line}\nEOF\n)"\n'
+    # the pipeline ended on its own, do not leave the watcher behind
+    cmd += 'pkill -P $!; kill $! 2>/dev/null; true'
+    return cmd
+
+
+class LogFollower:
+    """
+    Count of lines matching one pattern in one log, updated as the server writes the log.
+    """
+    def __init__(self, line, kind, location, destination=world.f_cfg.mgmt_address):
+        self.line = line
+        self.count = 0
+        self._pending = b''
+        self._kind = kind
+        self._cond = threading.Condition()
+        self.stream = fabric_stream_command(_follow_command(kind, location, line, destination), self,
+                                            destination_host=destination)
+
+    def write(self, data):
+        """
+        Sink of the remote command output.
+        """
+        with self._cond:
+            self._pending += data
+            *lines, self._pending = self._pending.split(b'\n')
+            for line in lines:
+                line = line.decode('utf-8', 'replace').rstrip('\r')
+                if self._kind == 'file' and line.startswith('tail: '):
+                    # log was removed, rotated or truncated; the count is about the current file only
+                    if line.endswith('truncated') or line.endswith('following new file'):
+                        self.count = 0
+                    continue
+                self.count += 1
+            self._cond.notify_all()
+
+    @property
+    def running(self):
+        return self.stream.running
+
+    def wait_for(self, count, timeout):
+        """
+        Wait until at least count lines matched or the follower stopped.
+
+        :param count: number of matching lines to wait for
+        :param timeout: time to wait for in seconds
+        :return: number of matching lines seen so far
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.count < count and self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # wake up now and then only to notice that the follower has died
+                self._cond.wait(min(remaining, 0.5))
+            return self.count
+
+    def close(self):
+        self.stream.close()
+
+
+class LogFollowers:
+    """
+    Followers per (host, log, pattern), all of them are stopped when the test ends.
+    """
+    def __init__(self):
+        self._test = None
+        self._followers = {}
+        self._lock = threading.Lock()
+
+    def get(self, line, kind, location, destination=world.f_cfg.mgmt_address):
+        """
+        Return running follower of the pattern in the log, start it if needed.
+
+        :param line: pattern passed to grep
+        :param kind: 'file' or 'journal'
+        :param location: log file path or systemd unit name
+        :param destination: address of server hosting the log
+        """
+        with self._lock:
+            if self._test != getattr(world, 'name', None):
+                self._close_all()
+                self._test = getattr(world, 'name', None)
+            key = (destination, kind, location, line)
+            follower = self._followers.get(key)
+            if follower is None:
+                # a follower that died (e.g. grep without --line-buffered) is not restarted,
+                # callers fall back to counting lines in the log
+                follower = LogFollower(line, kind, location, destination)
+                self._followers[key] = follower
+            return follower
+
+    def _close_all(self):
+        followers = list(self._followers.values())
+        self._followers = {}
+        for follower in followers:
+            follower.close()
+
+    def close(self):
+        """
+        Stop all followers, e.g. before logs are removed at the end of a test.
+        """
+        with self._lock:
+            self._close_all()
+
+
+log_followers = LogFollowers()
@@ -0,0 +1,551 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Live local copies of server logs.
+
+During a test every log of interest is streamed from the server (tail -F of a log file
+or journalctl -f of a systemd unit) into a file in the test results directory, and its lines
+are kept in memory. Lines of journal entries are their messages, as journalctl --output=cat
+gives them to checks done without the mirror, so patterns match the same way either way.
+Checks of log content are answered from memory: matching lines are counted with the same
+basic regular expressions grep uses, and the count of every pattern is updated only with
+lines received since it was asked for last time.
+
+Before a check the mirror is synchronized: a request is written to stdin of the remote command
+which answers with the current size of the log (or cursor of the last journal entry), and
+the check waits until the mirror got that far. That costs one round trip over an already open channel instead
+of starting new remote command and scanning the whole log.
+
+A log file removed, replaced or truncated on the server (e.g. by clear_logs) is reported by tail.
+The mirror then starts over with the new file: lines and counts are about the current file only,
+and its copy goes to a new directory (kea-logs-1/kea.log, kea-logs-2/kea.log, ...) so that
+the copy of the previous file is kept.
+"""
+
+import os
+import re
+import json
+import time
+import datetime
+import threading
+
+from src.forge_cfg import world
+from src.protosupport.log_cursor import log_cursors
+from src.protosupport.kea_log import KeaLogIndex
+from src.softwaresupport.multi_server_functions import fabric_stream_command
+from src.softwaresupport.multi_server_functions import check_local_path_for_downloaded_files
+
+SYNC_TIMEOUT = 10
+
+# tail notices printed when the followed file is removed, replaced or truncated
+_TAIL_NOTICE = re.compile(rb'tail: .*(?:following new file|file truncated|has become inaccessible: .*)$')
+
+# POSIX character classes used in bracket expressions
+_CHAR_CLASSES = {'alpha': 'a-zA-Z', 'digit': '0-9', 'alnum': 'a-zA-Z0-9', 'upper': 'A-Z', 'lower': 'a-z',
+                 'space': r'\s', 'blank': r' \t', 'xdigit': '0-9A-Fa-f', 'cntrl': r'\x00-\x1f\x7f',
+                 'punct': re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'), 'print': r'\x20-\x7e',
+                 'graph': r'\x21-\x7e'}
+
+
+def _heredoc_expand(text):
+    """
+    Expansions done by shell in unquoted here-document, which is how patterns are passed to grep.
+    Variables are not known here, they expand to nothing.
+    """
+    return re.sub(r'\\([\\$`])|\\\n|\$(?:\{[^}]*\}|[A-Za-z_][A-Za-z0-9_]*|[0-9#?$!*@-])',
+                  lambda m: m.group(1) or '', text)
+
+
+def _bracket_to_re(pattern, i):
+    """
+    Translate bracket expression starting at pattern[i] == '['.
+    :return: (python regex, index after the expression)
+    """
+    j = i + 1
+    out = '['
+    if j < len(pattern) and pattern[j] == '^':
+        out += '^'
+        j += 1
+    first = True
+    while j < len(pattern):
+        c = pattern[j]
+        if c == ']' and not first:
+            return out + ']', j + 1
+        first = False
+        if c == '[' and pattern[j + 1:j + 2] in (':', '.', '='):
+            end = pattern.find(pattern[j + 1] + ']', j + 2)
+            if end < 0:
+                break
+            name = pattern[j + 2:end]
+            if pattern[j + 1] == ':':
+                if name not in _CHAR_CLASSES:
+                    break
+                out += _CHAR_CLASSES[name]
+            else:
+                out += re.escape(name)
+            j = end + 2
+            continue
+        # backslash is not special in bracket expression, python needs some more characters escaped
+        out += '\\' + c if c in '\\[]^&~|' else c
+        j += 1
+    raise ValueError('Unmatched [')
+
+
+def _quantify(atoms, quantifier):
+    """
+    Apply quantifier to the last atom. grep allows quantifiers to follow each other, python does not.
+    """
+    atom, quantified = atoms[-1]
+    if quantified:
+        atom = f'(?:{atom})'
+    atoms[-1] = (atom + quantifier, True)
+
+
+def _bre_to_re(pattern):
+    """
+    Translate one GNU grep basic regular expression to python regular expression.
+    """
+    # (python regex, quantified) of every atom, group is one atom once it is closed
+    atoms = []
+    # indexes of atoms opening groups that are not closed yet
+    groups = []
+    i = 0
+    # position at which ^ is an anchor and quantifiers are literal: start of the pattern, group or alternative
+    at_start = True
+    while i < len(pattern):
+        c = pattern[i]
+        start = at_start
+        at_start = False
+        if c == '\\' and i + 1 < len(pattern):
+            c = pattern[i + 1]
+            i += 2
+            if c == '(':
+                groups.append(len(atoms))
+                atoms.append(('(', False))
+                at_start = True
+            elif c == '|':
+                atoms.append(('|', False))
+                at_start = True
+            elif c == ')':
+                if groups:
+                    first = groups.pop()
+                    atoms[first:] = [(''.join(atom for atom, _ in atoms[first:]) + ')', False)]
+                else:
+                    # grep rejects it and so does python
+                    atoms.append((')', False))
+            elif c == '{' and not start:
+                end = pattern.find('\\}', i)
+                if end < 0:
+                    raise ValueError('Unmatched \\{')
+                _quantify(atoms, '{' + pattern[i:end] + '}')
+                i = end + 2
+            elif c in '+?' and not start:
+                _quantify(atoms, c)
+            elif c in '123456789wWsSbB':
+                atoms.append(('\\' + c, False))
+            elif c == '<':
+                atoms.append((r'\b(?=\w)', False))
+            elif c == '>':
+                atoms.append((r'\b(?<=\w)', False))
+            else:
+                atoms.append((re.escape(c), False))
+            continue
+        if c == '[':
+            expr, i = _bracket_to_re(pattern, i)
+            atoms.append((expr, False))
+            continue
+        if c == '*' and not start:
+            _quantify(atoms, '*')
+        elif c == '^' and start:
+            atoms.append(('^', False))
+            at_start = True
+        elif c == '$' and (i + 1 == len(pattern) or pattern[i + 1:i + 3] in ('\\)', '\\|')):
+            atoms.append(('$', False))
+        elif c == '.':
+            atoms.append(('.', False))
+        else:
+            atoms.append((re.escape(c), False))
+        i += 1
+    return ''.join(atom for atom, _ in atoms)
+
+
+def grep_regex(line):
+    """
+    Compile pattern passed to grep the way forge does it (in a here-document).
+
+    :param line: pattern as given to log checking functions
+    :return: compiled regex or None if grep would reject the pattern
+    """
+    patterns = _heredoc_expand(line).rstrip('\n').split('\n')
+    try:
+        return re.compile('|'.join(f'(?:{_bre_to_re(p)})' for p in patterns))
+    except (ValueError, re.error):
+        return None
+
+
+def _mirror_command(kind, location, destination):
+    """
+    Remote script: stream the log to stdout, answer each line read from stdin with a sync
+    marker on stderr and stop everything when stdin is closed.
+    """
+    if kind == 'journal':
+        scope = log_cursors.journal_scope(destination)
+        # entries as JSON, to have their cursors along with the messages
+        source = f'journalctl -u {location} -f -n all -q -o json{scope} 2>/dev/null'
+        # -n 1 does not combine with --after-cursor, the last entry is taken from all entries of the test
+        position = f'$(journalctl -u {location} -q -o cat --show-cursor{scope} 2>/dev/null | tail -n 1 | ' \
+                   'sed -n "s/^-- cursor: //p")'
+    else:
+        # tail reports replaced and truncated files on stderr, they are passed along in order with
+        # the content; file that did not exist at start is polled, so the interval is shortened
+        source = f'tail -c +1 -F -s 0.1 "{location}" 2>&1'
+        position = f'$(stat -c "%i %s" "{location}" 2>/dev/null || echo "0 0")'
+    cmd = 'exec 3<&0\n'
+    cmd += 'echo forge-ready >&2\n'
+    cmd += f'{{ while read -r r <&3; do echo "forge-sync $r {position}" >&2; done; pkill -P $$; }} &\n'
+    cmd += f'{source}\n'
+    # the log stream ended on its own, do not leave the sync loop behind
+    cmd += 'pkill -P $!; kill $! 2>/dev/null; true'
+    return cmd
+
+
+class _SyncChannel:
+    """
+    Remote command streaming the log and the sync requests and markers it exchanges with the mirror
+    over its stdin and stderr. Shares the lock of the mirror, waiting threads are woken up by markers.
+    """
+    def __init__(self, cond):
+        self._cond = cond
+        self._pending = b''
+        self.ready = False
+        self._seq = 0
+        self.replies = {}
+        # (inode, size, resets) of the log file at the last sync
+        self.synced = None
+        self.stream = None
+
+    def start(self, cmd, sink, destination):
+        self.stream = fabric_stream_command(cmd, sink, destination_host=destination, stderr_sink=self)
+
+    def write(self, data):
+        """
+        Sink of stderr of the remote command.
+        """
+        self._pending += data
+        *lines, self._pending = self._pending.split(b'\n')
+        for line in lines:
+            self.marker(line.decode('utf-8', 'replace').rstrip('\r'))
+
+    def marker(self, line):
+        # sudo password prompt is not followed by new line, markers may come right after it
+        with self._cond:
+            if line.endswith('forge-ready'):
+                self.ready = True
+            elif 'forge-sync ' in line:
+                _, seq, position = (line[line.index('forge-sync '):] + ' ').split(' ', 2)
+                self.replies[int(seq)] = position.strip()
+            self._cond.notify_all()
+
+    def request(self):
+        """
+        Ask the remote command for the current position in the log.
+
+        :return: sequence number of the request, the reply is kept in replies under it
+        """
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+        self.stream.send(f'{seq}\n'.encode())
+        return seq
+
+    @property
+    def running(self):
+        return self.stream.running
+
+    def close(self):
+        self.stream.close()
+
+
+class LogMirror:
+    """
+    Local copy of one server log, kept up to date while the test runs.
+    """
+    def __init__(self, kind, location, local_path, destination=world.f_cfg.mgmt_address):
+        self.kind = kind
+        self.location = location
+        # copy of the current log, it moves to a new directory when the log is replaced
+        self.local_path = local_path
+        self._copies = [local_path]
+        self.lines = []
+        # journal: times of lines (seconds since epoch) and cursors of received entries
+        self._timestamps = []
+        self._cursors = set()
+        self._pending = b''
+        self._received = 0
+        # number of times the log was replaced or truncated
+        self._resets = 0
+        # pattern -> (regex, number of lines scanned, number of matching lines)
+        self._index = {}
+        self._kea_index = None
+        self._cond = threading.Condition()
+        self._file = open(local_path, 'wb')  # pylint: disable=consider-using-with
+        self._channel = _SyncChannel(self._cond)
+        self._channel.start(_mirror_command(kind, location, destination), self, destination)
+
+    def write(self, data):
+        """
+        Sink of the streamed log.
+        """
+        with self._cond:
+            self._pending += data
+            *lines, self._pending = self._pending.split(b'\n')
+            for line in lines:
+                if self.kind == 'journal':
+                    self._add_entry(line)
+                    continue
+                notice = _TAIL_NOTICE.search(line)
+                if notice is not None:
+                    # notice may follow the last line of the previous file that was not terminated
+                    if notice.start():
+                        self._add_line(line[:notice.start()])
+                    self._reset()
+                elif not line.startswith(b'tail: '):
+                    # other messages of tail (file does not exist yet, ...) are not part of the log
+                    self._add_line(line)
+            if self._file is not None:
+                self._file.flush()
+            self._cond.notify_all()
+
+    def _add_line(self, line):
+        # the lock is held by the caller
+        if self._file is None:
+            self.local_path = self._next_local_path()
+            self._copies.append(self.local_path)
+            self._file = open(self.local_path, 'wb')  # pylint: disable=consider-using-with
+        self._file.write(line + b'\n')
+        self._received += len(line) + 1
+        self.lines.append(line.decode('utf-8', 'replace'))
+
+    def _add_entry(self, line):
+        """
+        Add lines of journal entry in JSON, the copy of the log gets them like journalctl -o short-precise.
+        """
+        # the lock is held by the caller
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return
+        message = entry.get('MESSAGE')
+        if isinstance(message, list):
+            # message that is not valid UTF-8 is given as array of bytes
+            message = bytes(message).decode('utf-8', 'replace')
+        self._cursors.add(entry.get('__CURSOR'))
+        if message is None:
+            # journalctl -o cat skips entries without message
+            return
+        stamp = int(entry.get('__REALTIME_TIMESTAMP', 0)) / 1e6
+        prefix = datetime.datetime.fromtimestamp(stamp).strftime('%b %d %H:%M:%S.%f')
+        prefix += f' {entry.get("_HOSTNAME", "")} {entry.get("SYSLOG_IDENTIFIER", self.location)}'
+        prefix += f'[{entry["_PID"]}]: ' if '_PID' in entry else ': '
+        for text in message.split('\n'):
+            self.lines.append(text)
+            self._timestamps.append(stamp)
+            self._file.write((prefix + text + '\n').encode())
+
+    def _next_local_path(self):
+        """
+        Path of copy of the next log file: first free kea-logs-N/kea.log for kea.log.
+        """
+        directory, name = os.path.split(self._copies[0])
+        i = 1
+        while os.path.exists(os.path.join(directory, f'{name.split(".")[0]}-logs-{i}')):
+            i += 1
+        directory = os.path.join(directory, f'{name.split(".")[0]}-logs-{i}')
+        os.makedirs(directory)
+        return os.path.join(directory, name)
+
+    def _reset(self):
+        """
+        Start over with a new log file, the copy of the previous one is kept as it is.
+        """
+        # the lock is held by the caller
+        self._resets += 1
+        self.lines = []
+        self._index = {}
+        self._kea_index = None
+        if self._received:
+            # the copy of the new file is made once something is logged to it
+            self._file.close()
+            self._file = None
+        self._received = 0
+
+    def _pending_data(self):
+        # unterminated last line of log file, unless it is start of a tail notice;
+        # journal entry is not complete until its JSON line is
+        if self.kind == 'journal' or self._pending[:6] == b'tail: '[:len(self._pending)]:
+            return b''
+        return self._pending
+
+    @property
+    def running(self):
+        return self._channel.running
+
+    def _wait(self, predicate, deadline):
+        # the lock is held by the caller
+        while not predicate() and self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._cond.wait(min(remaining, 0.5))
+        return predicate()
+
+    def _caught_up(self, position):
+        if self.kind == 'journal':
+            return position == '' or position in self._cursors
+        return self._received + len(self._pending_data()) >= int(position.split()[-1] if position else 0)
+
+    def _replaced(self, position):
+        """
+        Is the log file on the server other than the one followed at the last sync, and tail
+        did not report it yet? Removed file is reported as inode 0, truncated one is smaller.
+        """
+        if self.kind == 'journal' or self._channel.synced is None:
+            return False
+        inode, size = (position.split() + ['0', '0'])[:2]
+        last_inode, last_size, resets = self._channel.synced
+        return (inode != last_inode or int(size) < last_size) and self._resets == resets
+
+    def sync(self, timeout=SYNC_TIMEOUT):
+        """
+        Wait until everything logged on the server so far is in the mirror.
+
+        :return: False if the mirror could not be synchronized
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if not self._wait(lambda: self._channel.ready, deadline):
+                return False
+        seq = self._channel.request()
+        with self._cond:
+            if not self._wait(lambda: seq in self._channel.replies, deadline):
+                return False
+            position = self._channel.replies.pop(seq)
+            # wait for tail to notice a replaced log, otherwise content of the old one would count
+            if not self._wait(lambda: not self._replaced(position), deadline):
+                return False
+            if not self._wait(lambda: self._caught_up(position), deadline):
+                return False
+            if self.kind == 'file':
+                inode, size = (position.split() + ['0', '0'])[:2]
+                self._channel.synced = (inode, int(size), self._resets)
+            return True
+
+    def count(self, line):
+        """
+        Number of lines in the mirror matching the pattern, like grep would count them.
+        """
+        with self._cond:
+            regex, scanned, count = self._index.get(line) or (grep_regex(line), 0, 0)
+            if regex is None:
+                return 0
+            count += sum(1 for text in self.lines[scanned:] if regex.search(text))
+            self._index[line] = (regex, len(self.lines), count)
+            # last line that is not terminated yet is counted by grep as well
+            if self._pending_data() and regex.search(self._pending_data().decode('utf-8', 'replace')):
+                count += 1
+            return count
+
+    def wait_for(self, line, count, timeout):
+        """
+        Wait until at least count lines match the pattern or the mirror stopped.
+        Lines are pushed to the mirror as they are logged, no sync is needed.
+
+        :param line: pattern as given to log checking functions
+        :param count: number of matching lines to wait for
+        :param timeout: time to wait for in seconds
+        :return: number of matching lines seen so far
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._wait(lambda: self.count(line) >= count, deadline)
+            return self.count(line)
+
+    def kea_index(self):
+        """
+        Index of Kea messages in the mirror, extended with lines received since the last call.
+        """
+        with self._cond:
+            if self._kea_index is None:
+                self._kea_index = KeaLogIndex(self.lines)
+            # journal entries carry their time, Kea messages logged to stdout may not
+            self._kea_index.add_lines(self._timestamps if self.kind == 'journal' else None)
+            return self._kea_index
+
+    def close(self, remove_copy=False):
+        self._channel.close()
+        with self._cond:
+            if self._file is not None:
+                if self.kind == 'file' and self._pending_data():
+                    self._file.write(self._pending_data())
+                self._file.close()
+                self._file = None
+        if remove_copy:
+            for path in self._copies:
+                if os.path.exists(path):
+                    os.remove(path)
+                if path != self._copies[0] and not os.listdir(os.path.dirname(path)):
+                    os.rmdir(os.path.dirname(path))
+
+
+class LogMirrors:
+    """
+    Mirrors per (host, log), all of them are stopped when the test ends.
+    """
+    def __init__(self):
+        self._test = None
+        self._mirrors = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, location, local_name, destination=world.f_cfg.mgmt_address, start=True):
+        """
+        Return mirror of the log, start it if needed.
+
+        :param kind: 'file' or 'journal'
+        :param location: log file path or systemd unit name
+        :param local_name: name of the mirror file in the test results directory
+        :param destination: address of server hosting the log
+        :param start: if False, only a mirror that is already running is returned
+        :return: LogMirror or None
+        """
+        with self._lock:
+            if self._test != getattr(world, 'name', None):
+                self._close_all()
+                self._test = getattr(world, 'name', None)
+            key = (destination, kind, location)
+            mirror = self._mirrors.get(key)
+            if mirror is None and start:
+                local_path = check_local_path_for_downloaded_files(world.cfg["test_result_dir"], local_name,
+                                                                   destination)
+                mirror = LogMirror(kind, location, local_path, destination)
+                self._mirrors[key] = mirror
+            return mirror
+
+    def _close_all(self, remove_copies=False):
+        mirrors = list(self._mirrors.values())
+        self._mirrors = {}
+        for mirror in mirrors:
+            mirror.close(remove_copies)
+
+    def close(self, remove_copies=False):
+        """
+        Stop all mirrors, the copies of logs stay in test results directory unless remove_copies is set.
+        """
+        with self._lock:
+            self._close_all(remove_copies)
+
+
+log_mirrors = LogMirrors()
@@ -47,7 +47,11 @@ import requests
 from src.forge_cfg import world
 from src.softwaresupport.multi_server_functions import fabric_send_file, fabric_download_file,\
         fabric_remove_file_command, remove_local_file, fabric_sudo_command, generate_file_name,\
-        save_local_file, fabric_run_command
+        save_local_file, fabric_run_command, run_blocking
+from src.protosupport.log_cursor import log_cursors
+from src.protosupport.log_follower import log_followers
+from src.protosupport.log_mirror import log_mirrors
+from src.protosupport.kea_log import KeaLogIndex
 
 
 log = logging.getLogger('forge')
@@ -205,46 +209,78 @@ def get_line_count_in_file(line, file, destination=world.f_cfg.mgmt_address):
     return int(result)
 
 
+def get_log_location(log_file=None):
+    """
+    Find out where a log is kept on the server.
+
+    :param log_file: name of the log file. If None, default values representing Kea logs are used.
+    :return: tuple ('journal', systemd unit name) or ('file', log file path or glob)
+    """
+    if world.f_cfg.install_method == 'make':
+        if log_file is None:
+            log_file = 'kea.log'
+        return 'file', world.f_cfg.log_join(log_file)
+    if log_file is None or log_file == 'kea-dhcp-ddns.log':
+        if log_file == 'kea-dhcp-ddns.log':
+            if world.server_system in ['redhat', 'alpine']:
+                service_name = 'kea-dhcp-ddns'
+            else:
+                service_name = 'isc-kea-dhcp-ddns-server'
+        else:
+            if world.server_system in ['redhat', 'alpine']:
+                service_name = f'kea-dhcp{world.proto[1]}'
+            else:
+                service_name = f'isc-kea-dhcp{world.proto[1]}-server'
+        if world.server_system == 'alpine':
+            return 'file', world.f_cfg.log_join(f'{service_name}.log')
+        # logs of kea service
+        return 'journal', service_name
+    return 'file', world.f_cfg.log_join(log_file)
+
+
+def get_log_mirror(log_file=None, destination=world.f_cfg.mgmt_address, start=True):
+    """
+    Local copy of a log kept up to date during the test, see log_mirror.
+
+    :param log_file: name of the log file. If None, default values representing Kea logs are used.
+    :param destination: address of server hosting the log
+    :param start: start mirroring the log if it is not mirrored yet
+    :return: LogMirror or None if logs are not mirrored
+    """
+    kind, location = get_log_location(log_file)
+    if not world.f_cfg.log_mirror or any(c in location for c in '*?['):
+        return None
+    if log_file is None:
+        local_name = 'kea.log'
+    elif kind == 'journal':
+        local_name = f'{location}.log'
+    else:
+        local_name = os.path.basename(location)
+    return log_mirrors.get(kind, location, local_name, destination=destination, start=start)
+
+
 def get_line_count_in_log(line, log_file=None, destination=world.f_cfg.mgmt_address):
     """
     Retrieves the number of lines contained in a log file.
+    Lines are counted in the local copy of the log if it is mirrored, otherwise logs are
+    scanned incrementally, only the part logged since previous call with the same line
+    in current test is searched, see log_cursor.
 
     :param line: line (or part of file or glob pattern) being checked
     :param log_file: name of the log file being checked. If None, default values
                      representing Kea logs are used.
     :param destination: address of server hosting the file
     """
-    if world.f_cfg.install_method == 'make':
-        if log_file is None:
-            log_file = 'kea.log'
-        log_file = world.f_cfg.log_join(log_file)
-        result = get_line_count_in_file(line, log_file, destination)
-    else:
-        if log_file is None or log_file == 'kea-dhcp-ddns.log':
-            if log_file == 'kea-dhcp-ddns.log':
-                if world.server_system in ['redhat', 'alpine']:
-                    service_name = 'kea-dhcp-ddns'
-                else:
-                    service_name = 'isc-kea-dhcp-ddns-server'
-            else:
-                if world.server_system in ['redhat', 'alpine']:
-                    service_name = f'kea-dhcp{world.proto[1]}'
-                else:
-                    service_name = f'isc-kea-dhcp{world.proto[1]}-server'
-            if world.server_system == 'alpine':
-                log_file = world.f_cfg.log_join(f'{service_name}.log')
-                cmd = f'cat {log_file} |'
-            else:
-                cmd = f'journalctl -u {service_name} |'  # get logs of kea service
-            cmd += ' grep "$(cat <<EOF\n'
-            cmd += f'{line}\n'
-            cmd += 'EOF\n'
-            cmd += ')" | wc -l'
-            result = fabric_sudo_command(cmd, destination_host=destination, ignore_errors=True)
-        else:
-            log_file = world.f_cfg.log_join(log_file)
-            result = get_line_count_in_file(line, log_file, destination)
-    return int(result)
+    mirror = get_log_mirror(log_file, destination=destination)
+    if mirror is not None and mirror.sync():
+        return mirror.count(line)
+    kind, location = get_log_location(log_file)
+    if kind == 'journal':
+        return log_cursors.count_in_journal(line, location, destination)
+    if any(c in location for c in '*?['):
+        # globs may match different files each time, count them all
+        return get_line_count_in_file(line, location, destination)
+    return log_cursors.count_in_file(line, location, destination)
 
 
 def file_contains_line(file, line, destination=world.f_cfg.mgmt_address):
@@ -253,7 +289,11 @@ def file_contains_line(file, line, destination=world.f_cfg.mgmt_address):
 
 
 def file_contains_line_n_times(file, n, line, destination=world.f_cfg.mgmt_address):
-    result = get_line_count_in_file(line, file, destination=destination)
+    mirror = log_mirrors.get('file', file, None, destination=destination, start=False)
+    if mirror is not None and mirror.sync():
+        result = mirror.count(line)
+    else:
+        result = get_line_count_in_file(line, file, destination=destination)
     assert result == n, f'Expected file {file} to contain line "{line}" a number of {n} time{"" if n == 1 else "s"}. ' \
                         f'Found {result} time{"" if result == 1 else "s"}.'
 
@@ -272,6 +312,117 @@ def lease_file_doesnt_contain(line, destination=world.f_cfg.mgmt_address):
     file_doesnt_contain_line(world.f_cfg.get_leases_path(), line, destination=destination)
 
 
+def get_log_index(log_file=None, destination=world.f_cfg.mgmt_address):
+    """
+    Index of Kea messages in a log, to ask about message IDs and their timing, see kea_log.
+
+    :param log_file: name of the log file. If None, default values representing Kea logs are used.
+    :param destination: address of server hosting the log
+    :return: KeaLogIndex
+    """
+    mirror = get_log_mirror(log_file, destination=destination)
+    if mirror is not None and mirror.sync():
+        return mirror.kea_index()
+    kind, location = get_log_location(log_file)
+    if kind == 'journal':
+        result = fabric_sudo_command(f'journalctl -u {location} -o export{log_cursors.journal_scope(destination)}',
+                                     destination_host=destination, hide_all=True, combine_stderr=False)
+        return KeaLogIndex.from_journal_export(result.stdout)
+    result = fabric_sudo_command(f'cat {location}', destination_host=destination, hide_all=True,
+                                 combine_stderr=False)
+    return KeaLogIndex.from_text(result.stdout)
+
+
+def log_contains_message(msgid, count=None, after=None, log_file=None, destination=world.f_cfg.mgmt_address):
+    """
+    Check Kea messages with given ID in the index of the log, see get_log_index().
+
+    :param msgid: message ID, e.g. HA_STATE_TRANSITION
+    :param count: number of expected messages, None means at least one
+    :param after: message ID, only messages logged after the first message with this ID are counted
+    :param log_file: name of the log file being checked. If None, default values
+                     representing Kea logs are used.
+    :param destination: address of server hosting the file
+    """
+    index = get_log_index(log_file, destination=destination)
+    since = None
+    where = ''
+    if after is not None:
+        since = index.first(after)
+        assert since is not None, f'Expected log file {log_file} to contain message {after}, but it does not.'
+        where = f' after {after}'
+    result = index.count(msgid, after=since)
+    if count is None:
+        assert result > 0, f'Expected log file {log_file} to contain message {msgid}{where}, but it does not.'
+    else:
+        assert result == count, f'Expected log file {log_file} to contain message {msgid}{where} a number of ' \
+                                f'{count} time{"" if count == 1 else "s"}. Found {result} time{"" if result == 1 else "s"}.'
+
+
+def get_line_counts_in_log(lines, log_file=None, destination=world.f_cfg.mgmt_address):
+    """
+    Retrieves the number of lines matching each of the patterns, all of them at once:
+    in the local copy of the log if it is mirrored, in a single remote command reading
+    the log once otherwise.
+
+    :param lines: list of lines (or parts of file or glob patterns) being checked
+    :param log_file: name of the log file being checked. If None, default values
+                     representing Kea logs are used.
+    :param destination: address of server hosting the file
+    :return: list of counts in the order of lines
+    """
+    mirror = get_log_mirror(log_file, destination=destination)
+    if mirror is not None and mirror.sync():
+        return [mirror.count(line) for line in lines]
+    if not lines:
+        return []
+    kind, location = get_log_location(log_file)
+    if kind == 'journal':
+        source = f'journalctl -u {location} --output=cat{log_cursors.journal_scope(destination)}'
+    else:
+        source = f'cat {location} 2>/dev/null'
+    # The log is read once, tee passes it to one grep per pattern through named pipes.
+    command = 'd=$(mktemp -d)\n'
+    for i, line in enumerate(lines):
+        command += 'p=$(cat <<EOF\n'
+        command += f'{line}\n'
+        command += 'EOF\n'
+        command += ')\n'
+        command += f'mkfifo "$d/{i}"; grep -c -e "$p" < "$d/{i}" > "$d/{i}.count" &\n'
+    # pattern rejected by grep does not stop tee feeding the others, its count is empty
+    pipes = ' '.join(f'"$d/{i}"' for i in range(len(lines)))
+    command += f'(trap "" PIPE; {source} | tee {pipes} > /dev/null)\n'
+    command += 'wait\n'
+    command += f'for i in $(seq 0 {len(lines) - 1}); do c=$(cat "$d/$i.count"); echo "${{c:-0}}"; done\n'
+    command += 'rm -rf "$d"'
+    result = fabric_sudo_command(command, destination_host=destination, hide_all=not world.f_cfg.forge_verbose,
+                                 ignore_errors=True, combine_stderr=False)
+    assert result.succeeded, f'Command in get_line_counts_in_log failed:\n{command}'
+    return [int(count) for count in result.splitlines()[-len(lines):]]
+
+
+def logs_contain_all(checks, log_file=None, destination=world.f_cfg.mgmt_address):
+    """
+    Check many patterns in a log at once and report all the mismatches together.
+
+    :param checks: list of tuples (line, count); count None means that the line is expected
+                   at least once, otherwise it is expected exactly count times (0 - not at all)
+    :param log_file: name of the log file being checked. If None, default values
+                     representing Kea logs are used.
+    :param destination: address of server hosting the file
+    """
+    counts = get_line_counts_in_log([line for line, _ in checks], log_file, destination=destination)
+    errors = []
+    for (line, expected), result in zip(checks, counts):
+        if expected is None:
+            if result == 0:
+                errors.append(f'Expected log file {log_file} to contain line "{line}", but it does not.')
+        elif result != expected:
+            errors.append(f'Expected log file {log_file} to contain line "{line}" a number of {expected} '
+                          f'time{"" if expected == 1 else "s"}. Found {result} time{"" if result == 1 else "s"}.')
+    assert not errors, f'{len(errors)} of {len(checks)} log checks failed:\n' + '\n'.join(errors)
+
+
 def log_contains(line, log_file=None, destination=world.f_cfg.mgmt_address):
     result = get_line_count_in_log(line, log_file, destination=destination)
     assert result > 0, f'Expected log file {log_file} to contain line "{line}", but it does not.'
@@ -297,6 +448,23 @@ def wait_for_message_in_log(line, count=1, timeout=4, log_file=None, destination
     started_at = datetime.datetime.now()
     count = int(count)
     should_finish_by = started_at + datetime.timedelta(seconds=timeout)
+    kind, location = get_log_location(log_file)
+    # Matching lines are pushed from the server as they are logged: the whole log to its mirror
+    # if it is mirrored, otherwise only lines matching the pattern, to a follower started for it.
+    watcher = get_log_mirror(log_file, destination=destination)
+    if watcher is not None:
+        result = watcher.wait_for(line, count, timeout)
+    elif not any(c in location for c in '*?['):
+        watcher = log_followers.get(line, kind, location, destination=destination)
+        result = watcher.wait_for(count, timeout)
+    if watcher is not None:
+        if count <= result:
+            return
+        assert not watcher.running, \
+            f'Timeout {timeout}s exceeded while waiting for {count} ' \
+            f'line{"" if count == 1 else "s"} of "{line}" in log file {log_file}. ' \
+            f'Instead got {result} lines.'
+        # The mirror or follower could not be started on this system, poll instead.
     while True:
         # Get the number of line occurrences in the log.
         result = get_line_count_in_log(line, log_file, destination=destination)
@@ -315,6 +483,16 @@ def wait_for_message_in_log(line, count=1, timeout=4, log_file=None, destination
         forge_sleep(100, 'milliseconds')
 
 
+async def wait_for_message_in_log_async(line, count=1, timeout=4, log_file=None,
+                                        destination=world.f_cfg.mgmt_address):
+    """
+    asyncio version of wait_for_message_in_log, e.g. to wait for messages in logs of several servers
+    while exchanging packets. The wait runs in a thread of remote calls, see run_blocking().
+    """
+    await run_blocking(wait_for_message_in_log, line, count=count, timeout=timeout, log_file=log_file,
+                       destination=destination)
+
+
 ################################################################################
 
 
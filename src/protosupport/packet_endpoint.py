@@ -0,0 +1,304 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Persistent packet sockets for DHCP exchanges.
+
+scapy's srp() and sr() open a socket, compile and attach a filter and start a sniffing loop
+for every exchange, and tear all of it down afterwards. PacketEndpoint does that once per
+interface and ports for the whole session: a receiver thread reads packets passing the filter
+and hands them to exchanges in progress. Answers are matched exactly like sr() matches them,
+by hashret() (transaction ID: xid in DHCPv4, trid in DHCPv6) and answers() of the reply,
+and the exchange returns as soon as every sent packet has its answer.
+
+exchange_async() does the same in asyncio event loop: packets with the transaction IDs
+of the exchange are passed from the receiver thread to its queue, so many exchanges can
+overlap without waking up each other.
+"""
+
+import time
+import select
+import asyncio
+import itertools
+import logging
+import threading
+
+from scapy.compat import raw
+from scapy.config import conf
+from scapy.error import Scapy_Exception
+from scapy.fields import FlagValue
+from scapy.layers.inet import UDP
+from scapy.packet import NoPayload
+
+from src.forge_cfg import world
+
+log = logging.getLogger('forge')
+
+# how often the receiver thread checks that the endpoint was closed
+POLL_INTERVAL = 0.2
+# DHCP server, client and relay ports are always passed by the filter
+DHCP_PORTS = (67, 68, 546, 547)
+# field values which neither expand into several packets nor change between serializations
+_FIXED_TYPES = (int, str, bytes, FlagValue, type(None))
+
+
+class _AsyncWaiter:
+    """
+    Receives packets for an exchange running in asyncio event loop.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def append(self, packet):
+        # called from the receiver thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, packet)
+
+
+def _is_concrete(packet):
+    """
+    Packet with nothing to expand: dissected and not changed since, e.g. one made from template.
+    Layer without its bytes (BOOTP changes its options while dissected) has to have only plain values.
+    """
+    while not isinstance(packet, NoPayload):
+        if packet.raw_packet_cache is None:
+            values = itertools.chain(packet.default_fields.values(), packet.fields.values())
+            if not all(isinstance(value, _FIXED_TYPES) for value in values):
+                return False
+        packet = packet.payload
+    return True
+
+
+def _expand(packets):
+    """
+    Like in sr(), packets with field ranges expand into several and random values are fixed.
+    :return: (list of packets, {hashret: [packets]})
+    """
+    packets = [concrete for packet in packets for concrete in ([packet] if _is_concrete(packet) else packet)]
+    pending = {}
+    for packet in packets:
+        pending.setdefault(packet.hashret(), []).append(packet)
+    return packets, pending
+
+
+def _is_echo(reply, sent):
+    """
+    Sent packet received back by the socket. DHCP layers answer packets with the same transaction ID
+    and UDP does not check the ports when conf.checkIPsrc is off, so it would answer itself.
+    Lower layers can be filled in by the kernel, the UDP payload is compared.
+    """
+    return UDP in reply and UDP in sent and raw(reply[UDP].payload) == raw(sent[UDP].payload)
+
+
+def _match(reply, pending, answered):
+    """
+    If reply answers one of pending packets, move that one to answered.
+    """
+    key = reply.hashret()
+    candidates = pending.get(key, [])
+    for sent in candidates:
+        if reply.answers(sent) and not _is_echo(reply, sent):
+            answered.append((sent, reply))
+            candidates.remove(sent)
+            if not candidates:
+                del pending[key]
+            return
+
+
+def _unanswered(packets, answered):
+    answered_ids = {id(sent) for sent, _ in answered}
+    return [packet for packet in packets if id(packet) not in answered_ids]
+
+
+class PacketEndpoint:
+    """
+    Socket on one interface receiving DHCP packets in background: layer 2 (Ether) for DHCPv4,
+    layer 3 (IPv6) for DHCPv6.
+    """
+    def __init__(self, iface, ipv6, ports):
+        """
+        :param iface: interface name
+        :param ipv6: True for layer 3 IPv6 socket, False for layer 2 socket
+        :param ports: UDP ports of the exchanged packets, used in the filter
+        """
+        self.iface = iface
+        self.ipv6 = ipv6
+        self.bpf = f"udp and ({' or '.join(f'port {port}' for port in sorted(set(ports)))})"
+        self._waiters = []
+        # hashret -> waiters of exchange_async() that sent packets with that hashret
+        self._keyed_waiters = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self.socket = self._open()
+        self._thread = threading.Thread(target=self._receive, daemon=True, name=f'forge-packets-{iface}')
+        self._thread.start()
+
+    def _open(self):
+        if self.ipv6:
+            socket_class = getattr(conf, 'L3socket6', None) or conf.L3socket
+        else:
+            socket_class = conf.L2socket
+        try:
+            return socket_class(iface=self.iface, filter=self.bpf)
+        except (Scapy_Exception, OSError) as e:
+            # filter could not be compiled (e.g. no tcpdump nor libpcap), non DHCP packets will not match anyway
+            log.warning('cannot attach filter "%s" on %s (%s), receiving all packets', self.bpf, self.iface, e)
+            return socket_class(iface=self.iface, nofilter=1)
+
+    def _receive(self):
+        while not self._closed:
+            try:
+                ready, _, _ = select.select([self.socket], [], [], POLL_INTERVAL)
+                if not ready:
+                    continue
+                packet = self.socket.recv()
+            except (OSError, ValueError, Scapy_Exception):
+                if self._closed:
+                    break
+                continue
+            if packet is None:
+                continue
+            with self._cond:
+                for waiter in self._waiters:
+                    waiter.append(packet)
+                if self._keyed_waiters:
+                    for waiter in self._keyed_waiters.get(packet.hashret(), ()):
+                        waiter.append(packet)
+                self._cond.notify_all()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def exchange(self, packets, timeout):
+        """
+        Send packets and wait for their answers, like sr()/srp() with multi=False.
+
+        :param packets: list of scapy packets, of the layer of the endpoint
+        :param timeout: time to wait for answers in seconds
+        :return: (list of (sent, received) tuples, list of unanswered sent packets)
+        """
+        # sent packets by hashret, the answer has to have the same one
+        packets, pending = _expand(packets)
+        received = []
+        answered = []
+        with self._cond:
+            # registered before sending, an answer may come back before send() returns
+            self._waiters.append(received)
+        try:
+            for packet in packets:
+                packet.sent_time = time.time()
+                self.socket.send(packet)
+            deadline = time.monotonic() + timeout
+            with self._cond:
+                while pending:
+                    while received and pending:
+                        _match(received.pop(0), pending, answered)
+                    remaining = deadline - time.monotonic()
+                    if not pending or remaining <= 0 or not self.running:
+                        break
+                    self._cond.wait(remaining)
+        finally:
+            with self._cond:
+                self._waiters.remove(received)
+        return answered, _unanswered(packets, answered)
+
+    async def exchange_async(self, packets, timeout):
+        """
+        exchange() for asyncio, other coroutines run while waiting for answers.
+        """
+        packets, pending = _expand(packets)
+        loop = asyncio.get_running_loop()
+        waiter = _AsyncWaiter(loop)
+        answered = []
+        with self._cond:
+            for key in pending:
+                self._keyed_waiters.setdefault(key, []).append(waiter)
+        try:
+            for packet in packets:
+                packet.sent_time = time.time()
+                self.socket.send(packet)
+            deadline = loop.time() + timeout
+            while pending and self.running:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    reply = await asyncio.wait_for(waiter.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                _match(reply, pending, answered)
+        finally:
+            with self._cond:
+                for key in {packet.hashret() for packet in packets}:
+                    waiters = self._keyed_waiters.get(key, [])
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+                    if not waiters:
+                        self._keyed_waiters.pop(key, None)
+        return answered, _unanswered(packets, answered)
+
+    def close(self):
+        self._closed = True
+        self._thread.join(2 * POLL_INTERVAL + 1)
+        self.socket.close()
+
+
+class PacketEndpoints:
+    """
+    Endpoints per (interface, IP version, ports), open for the whole forge session.
+    """
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def get(self, iface, ipv6, ports):
+        """
+        Return open endpoint, open it if needed. An endpoint whose receiver died is replaced.
+        """
+        key = (iface, ipv6, tuple(sorted(set(ports))))
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None or not endpoint.running:
+                endpoint = PacketEndpoint(iface, ipv6, ports)
+                self._endpoints[key] = endpoint
+            return endpoint
+
+    def close(self):
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            self._endpoints = {}
+        for endpoint in endpoints:
+            endpoint.close()
+
+
+packet_endpoints = PacketEndpoints()
+
+
+def exchange_packets(packets, timeout, ipv6):
+    """
+    Send packets on world.cfg["iface"] and wait for answers on the persistent endpoint,
+    replacement of srp() (ipv6 False) and sr() (ipv6 True). Besides DHCP ports, the filter
+    passes ports the test has set in world.cfg["source_port"] and world.cfg["destination_port"].
+
+    :return: (list of (sent, received) tuples, list of unanswered sent packets)
+    """
+    return _endpoint(ipv6).exchange(packets, timeout)
+
+
+def exchange_packets_async(packets, timeout, ipv6):
+    """
+    exchange_packets() for asyncio. The endpoint is chosen by world state at the time of the call,
+    the returned coroutine can be awaited after another exchange context became active.
+
+    :return: coroutine returning (list of (sent, received) tuples, list of unanswered sent packets)
+    """
+    return _endpoint(ipv6).exchange_async(packets, timeout)
+
+
+def _endpoint(ipv6):
+    ports = DHCP_PORTS + (world.cfg["source_port"], world.cfg["destination_port"])
+    return packet_endpoints.get(world.cfg["iface"], ipv6, ports)
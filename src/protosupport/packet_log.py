@@ -0,0 +1,186 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Log of packets exchanged by the test, shown only when needed.
+
+Printing every packet with scapy's show() as it is sent or received is slow and floods the
+output of long tests. Instead, the last PACKET_LOG_SIZE packets of the test are kept as bytes
+with the time they were sent or received, and dissected and rendered only when the test failed
+(SHOW_PACKETS = 'on-failure') or when a step asks for it: as show() output, as hexdump or
+written to a pcap file. The pcap file has DHCP and DNS exchanges of forge without running
+tcpdump (PACKET_CAPTURE).
+"""
+
+import time
+import logging
+import collections
+
+from scapy.compat import raw
+from scapy.data import DLT_EN10MB, DLT_RAW
+from scapy.layers.l2 import Ether
+from scapy.utils import RawPcapWriter, hexdump
+
+from src.forge_cfg import world
+
+log = logging.getLogger('forge')
+
+# packet sent by forge and packet received by it, as in SHOW_PACKETS_FROM setting
+CLIENT = 'client'
+SERVER = 'server'
+
+
+class LoggedPacket:
+    """
+    Packet kept in the log.
+    """
+    def __init__(self, direction, layer, data, timestamp):
+        """
+        :param direction: CLIENT or SERVER
+        :param layer: scapy class of the first layer, to dissect the data
+        :param data: bytes of the packet
+        :param timestamp: time the packet was sent or received, seconds since epoch
+        """
+        self.direction = direction
+        self.layer = layer
+        self.data = data
+        self.timestamp = timestamp
+
+    def packet(self):
+        return self.layer(self.data)
+
+    def header(self):
+        stamp = time.strftime('%H:%M:%S', time.localtime(self.timestamp)) + f'.{int(self.timestamp % 1 * 1e6):06d}'
+        sender = 'sent' if self.direction == CLIENT else 'received'
+        return f'{stamp} {sender} {len(self.data)} bytes: {self.packet().summary()}'
+
+
+class PacketLog:
+    """
+    Last packets exchanged by the test.
+    """
+    def __init__(self, size=500):
+        """
+        :param size: number of packets kept, older ones are dropped
+        """
+        self._packets = collections.deque(maxlen=size)
+        self.dropped = 0
+
+    def resize(self, size):
+        self._packets = collections.deque(self._packets, maxlen=size)
+
+    def clear(self):
+        self._packets.clear()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._packets)
+
+    def record(self, direction, packet, timestamp=None):
+        """
+        Keep the packet. Only its bytes are taken, it is not dissected nor rendered.
+
+        :param direction: CLIENT or SERVER
+        :param packet: scapy packet
+        :param timestamp: time it was sent or received, packet.time if None
+        """
+        if not self._packets.maxlen:
+            return
+        if len(self._packets) == self._packets.maxlen:
+            self.dropped += 1
+        if timestamp is None:
+            timestamp = float(packet.time)
+        self._packets.append(LoggedPacket(direction, type(packet), raw(packet), timestamp))
+
+    def packets(self, directions=(CLIENT, SERVER)):
+        """
+        Logged packets sent or received.
+
+        :param directions: CLIENT, SERVER or both
+        :return: list of LoggedPacket
+        """
+        return [logged for logged in self._packets if logged.direction in directions]
+
+    def render(self, directions=(CLIENT, SERVER), dump='show'):
+        """
+        Text of logged packets.
+
+        :param directions: CLIENT, SERVER or both
+        :param dump: 'show' for scapy show() output of each packet, 'hexdump' for its bytes
+                     or 'summary' for one line per packet
+        :return: string
+        """
+        assert dump in ('show', 'hexdump', 'summary'), f"Unknown packet dump {dump}"
+        lines = []
+        if self.dropped:
+            lines.append(f'{self.dropped} older packets are not logged')
+        for logged in self.packets(directions):
+            lines.append(logged.header())
+            if dump == 'show':
+                lines.append(logged.packet().show(dump=True))
+            elif dump == 'hexdump':
+                lines.append(hexdump(logged.data, dump=True) + '\n')
+        return '\n'.join(lines)
+
+    def write_pcap(self, file_name, directions=(CLIENT, SERVER)):
+        """
+        Write logged packets to pcap file. If all of them are Ethernet frames, the file has
+        Ethernet link type, otherwise IP packets without Ethernet headers.
+
+        :param file_name: path of the file
+        :param directions: CLIENT, SERVER or both
+        :return: number of written packets
+        """
+        packets = self.packets(directions)
+        ethernet = all(issubclass(logged.layer, Ether) for logged in packets)
+        writer = RawPcapWriter(file_name, linktype=DLT_EN10MB if ethernet else DLT_RAW)
+        try:
+            writer.write_header(None)
+            for logged in packets:
+                data = logged.data
+                if not ethernet and issubclass(logged.layer, Ether):
+                    data = data[14:]
+                writer.write_packet(data, sec=int(logged.timestamp),
+                                    usec=int(logged.timestamp % 1 * 1e6))
+        finally:
+            writer.close()
+        log.info('%d packets written to %s', len(packets), file_name)
+        return len(packets)
+
+
+packet_log = PacketLog()
+
+
+def selected_directions(show_packets_from):
+    """
+    Directions of packets selected by SHOW_PACKETS_FROM value ('both', 'client', 'server').
+    """
+    if show_packets_from == 'both':
+        return CLIENT, SERVER
+    if show_packets_from in (CLIENT, SERVER):
+        return (show_packets_from,)
+    return ()
+
+
+def log_sent(packets):
+    """
+    Record packets sent by forge and print them if SHOW_PACKETS is 'always'.
+    """
+    now = time.time()
+    for packet in packets:
+        packet_log.record(CLIENT, packet, now)
+        if world.f_cfg.show_packets == 'always' and CLIENT in selected_directions(world.f_cfg.show_packets_from):
+            packet.show()
+
+
+def log_received(packets):
+    """
+    Record packets received by forge and print them if SHOW_PACKETS is 'always'.
+    """
+    for packet in packets:
+        packet_log.record(SERVER, packet)
+        if world.f_cfg.show_packets == 'always' and SERVER in selected_directions(world.f_cfg.show_packets_from):
+            packet.show()
@@ -0,0 +1,301 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Templates of client messages, to skip scapy construction of messages sent over and over.
+
+Building a message layer by layer with scapy and serializing it is slow and it is done for
+every message sent, although tests and loops of clients mostly send messages of the same shape
+differing only in transaction ID, client identifier (DUID, chaddr, client-id option) and IAIDs.
+The first message of a shape is built by scapy as usual, serialized and kept as a template,
+keyed by its layout: addresses, ports, message type and all option fields except the variable
+ones. Following messages of the shape are made by writing their variable fields into a copy
+of the template bytes and updating UDP checksum. The bytes are dissected by scapy, so steps
+checking world.climsg get the same scapy packet as before, and sending it does not build it again.
+Steps changing a message made from template have to call thaw() first, so that scapy computes
+lengths and checksums of the changed message.
+
+A shape whose template would not give back the very message scapy builds (random values,
+non DHCP ports, variable fields not found) is remembered as not usable and always built by scapy.
+"""
+
+import struct
+import logging
+
+from scapy.compat import raw
+from scapy.layers.inet import IP, UDP
+from scapy.layers.inet6 import IPv6
+from scapy.packet import Packet, NoPayload
+from scapy.utils import checksum
+from scapy.volatile import VolatileValue
+
+log = logging.getLogger('forge')
+
+# templates kept at most, the cache is emptied when it is full
+MAX_TEMPLATES = 1024
+# fields of lower layers computed by scapy from the payload, kept in dissected message
+COMPUTED_FIELDS = ((IP, ('len', 'chksum')), (IPv6, ('plen',)), (UDP, ('len', 'chksum')))
+
+# DHCPv6 option codes with variable fields
+DHCP6_OPT_CLIENTID = 1
+DHCP6_OPT_IA_NA = 3
+DHCP6_OPT_IA_PD = 25
+# DHCPv4 fixed header length (without magic cookie) and client identifier option
+BOOTP_LEN = 236
+DHCP4_OPT_CLIENT_ID = 61
+
+
+class NotTemplatable(Exception):
+    """
+    Message cannot be made from a template.
+    """
+
+
+def layout_key(value):
+    """
+    Hashable key of value, packets are described by their type, fields and payload.
+
+    :raise NotTemplatable: value is random (scapy volatile value)
+    """
+    if isinstance(value, VolatileValue):
+        raise NotTemplatable(f'random value {value!r}')
+    if isinstance(value, NoPayload):
+        return None
+    if isinstance(value, Packet):
+        return (type(value), tuple((name, layout_key(field)) for name, field in value.fields.items()),
+                layout_key(value.payload))
+    if isinstance(value, (list, tuple)):
+        return tuple(layout_key(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, layout_key(item)) for key, item in value.items())
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _layers(packet):
+    layers = []
+    while not isinstance(packet, NoPayload):
+        layers.append(type(packet))
+        packet = packet.payload
+    return layers
+
+
+def thaw(packet):
+    """
+    Make scapy compute lengths and checksums of a message made from template again when it is
+    serialized, like in a newly built message. Needed before the message is changed: a dissected
+    message keeps its bytes and changes of upper layers do not update lower ones.
+    """
+    for layer_class, names in COMPUTED_FIELDS:
+        layer = packet.getlayer(layer_class)
+        if layer is not None:
+            for name in names:
+                setattr(layer, name, None)
+    packet.clear_cache()
+
+
+class PacketTemplate:
+    """
+    Serialized message with offsets of its variable fields.
+    """
+    def __init__(self, packet, offsets, values):
+        """
+        :param packet: message built by scapy
+        :param offsets: {field name: (offset, length)} of variable fields in serialized message
+        :param values: {field name: bytes} values of variable fields in the message
+        :raise NotTemplatable: the template does not give back the message
+        """
+        self.data = raw(packet)
+        self.layer = type(packet)
+        self.offsets = offsets
+        if set(offsets) != set(values):
+            raise NotTemplatable(f'variable fields {sorted(map(str, offsets))} found in {sorted(map(str, values))}')
+        for name, (offset, length) in offsets.items():
+            if self.data[offset:offset + length] != values[name]:
+                raise NotTemplatable(f'field {name} not found at {offset}')
+        ip_layer = packet.getlayer(IPv6)
+        if ip_layer is None:
+            ip_layer = packet.getlayer(IP)
+        if ip_layer is None or not isinstance(ip_layer.payload, UDP):
+            raise NotTemplatable('message is not UDP')
+        # UDP checksum covers addresses from IP header (pseudo header)
+        self.udp = len(self.data) - len(raw(ip_layer.payload))
+        ip = len(self.data) - len(raw(ip_layer))
+        if isinstance(ip_layer, IPv6):
+            self.pseudo_header = self.data[ip + 8:ip + 40] + struct.pack('!I3xB', len(self.data) - self.udp, 17)
+        else:
+            self.pseudo_header = self.data[ip + 12:ip + 20] + struct.pack('!xBH', 17, len(self.data) - self.udp)
+        filled = self.fill(values)
+        if _layers(filled) != _layers(packet) or raw(filled) != self.data:
+            raise NotTemplatable(f'message is dissected as {filled.summary()}')
+        thaw(filled)
+        if raw(filled) != self.data:
+            raise NotTemplatable(f'message {filled.summary()} is built differently')
+
+    def fill(self, values):
+        """
+        Message with the variable fields set.
+
+        :param values: {field name: bytes} of the same lengths as in the template
+        """
+        data = bytearray(self.data)
+        for name, (offset, length) in self.offsets.items():
+            assert len(values[name]) == length, f"Field {name} of template is {length} bytes long"
+            data[offset:offset + length] = values[name]
+        # lengths are the same as in the template, only UDP checksum changes
+        data[self.udp + 6:self.udp + 8] = b'\x00\x00'
+        chksum = checksum(self.pseudo_header + bytes(data[self.udp:]))
+        struct.pack_into('!H', data, self.udp + 6, chksum or 0xffff)
+        return self.layer(bytes(data))
+
+
+class PacketTemplates:
+    """
+    Templates by layout key, None for layouts that cannot be made from a template.
+    """
+    def __init__(self):
+        self._templates = {}
+
+    def get(self, key):
+        """
+        :return: PacketTemplate, None if there is none for the key
+        """
+        return self._templates.get(key)
+
+    def known(self, key):
+        return key in self._templates
+
+    def add(self, key, packet, offsets, values):
+        """
+        Make template of a message built by scapy.
+
+        :param key: layout key of the message
+        :param packet: the message
+        :param offsets: {field name: (offset, length)} of variable fields in serialized message
+        :param values: {field name: bytes} values of variable fields in the message
+        """
+        if len(self._templates) >= MAX_TEMPLATES:
+            self._templates.clear()
+        try:
+            self._templates[key] = PacketTemplate(packet, offsets, values)
+        except NotTemplatable as e:
+            log.debug('message %s is built without template: %s', packet.summary(), e)
+            self._templates[key] = None
+
+    def clear(self):
+        self._templates.clear()
+
+
+packet_templates = PacketTemplates()
+
+
+def dhcp6_layout(head, message, options):
+    """
+    Layout key and variable fields of DHCPv6 message: client-id DUID and IA_NA/IA_PD IAIDs.
+    Transaction ID is set by the caller as 'trid' value.
+
+    :param head: hashable description of IPv6 and UDP layers (addresses, ports)
+    :param message: DHCPv6 message layer without options
+    :param options: options in the order they are added to the message
+    :return: (key, {field name: bytes})
+    :raise NotTemplatable: message has random values or options with payload
+    """
+    key = [layout_key(head), layout_key(message)]
+    values = {}
+    counts = {}
+    for option in [message] + options:
+        if not isinstance(option, Packet):
+            raise NotTemplatable(f'option {option!r}')
+    for option in options:
+        if not isinstance(option.payload, NoPayload):
+            raise NotTemplatable(f'option {option.summary()} has payload')
+        fields = dict(option.fields)
+        code = getattr(option, 'optcode', None)
+        if code == DHCP6_OPT_CLIENTID:
+            name = ('duid', counts.setdefault('duid', 0))
+            value = raw(fields.pop('duid', b''))
+        elif code in (DHCP6_OPT_IA_NA, DHCP6_OPT_IA_PD):
+            name = ('iaid', counts.setdefault('iaid', 0))
+            value = struct.pack('!I', fields.pop('iaid', None) or 0)
+        else:
+            key.append((type(option), layout_key(fields)))
+            continue
+        counts[name[0]] += 1
+        values[name] = value
+        key.append((type(option), layout_key(fields), name, len(value)))
+    return tuple(key), values
+
+
+def dhcp6_offsets(data):
+    """
+    Offsets of variable fields in serialized IPv6/UDP/DHCPv6 message.
+    """
+    start = 40 + 8
+    offsets = {'trid': (start + 1, 3)}
+    counts = {'duid': 0, 'iaid': 0}
+    pos = start + 4
+    while pos + 4 <= len(data):
+        code, length = struct.unpack_from('!HH', data, pos)
+        if code == DHCP6_OPT_CLIENTID:
+            offsets[('duid', counts['duid'])] = (pos + 4, length)
+            counts['duid'] += 1
+        elif code in (DHCP6_OPT_IA_NA, DHCP6_OPT_IA_PD):
+            offsets[('iaid', counts['iaid'])] = (pos + 4, 4)
+            counts['iaid'] += 1
+        pos += 4 + length
+    return offsets
+
+
+def dhcp4_layout(head, options):
+    """
+    Layout key and variable fields of DHCPv4 options: client_id values.
+    Transaction ID and chaddr are set by the caller as 'xid' and 'chaddr' values.
+
+    :param head: hashable description of Ether, IP, UDP and BOOTP layers
+    :param options: DHCP options, as in scapy DHCP layer
+    :return: (key, {field name: bytes})
+    :raise NotTemplatable: options have random values
+    """
+    key = [layout_key(head)]
+    values = {}
+    for option in options:
+        if isinstance(option, tuple) and len(option) == 2 and option[0] == 'client_id' \
+                and isinstance(option[1], bytes):
+            name = ('client_id', len(values))
+            values[name] = option[1]
+            key.append(('client_id', len(option[1])))
+        else:
+            key.append(layout_key(option))
+    return tuple(key), values
+
+
+def dhcp4_offsets(data):
+    """
+    Offsets of variable fields in serialized Ether/IP/UDP/BOOTP/DHCP message.
+    """
+    start = 14 + (data[14] & 0x0f) * 4 + 8
+    offsets = {'xid': (start + 4, 4), 'chaddr': (start + 28, 16)}
+    count = 0
+    # options start after the magic cookie
+    pos = start + BOOTP_LEN + 4
+    while pos < len(data):
+        code = data[pos]
+        if code == 255:
+            break
+        if code == 0:
+            pos += 1
+            continue
+        if pos + 1 >= len(data):
+            break
+        length = data[pos + 1]
+        if code == DHCP4_OPT_CLIENT_ID:
+            offsets[('client_id', count)] = (pos + 2, length)
+            count += 1
+        pos += 2 + length
+    return offsets
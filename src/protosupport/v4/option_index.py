@@ -0,0 +1,168 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Options and fixed fields of a received DHCPv4 message, decoded once per message.
+
+scapy keeps DHCPv4 options as a list of tuples (option name, values...) where unknown options
+have their code instead of the name. OptionIndex goes through the list once and keeps options
+by code, with their values (IP addresses, strings, numbers as decoded by scapy, bytes also
+as hex), suboptions of relay agent information (82) and vendor options (43, 125), and BOOTP
+fields of the message. The index is kept with the message, option_index() of the same message
+does not decode it again.
+"""
+
+import types
+
+from scapy.layers.dhcp import BOOTP, DHCP, DHCPRevOptions
+
+# fixed BOOTP fields kept as they are
+BOOTP_FIELDS = ('op', 'htype', 'hlen', 'hops', 'xid', 'secs', 'flags', 'ciaddr', 'yiaddr', 'siaddr', 'giaddr')
+# options with suboptions as code, length, data
+TLV_SUBOPTIONS = (43, 82)
+# V-I vendor specific information, suboptions in blocks of enterprise number, length, suboptions
+VIVSO = 125
+
+
+def option_code(name):
+    """
+    Code of option as it is in scapy's options list: name of known option or code of unknown one.
+
+    :return: code, None if the name is not known
+    """
+    if isinstance(name, int):
+        return name
+    entry = DHCPRevOptions.get(name)
+    return entry[0] if entry else None
+
+
+def parse_tlv(data):
+    """
+    :return: list of (code, data) of suboptions encoded as one byte code, one byte length, data
+    """
+    suboptions = []
+    pos = 0
+    while pos + 2 <= len(data):
+        code, length = data[pos], data[pos + 1]
+        suboptions.append((code, data[pos + 2:pos + 2 + length]))
+        pos += 2 + length
+    return suboptions
+
+
+def parse_vivso(data):
+    """
+    :return: list of ((enterprise number, code), data) of V-I vendor specific suboptions
+    """
+    suboptions = []
+    pos = 0
+    while pos + 5 <= len(data):
+        enterprise = int.from_bytes(data[pos:pos + 4], 'big')
+        length = data[pos + 4]
+        suboptions += [((enterprise, code), value) for code, value in parse_tlv(data[pos + 5:pos + 5 + length])]
+        pos += 5 + length
+    return suboptions
+
+
+def _subcode_matches(key, subcode):
+    return key == subcode or (isinstance(key, tuple) and not isinstance(subcode, tuple) and key[1] == subcode)
+
+
+class OptionIndex:
+    """
+    Options of a DHCPv4 message by option code and its BOOTP fields.
+    """
+    def __init__(self, msg):
+        """
+        :param msg: received message, whole (Ether/IP/UDP/BOOTP/DHCP) or starting with BOOTP
+        """
+        bootp = msg.getlayer(BOOTP)
+        dhcp = msg.getlayer(DHCP)
+
+        fields = {}
+        if bootp is not None:
+            for name in BOOTP_FIELDS:
+                fields[name] = bootp.getfieldval(name)
+            fields['chaddr'] = bytes(bootp.chaddr[:6]).hex(':')
+            fields['sname'] = bootp.sname.decode('utf-8', 'replace').rstrip('\x00')
+            fields['file'] = bootp.file.decode('utf-8', 'replace').rstrip('\x00')
+        if 'src' in msg.fieldtype:
+            fields['src_address'] = msg.src
+
+        options = {}
+        # BOOTP messages may be optionless
+        for opt in dhcp.options if dhcp is not None else []:
+            # 'end', 'pad' and other markers without value are not options
+            if not isinstance(opt, tuple) or not opt:
+                continue
+            code = option_code(opt[0])
+            if code is not None and code not in options:
+                options[code] = opt
+
+        values = {}
+        hex_values = {}
+        suboptions = {}
+        for code, opt in options.items():
+            value = opt[1] if len(opt) == 2 else tuple(opt[1:])
+            values[code] = value
+            if isinstance(value, bytes):
+                hex_values[code] = value.hex().upper()
+                if code in TLV_SUBOPTIONS:
+                    suboptions[code] = parse_tlv(value)
+                elif code == VIVSO:
+                    suboptions[code] = parse_vivso(value)
+
+        self.fields = types.MappingProxyType(fields)
+        self._options = types.MappingProxyType(options)
+        self._values = types.MappingProxyType(values)
+        self._hex = types.MappingProxyType(hex_values)
+        self._suboptions = types.MappingProxyType({code: tuple(subopts) for code, subopts in suboptions.items()})
+
+    def option(self, code):
+        """
+        :return: option as in scapy's options list (name, values...), None if there is none
+        """
+        return self._options.get(code)
+
+    def value(self, code):
+        """
+        :return: value of the option, tuple if it has multiple ones (e.g. list of addresses)
+        """
+        return self._values.get(code)
+
+    def hex(self, code):
+        """
+        :return: upper case hex string of option data, None if scapy does not keep it as bytes
+        """
+        return self._hex.get(code)
+
+    def suboptions(self, code, subcode=None):
+        """
+        Suboptions of relay agent information (82), vendor specific information (43) or
+        V-I vendor specific information (125) option, whose subcode is (enterprise number, code).
+
+        :param code: option code
+        :param subcode: suboption code, all suboptions if None; suboption code of option 125
+                        matches suboptions with that code of any enterprise
+        :return: tuple of (subcode, data)
+        """
+        found = self._suboptions.get(code, ())
+        if subcode is None:
+            return found
+        return tuple(subopt for subopt in found if _subcode_matches(subopt[0], subcode))
+
+    def __contains__(self, code):
+        return code in self._options
+
+
+def option_index(msg):
+    """
+    OptionIndex of a received message, made on first use and kept with the message.
+    """
+    index = msg.__dict__.get('option_index')
+    if index is None:
+        index = OptionIndex(msg)
+        msg.option_index = index
+    return index
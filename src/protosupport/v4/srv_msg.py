@@ -21,7 +21,9 @@
 # pylint: disable=unused-import
 # pylint: disable=unused-variable
 
+import asyncio
 import codecs
+import functools
 import logging
 import os
 import struct
@@ -34,12 +36,16 @@ from random import randint
 
 from scapy.all import get_if_raw_hwaddr, Ether, srp, raw
 from scapy.config import conf
-from scapy.fields import Field
 from scapy.layers.dhcp import BOOTP, DHCP, DHCPOptions
 from scapy.packet import Raw
 from scapy.layers.inet import IP, UDP
 
 from src.forge_cfg import world
+from src.protosupport.exchange_context import ExchangeContext
+from src.protosupport.packet_endpoint import exchange_packets, exchange_packets_async
+from src.protosupport.packet_log import log_sent, log_received
+from src.protosupport.packet_template import NotTemplatable, packet_templates, dhcp4_layout, dhcp4_offsets, thaw
+from src.protosupport.v4.option_index import option_index
 from src.protosupport.v6.srv_msg import apply_message_fields_changes, close_sockets, client_add_saved_option
 
 from src import misc
@@ -79,6 +85,7 @@ def build_raw(msg, append):
         world.climsg.append(build_msg(opts="") / Raw(load=append))
     else:
         client_send_msg(msg)
+        thaw(world.climsg[0])
         world.climsg[0] = world.climsg[0] / Raw(load=append)
 
 
@@ -228,19 +235,13 @@ def client_does_include(sender_type, opt_type, value):
 
 
 def response_check_content(expect, data_type, expected):
+    assert len(world.srvmsg) != 0, "No response received."
 
-    if data_type in ['yiaddr', 'ciaddr', 'siaddr', 'giaddr']:
-        received = getattr(world.srvmsg[0], data_type)
-    elif data_type == 'src_address':
-        received = world.srvmsg[0].src
-    elif data_type == 'chaddr':
-        tmp = struct.unpack('16B', world.srvmsg[0].chaddr)
-        received = ':'.join("%.2x" % x for x in tmp[:6])
-    elif data_type == 'sname':
-        received = world.srvmsg[0].sname.decode('utf-8').rstrip('\x00')
-    elif data_type == 'file':
-        received = world.srvmsg[0].file.decode('utf-8').rstrip('\x00')
-
+    # BOOTP fields are decoded (chaddr as MAC address, sname and file as text) once per message
+    fields = option_index(world.srvmsg[0]).fields
+    if data_type in ['yiaddr', 'ciaddr', 'siaddr', 'giaddr', 'src_address', 'chaddr', 'sname', 'file']:
+        assert data_type in fields, "Response has no %s" % data_type
+        received = fields[data_type]
     else:
         assert False, "Value %s is not supported" % data_type
 
@@ -301,13 +302,49 @@ def build_msg(opts):
     else:
         msg_flag = 0
 
+    if opts == "":
+        msg = Ether(dst="ff:ff:ff:ff:ff:ff",
+                    src=hw)
+        msg /= IP(src=world.cfg["source_IP"],
+                  dst=world.cfg["destination_IP"],)
+        msg /= UDP(sport=world.cfg["source_port"], dport=world.cfg["destination_port"])
+        return msg
+
+    # BOOTP requests can be optionless
+    if len(opts) > 0:
+        opts += ["end"]  # end option
+
+    # transaction id
+    if world.cfg["values"]["tr_id"] is None:
+        xid = randint(0, 256*256*256)
+    else:
+        xid = int(world.cfg["values"]["tr_id"])
+
+    key, values = None, {}
+    if world.f_cfg.packet_templates:
+        head = (hw, world.cfg["source_IP"], world.cfg["destination_IP"], world.cfg["source_port"],
+                world.cfg["destination_port"], world.cfg["values"]["giaddr"], msg_flag,
+                world.cfg["values"]["secs"], world.cfg["values"]["hops"], world.cfg["values"]["ciaddr"],
+                world.cfg["values"]["siaddr"], world.cfg["values"]["yiaddr"], world.cfg["values"]["htype"],
+                world.cfg["values"]["hlen"], len(tmp_hw), len(opts) > 0)
+        try:
+            key, values = dhcp4_layout(head, opts)
+        except NotTemplatable:
+            key = None
+        else:
+            values['xid'] = struct.pack('!I', xid)
+            values['chaddr'] = (tmp_hw + b'\x00' * 16)[:16]
+    template = packet_templates.get(key) if key is not None else None
+    if template is not None:
+        msg = template.fill(values)
+        world.cfg["values"]["tr_id"] = msg.xid
+        return msg
+
     msg = Ether(dst="ff:ff:ff:ff:ff:ff",
                 src=hw)
     msg /= IP(src=world.cfg["source_IP"],
               dst=world.cfg["destination_IP"],)
     msg /= UDP(sport=world.cfg["source_port"], dport=world.cfg["destination_port"])
-    if opts == "":
-        return msg
 
     msg /= BOOTP(chaddr=tmp_hw,
                  giaddr=world.cfg["values"]["giaddr"],
@@ -315,16 +352,10 @@ def build_msg(opts):
                  secs=world.cfg["values"]["secs"],
                  hops=world.cfg["values"]["hops"])
 
-    # BOOTP requests can be optionless
     if len(opts) > 0:
-        opts += ["end"]  # end option
         msg /= DHCP(options=opts)
 
-    # transaction id
-    if world.cfg["values"]["tr_id"] is None:
-        msg.xid = randint(0, 256*256*256)
-    else:
-        msg.xid = int(world.cfg["values"]["tr_id"])
+    msg.xid = xid
     world.cfg["values"]["tr_id"] = msg.xid
 
     msg.ciaddr = world.cfg["values"]["ciaddr"]
@@ -332,6 +363,8 @@ def build_msg(opts):
     msg.yiaddr = world.cfg["values"]["yiaddr"]
     msg.htype = world.cfg["values"]["htype"]
     msg.hlen = world.cfg["values"]["hlen"]
+    if key is not None and not packet_templates.known(key):
+        packet_templates.add(key, msg, dhcp4_offsets(raw(msg)), values)
     return msg
 
 
@@ -493,10 +526,12 @@ def tcp_get_message(**kwargs):
     assert False, f"Message with {kwargs} you are looking for couldn't be found."
 
 
-def send_wait_for_message(requirement_level: str, presence: bool, exp_message: str,
-                          protocol: str = 'UDP', address: str = None, port: int = None):
+def _prepare_exchange():
+    """
+    Finish the message to be sent and clear the previous response.
+    :return: time to wait for the response
+    """
     world.cliopts = []  # clear options, always build new message, also possible make it in client_send_msg
-    # We need to use srp() here (send and receive on layer 2)
     factor = 1
     pytest_current_test = os.environ.get('PYTEST_CURRENT_TEST')
     if 'HA' in pytest_current_test.split('/'):
@@ -506,34 +541,52 @@ def send_wait_for_message(requirement_level: str, presence: bool, exp_message: s
     apply_message_fields_changes()
     world.srvmsg = []
     world.tcpmsg = []
-    received_name = ""
 
-    if world.f_cfg.show_packets_from in ['both', 'client']:
-        world.climsg[0].show()
-        print('\n')
+    log_sent(world.climsg)
+    return factor * world.cfg['wait_interval']
 
-    if protocol == 'UDP':
-        ans, unans = srp(world.climsg,
-                         iface=world.cfg["iface"],
-                         timeout=factor * world.cfg['wait_interval'],
-                         multi=False,
-                         verbose=int(world.f_cfg.forge_verbose))
-        if world.f_cfg.forge_verbose == 0:
-            print(".", end='')
-
-        for x in ans:
-            a, b = x
-            world.srvmsg.append(b)
-    else:
-        address = world.f_cfg.dns4_addr if address is None else address
-        world.tcpmsg = send_over_tcp(raw(world.climsg[0].getlayer(3)), address, port)
-        if len(world.tcpmsg) > 0:
-            world.srvmsg = world.tcpmsg.copy()
-        unans = []
 
-    if world.f_cfg.show_packets_from in ['both', 'server']:
-        for msg in world.srvmsg:
-            msg.show()
+def _tcp_query(address):
+    """
+    Message from world.climsg sent over TCP and the address it goes to.
+    """
+    address = world.f_cfg.dns4_addr if address is None else address
+    return raw(world.climsg[0].getlayer(3)), address
+
+
+def _tcp_answers(responses):
+    world.tcpmsg = responses
+    return [(world.climsg[0], msg) for msg in world.tcpmsg], []
+
+
+def _exchange_over_tcp(address, port):
+    msg, address = _tcp_query(address)
+    return _tcp_answers(send_over_tcp(msg, address, port))
+
+
+def _send_over_tcp_in_executor(f_cfg, msg, address, port):
+    """
+    send_over_tcp() run by executor, in a thread with world of its own.
+    :return: tuple (transaction ID of the sent message, responses)
+    """
+    world.f_cfg = f_cfg
+    responses = send_over_tcp(msg, address, port)
+    return world.blq_trid, responses
+
+
+def _check_response(presence, exp_message, protocol, ans, unans):
+    """
+    Store the response in world.srvmsg and check that it came or not.
+    """
+    received_name = ""
+    if protocol == 'UDP' and world.f_cfg.forge_verbose == 0:
+        print(".", end='')
+
+    for x in ans:
+        a, b = x
+        world.srvmsg.append(b)
+
+    log_received(world.srvmsg)
 
     if len(world.srvmsg) > 0:
         received_name = get_msg_type(world.srvmsg[0])
@@ -555,6 +608,56 @@ def send_wait_for_message(requirement_level: str, presence: bool, exp_message: s
     return world.srvmsg
 
 
+def send_wait_for_message(requirement_level: str, presence: bool, exp_message: str,
+                          protocol: str = 'UDP', address: str = None, port: int = None):
+    timeout = _prepare_exchange()
+    if protocol == 'UDP':
+        # We need to use srp() here (send and receive on layer 2)
+        if world.f_cfg.persistent_packet_socket:
+            # socket opened once per session, no setup and teardown for each exchange
+            ans, unans = exchange_packets(world.climsg, timeout, ipv6=False)
+        else:
+            ans, unans = srp(world.climsg,
+                             iface=world.cfg["iface"],
+                             timeout=timeout,
+                             multi=False,
+                             verbose=int(world.f_cfg.forge_verbose))
+    else:
+        ans, unans = _exchange_over_tcp(address, port)
+    return _check_response(presence, exp_message, protocol, ans, unans)
+
+
+async def send_wait_for_message_async(ctx, requirement_level: str, presence: bool, exp_message: str,
+                                      protocol: str = 'UDP', address: str = None, port: int = None):
+    """
+    send_wait_for_message() with the messages of exchange context, other coroutines run
+    while the response is awaited.
+    :param ctx: ExchangeContext
+    :return: list of responses
+    """
+    with ctx.active():
+        timeout = _prepare_exchange()
+        loop = asyncio.get_running_loop()
+        # world is per thread, everything is taken from it before the exchange goes to executor
+        if protocol != 'UDP':
+            msg, address = _tcp_query(address)
+            pending = loop.run_in_executor(None, _send_over_tcp_in_executor, world.f_cfg, msg, address, port)
+        elif world.f_cfg.persistent_packet_socket:
+            pending = exchange_packets_async(world.climsg, timeout, ipv6=False)
+        else:
+            pending = loop.run_in_executor(
+                None, functools.partial(srp, world.climsg, iface=world.cfg["iface"], timeout=timeout,
+                                        multi=False, verbose=int(world.f_cfg.forge_verbose)))
+    result = await pending
+    with ctx.active():
+        if protocol != 'UDP':
+            world.blq_trid, responses = result
+            ans, unans = _tcp_answers(responses)
+        else:
+            ans, unans = result
+        return _check_response(presence, exp_message, protocol, ans, unans)
+
+
 def get_option(msg, opt_code):
     """
     Retrieve from scapy message {msg}, the DHCPv4 option having IANA code {opt_code}.
@@ -566,28 +669,10 @@ def get_option(msg, opt_code):
     # Ensure the option code is an integer.
     opt_code = get_option_code(opt_code)
 
-    # Returns option of specified type
-    # We need to iterate over all options and see
-    # if there's one we're looking for
-    world.opts = []
-    opt_name = DHCPOptions[opt_code]
-    # dhcpv4 implementation in Scapy is a mess. The options array contains mix of
-    # strings, IPField, ByteEnumField and who knows what else. In each case the
-    # values are accessed differently
-    if isinstance(opt_name, Field):
-        opt_name = opt_name.name
-
-    if len(world.tcpmsg) == 0:
-        x = msg.getlayer(4)  # 0 is Ethernet, 1 is IPv4, 2 is UDP, 3 is BOOTP, 4 is DHCP options
-    else:
-        x = msg.getlayer(1)  # if tcp connection is used, than BOOTP is layer 0 and DHCP options is 1
-    # BOOTP messages may be optionless, so check first
-    if x is not None:
-        for opt in x.options:
-            if opt[0] is opt_name:
-                world.opts.append(opt)
-                return opt
-    return None
+    # options are looked up by code in the index of the message, made once per message
+    opt = option_index(msg).option(opt_code)
+    world.opts = [] if opt is None else [opt]
+    return opt
 
 
 def byte_to_hex(byte_str):
@@ -609,13 +694,12 @@ def test_option(opt_code, received, expected):
         else:
             return False, received
 
-    tmp = ""
     decode_opts_byte_to_hex = [43, 125]
     if opt_code in decode_opts_byte_to_hex or expected[:4] == "HEX:":
         expected = expected[4:]
-        # for this option we need a bit magic, and proper formatting at the end
-        tmp = struct.unpack('%dB' % len(received[1]), received[1])
-        received = (received[0], "".join("%.2x" % x for x in tmp).upper())
+        # value may already be given as hex string from the option index
+        if isinstance(received[1], bytes):
+            received = (received[0], received[1].hex().upper())
 
     for each in received:
         if str(each) == str(expected):
@@ -665,6 +749,8 @@ def response_check_option_content(opt_code, expect, data_type, expected):
     assert len(world.srvmsg) != 0, "No response received."
 
     received = get_option(world.srvmsg[0], opt_code)
+    assert received is not None, "Expected option %s not present in the message." % _get_opt_descr(opt_code) + \
+                                 "\nPacket:" + str(world.srvmsg[0].show(dump=True))
 
     # FQDN is being parsed different way because of scapy imperfections
     if opt_code == 81:
@@ -679,8 +765,11 @@ def response_check_option_content(opt_code, expect, data_type, expected):
         expected = convert_to_hex(expected)
     elif opt_code == 82:
         expected = convert_to_hex(expected)
-    elif isinstance(received[1], bytes):
-        received = (received[0], received[1])
+    else:
+        # data of options 43, 125 and HEX: values are compared as hex string, made once per message
+        hex_value = option_index(world.srvmsg[0]).hex(get_option_code(opt_code))
+        if hex_value is not None and (opt_code in [43, 125] or str(expected)[:4] == "HEX:"):
+            received = (received[0], hex_value)
 
     outcome, received = test_option(opt_code, received, expected)
 
@@ -697,26 +786,84 @@ def response_check_option_content(opt_code, expect, data_type, expected):
 
 def get_all_leases(decode_duid=True):
     assert world.srvmsg
-    mac = ""
-    tmp = struct.unpack('16B', world.srvmsg[0].chaddr)
-    mac += ':'.join("%.2x" % x for x in tmp[:6])
-
-    lease = {"hwaddr": mac, "address": world.srvmsg[0].yiaddr}
-    try:
-        lease.update({"client_id": get_option(world.srvmsg[0], 61)[1].hex()})
-    except BaseException:
-        pass
-    try:
-        lease.update({"valid_lifetime": get_option(world.srvmsg[0], 51)[1]})
-    except BaseException:
-        pass
-    try:
-        lease.update({"server_id": get_option(world.srvmsg[0], 54)[1]})
-    except BaseException:
-        pass
+    index = option_index(world.srvmsg[0])
+
+    lease = {"hwaddr": index.fields['chaddr'], "address": index.fields['yiaddr']}
+    if index.hex(61) is not None:
+        lease.update({"client_id": index.hex(61).lower()})
+    if 51 in index:
+        lease.update({"valid_lifetime": index.option(51)[1]})
+    if 54 in index:
+        lease.update({"server_id": index.option(54)[1]})
     return lease
 
 
+def response_check_include_suboption(opt_code, expect, expected_value):
+    """
+    Assert that suboption {expected_value} exists inside option {opt_code}
+    (relay agent information 82, vendor specific information 43 or 125)
+    if {expect} is True or doesn't exist if {expect} is False.
+    :param opt_code: option code or name
+    :param expect: whether the suboption should exist
+    :param expected_value: suboption code, in option 125 of any enterprise
+    :return: list of (suboption code, data) found
+    """
+    assert len(world.srvmsg) != 0, "No response received."
+    opt_code = get_option_code(opt_code)
+    x = list(option_index(world.srvmsg[0]).suboptions(opt_code, int(expected_value)))
+    opt_descr = _get_opt_descr(opt_code)
+    if expect:
+        assert len(x) > 0, "Expected sub-option {expected_value} not present in the option {opt_descr}".format(**locals())
+    else:
+        assert len(x) == 0, "NOT expected sub-option {expected_value} is present in the option {opt_descr}".format(**locals())
+    return x
+
+
+def response_check_suboption_content(subopt_code, opt_code, expect, data_type, expected_value):
+    """
+    Assert that data of suboption {subopt_code} nested inside option {opt_code}
+    has {expected_value} if {expect} is True. Or check that it has a
+    different value than {expected_value} if {expect} is False.
+    :param subopt_code: suboption code
+    :param opt_code: option code or name
+    :param expect: whether the value is expected or not in the suboption
+    :param data_type: 'hex' to compare data as hex string (colons are ignored), otherwise as text
+    :param expected_value: the value that is checked
+    """
+    opt_code = get_option_code(opt_code)
+    expected_value = str(expected_value)
+    if data_type == 'hex':
+        expected_value = expected_value.replace(':', '').upper()
+    received = []
+    for _, data in response_check_include_suboption(opt_code, True, subopt_code):
+        if data_type == 'hex':
+            received.append(data.hex().upper())
+        else:
+            received.append(data.decode('utf-8', 'replace'))
+
+    opt_descr = _get_opt_descr(opt_code)
+
+    if expect:
+        assert expected_value in received, ("Invalid {opt_descr} option, received {data_type}: ".format(**locals()) +
+                                            ",".join(received) + ", but expected " + str(expected_value))
+    else:
+        assert expected_value not in received, ("Received value of {data_type}: ".format(**locals()) + ",".join(received) +
+                                                " should not be equal to value from client - " + str(expected_value))
+
+
+def _do_send(options, chaddr):
+    client_sets_value('chaddr', chaddr)
+    if options:
+        for k, v in options.items():
+            client_does_include(None, k, v)
+    client_send_msg('DISCOVER')
+
+
+def _do_check(address, chaddr):
+    response_check_content(True, 'yiaddr', address)
+    client_sets_value('chaddr', chaddr)
+
+
 def DO(address=None, options=None, chaddr='ff:01:02:03:ff:04'):
     """
     Sends a discover and expects an offer. Inserts options in the client
@@ -733,11 +880,7 @@ def DO(address=None, options=None, chaddr='ff:01:02:03:ff:04'):
         (default: 'ff:01:02:03:ff:04' - a value commonly used in tests)
     """
     # Send a discover.
-    client_sets_value('chaddr', chaddr)
-    if options:
-        for k, v in options.items():
-            client_does_include(None, k, v)
-    client_send_msg('DISCOVER')
+    _do_send(options, chaddr)
 
     # If the test requires an address, expect it in the offer, otherwise expect
     # no message back.
@@ -745,30 +888,27 @@ def DO(address=None, options=None, chaddr='ff:01:02:03:ff:04'):
         send_wait_for_message('MUST', False, None)
     else:
         send_wait_for_message('MUST', True, 'OFFER')
-        response_check_content(True, 'yiaddr', address)
-        client_sets_value('chaddr', chaddr)
+        _do_check(address, chaddr)
 
 
-def RA(address, options=None, response_type='ACK', chaddr='ff:01:02:03:ff:04',
-       init_reboot=False, subnet_mask='255.255.255.0', fqdn=None):
+async def do(address=None, options=None, chaddr='ff:01:02:03:ff:04', ctx=None):
     """
-    Sends a request and expects an advertise. Inserts options in the client
-    packets based on given parameters and ensures that the right options are
-    found in the server packets. A single option missing or having incorrect
-    values renders the test failed.
+    DO() as coroutine, with client state in exchange context.
 
-    :param address: the address used in the requested_addr option in the DHCP request.
-        If None, the yiaddr in the last message, supposedly a DHCPOFFER, is expected.
-    :param options: any additional options to be inserted in the client packets in
-        dictionary form with option names as keys and option values as values.
-        (default: {})
-    :param response_type: the type of response to be expected in the server packet.
-        Can have values 'ACK', 'NAK' or None. None means no response.
-        (default: 'ACK')
-    :param chaddr: the client hardware address to be used in client packets
-        (default: 'ff:01:02:03:ff:04' - a value commonly used in tests)
-    :param subnet_mask: the value for option 1 subnet mask expected in a DHCPACK
+    :param ctx: ExchangeContext of the client, new client if None
     """
+    ctx = ctx or ExchangeContext()
+    with ctx.active():
+        _do_send(options, chaddr)
+    if address is None:
+        await send_wait_for_message_async(ctx, 'MUST', False, None)
+    else:
+        await send_wait_for_message_async(ctx, 'MUST', True, 'OFFER')
+        with ctx.active():
+            _do_check(address, chaddr)
+
+
+def _ra_send(address, options, chaddr, init_reboot, fqdn):
     client_sets_value('chaddr', chaddr)
     # Copy server ID if the client is not simulating an INIT-REBOOT state and if
     # there was a server response in the past to copy it from.
@@ -790,20 +930,68 @@ def RA(address, options=None, response_type='ACK', chaddr='ff:01:02:03:ff:04',
         client_does_include(None, 'fqdn', 'fqdn')
     client_send_msg('REQUEST')
 
+
+def _ra_check(address, subnet_mask, fqdn):
+    response_check_content(True, 'yiaddr', address)
+    response_check_include_option(True, 'subnet-mask')
+    response_check_option_content('subnet-mask', True, 'value', subnet_mask)
+    if fqdn is not None:
+        response_check_include_option(True, 81)
+        response_check_option_content(81, True, 'fqdn', fqdn)
+
+
+def RA(address, options=None, response_type='ACK', chaddr='ff:01:02:03:ff:04',
+       init_reboot=False, subnet_mask='255.255.255.0', fqdn=None):
+    """
+    Sends a request and expects an advertise. Inserts options in the client
+    packets based on given parameters and ensures that the right options are
+    found in the server packets. A single option missing or having incorrect
+    values renders the test failed.
+
+    :param address: the address used in the requested_addr option in the DHCP request.
+        If None, the yiaddr in the last message, supposedly a DHCPOFFER, is expected.
+    :param options: any additional options to be inserted in the client packets in
+        dictionary form with option names as keys and option values as values.
+        (default: {})
+    :param response_type: the type of response to be expected in the server packet.
+        Can have values 'ACK', 'NAK' or None. None means no response.
+        (default: 'ACK')
+    :param chaddr: the client hardware address to be used in client packets
+        (default: 'ff:01:02:03:ff:04' - a value commonly used in tests)
+    :param subnet_mask: the value for option 1 subnet mask expected in a DHCPACK
+    """
+    _ra_send(address, options, chaddr, init_reboot, fqdn)
+
     if response_type is None:
         send_wait_for_message('MUST', False, None)
     elif response_type == 'ACK':
         send_wait_for_message('MUST', True, 'ACK')
-        response_check_content(True, 'yiaddr', address)
-        response_check_include_option(True, 'subnet-mask')
-        response_check_option_content('subnet-mask', True, 'value', subnet_mask)
-        if fqdn is not None:
-            response_check_include_option(True, 81)
-            response_check_option_content(81, True, 'fqdn', fqdn)
+        _ra_check(address, subnet_mask, fqdn)
     elif response_type == 'NAK':
         send_wait_for_message('MUST', True, 'NAK')
 
 
+async def ra(address, options=None, response_type='ACK', chaddr='ff:01:02:03:ff:04',
+             init_reboot=False, subnet_mask='255.255.255.0', fqdn=None, ctx=None):
+    """
+    RA() as coroutine, with client state in exchange context.
+
+    :param ctx: ExchangeContext of the client, new client if None
+    """
+    ctx = ctx or ExchangeContext()
+    with ctx.active():
+        _ra_send(address, options, chaddr, init_reboot, fqdn)
+
+    if response_type is None:
+        await send_wait_for_message_async(ctx, 'MUST', False, None)
+    elif response_type == 'ACK':
+        await send_wait_for_message_async(ctx, 'MUST', True, 'ACK')
+        with ctx.active():
+            _ra_check(address, subnet_mask, fqdn)
+    elif response_type == 'NAK':
+        await send_wait_for_message_async(ctx, 'MUST', True, 'NAK')
+
+
 def DORA(address=None, options=None, exchange='full', response_type='ACK', chaddr='ff:01:02:03:ff:04',
          init_reboot=False, subnet_mask='255.255.255.0', fqdn=None):
     """
@@ -844,28 +1032,35 @@ def DORA(address=None, options=None, exchange='full', response_type='ACK', chadd
     RA(address, options, response_type, chaddr, init_reboot, subnet_mask, fqdn)
 
 
-def BOOTP_REQUEST_and_BOOTP_REPLY(address: str,
-                                  chaddr: str = 'ff:01:02:03:ff:04',
-                                  client_id: str = None):
+async def dora(address=None, options=None, exchange='full', response_type='ACK', chaddr='ff:01:02:03:ff:04',
+               init_reboot=False, subnet_mask='255.255.255.0', fqdn=None, ctx=None):
     """
-    Send a BOOTP request and expect a BOOTP reply.
+    DORA() as coroutine, with client state in exchange context. Many clients at once:
 
-    :param address: the address expected in the reply. If None, address is not checked.
-    :param chaddr: the value of the chaddr field in the BOOTP request packet
-    :param client_id: the value of option 61 client identifier in the BOOTP request packet
+        await asyncio.gather(dora('192.168.50.1', chaddr='ff:01:02:03:ff:01'),
+                             dora('192.168.50.2', chaddr='ff:01:02:03:ff:02'))
+
+    :param ctx: ExchangeContext of the client, new client if None
     """
+    ctx = ctx or ExchangeContext()
+    with ctx.active():
+        misc.test_procedure()
+        client_sets_value('chaddr', chaddr)
+    if exchange == 'full':
+        await do(address, options, chaddr, ctx=ctx)
+        await ra(address, options, response_type, chaddr, init_reboot, subnet_mask, fqdn, ctx=ctx)
+    await ra(address, options, response_type, chaddr, init_reboot, subnet_mask, fqdn, ctx=ctx)
 
-    # Send request.
+
+def _bootp_send(chaddr, client_id):
     misc.test_procedure()
     client_sets_value('chaddr', chaddr)
     if client_id is not None:
         client_does_include(None, 'client_id', client_id)
     client_send_msg('BOOTP_REQUEST')
 
-    # Wait for reply.
-    misc.pass_criteria()
-    send_wait_for_message('MUST', True, 'BOOTP_REPLY')
 
+def _bootp_check(address):
     # Make sure that the Message Type option added while converting
     # BOOTP_REQUEST to REQUEST is not mirrored in the BOOTP_REPLY.
     response_check_include_option(False, 53)
@@ -877,3 +1072,41 @@ def BOOTP_REQUEST_and_BOOTP_REPLY(address: str,
     # Check received address.
     if address is not None:
         response_check_content(True, 'yiaddr', address)
+
+
+def BOOTP_REQUEST_and_BOOTP_REPLY(address: str,
+                                  chaddr: str = 'ff:01:02:03:ff:04',
+                                  client_id: str = None):
+    """
+    Send a BOOTP request and expect a BOOTP reply.
+
+    :param address: the address expected in the reply. If None, address is not checked.
+    :param chaddr: the value of the chaddr field in the BOOTP request packet
+    :param client_id: the value of option 61 client identifier in the BOOTP request packet
+    """
+
+    # Send request.
+    _bootp_send(chaddr, client_id)
+
+    # Wait for reply.
+    misc.pass_criteria()
+    send_wait_for_message('MUST', True, 'BOOTP_REPLY')
+    _bootp_check(address)
+
+
+async def bootp_request_and_bootp_reply(address: str,
+                                        chaddr: str = 'ff:01:02:03:ff:04',
+                                        client_id: str = None,
+                                        ctx=None):
+    """
+    BOOTP_REQUEST_and_BOOTP_REPLY() as coroutine, with client state in exchange context.
+
+    :param ctx: ExchangeContext of the client, new client if None
+    """
+    ctx = ctx or ExchangeContext()
+    with ctx.active():
+        _bootp_send(chaddr, client_id)
+    misc.pass_criteria()
+    await send_wait_for_message_async(ctx, 'MUST', True, 'BOOTP_REPLY')
+    with ctx.active():
+        _bootp_check(address)
@@ -0,0 +1,115 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Options of a received DHCPv6 message, found once per message.
+
+Checks of a response look up its options many times. OptionIndex walks the message once,
+takes a copy of each option without the rest of the message, and keeps them by option code,
+with suboptions (IA_NA, IA_PD, IA Prefix, relay supplied options, ...) by the code of the option
+holding them. The index is kept with the message, option_index() of the same message does not
+walk it again. Options in the index are shared by all lookups, they must not be changed:
+copy an option before sending it back in a client message.
+"""
+
+import types
+
+from scapy.packet import NoPayload
+
+# fields of options holding suboptions
+SUBOPTION_FIELDS = ("clientoptions",
+                    "ianaopts",
+                    "iapdopt",
+                    "iaprefopts",
+                    "relaysupplied",
+                    "userclassdata",
+                    "queryopts",
+                    "vcdata",
+                    "vso")
+
+
+def detached(layer):
+    """
+    Copy of a single layer, without its payload. Unlike layer.copy() the rest of the message
+    following the layer is not copied.
+    """
+    return layer.clone_with(**layer.copy_fields_dict(layer.fields))
+
+
+class OptionIndex:
+    """
+    Options of a DHCPv6 message by option code.
+    """
+    def __init__(self, msg):
+        """
+        :param msg: received message, whole (IPv6/UDP/DHCPv6) or starting with DHCPv6 message or option layer;
+                    layers that are not options are skipped
+        """
+        options = []
+        suboptions = []
+        layer = msg
+        while not isinstance(layer, NoPayload):
+            if 'optcode' in layer.fieldtype:
+                option = detached(layer)
+                options.append(option)
+                for field in SUBOPTION_FIELDS:
+                    # there can be multiple suboptions, each one can be followed by more of them as payload
+                    for sub_option in layer.fields.get(field) or []:
+                        while not isinstance(sub_option, NoPayload):
+                            suboptions.append((option.optcode, detached(sub_option)))
+                            sub_option = sub_option.payload
+            layer = layer.payload
+
+        by_code = {}
+        for option in options:
+            by_code.setdefault(option.optcode, []).append(option)
+        by_parent = {}
+        for parent_code, sub_option in suboptions:
+            by_parent.setdefault(parent_code, []).append(sub_option)
+
+        # all options in order of the message and all (parent option code, suboption) pairs
+        self.all_options = tuple(options)
+        self.all_suboptions = tuple(suboptions)
+        self._options = types.MappingProxyType({code: tuple(opts) for code, opts in by_code.items()})
+        self._suboptions = types.MappingProxyType({code: tuple(opts) for code, opts in by_parent.items()})
+
+    def options(self, code):
+        """
+        :return: tuple of options with the code, in order of the message
+        """
+        return self._options.get(code, ())
+
+    def option(self, code):
+        """
+        :return: the last option with the code, None if there is none
+        """
+        found = self._options.get(code)
+        return found[-1] if found else None
+
+    def suboptions(self, parent_code, code=None):
+        """
+        :param parent_code: code of the option holding suboptions
+        :param code: code of suboptions, all suboptions if None
+        :return: tuple of suboptions
+        """
+        found = self._suboptions.get(parent_code, ())
+        if code is None:
+            return found
+        return tuple(sub_option for sub_option in found if getattr(sub_option, 'optcode', None) == code)
+
+    def __contains__(self, code):
+        return code in self._options
+
+
+def option_index(msg):
+    """
+    OptionIndex of a received message, made on first use and kept with the message.
+    """
+    index = msg.__dict__.get('option_index')
+    if index is None:
+        index = OptionIndex(msg)
+        msg.option_index = index
+    return index
@@ -29,15 +29,17 @@
 # pylint: disable=unused-argument
 # pylint: disable=unused-variable
 
+import asyncio
 import codecs
+import functools
 import random
 import os
 import logging
 import select
+import struct
 import socket
 from time import time
 
-import scapy
 from scapy.compat import raw
 from scapy.sendrecv import sr
 from scapy.layers import dhcp6
@@ -49,6 +51,11 @@ from scapy.all import Raw
 from src import misc
 from src.protosupport.dhcp4_scen import DHCPv6_STATUS_CODES
 from src.forge_cfg import world
+from src.protosupport.exchange_context import ExchangeContext
+from src.protosupport.packet_endpoint import exchange_packets, exchange_packets_async
+from src.protosupport.packet_log import log_sent, log_received
+from src.protosupport.v6.option_index import option_index
+from src.protosupport.packet_template import NotTemplatable, packet_templates, dhcp6_layout, dhcp6_offsets, thaw
 from src.terrain import client_id, ia_id, ia_pd
 
 log = logging.getLogger('forge')
@@ -393,6 +400,8 @@ def change_message_field(message_filed, value, value_type):
 
 
 def apply_message_fields_changes():
+    if world.message_fields and world.climsg:
+        thaw(world.climsg[0])
     for field_details in world.message_fields:
 
         try:
@@ -549,40 +558,61 @@ def build_raw(msg, append):
         world.climsg.append(build_msg("") / Raw(load=append))
     else:
         client_send_msg(msg, None, None)
+        thaw(world.climsg[0])
         world.climsg[0] = world.climsg[0] / Raw(load=append)
 
 
 def build_msg(msg_dhcp):
-    msg = IPv6(dst=world.cfg["address_v6"], src=world.cfg["cli_link_local"])
-    msg /= UDP(sport=world.cfg["source_port"], dport=world.cfg["destination_port"])
-
-    # print("IP/UDP layers in bytes: ", raw(msg))
-
-    msg /= msg_dhcp
-
-    # get back to multicast address.
-    world.cfg["address_v6"] = "ff02::1:2"
+    # option request first, then options in order of world.cliopts
+    options = []
+    try:
+        if len(world.oro.reqopts) > 0:
+            options.append(world.oro)
+    except BaseException:
+        pass
+    options += world.cliopts
+    world.cliopts = []
 
     # transaction id
     if world.cfg["values"]["tr_id"] is None:
-        msg.trid = random.randint(0, 256*256*256)
+        trid = random.randint(0, 256*256*256)
     else:
-        msg.trid = int(world.cfg["values"]["tr_id"])
-    world.cfg["values"]["tr_id"] = msg.trid
+        trid = int(world.cfg["values"]["tr_id"])
 
-    # add option request if any
-    try:
-        if len(world.oro.reqopts) > 0:
-            msg = add_option_to_msg(msg, world.oro)
-    except BaseException:
-        pass
+    key, values = None, {}
+    if world.f_cfg.packet_templates and msg_dhcp != "":
+        head = (world.cfg["address_v6"], world.cfg["cli_link_local"],
+                world.cfg["source_port"], world.cfg["destination_port"])
+        try:
+            key, values = dhcp6_layout(head, msg_dhcp, options)
+        except NotTemplatable:
+            key = None
+    template = packet_templates.get(key) if key is not None else None
+
+    if template is not None:
+        values['trid'] = struct.pack('!I', trid)[1:]
+        msg = template.fill(values)
+    else:
+        msg = IPv6(dst=world.cfg["address_v6"], src=world.cfg["cli_link_local"])
+        msg /= UDP(sport=world.cfg["source_port"], dport=world.cfg["destination_port"])
+
+        # print("IP/UDP layers in bytes: ", raw(msg))
 
-    # add all rest options to message.
-    world.cliopts = world.cliopts[::-1]
-    while world.cliopts:
-        msg /= world.cliopts.pop()
+        msg /= msg_dhcp
+        msg.trid = trid
 
-    # print("DHCP layer in bytes: ", raw(msg.getlayer(2)), "\n")
+        # add option request if any and all rest options to message.
+        for option in options:
+            msg = add_option_to_msg(msg, option)
+
+        # print("DHCP layer in bytes: ", raw(msg.getlayer(2)), "\n")
+        if key is not None and not packet_templates.known(key):
+            values['trid'] = struct.pack('!I', trid)[1:]
+            packet_templates.add(key, msg, dhcp6_offsets(raw(msg)), values)
+
+    # get back to multicast address.
+    world.cfg["address_v6"] = "ff02::1:2"
+    world.cfg["values"]["tr_id"] = msg.trid
     return msg
 
 
@@ -719,8 +749,11 @@ def send_over_tcp(msg: bytes, address: str = None, port: int = None, timeout: in
     return msgs
 
 
-def send_wait_for_message(requirement_level: str, presence: bool, exp_message: str,
-                          protocol: str = 'UDP', address: str = None, port: int = None):
+def _prepare_exchange():
+    """
+    Finish the message to be sent and clear the previous response.
+    :return: time to wait for the response
+    """
     world.cliopts = []  # clear options, always build new message, also possible make it in client_send_msg
     # debug.recv=[]
     # Uncomment this to get debug.recv filled with all received messages
@@ -733,7 +766,6 @@ def send_wait_for_message(requirement_level: str, presence: bool, exp_message: s
     factor = 1
     world.srvmsg = []
     world.tcpmsg = []
-    received_name = ""
 
     pytest_current_test = os.environ.get('PYTEST_CURRENT_TEST')
     if 'HA' in pytest_current_test.split('/'):
@@ -741,32 +773,51 @@ def send_wait_for_message(requirement_level: str, presence: bool, exp_message: s
     if '_radius' in pytest_current_test.lower():
         factor = max(factor, world.f_cfg.radius_packet_wait_interval_factor)
 
-    if world.f_cfg.show_packets_from in ['both', 'client']:
-        world.climsg[0].show()
+    log_sent(world.climsg)
+    return factor * world.cfg['wait_interval']
 
-    if protocol == 'UDP':
-        ans, unans = sr(world.climsg,
-                        iface=world.cfg["iface"],
-                        timeout=factor * world.cfg['wait_interval'],
-                        nofilter=1,
-                        verbose=int(world.f_cfg.forge_verbose))
-        if world.f_cfg.forge_verbose == 0:
-            print(".", end='')
-
-        for x in ans:
-            a, b = x
-            world.srvmsg.append(b)
 
-    else:
-        address = world.f_cfg.srv_ipv6_addr_global if address is None else address
-        world.tcpmsg = send_over_tcp(raw(world.climsg[0].getlayer(2)), address, port)
-        if len(world.tcpmsg) > 0:
-            world.srvmsg = world.tcpmsg.copy()
-        unans = []
+def _tcp_query(address):
+    """
+    Message from world.climsg sent over TCP and the address it goes to.
+    """
+    address = world.f_cfg.srv_ipv6_addr_global if address is None else address
+    return raw(world.climsg[0].getlayer(2)), address
 
-    if world.f_cfg.show_packets_from in ['both', 'server']:
-        for msg in world.srvmsg:
-            msg.show()
+
+def _tcp_answers(responses):
+    world.tcpmsg = responses
+    return [(world.climsg[0], msg) for msg in world.tcpmsg], []
+
+
+def _exchange_over_tcp(address, port):
+    msg, address = _tcp_query(address)
+    return _tcp_answers(send_over_tcp(msg, address, port))
+
+
+def _send_over_tcp_in_executor(f_cfg, msg, address, port):
+    """
+    send_over_tcp() run by executor, in a thread with world of its own.
+    :return: tuple (transaction ID of the sent message, responses)
+    """
+    world.f_cfg = f_cfg
+    responses = send_over_tcp(msg, address, port)
+    return world.blq_trid, responses
+
+
+def _check_response(presence, exp_message, protocol, ans, unans):
+    """
+    Store the response in world.srvmsg and check that it came or not.
+    """
+    received_name = ""
+    if protocol == 'UDP' and world.f_cfg.forge_verbose == 0:
+        print(".", end='')
+
+    for x in ans:
+        a, b = x
+        world.srvmsg.append(b)
+
+    log_received(world.srvmsg)
 
     if len(world.srvmsg) > 0:
         received_name = get_msg_type(world.srvmsg[0])
@@ -788,6 +839,55 @@ def send_wait_for_message(requirement_level: str, presence: bool, exp_message: s
     return world.srvmsg
 
 
+def send_wait_for_message(requirement_level: str, presence: bool, exp_message: str,
+                          protocol: str = 'UDP', address: str = None, port: int = None):
+    timeout = _prepare_exchange()
+    if protocol == 'UDP':
+        if world.f_cfg.persistent_packet_socket:
+            # socket opened once per session, no setup and teardown for each exchange
+            ans, unans = exchange_packets(world.climsg, timeout, ipv6=True)
+        else:
+            ans, unans = sr(world.climsg,
+                            iface=world.cfg["iface"],
+                            timeout=timeout,
+                            nofilter=1,
+                            verbose=int(world.f_cfg.forge_verbose))
+    else:
+        ans, unans = _exchange_over_tcp(address, port)
+    return _check_response(presence, exp_message, protocol, ans, unans)
+
+
+async def send_wait_for_message_async(ctx, requirement_level: str, presence: bool, exp_message: str,
+                                      protocol: str = 'UDP', address: str = None, port: int = None):
+    """
+    send_wait_for_message() with the messages of exchange context, other coroutines run
+    while the response is awaited.
+    :param ctx: ExchangeContext
+    :return: list of responses
+    """
+    with ctx.active():
+        timeout = _prepare_exchange()
+        loop = asyncio.get_running_loop()
+        # world is per thread, everything is taken from it before the exchange goes to executor
+        if protocol != 'UDP':
+            msg, address = _tcp_query(address)
+            pending = loop.run_in_executor(None, _send_over_tcp_in_executor, world.f_cfg, msg, address, port)
+        elif world.f_cfg.persistent_packet_socket:
+            pending = exchange_packets_async(world.climsg, timeout, ipv6=True)
+        else:
+            pending = loop.run_in_executor(
+                None, functools.partial(sr, world.climsg, iface=world.cfg["iface"], timeout=timeout,
+                                        nofilter=1, verbose=int(world.f_cfg.forge_verbose)))
+    result = await pending
+    with ctx.active():
+        if protocol != 'UDP':
+            world.blq_trid, responses = result
+            ans, unans = _tcp_answers(responses)
+        else:
+            ans, unans = result
+        return _check_response(presence, exp_message, protocol, ans, unans)
+
+
 def get_last_response():
     assert len(world.srvmsg), "No response received."
     return world.srvmsg[-1].copy()
@@ -814,10 +914,12 @@ def get_msg_type(msg):
 def client_save_option(option_name, count=0):
     assert option_name in OPTIONS, "Unsupported option name " + option_name
     opt_code = OPTIONS.get(option_name)
-    opt = get_option(get_last_response(), opt_code)
+    assert len(world.srvmsg), "No response received."
+    opt = get_option(world.srvmsg[-1], opt_code)
 
     assert opt, "Received message does not contain option " + option_name
-    opt.payload = scapy.packet.NoPayload()
+    # options found by get_option() are shared, it has no payload already
+    opt = opt.copy()
 
     if count not in world.savedmsg:
         world.savedmsg[count] = [opt]
@@ -842,22 +944,23 @@ def client_copy_option(option_name, copy_all=False):
 
     assert opt, "Received message does not contain option " + option_name
 
-    # payload need to be 'None' otherwise we copy all options from one we are
-    # looking for till the end of the message
+    # options found by get_option() are shared, without payload, copy them
     # it would be nice to remove 'status code' sub-option
     # before sending it back to server
     if copy_all and isinstance(opt, list):
         for i in opt:
-            i.payload = scapy.packet.NoPayload()
-            add_client_option(i)
+            add_client_option(i.copy())
     else:
-        opt.payload = scapy.packet.NoPayload()
-        add_client_option(opt)
+        add_client_option(opt.copy())
 
 
 def get_option(msg, opt_code, get_all=False):
     '''
     Retrieve from scapy message {msg}, the DHCPv6 option having IANA code {opt_code}.
+    Options are looked up in the option index of the message, they are found
+    in the message once and must not be changed (copy them first).
+    World.opts is set to all options with the code and world.subopts to all
+    (option code, suboption) pairs of the message.
     :param msg: scapy message to retrieve the option from
     :param opt_code: option code or name
     :param get_all: True if it should return all options with given code,
@@ -869,54 +972,10 @@ def get_option(msg, opt_code, get_all=False):
     # Ensure the option code is an integer.
     opt_code = get_option_code(opt_code)
 
-    # We need to iterate over all options and see
-    # if there's one we're looking for
-
-    # message needs to be copied, otherwise we changing original message
-    # what makes sometimes multiple copy impossible.
-    tmp_msg = msg.copy()
-
-    # clear all opts/subopts
-    world.opts = []
-    world.subopts = []
-    result = []
-
-    if len(world.rlymsg) == 0 and len(world.tcpmsg) == 0:  # relay message is already cropped to exact layer
-        tmp_msg = tmp_msg.getlayer(3)  # 0th is IPv6, 1st is UDP, 2nd is DHCP6, 3rd is the first option
-    elif len(world.tcpmsg) != 0:
-        tmp_msg = tmp_msg.getlayer(1)
-
-    # check all message, for expected option and all suboptions in IA_NA/IA_PD
-    check_suboptions = ["clientoptions",
-                        "ianaopts",
-                        "iapdopt",
-                        "iaprefopts",
-                        "relaysupplied",
-                        "userclassdata",
-                        "queryopts",
-                        "vcdata",
-                        "vso"]
-
-    while tmp_msg:
-        if tmp_msg.optcode == opt_code:
-            opt = tmp_msg.copy()
-            del opt.payload
-            result.append(opt)
-            world.opts.append(opt)
-
-        for each in check_suboptions:
-            if tmp_msg.fields.get(each):
-                # there can be multiple suboptions, we need them all!
-                for sub_option in tmp_msg.fields.get(each):
-                    # and sometimes options are combined in two, I don't know why, so we have to loop over them again
-                    # to get all options that are send as suboptions.
-                    while sub_option:
-                        t = sub_option.copy()
-                        del t.payload
-                        world.subopts.append([tmp_msg.optcode, t])
-                        sub_option = sub_option.payload
-
-        tmp_msg = tmp_msg.payload
+    index = option_index(msg)
+    world.opts = list(index.options(opt_code))
+    world.subopts = list(index.all_suboptions)
+    result = list(world.opts)
 
     if len(result) > 0 and not get_all:
         result = result[-1]
@@ -1048,12 +1107,10 @@ def response_check_include_suboption(opt_code, expect, expected_value):
     :param expected_value: suboption code or name
     :return: tuple(the list of suboptions, the suboption code)
     """
-    x = []
+    assert len(world.srvmsg) != 0, "No response received."
     opt_code = get_option_code(opt_code)
     expected_value = get_option_code(expected_value)
-    for option_code, option in world.subopts:
-        if option_code == opt_code and option.optcode == int(expected_value):
-            x.append(option)
+    x = list(option_index(world.srvmsg[0]).suboptions(opt_code, int(expected_value)))
     opt_descr = _get_opt_descr(opt_code)
     subopt_descr = _get_opt_descr(expected_value)
     if expect:
@@ -1227,13 +1284,9 @@ def get_all_leases(decode_duid=True):
 
     assert world.srvmsg
 
-    msg = get_last_response()
-    if len(world.rlymsg) == 0:  # relay message is already cropped to exact layer
-        msg = msg.getlayer(3)  # 0th is IPv6, 1st is UDP, 2nd is DHCP6, 3rd is the first option
-
     current_duid = ""
     all_addr = []
-    while msg:
+    for msg in option_index(world.srvmsg[-1]).all_options:
         if msg.optcode == 1:
             if decode_duid:
                 txt_duid = extract_duid(msg.duid)
@@ -1250,7 +1303,6 @@ def get_all_leases(decode_duid=True):
                 if ia_pd.optcode == 26:
                     all_addr.append({"duid": current_duid, "iaid": msg.iaid, "valid_lifetime": ia_pd.validlft,
                                      "pref_lifetime": ia_pd.preflft, "address": ia_pd.prefix, "prefix_len": ia_pd.plen})
-        msg = msg.payload
 
     return all_addr
 
@@ -1299,7 +1351,7 @@ def tcp_get_message(**kwargs):
             if get_msg_type(msg) in ["LEASEQUERY-DONE", "UNKNOWN-TYPE"]:
                 continue
 
-            msg_opt = get_option(msg.copy(), 45)
+            msg_opt = get_option(msg, 45)
             if hasattr(msg, "clientoptions"):
                 msg_opt = msg_opt.clientoptions
             for x in msg_opt:
@@ -1511,6 +1563,53 @@ def check_IA_PD(prefix, prefix_length=None, status_code=DHCPv6_STATUS_CODES['Suc
             response_check_suboption_content('IA-Prefix', 'IA_PD', expect, 'plen', prefix_length)
 
 
+def _check_leases(address, delegated_prefix):
+    if address is not None:
+        check_IA_NA(address)
+    if delegated_prefix is not None:
+        check_IA_PD(delegated_prefix)
+
+
+def _request_send(address, delegated_prefix, status_code, duid):
+    if address is not None:
+        client_copy_option('IA_NA')
+    if delegated_prefix is not None:
+        client_copy_option('IA_PD')
+    client_copy_option('server-id')
+    client_sets_value('DUID', duid)
+    client_does_include('Client', 'client-id')
+    if status_code == DHCPv6_STATUS_CODES['NoAddrsAvail']:
+        if address is not None:
+            client_sets_value('IA_Address', address)
+        if delegated_prefix is not None:
+            client_sets_value('IA-Prefix', delegated_prefix)
+    client_send_msg('REQUEST')
+
+
+def _renew_send(address, delegated_prefix, status_code, duid, iaid):
+    misc.test_procedure()
+    client_sets_value('DUID', duid)
+    if iaid is not None:
+        client_sets_value('ia_id', iaid)
+        # Set the IAID for IAPDs as well.
+        # It's handled under the different name 'ia_pd' in forge.
+        client_sets_value('ia_pd', iaid)
+    # Build and send a renew.
+    if address is not None:
+        client_copy_option('IA_NA')
+    if delegated_prefix is not None:
+        client_copy_option('IA_PD')
+    client_copy_option('server-id')
+    client_does_include('Client', 'client-id', None)
+    client_add_saved_option(False)
+    if status_code == DHCPv6_STATUS_CODES['NoAddrsAvail']:
+        if address is not None:
+            client_sets_value('IA_Address', address)
+        if delegated_prefix is not None:
+            client_sets_value('IA_Prefix', delegated_prefix)
+    client_send_msg('RENEW')
+
+
 def SARR(address=None, delegated_prefix=None, relay_information=False,
          status_code=DHCPv6_STATUS_CODES['Success'], exchange='full',
          duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
@@ -1548,27 +1647,12 @@ def SARR(address=None, delegated_prefix=None, relay_information=False,
 
         if not relay_information:
             # Build and send a request.
-            if address is not None:
-                client_copy_option('IA_NA')
-            if delegated_prefix is not None:
-                client_copy_option('IA_PD')
-            client_copy_option('server-id')
-            client_sets_value('DUID', duid)
-            client_does_include('Client', 'client-id')
-            if status_code == DHCPv6_STATUS_CODES['NoAddrsAvail']:
-                if address is not None:
-                    client_sets_value('IA_Address', address)
-                if delegated_prefix is not None:
-                    client_sets_value('IA-Prefix', delegated_prefix)
-            client_send_msg('REQUEST')
+            _request_send(address, delegated_prefix, status_code, duid)
 
             # Expect a reply.
             misc.pass_criteria()
             send_wait_for_message('MUST', True, 'REPLY')
-            if address is not None:
-                check_IA_NA(address)
-            if delegated_prefix is not None:
-                check_IA_PD(delegated_prefix)
+            _check_leases(address, delegated_prefix)
 
     # @todo: forge doesn't receive a reply on renews if the initial solicit was
     # encapsulated in a relay forward message. After an investigation is done,
@@ -1577,62 +1661,47 @@ def SARR(address=None, delegated_prefix=None, relay_information=False,
     # statement is a hack and should be removed and the code block within should
     # be bumped one scope level up at function level i.e. always executed.
     if not relay_information:
-        misc.test_procedure()
-        client_sets_value('DUID', duid)
-        if iaid is not None:
-            client_sets_value('ia_id', iaid)
-            # Set the IAID for IAPDs as well.
-            # It's handled under the different name 'ia_pd' in forge.
-            client_sets_value('ia_pd', iaid)
-        # Build and send a renew.
-        if address is not None:
-            client_copy_option('IA_NA')
-        if delegated_prefix is not None:
-            client_copy_option('IA_PD')
-        client_copy_option('server-id')
-        client_does_include('Client', 'client-id', None)
-        client_add_saved_option(False)
-        if status_code == DHCPv6_STATUS_CODES['NoAddrsAvail']:
-            if address is not None:
-                client_sets_value('IA_Address', address)
-            if delegated_prefix is not None:
-                client_sets_value('IA_Prefix', delegated_prefix)
-        client_send_msg('RENEW')
+        _renew_send(address, delegated_prefix, status_code, duid, iaid)
 
         # Expect a reply.
         send_wait_for_message('MUST', True, 'REPLY')
-        if address is not None:
-            check_IA_NA(address)
-        if delegated_prefix is not None:
-            check_IA_PD(delegated_prefix)
+        _check_leases(address, delegated_prefix)
 
 
-def SA(address=None, delegated_prefix=None, relay_information=False,
-       status_code=DHCPv6_STATUS_CODES['Success'], duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
-       linkaddr='2001:db8:1::1000', ifaceid='port1234'):
+async def sarr(address=None, delegated_prefix=None, relay_information=False,
+               status_code=DHCPv6_STATUS_CODES['Success'], exchange='full',
+               duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
+               linkaddr='2001:db8:1::1000', ifaceid='port1234', ctx=None):
     """
-    Sends and ensures receival of 2 packets part of a regular DHCPv6 exchange
-    in the correct sequence: solicit, advertise.
-    Inserts options in the client packets based on given parameters and ensures
-    that the right options are found in the server packets. A single option
-    missing or having incorrect values renders the test failed.
+    SARR() as coroutine, with client state in exchange context. Many clients at once:
+
+        await asyncio.gather(sarr('2001:db8:1::1', duid='00:03:00:01:f6:f5:f4:f3:f2:01'),
+                             sarr('2001:db8:1::2', duid='00:03:00:01:f6:f5:f4:f3:f2:02'))
 
     Args:
-        address: the expected address as value of the IA_Address suboption.
-            For multiple addresses, use additional check_IA_NA() calls.
-        delegated_prefix: the expected prefix as value of the IA_Prefix suboption.
-            For multiple prefixes, use additional check_IA_PD() calls.
-        relay_information: whether client packets should be encapsulated in relay
-            forward messages, and by extension whether server packets should be
-            expected to be encapsulated in relay reply messages (default: False)
-        status_code: the expected status code (default: Success)
-        duid: the DUID to be used in client packets
-            (default: '00:03:00:01:f6:f5:f4:f3:f2:01' - a value commonly used in tests)
-        iaid: sets IAID for the client
-        linkaddr: sets Link Address in Relayed message
-        ifaceid: sets Interface ID in option 18 in Relayed message
-        """
+        ctx: ExchangeContext of the client, new client if None
+    """
+    ctx = ctx or ExchangeContext()
+    if exchange == 'full':
+        await sa(address, delegated_prefix, relay_information, status_code, duid, iaid, linkaddr, ifaceid, ctx=ctx)
+        if not relay_information:
+            with ctx.active():
+                _request_send(address, delegated_prefix, status_code, duid)
+            misc.pass_criteria()
+            await send_wait_for_message_async(ctx, 'MUST', True, 'REPLY')
+            with ctx.active():
+                _check_leases(address, delegated_prefix)
 
+    # no renew after relayed solicit, see SARR()
+    if not relay_information:
+        with ctx.active():
+            _renew_send(address, delegated_prefix, status_code, duid, iaid)
+        await send_wait_for_message_async(ctx, 'MUST', True, 'REPLY')
+        with ctx.active():
+            _check_leases(address, delegated_prefix)
+
+
+def _solicit_send(address, delegated_prefix, relay_information, duid, iaid, linkaddr, ifaceid):
     misc.test_procedure()
     client_sets_value('DUID', duid)
     if iaid is not None:
@@ -1657,25 +1726,67 @@ def SA(address=None, delegated_prefix=None, relay_information=False,
         client_does_include('RelayAgent', 'interface-id')
         create_relay_forward()
 
-        # Expect a relay reply.
-        misc.pass_criteria()
-        send_wait_for_message('MUST', True, 'RELAYREPLY')
+
+def _advertise_check(address, delegated_prefix, relay_information, status_code):
+    if relay_information:
         response_check_include_option(True, 'interface-id')
         response_check_include_option(True, 'relay-msg')
         response_check_option_content('relay-msg', True, 'Relayed', 'Message')
-        response_check_include_option(True, 'client-id')
-        response_check_include_option(True, 'server-id')
-        if address is not None:
-            check_IA_NA(address, status_code)
-        if delegated_prefix is not None:
-            check_IA_PD(delegated_prefix, status_code=status_code)
-    else:
-        # Expect an advertise.
-        misc.pass_criteria()
-        send_wait_for_message('MUST', True, 'ADVERTISE')
-        response_check_include_option(True, 'client-id')
-        response_check_include_option(True, 'server-id')
-        if address is not None:
-            check_IA_NA(address, status_code)
-        if delegated_prefix is not None:
-            check_IA_PD(delegated_prefix, status_code=status_code)
+    response_check_include_option(True, 'client-id')
+    response_check_include_option(True, 'server-id')
+    if address is not None:
+        check_IA_NA(address, status_code)
+    if delegated_prefix is not None:
+        check_IA_PD(delegated_prefix, status_code=status_code)
+
+
+def SA(address=None, delegated_prefix=None, relay_information=False,
+       status_code=DHCPv6_STATUS_CODES['Success'], duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
+       linkaddr='2001:db8:1::1000', ifaceid='port1234'):
+    """
+    Sends and ensures receival of 2 packets part of a regular DHCPv6 exchange
+    in the correct sequence: solicit, advertise.
+    Inserts options in the client packets based on given parameters and ensures
+    that the right options are found in the server packets. A single option
+    missing or having incorrect values renders the test failed.
+
+    Args:
+        address: the expected address as value of the IA_Address suboption.
+            For multiple addresses, use additional check_IA_NA() calls.
+        delegated_prefix: the expected prefix as value of the IA_Prefix suboption.
+            For multiple prefixes, use additional check_IA_PD() calls.
+        relay_information: whether client packets should be encapsulated in relay
+            forward messages, and by extension whether server packets should be
+            expected to be encapsulated in relay reply messages (default: False)
+        status_code: the expected status code (default: Success)
+        duid: the DUID to be used in client packets
+            (default: '00:03:00:01:f6:f5:f4:f3:f2:01' - a value commonly used in tests)
+        iaid: sets IAID for the client
+        linkaddr: sets Link Address in Relayed message
+        ifaceid: sets Interface ID in option 18 in Relayed message
+        """
+
+    _solicit_send(address, delegated_prefix, relay_information, duid, iaid, linkaddr, ifaceid)
+
+    # Expect a relay reply or an advertise.
+    misc.pass_criteria()
+    send_wait_for_message('MUST', True, 'RELAYREPLY' if relay_information else 'ADVERTISE')
+    _advertise_check(address, delegated_prefix, relay_information, status_code)
+
+
+async def sa(address=None, delegated_prefix=None, relay_information=False,
+             status_code=DHCPv6_STATUS_CODES['Success'], duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
+             linkaddr='2001:db8:1::1000', ifaceid='port1234', ctx=None):
+    """
+    SA() as coroutine, with client state in exchange context.
+
+    Args:
+        ctx: ExchangeContext of the client, new client if None
+    """
+    ctx = ctx or ExchangeContext()
+    with ctx.active():
+        _solicit_send(address, delegated_prefix, relay_information, duid, iaid, linkaddr, ifaceid)
+    misc.pass_criteria()
+    await send_wait_for_message_async(ctx, 'MUST', True, 'RELAYREPLY' if relay_information else 'ADVERTISE')
+    with ctx.active():
+        _advertise_check(address, delegated_prefix, relay_information, status_code)
@@ -25,6 +25,8 @@ from src.softwaresupport.bind9_server.bind_configs import config_file_set
 from src.softwaresupport.multi_server_functions import fabric_sudo_command, fabric_download_file
 from src.softwaresupport.multi_server_functions import fabric_remove_file_command
 from src.softwaresupport.multi_server_functions import check_local_path_for_downloaded_files, send_content
+from src.softwaresupport.multi_server_functions import remote_batch, fabric_send_files_cached
+from src.softwaresupport.multi_server_functions import save_configuration_content
 
 
 def make_file(name, content):
@@ -113,33 +115,26 @@ def use_config_set(number, override_dns=None):
     world.cfg["dns_log_file"] = '/tmp/dns.log'
 
     namedb_dir = os.path.join(world.f_cfg.dns_data_path, 'namedb')
-    fabric_sudo_command('mkdir -p %s' % namedb_dir)
-    fabric_sudo_command('chmod a+w %s' % namedb_dir)
-
-    send_content('named.conf', os.path.join(world.f_cfg.dns_data_path, 'named.conf'),
-                 _patch_config(config_file_set[number][0], override_dns), 'dns')
-
-    send_content('rndc.conf', os.path.join(world.f_cfg.dns_data_path, 'rndc.conf'),
-                 config_file_set[number][1], 'dns')
-
-    send_content('fwd.db', os.path.join(namedb_dir, 'fwd.db'),
-                 config_file_set[number][2], 'dns')
-
-    send_content('rev.db', os.path.join(namedb_dir, 'rev.db'),
-                 config_file_set[number][3], 'dns')
-
+    files = [('named.conf', os.path.join(world.f_cfg.dns_data_path, 'named.conf'),
+              _patch_config(config_file_set[number][0], override_dns)),
+             ('rndc.conf', os.path.join(world.f_cfg.dns_data_path, 'rndc.conf'), config_file_set[number][1]),
+             ('fwd.db', os.path.join(namedb_dir, 'fwd.db'), config_file_set[number][2]),
+             ('rev.db', os.path.join(namedb_dir, 'rev.db'), config_file_set[number][3])]
     if len(config_file_set[number]) == 8:
-        send_content('fwd2.db', os.path.join(namedb_dir, 'fwd2.db'),
-                     config_file_set[number][4], 'dns')
-
-        send_content('rev2.db', os.path.join(namedb_dir, 'rev2.db'),
-                     config_file_set[number][5], 'dns')
+        files += [('fwd2.db', os.path.join(namedb_dir, 'fwd2.db'), config_file_set[number][4]),
+                  ('rev2.db', os.path.join(namedb_dir, 'rev2.db'), config_file_set[number][5]),
+                  ('fwd3.db', os.path.join(namedb_dir, 'fwd3.db'), config_file_set[number][6]),
+                  ('rev3.db', os.path.join(namedb_dir, 'rev3.db'), config_file_set[number][7])]
 
-        send_content('fwd3.db', os.path.join(namedb_dir, 'fwd3.db'),
-                     config_file_set[number][6], 'dns')
+    # directory setup and installation of the files cached on the server are done in a single round trip,
+    # the same config sets are used over and over so the files are uploaded only once per session
+    with remote_batch() as batch:
+        batch.sudo('mkdir -p %s' % namedb_dir)
+        batch.sudo('chmod a+w %s' % namedb_dir)
+        fabric_send_files_cached([(remote_path, content, None) for _, remote_path, content in files], batch=batch)
 
-        send_content('rev3.db', os.path.join(namedb_dir, 'rev3.db'),
-                     config_file_set[number][7], 'dns')
+    for name, _, content in files:
+        save_configuration_content(content, os.path.join('dns', name))
 
     # needed for dns sec validation
     # send_content('managed-keys.bind', os.path.join(world.f_cfg.dns_data_path, 'managed-keys.bind'),
@@ -150,19 +145,20 @@ def upload_dns_keytab(dns_keytab):
     content = base64.decodebytes(bytes(dns_keytab, 'ascii'))
     namedb_dir = os.path.join(world.f_cfg.dns_data_path, 'namedb')
     p = os.path.join(namedb_dir, 'dns.keytab')
-    fabric_sudo_command("cp /tmp/dns.keytab %s" % p)
-    send_content('dns.keytab', p, content, 'dns')
-    if world.f_cfg.dns_data_path.startswith('/etc'):
-        # when installed from pkg
-        fabric_sudo_command('chmod 440 %s' % p)
-        if world.server_system == 'redhat':
-            fabric_sudo_command('chown root:named %s' % p)
+    with remote_batch() as batch:
+        batch.sudo("cp /tmp/dns.keytab %s" % p)
+        send_content('dns.keytab', p, content, 'dns', batch)
+        if world.f_cfg.dns_data_path.startswith('/etc'):
+            # when installed from pkg
+            batch.sudo('chmod 440 %s' % p)
+            if world.server_system == 'redhat':
+                batch.sudo('chown root:named %s' % p)
+            else:
+                batch.sudo('chown root:bind %s' % p)
         else:
-            fabric_sudo_command('chown root:bind %s' % p)
-    else:
-        # when compiled and installed from sources
-        fabric_sudo_command('chmod 400 %s' % p)
-        fabric_sudo_command('chown root:root %s' % p)
+            # when compiled and installed from sources
+            batch.sudo('chmod 400 %s' % p)
+            batch.sudo('chown root:root %s' % p)
 
 
 def stop_srv(value=False, destination_address=world.f_cfg.mgmt_address):
@@ -692,7 +692,7 @@ def save_logs(destination_address=world.f_cfg.mgmt_address):
                              check_local_path_for_downloaded_files(world.cfg["test_result_dir"],
                                                                    'forge_dhcpd.log',
                                                                    destination_address),
-                             destination_host=destination_address)
+                             destination_host=destination_address, ignore_errors=True)
     except BaseException:
         pass
 
@@ -21,6 +21,7 @@ import datetime
 import re
 import os
 import glob
+import posixpath
 import json
 import logging
 
@@ -30,11 +31,13 @@ from src.forge_cfg import world
 from src.misc import merge_containers
 from src.protosupport.multi_protocol_functions import add_variable, substitute_vars
 from src.protosupport.multi_protocol_functions import remove_file_from_server, copy_file_from_server
-from src.protosupport.multi_protocol_functions import wait_for_message_in_log
-from src.softwaresupport.multi_server_functions import fabric_run_command, fabric_send_file, remove_local_file
-from src.softwaresupport.multi_server_functions import copy_configuration_file, fabric_sudo_command
+from src.protosupport.multi_protocol_functions import wait_for_message_in_log, get_log_mirror
+from src.protosupport.log_cursor import log_cursors
+from src.softwaresupport.multi_server_functions import fabric_run_command, fabric_sudo_command
+from src.softwaresupport.multi_server_functions import fabric_send_files, save_configuration_content
 from src.softwaresupport.multi_server_functions import fabric_remove_file_command, fabric_download_file
-from src.softwaresupport.multi_server_functions import check_local_path_for_downloaded_files
+from src.softwaresupport.multi_server_functions import check_local_path_for_downloaded_files, remote_batch
+from src.softwaresupport.multi_server_functions import artifacts_staging_dir
 
 log = logging.getLogger('forge')
 
@@ -172,6 +175,13 @@ world.kea_options4 = {
 }
 
 
+def _sudo(batch):
+    """
+    Function running sudo commands: queuing them in remote_batch or executing them immediately if batch is None.
+    """
+    return fabric_sudo_command if batch is None else batch.sudo
+
+
 class CreateCert:
     """
     This class creates TLS certificates for CA, server and client,
@@ -203,10 +213,11 @@ class CreateCert:
         self.generate()
 
     @staticmethod
-    def change_access(p):
+    def change_access(p, batch=None):
         if isinstance(p, list):
             p = " ".join(p)
-        fabric_sudo_command(f'chmod 644 {p}')
+        sudo = _sudo(batch)
+        sudo(f'chmod 644 {p}')
 
     def clear(self, name: str = None):
         """
@@ -216,39 +227,42 @@ class CreateCert:
         if name is not None:
             remove_file_from_server(name)
             return
-        # Delete leftover certificates.
-        remove_file_from_server(self.ca_key)
-        remove_file_from_server(self.ca_cert)
-        remove_file_from_server(self.server_cert)
-        remove_file_from_server(self.server_csr)
-        remove_file_from_server(self.server_key)
-        remove_file_from_server(self.client_cert)
-        remove_file_from_server(self.client_csr)
-        remove_file_from_server(self.client_key)
+        # Delete leftover certificates, all with a single command.
+        remove_file_from_server(' '.join(self._files()))
+
+    def _files(self):
+        """
+        Paths of all default keys and certs on the server.
+        """
+        files = [self.ca_key, self.ca_cert,
+                 self.server_cert, self.server_csr, self.server_key,
+                 self.client_cert, self.client_csr, self.client_key]
         if world.f_cfg.mgmt_address_2 != '':
-            remove_file_from_server(self.server2_cert)
-            remove_file_from_server(self.server2_csr)
-            remove_file_from_server(self.server2_key)
+            files += [self.server2_cert, self.server2_csr, self.server2_key]
+        return files
 
     def generate(self):
         """
-        Generate certs and keys with default names and location
+        Generate certs and keys with default names and location, all in a single round trip
         """
-        self.generate_ca()
-        self.generate_server()
-        self.generate_client()
-        if world.f_cfg.mgmt_address_2 != '':
-            self.generate_server_2()
+        with remote_batch() as batch:
+            self.generate_ca(batch=batch)
+            self.generate_server(batch=batch)
+            self.generate_client(batch=batch)
+            if world.f_cfg.mgmt_address_2 != '':
+                self.generate_server_2(batch=batch)
 
     def generate_ca(self,
                     ca_name: str = "Kea",
                     ca_key_name: str = None,
-                    ca_cert_name: str = None):
+                    ca_cert_name: str = None,
+                    batch=None):
         """
         Generate CA ( Certificate authority ) cert and key on remote system, and change access right of generated files
         :param ca_name: CN name of cert
         :param ca_key_name: name of key output file
         :param ca_cert_name: name of cert output file
+        :param batch: remote_batch to queue commands in, commands are executed immediately if None
         """
         key = self.ca_key if ca_key_name is None else world.f_cfg.data_join(ca_key_name)
         cert = self.ca_cert if ca_cert_name is None else world.f_cfg.data_join(ca_cert_name)
@@ -261,8 +275,9 @@ class CreateCert:
                       f'-keyout {key} ' \
                       f'-out {cert} ' \
                       f'-subj "/C=US/ST=Acme State/L=Acme City/O=Acme Inc./CN={ca_name}"'
-        fabric_sudo_command(generate_ca)
-        self.change_access([key, cert])
+        sudo = _sudo(batch)
+        sudo(generate_ca)
+        self.change_access([key, cert], batch)
 
     def generate_server(self,
                         cn: str = world.f_cfg.mgmt_address,
@@ -270,7 +285,8 @@ class CreateCert:
                         server_csr_name: str = None,
                         server_cert_name: str = None,
                         ca_cert_name: str = None,
-                        ca_key_name: str = None):
+                        ca_key_name: str = None,
+                        batch=None):
         """
         Generate server cert and key, sign it with previously generated CA, change access rights
         :param cn: CN parameter of a key
@@ -279,6 +295,7 @@ class CreateCert:
         :param server_cert_name: name of server cert output file
         :param ca_cert_name: name of CA cert file
         :param ca_key_name: name of CA key file
+        :param batch: remote_batch to queue commands in, commands are executed immediately if None
         """
         s_key = self.server_key if server_key_name is None else world.f_cfg.data_join(server_key_name)
         s_csr = self.server_csr if server_csr_name is None else world.f_cfg.data_join(server_csr_name)
@@ -302,16 +319,18 @@ class CreateCert:
                  f'-extfile <(cat /etc/ssl/openssl.cnf' \
                  f' <(printf "\n[SAN]\nsubjectAltName=IP:{world.f_cfg.mgmt_address}"))'
 
-        fabric_sudo_command(serv_prv)
-        fabric_sudo_command(server)
-        self.change_access([s_key, s_csr, s_crt])
+        sudo = _sudo(batch)
+        sudo(serv_prv)
+        sudo(server)
+        self.change_access([s_key, s_csr, s_crt], batch)
 
     def generate_client(self, cn: str = 'client',
                         client_key_name: str = None,
                         client_csr_name: str = None,
                         ca_cert_name: str = None,
                         ca_key_name: str = None,
-                        client_cert_name: str = None):
+                        client_cert_name: str = None,
+                        batch=None):
         """
         Generate client cert and key, sign it with previously generated CA, change access rights
         :param cn: CN parameter of a key
@@ -320,12 +339,14 @@ class CreateCert:
         :param ca_cert_name:
         :param ca_key_name:
         :param client_cert_name:
+        :param batch: remote_batch to queue commands in, commands are executed immediately if None
         :return:
         """
         c_key = self.client_key if client_key_name is None else world.f_cfg.data_join(client_key_name)
         c_crt = self.client_cert if client_cert_name is None else world.f_cfg.data_join(client_cert_name)
         c_csr = self.client_csr if client_csr_name is None else world.f_cfg.data_join(client_csr_name)
-        remove_file_from_server(f'{c_key} {c_crt} {c_csr}')
+        sudo = _sudo(batch)
+        sudo(f'rm -rf {c_key} {c_crt} {c_csr}', hide_all=True)
         # Generate client cert and key
         cli_prv = f'openssl genrsa -out {c_key} 4096 ; ' \
                   f'openssl req ' \
@@ -342,16 +363,17 @@ class CreateCert:
                   f'-CAkey {self.ca_key if ca_key_name is None else world.f_cfg.data_join(ca_key_name)} ' \
                   f'-CAcreateserial -out {c_crt} '
 
-        fabric_sudo_command(cli_prv)
-        fabric_sudo_command(cli_crt)
-        self.change_access([c_key, c_crt, c_csr])
+        sudo(cli_prv)
+        sudo(cli_crt)
+        self.change_access([c_key, c_crt, c_csr], batch)
 
     def generate_server_2(self, cn: str = world.f_cfg.mgmt_address_2,
                           server_key_name: str = None,
                           server_csr_name: str = None,
                           server_cert_name: str = None,
                           ca_cert_name: str = None,
-                          ca_key_name: str = None):
+                          ca_key_name: str = None,
+                          batch=None):
         """
 
         :param cn:
@@ -360,6 +382,7 @@ class CreateCert:
         :param server_cert_name:
         :param ca_cert_name:
         :param ca_key_name:
+        :param batch: remote_batch to queue commands in, commands are executed immediately if None
         :return:
         """
         s_key = self.server2_key if server_key_name is None else world.f_cfg.data_join(server_key_name)
@@ -384,9 +407,10 @@ class CreateCert:
                f'-extfile <(cat /etc/ssl/openssl.cnf' \
                f' <(printf "\n[SAN]\nsubjectAltName=IP:{world.f_cfg.mgmt_address_2}"))'
 
-        fabric_sudo_command(serv_prv)
-        fabric_sudo_command(serv)
-        self.change_access([s_key, s_csr, s_crt])
+        sudo = _sudo(batch)
+        sudo(serv_prv)
+        sudo(serv)
+        self.change_access([s_key, s_csr, s_crt], batch)
 
     def download(self, cert_name: str = None):
         """ This function downloads selected certificate to test result directory on forge machine
@@ -1282,9 +1306,11 @@ def disable_mt_if_required(cfg):
 
 
 def _cfg_write():
-    # For now let's keep to old system of sending config file
-    with open(world.cfg["cfg_file_2"], 'w') as cfg_file:
-        cfg_file.write(world.cfg["keactrl"])
+    """
+    Generate contents of configuration files.
+    :return: dict of file name -> file content
+    """
+    files = {'keactrl.conf': world.cfg["keactrl"]}
 
     if world.f_cfg.install_method == 'make':
         logging_file = world.f_cfg.log_join('kea.log')
@@ -1304,40 +1330,46 @@ def _cfg_write():
     if world.ddns_enable:
         world.ddns_cfg = {"DhcpDdns": world.ddns_cfg}
         add_variable("DDNS_CONFIG", json.dumps(world.ddns_cfg), False)
-        with open("kea-dhcp-ddns.conf", 'w') as conf_file:
-            conf_file.write(json.dumps(world.ddns_cfg, indent=4, sort_keys=False))
+        files["kea-dhcp-ddns.conf"] = json.dumps(world.ddns_cfg, indent=4, sort_keys=False)
 
     if world.ctrl_enable:
         add_variable("AGENT_CONFIG", json.dumps(world.ca_cfg), False)
-        with open("kea-ctrl-agent.conf", 'w') as conf_file:
-            conf_file.write(json.dumps(world.ca_cfg, indent=4, sort_keys=False))
+        files["kea-ctrl-agent.conf"] = json.dumps(world.ca_cfg, indent=4, sort_keys=False)
 
     add_variable("DHCP_CONFIG", json.dumps(world.dhcp_cfg), False)
-    with open(f'kea-dhcp{world.proto[1]}.conf', 'w') as conf_file:
-        conf_file.write(json.dumps(world.dhcp_cfg, indent=4, sort_keys=False))
+    files[f'kea-dhcp{world.proto[1]}.conf'] = json.dumps(world.dhcp_cfg, indent=4, sort_keys=False)
+    return files
 
 
 def _write_cfg2(cfg):
+    """
+    Generate contents of configuration files from provided configuration.
+    :return: dict of file name -> file content
+    """
+    files = {}
     if "Control-agent" in cfg:
-        with open("kea-ctrl-agent.conf", 'w') as cfg_file:
-            json.dump({"Control-agent": cfg["Control-agent"]}, cfg_file, sort_keys=False,
-                      indent=4, separators=(',', ': '))
+        files["kea-ctrl-agent.conf"] = json.dumps({"Control-agent": cfg["Control-agent"]}, sort_keys=False,
+                                                  indent=4, separators=(',', ': '))
 
     if f'Dhcp{world.proto[1]}' in cfg:
         cfg = disable_mt_if_required(cfg)
-        with open(f'kea-dhcp{world.proto[1]}.conf', 'w') as cfg_file:
-            json.dump({f'Dhcp{world.proto[1]}': cfg[f'Dhcp{world.proto[1]}']},
-                      cfg_file, sort_keys=False, indent=4, separators=(',', ': '))
+        files[f'kea-dhcp{world.proto[1]}.conf'] = json.dumps({f'Dhcp{world.proto[1]}': cfg[f'Dhcp{world.proto[1]}']},
+                                                             sort_keys=False, indent=4, separators=(',', ': '))
 
     if "DhcpDdns" in cfg:
-        with open("kea-dhcp-ddns.conf", 'w') as cfg_file:
-            json.dump({"DhcpDdns": cfg["DhcpDdns"]}, cfg_file, sort_keys=False, indent=4, separators=(',', ': '))
+        files["kea-dhcp-ddns.conf"] = json.dumps({"DhcpDdns": cfg["DhcpDdns"]}, sort_keys=False, indent=4,
+                                                 separators=(',', ': '))
 
-    with open(world.cfg["cfg_file_2"], 'w') as cfg_file:
-        cfg_file.write(world.cfg["keactrl"])
+    files['keactrl.conf'] = world.cfg["keactrl"]
+    return files
 
 
 def build_config_files(cfg=None):
+    """
+    Generate configuration files content, nothing is written to disk.
+    :param cfg: complete configuration to use instead of the one built by test steps
+    :return: dict of file name -> file content
+    """
     substitute_vars(world.dhcp_cfg)
     if world.proto == 'v4':
         add_defaults4()
@@ -1347,9 +1379,8 @@ def build_config_files(cfg=None):
     _set_kea_ctrl_config()
 
     if cfg is None:
-        _cfg_write()
-    else:
-        _write_cfg2(cfg)
+        return _cfg_write()
+    return _write_cfg2(cfg)
 
 
 def build_and_send_config_files(destination_address=world.f_cfg.mgmt_address, cfg=None):
@@ -1361,52 +1392,25 @@ def build_and_send_config_files(destination_address=world.f_cfg.mgmt_address, cf
     """
 
     # generate config files content
-    build_config_files(cfg)
+    files = build_config_files(cfg)
 
     if destination_address not in world.f_cfg.multiple_tested_servers:
         world.multiple_tested_servers.append(destination_address)
 
-    # use mode="0o666" to make config writable to enable config-write tests
-
-    # send to server
-    if world.f_cfg.install_method == 'make':
-        fabric_send_file(world.cfg["cfg_file_2"],
-                         world.f_cfg.etc_join("keactrl.conf"),
-                         destination_host=destination_address)
-
-    fabric_send_file(f'kea-dhcp{world.proto[1]}.conf',
-                     world.f_cfg.etc_join(f'kea-dhcp{world.proto[1]}.conf'),
-                     destination_host=destination_address,
-                     mode="0o666")
-
-    if world.ctrl_enable:
-        fabric_send_file("kea-ctrl-agent.conf",
-                         world.f_cfg.etc_join("kea-ctrl-agent.conf"),
-                         destination_host=destination_address,
-                         mode="0o666")
+    # keactrl.conf is used only by 'make' installations
+    if world.f_cfg.install_method != 'make':
+        del files['keactrl.conf']
 
-    if world.ddns_enable:
-        fabric_send_file("kea-dhcp-ddns.conf",
-                         world.f_cfg.etc_join("kea-dhcp-ddns.conf"),
-                         destination_host=destination_address,
-                         mode="0o666")
+    # send to server, all files in one archive;
+    # use mode 0o666 to make config writable to enable config-write tests
+    fabric_send_files([(world.f_cfg.etc_join(name), content, None if name == 'keactrl.conf' else 0o666)
+                       for name, content in files.items()],
+                      destination_host=destination_address)
 
     # store files back to local for debug purposes
-    if world.f_cfg.install_method == 'make':
-        copy_configuration_file(world.cfg["cfg_file_2"], "kea_ctrl_config", destination_host=destination_address)
-        remove_local_file(world.cfg["cfg_file_2"])
-
-    copy_configuration_file(f'kea-dhcp{world.proto[1]}.conf',
-                            f'kea-dhcp{world.proto[1]}.conf', destination_host=destination_address)
-    remove_local_file(f'kea-dhcp{world.proto[1]}.conf')
-
-    if world.ctrl_enable:
-        copy_configuration_file("kea-ctrl-agent.conf", "kea-ctrl-agent.conf", destination_host=destination_address)
-        remove_local_file("kea-ctrl-agent.conf")
-
-    if world.ddns_enable:
-        copy_configuration_file("kea-dhcp-ddns.conf", "kea-dhcp-ddns.conf", destination_host=destination_address)
-        remove_local_file("kea-dhcp-ddns.conf")
+    for name, content in files.items():
+        save_configuration_content(content, 'kea_ctrl_config' if name == 'keactrl.conf' else name,
+                                   destination_host=destination_address)
 
 
 def clear_logs(destination_address=world.f_cfg.mgmt_address):
@@ -1434,66 +1438,62 @@ def clear_leases(db_name=world.f_cfg.db_name, db_user=world.f_cfg.db_user, db_pa
         raise Exception('Unsupported db type %s' % world.f_cfg.db_type)
 
 
-def clear_pid_leftovers(destination_address):
-    # we are using rm -f for files so command always succeed, so let's download it first than remove and rise error
-    result = fabric_download_file(world.f_cfg.run_join('kea.kea-dhcp*.pid'),
-                                  check_local_path_for_downloaded_files(world.cfg["test_result_dir"],
-                                                                        'PID_FILE',
-                                                                        destination_address),
-                                  destination_host=destination_address, ignore_errors=True)
-    if result.succeeded:
-        fabric_remove_file_command(world.f_cfg.run_join('kea.kea-dhcp*.pid'),
-                                   destination_host=destination_address)
-
-        assert False, "KEA PID FILE FOUND! POSSIBLE KEA CRASH"
-
-
 def clear_all(destination_address=world.f_cfg.mgmt_address,
               software_install_path=world.f_cfg.software_install_path, db_user=world.f_cfg.db_user,
               db_passwd=world.f_cfg.db_passwd, db_name=world.f_cfg.db_name):
-    clear_logs(destination_address)
-
-    # remove pid files
-    clear_pid_leftovers(destination_address=destination_address)
-
-    # remove other kea runtime data
-    fabric_remove_file_command(world.f_cfg.data_join('*'), destination_host=destination_address,
-                               hide_all=not world.f_cfg.forge_verbose)
-    fabric_remove_file_command(world.f_cfg.run_join('*'), destination_host=destination_address,
-                               hide_all=not world.f_cfg.forge_verbose)
-
-    # use kea script for cleaning mysql
-    cmd = 'bash {software_install_path}/share/kea/scripts/mysql/wipe_data.sh '
-    cmd += ' `mysql -u{db_user} -p{db_passwd} {db_name} -N -B'
-    cmd += '   -e "SELECT CONCAT_WS(\'.\', version, minor) FROM schema_version;" 2>/dev/null` -N -B'
-    cmd += ' -u{db_user} -p{db_passwd} {db_name}'
-    cmd = cmd.format(software_install_path=software_install_path,
-                     db_user=db_user,
-                     db_passwd=db_passwd,
-                     db_name=db_name)
-    fabric_run_command(cmd, destination_host=destination_address, hide_all=not world.f_cfg.forge_verbose)
-
-    # use kea script for cleaning pgsql
-    cmd = 'PGPASSWORD={db_passwd} bash {software_install_path}/share/kea/scripts/pgsql/wipe_data.sh '
-    cmd += ' `PGPASSWORD={db_passwd} psql --set ON_ERROR_STOP=1 -A -t -h "localhost" '
-    cmd += '   -q -U {db_user} -d {db_name} -c "SELECT version || \'.\' || minor FROM schema_version;" 2>/dev/null`'
-    cmd += ' --set ON_ERROR_STOP=1 -A -t -h "localhost" -q -U {db_user} -d {db_name}'
-    cmd = cmd.format(software_install_path=software_install_path,
-                     db_user=db_user,
-                     db_passwd=db_passwd,
-                     db_name=db_name)
-    fabric_run_command(cmd, destination_host=destination_address, hide_all=not world.f_cfg.forge_verbose)
-
-    # clear kea logs in journald (actually all logs)
-    if world.f_cfg.install_method != 'make':
-        if world.server_system == 'alpine':
-            cmd = 'truncate /var/log/messages -s0'
-            fabric_sudo_command(cmd, destination_host=destination_address, hide_all=not world.f_cfg.forge_verbose)
-        else:
-            cmd = 'journalctl --rotate'
-            fabric_sudo_command(cmd, destination_host=destination_address, hide_all=not world.f_cfg.forge_verbose)
-            cmd = 'journalctl --vacuum-time=1s'
-            fabric_sudo_command(cmd, destination_host=destination_address, hide_all=not world.f_cfg.forge_verbose)
+    hide = not world.f_cfg.forge_verbose
+    # all the cleanup is done in a single round trip
+    with remote_batch(destination_address) as batch:
+        batch.remove(world.f_cfg.log_join('kea*'), hide_all=hide)
+
+        # we are using rm -f for files so command always succeed, so let's read pid files first,
+        # if there are any then rise error once everything is removed
+        pid_files = batch.sudo(f"cat {world.f_cfg.run_join('kea.kea-dhcp*.pid')}", hide_all=True, ignore_errors=True)
+
+        # remove other kea runtime data
+        batch.remove(world.f_cfg.data_join('*'), hide_all=hide)
+        batch.remove(world.f_cfg.run_join('*'), hide_all=hide)
+
+        # use kea script for cleaning mysql
+        cmd = 'bash {software_install_path}/share/kea/scripts/mysql/wipe_data.sh '
+        cmd += ' `mysql -u{db_user} -p{db_passwd} {db_name} -N -B'
+        cmd += '   -e "SELECT CONCAT_WS(\'.\', version, minor) FROM schema_version;" 2>/dev/null` -N -B'
+        cmd += ' -u{db_user} -p{db_passwd} {db_name}'
+        cmd = cmd.format(software_install_path=software_install_path,
+                         db_user=db_user,
+                         db_passwd=db_passwd,
+                         db_name=db_name)
+        batch.run(cmd, hide_all=hide)
+
+        # use kea script for cleaning pgsql
+        cmd = 'PGPASSWORD={db_passwd} bash {software_install_path}/share/kea/scripts/pgsql/wipe_data.sh '
+        cmd += ' `PGPASSWORD={db_passwd} psql --set ON_ERROR_STOP=1 -A -t -h "localhost" '
+        cmd += '   -q -U {db_user} -d {db_name} -c "SELECT version || \'.\' || minor FROM schema_version;" 2>/dev/null`'
+        cmd += ' --set ON_ERROR_STOP=1 -A -t -h "localhost" -q -U {db_user} -d {db_name}'
+        cmd = cmd.format(software_install_path=software_install_path,
+                         db_user=db_user,
+                         db_passwd=db_passwd,
+                         db_name=db_name)
+        batch.run(cmd, hide_all=hide)
+
+        # kea logs in journald are not removed, logs of the test start after the newest entry
+        journal_cursor = None
+        if world.f_cfg.install_method != 'make':
+            if world.server_system == 'alpine':
+                batch.sudo('truncate /var/log/messages -s0', hide_all=hide)
+            else:
+                journal_cursor = batch.sudo('journalctl -n 1 -q --output=cat --show-cursor | '
+                                            'sed -n "s/^-- cursor: //p"', hide_all=True, ignore_errors=True)
+
+    if journal_cursor is not None:
+        cursor = journal_cursor.result if journal_cursor.result.succeeded else None
+        log_cursors.start_journal(cursor, destination=destination_address)
+
+    if pid_files.result.succeeded:
+        with open(check_local_path_for_downloaded_files(world.cfg["test_result_dir"], 'PID_FILE',
+                                                        destination_address), 'w') as pid_file:
+            pid_file.write(pid_files.result)
+        assert False, "KEA PID FILE FOUND! POSSIBLE KEA CRASH"
 
 
 def _check_kea_status(destination_address=world.f_cfg.mgmt_address):
@@ -1777,8 +1777,8 @@ def save_leases(tmp_db_type=None, destination_address=world.f_cfg.mgmt_address):
         pass
     else:
         if world.server_system == 'alpine':
-            lease_file = '/tmp/leases.csv'
-            cmd = f'cat {world.f_cfg.get_leases_path()} > {lease_file}'
+            lease_file = posixpath.join(artifacts_staging_dir(), 'leases.csv')
+            cmd = f'mkdir -p {artifacts_staging_dir()}; cat {world.f_cfg.get_leases_path()} > {lease_file}'
             fabric_sudo_command(cmd, destination_host=destination_address,
                                 ignore_errors=True)
         else:
@@ -1792,7 +1792,30 @@ def save_leases(tmp_db_type=None, destination_address=world.f_cfg.mgmt_address):
                              hide_all=not world.f_cfg.forge_verbose)
 
 
-def save_logs(destination_address=world.f_cfg.mgmt_address):
+def _stage_service_log(service_name, staged_name, destination_address):
+    """
+    Copy log of Kea service to the staging directory: its log file on alpine, otherwise its journal
+    entries logged in the test.
+
+    :return: path of the copy on the server
+    """
+    staging = artifacts_staging_dir()
+    if world.server_system == 'alpine':
+        source = f'cat {world.f_cfg.log_join(f"{service_name}.log")}'
+    else:
+        source = f'journalctl -u {service_name}{log_cursors.journal_scope(destination_address)}'
+    fabric_sudo_command(f'mkdir -p {staging}; {source} > {staging}/{staged_name}',
+                        destination_host=destination_address,
+                        ignore_errors=True)
+    return f'{staging}/{staged_name}'
+
+
+def _download_kea_log(destination_address):
+    """
+    Download log of the DHCP server that is not mirrored, to kea-logs-N directory if logs were saved before.
+
+    :return: local directory with the log
+    """
     if world.f_cfg.install_method == 'make':
         # download all logs, ie. kea.log, kea.log1, etc.
         log_path = world.f_cfg.log_join('kea.log*')
@@ -1801,17 +1824,7 @@ def save_logs(destination_address=world.f_cfg.mgmt_address):
             service_name = f'kea-dhcp{world.proto[1]}'
         else:
             service_name = f'isc-kea-dhcp{world.proto[1]}-server'
-        if world.server_system == 'alpine':
-            logging_file_path = world.f_cfg.log_join(f'{service_name}.log')
-            cmd = f'cat {logging_file_path} > '  # get logs of kea service
-            cmd += ' /tmp/kea.log'
-        else:
-            cmd = 'journalctl -u %s > ' % service_name  # get logs of kea service
-            cmd += ' /tmp/kea.log'
-        result = fabric_sudo_command(cmd,
-                                     destination_host=destination_address,
-                                     ignore_errors=True)
-        log_path = '/tmp/kea.log'
+        log_path = _stage_service_log(service_name, 'kea.log', destination_address)
 
     local_dest_dir = check_local_path_for_downloaded_files(world.cfg["test_result_dir"],
                                                            '.',
@@ -1824,58 +1837,50 @@ def save_logs(destination_address=world.f_cfg.mgmt_address):
         # Look for free subdir for logs, try at least 100 times and then give up.
         # There should not be so many stored logs.
         for i in range(1, 100):
-            dir2 = os.path.join(local_dest_dir, 'kea-logs-%d' % i)
+            dir2 = os.path.join(local_dest_dir, f'kea-logs-{i}')
             if not os.path.exists(dir2):
-                found = True
                 local_dest_dir = dir2
                 os.makedirs(local_dest_dir)
                 break
-        if not found:
+        else:
             raise Exception('cannot store log, there is already 100 files stored')
 
     fabric_download_file(log_path,
                          local_dest_dir,
                          destination_host=destination_address, ignore_errors=True,
                          hide_all=not world.f_cfg.forge_verbose)
+    return local_dest_dir
 
+
+def save_logs(destination_address=world.f_cfg.mgmt_address):
+    # copies of logs are made in the staging directory, it is removed once they are downloaded
+    mirror = get_log_mirror(destination=destination_address, start=False)
+    if mirror is not None and mirror.sync():
+        # the log has been copied to test results directory while the test was running,
+        # to kea-logs-N directory if the log was replaced since the last save (see log_mirror)
+        local_dest_dir = os.path.dirname(mirror.local_path)
+        if world.f_cfg.install_method == 'make':
+            # rotated logs, ie. kea.log.1, kea.log.2, etc. go next to the copy of kea.log
+            fabric_download_file(world.f_cfg.log_join('kea.log?*'),
+                                 local_dest_dir,
+                                 destination_host=destination_address, ignore_errors=True,
+                                 hide_all=not world.f_cfg.forge_verbose)
+    else:
+        local_dest_dir = _download_kea_log(destination_address)
+
+    other_logs = []
     if world.ctrl_enable:
         if world.server_system in ['redhat', 'alpine']:
-            service_name = 'kea-ctrl-agent'
-        else:
-            service_name = 'isc-kea-ctrl-agent'
-        if world.server_system == 'alpine':
-            logging_file_path = world.f_cfg.log_join('kea-ctrl-agent.log')
-            cmd = f'cat {logging_file_path} > '   # get logs of kea service
-            cmd += ' /tmp/kea-ctrl-agent.log'
+            other_logs.append(('kea-ctrl-agent', 'kea-ctrl-agent.log'))
         else:
-            cmd = 'journalctl -u %s > ' % service_name  # get logs of kea service
-            cmd += ' /tmp/kea-ctrl-agent.log'
-        result = fabric_sudo_command(cmd,
-                                     destination_host=destination_address,
-                                     ignore_errors=True)
-        log_path = '/tmp/kea-ctrl-agent.log'
-        fabric_download_file(log_path,
-                             local_dest_dir,
-                             destination_host=destination_address, ignore_errors=True,
-                             hide_all=not world.f_cfg.forge_verbose)
-
+            other_logs.append(('isc-kea-ctrl-agent', 'kea-ctrl-agent.log'))
     if world.ddns_enable:
         if world.server_system in ['redhat', 'alpine']:
-            service_name = 'kea-dhcp-ddns'
-        else:
-            service_name = 'isc-kea-dhcp-ddns'
-        if world.server_system == 'alpine':
-            logging_file_path = world.f_cfg.log_join('kea-dhcp-ddns.log')
-            cmd = f'cat {logging_file_path} > '   # get logs of kea service
-            cmd += ' /tmp/kea.log-ddns'
+            other_logs.append(('kea-dhcp-ddns', 'kea.log-ddns'))
         else:
-            cmd = 'journalctl -u %s > ' % service_name  # get logs of kea service
-            cmd += ' /tmp/kea.log-ddns'
-        result = fabric_sudo_command(cmd,
-                                     destination_host=destination_address,
-                                     ignore_errors=True)
-        log_path = '/tmp/kea.log-ddns'
-        fabric_download_file(log_path,
+            other_logs.append(('isc-kea-dhcp-ddns', 'kea.log-ddns'))
+    for service_name, staged_name in other_logs:
+        fabric_download_file(_stage_service_log(service_name, staged_name, destination_address),
                              local_dest_dir,
                              destination_host=destination_address, ignore_errors=True,
                              hide_all=not world.f_cfg.forge_verbose)
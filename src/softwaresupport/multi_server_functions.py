@@ -8,108 +8,462 @@
 
 # pylint: disable=consider-using-f-string
 # pylint: disable=consider-using-with
-# pylint: disable=not-context-manager
 # pylint: disable=unspecified-encoding
 # pylint: disable=useless-object-inheritance
 
 import os
+import asyncio
+import hashlib
 import logging
 import tarfile
-import warnings
+import threading
+import posixpath
+import functools
 import subprocess
+from copy import deepcopy
 from shutil import copy
-
-from fabric.api import get, settings, put, sudo, run, hide
-from fabric.exceptions import NetworkError
-import fabric.state
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from src.forge_cfg import world
+from src.softwaresupport.transport import ssh, local, session_pool, RemoteBatch, RemoteFileList
+from src.softwaresupport.remote_stats import instrumented
 
 
 log = logging.getLogger('forge')
 
 
+def _transport(destination_host):
+    return local if world.f_cfg.is_local_transport(destination_host) else ssh
+
+
+@instrumented
 def fabric_run_command(cmd, destination_host=world.f_cfg.mgmt_address,
                        user_loc=world.f_cfg.mgmt_username,
                        password_loc=world.f_cfg.mgmt_password, hide_all=False,
-                       ignore_errors=False):
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        with settings(host_string=destination_host, user=user_loc, password=password_loc, warn_only=ignore_errors):
-            if ignore_errors:
-                fabric.state.output.warnings = False
-            if hide_all:
-                with hide('running', 'stdout', 'stderr'):
-                    result = run(cmd, pty=False)
-            else:
-                result = run(cmd, pty=False)
-    fabric.state.output.warnings = True
-    return result
+                       ignore_errors=False, combine_stderr=True):
+    return _transport(destination_host).execute(cmd, destination_host, user_loc, password_loc,
+                                                hide_all=hide_all, ignore_errors=ignore_errors,
+                                                combine_stderr=combine_stderr)
 
 
+@instrumented
 def fabric_sudo_command(cmd, destination_host=world.f_cfg.mgmt_address,
                         user_loc=world.f_cfg.mgmt_username,
                         password_loc=world.f_cfg.mgmt_password, hide_all=False,
-                        sudo_user=None, ignore_errors=False):
+                        sudo_user=None, ignore_errors=False, combine_stderr=True):
     # print("Executing command: %s" % cmd, "at %s" % destination_host)
-    with settings(host_string=destination_host, user=user_loc, password=password_loc,
-                  sudo_user=sudo_user, warn_only=ignore_errors):
-        try:
-            if ignore_errors:
-                fabric.state.output.warnings = False
-            if hide_all:
-                with hide('running', 'stdout', 'stderr'):
-                    result = sudo(cmd, pty=world.f_cfg.fabric_pty)
-            else:
-                result = sudo(cmd, pty=world.f_cfg.fabric_pty)
-        except NetworkError:
-            fabric.state.output.warnings = True
-            assert False, "Network connection failed"
-    fabric.state.output.warnings = True
-    return result
+    return _transport(destination_host).execute(cmd, destination_host, user_loc, password_loc,
+                                                sudo=True, sudo_user=sudo_user, pty=world.f_cfg.fabric_pty,
+                                                hide_all=hide_all, ignore_errors=ignore_errors,
+                                                combine_stderr=combine_stderr)
 
 
+@instrumented
 def fabric_send_file(file_local, file_remote,
                      destination_host=world.f_cfg.mgmt_address,
                      user_loc=world.f_cfg.mgmt_username,
                      password_loc=world.f_cfg.mgmt_password,
                      mode=None):
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        with settings(host_string=destination_host, user=user_loc, password=password_loc, warn_only=False):
-            with hide('running', 'stdout', 'stderr'):
-                result = put(file_local, file_remote, use_sudo=True, mode=mode)
-    return result
+    return _transport(destination_host).put(file_local, file_remote, destination_host, user_loc, password_loc,
+                                            mode=mode)
+
 
+@instrumented
+def fabric_send_files(files,
+                      destination_host=world.f_cfg.mgmt_address,
+                      user_loc=world.f_cfg.mgmt_username,
+                      password_loc=world.f_cfg.mgmt_password):
+    """
+    Send several files in one archive extracted on remote system with one command.
+    :param files: list of (remote path, content, mode) tuples, mode None means 0644
+    :param destination_host: address of remote server
+    :param user_loc: ssh user name
+    :param password_loc: ssh password
+    """
+    return _transport(destination_host).put_files(files, destination_host, user_loc, password_loc)
+
+
+class RemoteFileCache:
+    """
+    Session wide, content addressed cache of files sent to remote systems.
+
+    Each sent file is also stored on the remote system in a cache directory under its sha256
+    digest. When the same content is sent to that system again, it is installed from there after
+    the digest is verified, so in one round trip for all files and without transferring them.
+    Only files that are new in this session or whose cached copy is gone or damaged are uploaded.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._digests = {}  # host -> digests stored in remote cache directory
+        self._lock = threading.Lock()
+
+    def invalidate(self, destination_host=None):
+        """
+        Forget what is cached on destination_host (or on all hosts if None), so next send uploads
+        everything again. Use it in tests that tamper with the cache directory.
+        """
+        with self._lock:
+            if destination_host is None:
+                self._digests.clear()
+            else:
+                self._digests.pop(destination_host, None)
+
+    def _known(self, host, digest):
+        with self._lock:
+            return digest in self._digests.get(host, set())
+
+    def _remember(self, host, digests):
+        with self._lock:
+            self._digests.setdefault(host, set()).update(digests)
+
+    def send(self, files, destination_host=world.f_cfg.mgmt_address, user_loc=world.f_cfg.mgmt_username,
+             password_loc=world.f_cfg.mgmt_password, batch=None):
+        """
+        Send files (same format as in fabric_send_files), installing cached ones from remote cache directory.
+        :param batch: remote_batch to queue cached files installation in, files that have to be uploaded
+        are sent right after the batch is executed
+        """
+        if batch is not None:
+            destination_host, user_loc, password_loc = batch.host, batch.user, batch.password
+        files = [(path, content.encode() if isinstance(content, str) else content, mode)
+                 for path, content, mode in files]
+        digests = [hashlib.sha256(content).hexdigest() for _, content, _ in files]
+
+        installs = []
+        to_upload = []
+        for (path, content, mode), digest in zip(files, digests):
+            if not self._known(destination_host, digest):
+                to_upload.append((path, content, mode, digest))
+                continue
+            if isinstance(mode, str):
+                mode = int(mode, 8)
+            cached = posixpath.join(self.directory, digest)
+            installs.append(((path, content, mode, digest),
+                             f'echo "{digest}  {cached}" | sha256sum -c --status && '
+                             f'install -D -m {(mode if mode is not None else 0o644) & 0o7777:o} "{cached}" "{path}"'))
+
+        def upload():
+            missing = to_upload + [file for file, entry in entries if entry.result.failed]
+            if not missing:
+                return
+            # store every file in cache directory as well
+            archive = []
+            for path, content, mode, digest in missing:
+                archive.append((path, content, mode))
+                archive.append((posixpath.join(self.directory, digest), content, 0o644))
+            fabric_send_files(archive, destination_host=destination_host,
+                              user_loc=user_loc, password_loc=password_loc)
+            self._remember(destination_host, [digest for _, _, _, digest in missing])
+
+        if batch is None and not installs:
+            entries = []
+            upload()
+        elif batch is None:
+            with remote_batch(destination_host, user_loc, password_loc) as own_batch:
+                entries = [(file, own_batch.sudo(cmd, hide_all=True, ignore_errors=True)) for file, cmd in installs]
+                own_batch.add_callback(upload)
+        else:
+            entries = [(file, batch.sudo(cmd, hide_all=True, ignore_errors=True)) for file, cmd in installs]
+            batch.add_callback(upload)
+        return [path for path, _, _ in files]
 
+
+remote_file_cache = RemoteFileCache(world.f_cfg.tmp_join('forge_file_cache'))
+
+
+@instrumented
+def fabric_send_files_cached(files,
+                             destination_host=world.f_cfg.mgmt_address,
+                             user_loc=world.f_cfg.mgmt_username,
+                             password_loc=world.f_cfg.mgmt_password,
+                             batch=None):
+    """
+    Send several files, skipping upload of those already cached on remote system, see RemoteFileCache.
+    :param files: list of (remote path, content, mode) tuples, mode None means 0644
+    :param destination_host: address of remote server
+    :param user_loc: ssh user name
+    :param password_loc: ssh password
+    :param batch: remote_batch to queue installation of cached files in
+    """
+    return remote_file_cache.send(files, destination_host, user_loc, password_loc, batch=batch)
+
+
+def invalidate_remote_file_cache(destination_host=None):
+    """
+    Make next fabric_send_files_cached() upload all files to destination_host (all hosts if None) again.
+    """
+    remote_file_cache.invalidate(destination_host)
+
+
+# downloads queued by collect_downloads() in the current thread
+_collected = threading.local()
+
+
+@instrumented
 def fabric_download_file(remote_path, local_path,
                          destination_host=world.f_cfg.mgmt_address,
                          user_loc=world.f_cfg.mgmt_username,
                          password_loc=world.f_cfg.mgmt_password,
                          ignore_errors=False, hide_all=False):
-    if '*' in remote_path:  # fabric get needs o+rx permissions on parent directory to properly list files when using *
-        try:
-            permissions = int(fabric_sudo_command(f'stat -c %a {remote_path.rsplit("/", 1)[0]}',
-                                                  ignore_errors=True, hide_all=True))
-        except ValueError:
-            permissions = -1
-        else:
-            fabric_sudo_command(f'chmod o+rx {remote_path.rsplit("/", 1)[0]}', hide_all=True)
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        with settings(host_string=destination_host, user=user_loc, password=password_loc, warn_only=ignore_errors):
-            if ignore_errors:
-                fabric.state.output.warnings = False
-            if hide_all:
-                with hide('running', 'stdout', 'stderr'):
-                    result = get(remote_path, local_path, use_sudo=True)
-            else:
-                result = get(remote_path, local_path, use_sudo=True)
-            fabric.state.output.warnings = True
-    if '*' in remote_path:  # return permisions to original state
-        if int(permissions) >= 0:
-            fabric_sudo_command(f'chmod {permissions} {remote_path.rsplit("/", 1)[0]}', hide_all=True)
-    return result
+    """
+    Download file(s) matching remote path (glob allowed) with sudo privileges, compressed on the way.
+    Inside collect_downloads() block for the same host the download is only queued
+    and an empty RemoteFileList is returned.
+    """
+    queue = getattr(_collected, 'queues', {}).get(destination_host)
+    if queue is not None:
+        queue.append((remote_path, local_path, ignore_errors, hide_all))
+        return RemoteFileList()
+    # remote globs are expanded with sudo so no permission juggling on parent directory is needed
+    return fabric_download_files([(remote_path, local_path)], destination_host, user_loc, password_loc,
+                                 ignore_errors=ignore_errors, hide_all=hide_all)
+
+
+@instrumented
+def fabric_download_files(files,
+                          destination_host=world.f_cfg.mgmt_address,
+                          user_loc=world.f_cfg.mgmt_username,
+                          password_loc=world.f_cfg.mgmt_password,
+                          ignore_errors=False, hide_all=False, keep_path=None, remove=None):
+    """
+    Download several files in one compressed archive streamed by one remote command.
+    :param files: list of (remote absolute path or glob, local file or directory path) tuples
+    :param destination_host: address of remote server
+    :param user_loc: ssh user name
+    :param password_loc: ssh password
+    :param keep_path: store the archive as it is at this path (suffix is added) instead of extracting it
+    :param remove: remote path removed by the same command once the files are sent
+    """
+    return _transport(destination_host).get_archive(files, destination_host, user_loc, password_loc,
+                                                    compression=world.f_cfg.artifacts_compression,
+                                                    keep_path=keep_path, hide_all=hide_all,
+                                                    ignore_errors=ignore_errors, remove=remove)
+
+
+@contextmanager
+def collect_downloads(destination_host=world.f_cfg.mgmt_address,
+                      user_loc=world.f_cfg.mgmt_username,
+                      password_loc=world.f_cfg.mgmt_password,
+                      remove=None):
+    """
+    Queue fabric_download_file() calls for the host made in the block and fetch all the files
+    with one fabric_download_files() call when the block ends, e.g. all artifacts of a test:
+
+        with collect_downloads(dest):
+            save_leases(destination_address=dest)
+            save_logs(destination_address=dest)
+
+    If ARTIFACTS_STORE_COMPRESSED is set, the archive is stored in test results directory as it is.
+    :param remove: remote path (e.g. artifacts_staging_dir()) removed afterwards, by the same command
+                   which sends the files
+    """
+    if not hasattr(_collected, 'queues'):
+        _collected.queues = {}
+    queue = _collected.queues[destination_host] = []
+    try:
+        yield
+    finally:
+        del _collected.queues[destination_host]
+    if not queue:
+        if remove is not None:
+            fabric_sudo_command(f'rm -rf {remove}', destination_host, user_loc, password_loc, hide_all=True,
+                                ignore_errors=True)
+        return
+    keep_path = None
+    if world.f_cfg.artifacts_store_compressed:
+        keep_path = check_local_path_for_downloaded_files(world.cfg["test_result_dir"], 'artifacts',
+                                                          destination_host)
+    result = fabric_download_files([(remote_path, local_path) for remote_path, local_path, _, _ in queue],
+                                   destination_host, user_loc, password_loc, ignore_errors=True,
+                                   hide_all=all(hide for _, _, _, hide in queue), keep_path=keep_path,
+                                   remove=remove)
+    failed = [remote_path for remote_path, _, ignore, _ in queue if remote_path in result.failed and not ignore]
+    assert not failed, f'Downloading {", ".join(failed)} from {destination_host} failed'
+
+
+@contextmanager
+def remote_batch(destination_host=world.f_cfg.mgmt_address,
+                 user_loc=world.f_cfg.mgmt_username,
+                 password_loc=world.f_cfg.mgmt_password):
+    """
+    Queue remote commands and execute all of them in a single round trip when the block ends.
+    Queued commands return entries which have .result set after the block, e.g.:
+
+        with remote_batch(dest) as b:
+            b.sudo('rm -rf /tmp/x', hide_all=True)
+            pid = b.sudo('cat /run/kea/*.pid', ignore_errors=True)
+        if pid.result.succeeded: ...
+
+    :param destination_host: address of remote server
+    :param user_loc: ssh user name
+    :param password_loc: ssh password
+    """
+    batch = RemoteBatch(_transport(destination_host), destination_host, user_loc, password_loc)
+    yield batch
+    _execute_batch(batch, destination_host, '\n'.join(entry.cmd[:200] for entry in batch.entries))
+
+
+@instrumented
+def _execute_batch(batch, destination_host, cmd):  # pylint: disable=unused-argument
+    # separate function just to have batches recorded in remote call statistics (host and command)
+    return batch.execute()
+
+
+# Threads running remote calls awaited by coroutines below, transports block on network I/O.
+_async_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='forge-remote')
+
+
+async def _in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_async_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Await blocking forge function (e.g. a step sending control command or waiting for a log message)
+    in the threads of remote calls, so that the event loop keeps running other coroutines meanwhile.
+    The function gets a copy of forge state (world) of the calling thread, see _copy_of_world().
+    """
+    state = _copy_of_world()
+
+    def call():
+        world.__dict__.clear()
+        world.__dict__.update(state)
+        return func(*args, **kwargs)
+
+    return await _in_executor(call)
+
+
+@instrumented
+async def remote_run(cmd, destination_host=world.f_cfg.mgmt_address,
+                     user_loc=world.f_cfg.mgmt_username,
+                     password_loc=world.f_cfg.mgmt_password, hide_all=False,
+                     ignore_errors=False, combine_stderr=True):
+    """
+    asyncio version of fabric_run_command, e.g. to run commands on several servers at once:
+
+        await asyncio.gather(remote_run(cmd, addr_1), remote_run(cmd, addr_2))
+    """
+    return await _in_executor(_transport(destination_host).execute, cmd, destination_host, user_loc, password_loc,
+                              hide_all=hide_all, ignore_errors=ignore_errors, combine_stderr=combine_stderr)
+
+
+@instrumented
+async def remote_sudo(cmd, destination_host=world.f_cfg.mgmt_address,
+                      user_loc=world.f_cfg.mgmt_username,
+                      password_loc=world.f_cfg.mgmt_password, hide_all=False,
+                      sudo_user=None, ignore_errors=False, combine_stderr=True):
+    """
+    asyncio version of fabric_sudo_command.
+    """
+    return await _in_executor(_transport(destination_host).execute, cmd, destination_host, user_loc, password_loc,
+                              sudo=True, sudo_user=sudo_user, pty=world.f_cfg.fabric_pty,
+                              hide_all=hide_all, ignore_errors=ignore_errors, combine_stderr=combine_stderr)
+
+
+@instrumented
+async def remote_put(file_local, file_remote,
+                     destination_host=world.f_cfg.mgmt_address,
+                     user_loc=world.f_cfg.mgmt_username,
+                     password_loc=world.f_cfg.mgmt_password,
+                     mode=None):
+    """
+    asyncio version of fabric_send_file.
+    """
+    return await _in_executor(_transport(destination_host).put, file_local, file_remote,
+                              destination_host, user_loc, password_loc, mode=mode)
+
+
+@instrumented
+async def remote_get(remote_path, local_path,
+                     destination_host=world.f_cfg.mgmt_address,
+                     user_loc=world.f_cfg.mgmt_username,
+                     password_loc=world.f_cfg.mgmt_password,
+                     ignore_errors=False, hide_all=False):
+    """
+    asyncio version of fabric_download_file.
+    """
+    return await _in_executor(_transport(destination_host).get_archive, [(remote_path, local_path)],
+                              destination_host, user_loc, password_loc,
+                              compression=world.f_cfg.artifacts_compression,
+                              hide_all=hide_all, ignore_errors=ignore_errors)
+
+
+def run_concurrently(*coroutines):
+    """
+    Run coroutines (e.g. remote_run() calls) concurrently from synchronous code.
+    Coroutines running in an event loop already have to await asyncio.gather() instead.
+    :return: list of their results in the order of arguments
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        for coroutine in coroutines:
+            coroutine.close()
+        raise RuntimeError('run_concurrently() cannot be called from a running event loop, '
+                           'await asyncio.gather() of the coroutines instead')
+
+    async def _gather():
+        return await asyncio.gather(*coroutines)
+    return asyncio.run(_gather())
+
+
+def _copy_of_world():
+    """
+    Forge state (world) of the calling thread for another thread: dicts, lists and sets, like world.cfg,
+    are deep copies, other objects (world.f_cfg, ...) are shared.
+    """
+    state = {}
+    for name, value in world.__dict__.items():
+        if isinstance(value, (dict, list, set)):
+            try:
+                value = deepcopy(value)
+            except TypeError:
+                # items that cannot be copied (e.g. sockets) are shared, the container is not
+                value = value.copy()
+        state[name] = value
+    return state
+
+
+def run_for_each_server(func, servers):
+    """
+    Call func(server) for all servers concurrently. Every call runs in its own thread which gets
+    its own copy of forge state (world) of the calling thread, see _copy_of_world(); func must not
+    change the shared objects, e.g. world.f_cfg. Changes of world made by func stay in its thread.
+    All calls are awaited, then errors are raised in the order of servers: a single one as it is,
+    more of them in one AssertionError.
+
+    :param func: function taking management address as its only argument
+    :param servers: list of management addresses
+    :return: list of results in the order of servers
+    """
+    if len(servers) < 2:
+        return [func(server) for server in servers]
+
+    def call(server, state):
+        world.__dict__.update(state)
+        return func(server)
+
+    states = [_copy_of_world() for _ in servers]
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        futures = [executor.submit(call, server, state) for server, state in zip(servers, states)]
+    errors = [(server, f.exception()) for server, f in zip(servers, futures) if f.exception() is not None]
+    if len(errors) == 1:
+        raise errors[0][1]
+    if errors:
+        msg = '\n'.join(f'{server}: {type(e).__name__}: {e}' for server, e in errors)
+        raise AssertionError(f'Failed on {len(errors)} servers:\n{msg}') from errors[0][1]
+    return [f.result() for f in futures]
+
+
+def close_remote_connections():
+    """
+    Close all pooled SSH connections, called once at the end of forge session.
+    """
+    session_pool.close_all()
 
 
 def make_tarfile(output_filename, source_dir):
@@ -117,20 +471,32 @@ def make_tarfile(output_filename, source_dir):
         tar.add(source_dir)
 
 
+@instrumented
 def fabric_remove_file_command(remote_path,
                                destination_host=world.f_cfg.mgmt_address,
                                user_loc=world.f_cfg.mgmt_username,
                                password_loc=world.f_cfg.mgmt_password,
                                hide_all=True):
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        with settings(host_string=destination_host, user=user_loc, password=password_loc, warn_only=False):
-            if hide_all:
-                with hide('running', 'stdout', 'stderr'):
-                    result = sudo("rm -rf " + remote_path)
-            else:
-                result = sudo("rm -rf " + remote_path)
-    return result
+    return _transport(destination_host).execute("rm -rf " + remote_path, destination_host, user_loc, password_loc,
+                                                sudo=True, pty=world.f_cfg.fabric_pty, hide_all=hide_all)
+
+
+def fabric_stream_command(cmd, sink,
+                          destination_host=world.f_cfg.mgmt_address,
+                          user_loc=world.f_cfg.mgmt_username,
+                          password_loc=world.f_cfg.mgmt_password,
+                          sudo=True, stderr_sink=None):
+    """
+    Start long running command, its stdout is written to sink in background until the command
+    exits or the returned stream is closed. Closing the stream sends EOF to stdin of the command.
+
+    :param cmd: command to execute
+    :param sink: object with write() method accepting bytes
+    :param stderr_sink: the same for stderr, by default it is captured in the result of the stream
+    :return: RemoteStream
+    """
+    return _transport(destination_host).stream(cmd, destination_host, user_loc, password_loc, sink, sudo=sudo,
+                                               stderr_sink=stderr_sink)
 
 
 def remove_local_file(file_local):
@@ -190,16 +556,30 @@ def check_local_path_for_downloaded_files(local_file_path, local_file_name, remo
     return os.path.join(local_file_path, local_file_name)
 
 
+def _configuration_file_path(file_name, destination_host):
+    file_name = generate_file_name(1, file_name)
+    if not os.path.exists(world.cfg["test_result_dir"]):
+        os.makedirs(world.cfg["test_result_dir"])
+    dest_path = check_local_path_for_downloaded_files(world.cfg["test_result_dir"], file_name, destination_host)
+    dest_dir = os.path.dirname(dest_path)
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+    return dest_path
+
+
 def copy_configuration_file(local_file, file_name='configuration_file', destination_host=world.f_cfg.mgmt_address):
     if world.f_cfg.save_config_file:
-        file_name = generate_file_name(1, file_name)
-        if not os.path.exists(world.cfg["test_result_dir"]):
-            os.makedirs(world.cfg["test_result_dir"])
-        dest_path = check_local_path_for_downloaded_files(world.cfg["test_result_dir"], file_name, destination_host)
-        dest_dir = os.path.dirname(dest_path)
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
-        copy(local_file, dest_path)
+        copy(local_file, _configuration_file_path(file_name, destination_host))
+
+
+def save_configuration_content(content, file_name='configuration_file', destination_host=world.f_cfg.mgmt_address):
+    """
+    Same as copy_configuration_file but the configuration is taken from memory.
+    """
+    if world.f_cfg.save_config_file:
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(_configuration_file_path(file_name, destination_host), mode) as f:
+            f.write(content)
 
 
 # Open file, write content and at the end of the context delete the file.
@@ -219,12 +599,24 @@ class TemporaryFile(object):
         os.unlink(self.file_name)
 
 
-def send_content(local_path, remote_path, content, subdir):
+def send_content(local_path, remote_path, content, subdir, batch=None):
     with TemporaryFile(local_path, content):
-        fabric_send_file(local_path, remote_path)
+        if batch is None:
+            fabric_send_file(local_path, remote_path)
+        else:
+            batch.write(remote_path, content)
         copy_configuration_file(local_path, os.path.join(subdir, local_path))
 
 
+def artifacts_staging_dir():
+    """
+    Remote directory where artifacts of the current test (captures, copies of logs) are kept
+    until the test ends. Then they are downloaded, or just removed if ARTIFACTS is 'on-failure'
+    and the test passed.
+    """
+    return world.f_cfg.tmp_join(posixpath.join('forge-artifacts', os.path.basename(world.cfg["test_result_dir"])))
+
+
 def start_tcpdump(file_name: str = "capture.pcap", iface: str = None, port_filter: str = None,
                   auto_start_dns: bool = False, location: str = 'local'):
     """
@@ -248,13 +640,13 @@ def start_tcpdump(file_name: str = "capture.pcap", iface: str = None, port_filte
 
     pcap_file_location = os.path.join(world.cfg["test_result_dir"], file_name)
     if location != 'local':
-        pcap_file_location = os.path.join('/tmp', file_name)
+        pcap_file_location = posixpath.join(artifacts_staging_dir(), file_name)
 
     cmd = f"sudo {os.path.join(world.f_cfg.tcpdump_path, 'tcpdump')}"
     cmd += f' -U -w {pcap_file_location} -s 65535 -i {iface} {port_filter}'
 
     if location != 'local':
-        cmd = f"nohup {cmd} > /dev/null 2>&1 & "
+        cmd = f"mkdir -p -m 1777 {artifacts_staging_dir()}; nohup {cmd} > /dev/null 2>&1 & "
         fabric_sudo_command(cmd, destination_host=location)
     else:
         subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
@@ -285,6 +677,6 @@ def download_tcpdump_capture(location, file_name):
     if location == 'local':
         print("Logs from locally running tcpdump are saved in tests results directly")
         return
-    fabric_download_file(os.path.join('/tmp', file_name),
+    fabric_download_file(posixpath.join(artifacts_staging_dir(), file_name),
                          os.path.join(world.cfg["test_result_dir"], file_name),
                          destination_host=location, ignore_errors=True)
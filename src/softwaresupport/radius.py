@@ -12,7 +12,7 @@ from src import srv_msg
 
 from src.protosupport.dhcp4_scen import DHCPv6_STATUS_CODES, get_address4, get_address6, send_discover_with_no_answer
 from src.forge_cfg import world
-from .multi_server_functions import fabric_sudo_command, fabric_send_file, TemporaryFile
+from .multi_server_functions import fabric_sudo_command, fabric_send_files_cached
 
 AUTHORIZE_CONTENT = ''
 
@@ -461,20 +461,14 @@ def _init_radius(destination: str = world.f_cfg.mgmt_address):
     """
 
     global AUTHORIZE_CONTENT
-    authorize_file = 'authorize.txt'
-    with TemporaryFile(authorize_file, AUTHORIZE_CONTENT):
-        if world.server_system in ['redhat', 'alpine']:
-            # freeradius 3.x
-            fabric_send_file(authorize_file, '/etc/raddb/mods-config/files/authorize',
-                             destination_host=destination)
-        else:
-            # freeradius 3.x
-            fabric_send_file(authorize_file,
-                             '/etc/freeradius/3.0/mods-config/files/authorize',
-                             destination_host=destination)
-            # freeradius 2.x
-            fabric_send_file(authorize_file, '/etc/freeradius/users',
-                             destination_host=destination)
+    if world.server_system in ['redhat', 'alpine']:
+        # freeradius 3.x
+        authorize_paths = ['/etc/raddb/mods-config/files/authorize']
+        clients_conf_paths = ['/etc/raddb/clients.conf']
+    else:
+        # freeradius 3.x and 2.x
+        authorize_paths = ['/etc/freeradius/3.0/mods-config/files/authorize', '/etc/freeradius/users']
+        clients_conf_paths = ['/etc/freeradius/3.0/clients.conf', '/etc/freeradius/clients.conf']
 
     # clients.conf file
     clients_conf_content = '''
@@ -491,18 +485,10 @@ client {mgmt_address} {{
    }}
 }}'''
     clients_conf_content = clients_conf_content.format(mgmt_address=destination)
-    clients_conf_file = 'clients.conf'
-    with TemporaryFile(clients_conf_file, clients_conf_content):
-        if world.server_system in ['redhat', 'alpine']:
-            # freeradius 3.x
-            fabric_send_file(clients_conf_file, '/etc/raddb/clients.conf',
-                             destination_host=destination)
-        else:
-            # freeradius 3.x
-            fabric_send_file(clients_conf_file, '/etc/freeradius/3.0/clients.conf',
-                             destination_host=destination)
-            # freeradius 2.x
-            fabric_send_file(clients_conf_file, '/etc/freeradius/clients.conf',
+
+    # content is the same in most of the tests so it is usually installed from the cache on the server
+    fabric_send_files_cached([(path, AUTHORIZE_CONTENT, None) for path in authorize_paths] +
+                             [(path, clients_conf_content, None) for path in clients_conf_paths],
                              destination_host=destination)
 
 
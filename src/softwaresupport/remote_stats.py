@@ -0,0 +1,204 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Instrumentation of remote calls: every call of an instrumented helper is recorded with its
+command, host, bytes transferred, wall time and the test that made it. At the end of the session
+the records are written as CSV together with a JSON summary (count, p50, p95, max per helper and per test).
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import inspect
+import functools
+import threading
+
+from src.forge_cfg import world
+from src.softwaresupport.transport import RemoteResult, RemoteFileList
+
+# names of arguments that hold the host and the command (or path) in the instrumented helpers
+HOST_ARGS = ('destination_host', 'location')
+COMMAND_ARGS = ('cmd', 'remote_path', 'file_remote', 'files')
+
+
+class RemoteCallStats:
+    """
+    Thread safe store of remote call records.
+    """
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+        self._depth = threading.local()
+
+    def record(self, helper, command, host, nbytes, duration, test, nested):
+        with self._lock:
+            self.calls.append({'helper': helper,
+                               'command': command,
+                               'host': host,
+                               'bytes': nbytes,
+                               'time': round(duration, 6),
+                               'test': test,
+                               'nested': nested})
+
+    def clear(self):
+        with self._lock:
+            self.calls = []
+
+    def enter(self):
+        """
+        Mark start of an instrumented call in current thread.
+        :return: True if the call is made from within another instrumented call
+        """
+        depth = getattr(self._depth, 'value', 0)
+        self._depth.value = depth + 1
+        return depth > 0
+
+    def leave(self):
+        self._depth.value -= 1
+
+    def slowest(self, count):
+        with self._lock:
+            return sorted(self.calls, key=lambda c: c['time'], reverse=True)[:count]
+
+    @staticmethod
+    def _histogram(times):
+        times = sorted(times)
+        return {'count': len(times),
+                'total': round(sum(times), 6),
+                'p50': round(_percentile(times, 50), 6),
+                'p95': round(_percentile(times, 95), 6),
+                'max': round(times[-1], 6)}
+
+    def summary(self):
+        """
+        Latency histograms per helper and per test. Per test totals count only top level calls,
+        so time of helpers calling other helpers is not counted twice.
+        """
+        with self._lock:
+            calls = list(self.calls)
+        per_helper = {}
+        per_test = {}
+        for call in calls:
+            per_helper.setdefault(call['helper'], []).append(call['time'])
+            if not call['nested']:
+                per_test.setdefault(call['test'], []).append(call['time'])
+        return {'helpers': {name: self._histogram(times) for name, times in sorted(per_helper.items())},
+                'tests': {name: self._histogram(times) for name, times in per_test.items()}}
+
+    def write_report(self, directory):
+        """
+        Write remote_calls.csv with all the records and remote_calls.json with the summary.
+        :param directory: local directory to store the report in
+        """
+        if not self.calls:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'remote_calls.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.calls[0].keys()))
+            writer.writeheader()
+            writer.writerows(self.calls)
+        with open(os.path.join(directory, 'remote_calls.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=4)
+
+
+def _percentile(sorted_values, percent):
+    # nearest rank method
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _size(value):
+    if isinstance(value, RemoteResult):
+        return len(value.stdout.encode()) + len(value.stderr.encode())
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, io.BytesIO):
+        return len(value.getbuffer())
+    return 0
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def _transferred(arguments, result):
+    """
+    Estimate number of bytes sent or received by a helper from its arguments and result.
+    """
+    if 'file_local' in arguments:
+        local = arguments['file_local']
+        return _file_size(local) if isinstance(local, str) else _size(local)
+    if 'files' in arguments and all(len(file) == 3 for file in arguments['files']):
+        # (remote path, content, mode) of sent files
+        return sum(_size(content) for _, content, _ in arguments['files'])
+    if isinstance(result, RemoteFileList):
+        downloaded = 'local_path' in arguments or 'files' in arguments
+        return sum(_file_size(path) for path in result) if downloaded else 0
+    if isinstance(result, list):
+        return sum(_size(r) for r in result)
+    return _size(result)
+
+
+def _describe(arguments):
+    host = next((arguments[a] for a in HOST_ARGS if a in arguments), '')
+    command = next((arguments[a] for a in COMMAND_ARGS if a in arguments), '')
+    if isinstance(command, list):
+        command = ' '.join(file[0] for file in command)
+    return host, command
+
+
+def instrumented(func):
+    """
+    Decorator recording every call of a helper (plain function or coroutine) in remote_stats.
+    """
+    signature = inspect.signature(func)
+
+    def _arguments(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return bound.arguments
+
+    def _record(arguments, result, start, nested):
+        host, command = _describe(arguments)
+        remote_stats.record(func.__name__, command, host, _transferred(arguments, result),
+                            time.monotonic() - start, getattr(world, 'name', ''), nested)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            arguments = _arguments(args, kwargs)
+            start = time.monotonic()
+            result = None
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            finally:
+                # coroutines interleave in one thread so they are never counted as nested
+                _record(arguments, result, start, False)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = _arguments(args, kwargs)
+        nested = remote_stats.enter()
+        start = time.monotonic()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            remote_stats.leave()
+            _record(arguments, result, start, nested)
+    return wrapper
+
+
+remote_stats = RemoteCallStats()
@@ -0,0 +1,1029 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Remote execution layer used by multi_server_functions.
+
+Every system under test gets a single authenticated SSH transport that lives for the whole
+forge session. Commands and file transfers are multiplexed as separate channels over that
+transport, so a remote call costs one channel open instead of a TCP + SSH handshake.
+
+When the system under test is the forge host itself, LocalTransport runs the very same
+commands with subprocess and copies files with shutil, results have the same shape.
+"""
+
+# pylint: disable=too-many-arguments
+
+import io
+import os
+import re
+import glob
+import stat
+import uuid
+import zlib
+import base64
+import shutil
+import fnmatch
+import socket
+import logging
+import tarfile
+import tempfile
+import threading
+import time
+import posixpath
+import subprocess
+import dataclasses
+
+import paramiko
+
+log = logging.getLogger('forge')
+
+# Commands are wrapped exactly like Fabric used to do it, so quoting in existing callers keeps working.
+SHELL = '/bin/bash -l -c'
+SUDO_PROMPT = 'sudo password:'
+CONNECT_TIMEOUT = 10
+KEEPALIVE_INTERVAL = 30
+# file name suffixes of archives with downloaded files
+ARCHIVE_SUFFIXES = {'zstd': '.tar.zst', 'gzip': '.tar.gz', 'none': '.tar'}
+
+
+class RemoteResult(str):
+    """
+    Stripped stdout of a remote command with the attributes callers expect:
+    .stdout, .stderr, .return_code, .succeeded and .failed.
+    If the command ran with combine_stderr, stdout holds both streams and stderr is empty.
+    """
+    def __new__(cls, stdout, stderr='', return_code=0, command='', real_command=''):
+        obj = super().__new__(cls, stdout)
+        obj.stderr = stderr
+        obj.return_code = return_code
+        obj.command = command
+        obj.real_command = real_command
+        obj.succeeded = return_code == 0
+        obj.failed = not obj.succeeded
+        return obj
+
+    @property
+    def stdout(self):
+        return str(self)
+
+
+class RemoteFileList(list):
+    """
+    List of local paths of downloaded files. .failed holds remote paths that could not be fetched.
+    """
+    def __init__(self, local_paths=(), failed=()):
+        super().__init__(local_paths)
+        self.failed = list(failed)
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
+def _shell_escape(cmd):
+    for char in ('"', '$', '`'):
+        cmd = cmd.replace(char, '\\' + char)
+    return cmd
+
+
+def _double_quote_unescape(cmd):
+    # what bash makes of the content of a double quoted string wrt. backslashes
+    out = []
+    i = 0
+    while i < len(cmd):
+        if cmd[i] == '\\' and i + 1 < len(cmd) and cmd[i + 1] in '$`"\\\n':
+            if cmd[i + 1] != '\n':
+                out.append(cmd[i + 1])
+            i += 2
+            continue
+        out.append(cmd[i])
+        i += 1
+    return ''.join(out)
+
+
+def sudo_prefix(sudo_user=None):
+    prefix = f"sudo -S -p '{SUDO_PROMPT}' "
+    if sudo_user is not None:
+        prefix += f'-u "{sudo_user}" '
+    return prefix
+
+
+def wrap_command(cmd, sudo=False, sudo_user=None):
+    """
+    Wrap command in a login shell and optionally in sudo.
+
+    :param cmd: command to be executed
+    :param sudo: run the command with sudo
+    :param sudo_user: user that sudo should switch to, root if None
+    :return: command line ready to be sent over exec channel
+    """
+    wrapped = f'{SHELL} "{_shell_escape(cmd)}"'
+    if sudo:
+        wrapped = sudo_prefix(sudo_user) + wrapped
+    return wrapped
+
+
+def split_host(host_string):
+    """
+    Split 'address[:port]' into address and port, IPv6 addresses without port are left intact.
+    """
+    if host_string.count(':') == 1:
+        host, port = host_string.split(':')
+        return host, int(port)
+    return host_string, 22
+
+
+class SSHSessionPool:
+    """
+    Session wide cache of SSH connections keyed by (address, user).
+
+    Connections are opened lazily, kept alive with SSH keepalives and replaced
+    when their transport is found dead.
+    """
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        # per connection locks, so connecting to one host does not hold up the others
+        self._key_locks = {}
+
+    @staticmethod
+    def _connect(host, user, password):
+        address, port = split_host(host)
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(address, port=port, username=user, password=password or None,
+                       timeout=CONNECT_TIMEOUT, allow_agent=True, look_for_keys=True)
+        client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+        log.debug('opened ssh connection to %s@%s', user, host)
+        return client
+
+    def get(self, host, user, password):
+        """
+        Return connected SSH client for the host, connect or reconnect if needed.
+        """
+        key = (host, user)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            client = self._clients.get(key)
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return client
+                client.close()
+            client = self._connect(host, user, password)
+            with self._lock:
+                self._clients[key] = client
+            return client
+
+    def evict(self, host, user):
+        """
+        Drop (and close) cached connection, next get() will open a new one.
+        """
+        with self._lock:
+            client = self._clients.pop((host, user), None)
+        if client is not None:
+            client.close()
+
+    def open_channel(self, host, user, password):
+        """
+        Open new session channel on the pooled transport. If the transport turns out
+        to be broken, reconnect once; a command is never sent twice.
+        """
+        for attempt in range(2):
+            try:
+                return self.get(host, user, password).get_transport().open_session()
+            except (paramiko.SSHException, socket.error, EOFError) as e:
+                self.evict(host, user)
+                if attempt:
+                    raise AssertionError(f'Network connection to {host} failed: {e}') from e
+        return None
+
+    def open_sftp(self, host, user, password):
+        for attempt in range(2):
+            try:
+                return self.get(host, user, password).open_sftp()
+            except (paramiko.SSHException, socket.error, EOFError) as e:
+                self.evict(host, user)
+                if attempt:
+                    raise AssertionError(f'Network connection to {host} failed: {e}') from e
+        return None
+
+    def close_all(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+class _OutputPump:
+    """
+    Read one stream of a command until EOF: capture it, echo full lines and answer sudo prompt.
+    Answer is passed to respond callable which writes to stdin of the command.
+    """
+    def __init__(self, recv, respond, prefix, echo, password, sink=None):
+        self.recv = recv
+        self.respond = respond
+        self.prefix = prefix
+        self.echo = echo
+        self.password = password
+        self.sink = sink
+        self.chunks = []
+        self._pending = b''
+        self._tail = b''
+
+    def _answer_prompt(self, data):
+        if self.password is None:
+            return
+        self._tail = (self._tail + data)[-len(SUDO_PROMPT):]
+        if self._tail == SUDO_PROMPT.encode():
+            self.respond(f'{self.password}\n'.encode())
+            self._tail = b''
+
+    def _echo(self, data, final=False):
+        self._pending += data
+        *lines, self._pending = self._pending.split(b'\n')
+        if final and self._pending:
+            lines.append(self._pending)
+            self._pending = b''
+        for line in lines:
+            print(self.prefix + line.decode('utf-8', 'replace').rstrip('\r'))
+
+    def run(self):
+        while True:
+            data = self.recv(65536)
+            if not data:
+                break
+            self._answer_prompt(data)
+            if self.sink is not None:
+                self.sink.write(data)
+                continue
+            self.chunks.append(data)
+            if self.echo:
+                self._echo(data)
+        if self.echo and self.sink is None:
+            self._echo(b'', final=True)
+
+    def text(self):
+        return b''.join(self.chunks).decode('utf-8', 'replace').replace(SUDO_PROMPT, '').strip()
+
+
+class RemoteStream:
+    """
+    Long running command started with stream(). Its stdout is passed to the sink as it comes,
+    closing the stream closes stdin of the command, which is how it is told to finish.
+    """
+    def __init__(self, run, close_input, send):
+        self._close_input = close_input
+        self._send = send
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(run,), daemon=True,
+                                        name='forge-stream')
+        self._thread.start()
+
+    def _run(self, run):
+        try:
+            self.result = run()
+        except AssertionError as e:
+            self.error = e
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def send(self, data):
+        """
+        Write bytes to stdin of the command.
+        """
+        self._send(data)
+
+    def close(self, timeout=5):
+        """
+        Send EOF to the command and wait for it to finish.
+        """
+        self._close_input()
+        self._thread.join(timeout)
+
+
+class _ArchiveSink:
+    """
+    Sink of a tar archive streamed by get_archive(): reads the header naming the compression,
+    then decompresses the stream on the fly and extracts the files from it in a separate thread,
+    or stores the stream as it is.
+    """
+    def __init__(self, files, keep_path=None):
+        """
+        :param files: list of (remote absolute path or glob, local path), see _Transport.get_archive
+        :param keep_path: store the compressed archive at this path (suffix is added) instead of extracting it
+        """
+        self.files = files
+        self.keep_path = keep_path
+        self.compression = None
+        self.local_files = []
+        self.matched = set()
+        self.error = None
+        self._header = b''
+        self._decompress = None
+        self._writer = None
+        self._thread = None
+
+    def _start(self):
+        if self.keep_path is not None:
+            self.keep_path += ARCHIVE_SUFFIXES[self.compression]
+            self._writer = open(self.keep_path, 'wb')  # pylint: disable=consider-using-with
+            self.local_files.append(self.keep_path)
+            return
+        read_fd, write_fd = os.pipe()
+        self._writer, reader = os.fdopen(write_fd, 'wb'), os.fdopen(read_fd, 'rb')
+        if self.compression == 'gzip':
+            self._decompress = zlib.decompressobj(wbits=31)
+        extract = self._extract_zstd if self.compression == 'zstd' else self._extract
+        self._thread = threading.Thread(target=extract, args=(reader,), daemon=True, name='forge-archive')
+        self._thread.start()
+
+    def _targets(self, name):
+        remote_file = '/' + name.lstrip('/')
+        targets = []
+        for remote_path, local_path in self.files:
+            if any(fnmatch.fnmatchcase(remote_file, pattern) for pattern in remote_path.split()):
+                self.matched.add(remote_path)
+                if os.path.isdir(local_path) or local_path.endswith('/'):
+                    local_path = os.path.join(local_path, posixpath.basename(remote_file))
+                targets.append(local_path)
+        return targets
+
+    def _extract(self, reader):
+        try:
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                for member in tar:
+                    targets = self._targets(member.name) if member.isfile() else []
+                    for i, target in enumerate(targets):
+                        if os.path.dirname(target):
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                        if i == 0:
+                            with open(target, 'wb') as local_file:
+                                shutil.copyfileobj(tar.extractfile(member), local_file)
+                        else:
+                            # the same file was asked for more times
+                            shutil.copyfile(targets[0], target)
+                        self.local_files.append(target)
+        except (tarfile.TarError, OSError) as e:
+            self.error = e
+        finally:
+            # keep reading, so the writer is never blocked by a full pipe
+            while reader.read(65536):
+                pass
+            reader.close()
+
+    def _extract_zstd(self, reader):
+        # zstd reads the compressed stream from the pipe, the archive is extracted from its output
+        try:
+            proc = subprocess.Popen(['zstd', '-d', '-c', '-q'],  # pylint: disable=consider-using-with
+                                    stdin=reader, stdout=subprocess.PIPE)
+        except OSError as e:
+            self.error = e
+            while reader.read(65536):
+                pass
+            reader.close()
+            return
+        with proc:
+            reader.close()
+            self._extract(proc.stdout)
+        if proc.returncode != 0 and self.error is None:
+            self.error = 'zstd failed'
+
+    def _feed(self, data):
+        if self._decompress is not None:
+            try:
+                data = self._decompress.decompress(data)
+            except zlib.error as e:
+                self.error = e
+                self._decompress = None
+                self._writer.close()
+                return
+        if data and not self._writer.closed:
+            try:
+                self._writer.write(data)
+            except (BrokenPipeError, ValueError):
+                pass
+
+    def write(self, data):
+        if self.compression is None:
+            self._header += data
+            if b'\n' not in self._header:
+                return
+            header, data = self._header.split(b'\n', 1)
+            self.compression = header.decode('utf-8', 'replace').split()[-1]
+        if not data:
+            return
+        if self._writer is None:
+            # started only now, nothing follows the header if none of the files exists
+            self._start()
+        self._feed(data)
+
+    def close(self):
+        """
+        End of the stream: flush everything and wait for the extraction to finish.
+        """
+        if self._writer is None:
+            return
+        if self._decompress is not None:
+            data, self._decompress = self._decompress.flush(), None
+            self._feed(data)
+        if not self._writer.closed:
+            try:
+                self._writer.close()
+            except BrokenPipeError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _Transport:
+    """
+    Parts of the transport interface which are built on top of execute().
+    """
+    def execute(self, cmd, host, user, password, sudo=False, sudo_user=None, pty=False,
+                hide_all=False, ignore_errors=False, stdout_sink=None, input_data=None, combine_stderr=False):
+        raise NotImplementedError
+
+    def stream(self, cmd, host, user, password, sink, sudo=False, stderr_sink=None):
+        raise NotImplementedError
+
+    def sudo_prefix(self, sudo_user=None):
+        return sudo_prefix(sudo_user)
+
+    @staticmethod
+    def _check(result, host, ignore_errors):
+        if result.failed and not ignore_errors:
+            assert False, f'Command "{result.command}" failed on {host} with exit code {result.return_code}:\n' \
+                          f'{result}\n{result.stderr}'
+        return result
+
+    def put_files(self, files, host, user, password):
+        """
+        Upload several files at once: pack them into in-memory tar archive, stream it to remote
+        system over stdin of one command and extract it there with sudo, keeping the modes.
+
+        :param files: list of (remote absolute path, content as str or bytes, mode or None for 0644)
+        :return: RemoteFileList of remote paths
+        """
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for remote_path, content, mode in files:
+                if isinstance(content, str):
+                    content = content.encode()
+                if isinstance(mode, str):
+                    mode = int(mode, 8)
+                info = tarfile.TarInfo(remote_path.lstrip('/'))
+                info.size = len(content)
+                info.mode = (mode if mode is not None else 0o644) & 0o7777
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(content))
+        data = archive.getvalue()
+        # the archive is stored first so that stdin is free again for sudo password prompt
+        cmd = f'f=$(mktemp) && head -c {len(data)} > "$f" && ' \
+              f'{self.sudo_prefix()}tar -xpf "$f" -C / --no-same-owner; rc=$?; rm -f "$f"; exit $rc'
+        self.execute(cmd, host, user, password, hide_all=True, input_data=data)
+        return RemoteFileList([remote_path for remote_path, _, _ in files])
+
+    def list_files(self, remote_path, host, user, password):
+        """
+        Expand remote path (it may be a glob) to the list of existing regular files.
+        """
+        cmd = f'for f in {remote_path}; do [ -f "$f" ] && echo "$f"; done; true'
+        result = self.execute(cmd, host, user, password, sudo=True, hide_all=True, ignore_errors=True)
+        return [line for line in result.splitlines() if line]
+
+    def _fetch(self, remote_file, target, host, user, password):
+        with open(target, 'wb') as sink:
+            result = self.execute(f'cat "{remote_file}"', host, user, password, sudo=True, hide_all=True,
+                                  ignore_errors=True, stdout_sink=sink)
+        return result.succeeded
+
+    def get(self, remote_path, local_path, host, user, password, hide_all=False, ignore_errors=False):
+        """
+        Download file(s) matching remote path (glob allowed) with sudo privileges.
+
+        :param remote_path: remote file path or glob
+        :param local_path: local file or directory path
+        :return: RemoteFileList of downloaded local files
+        """
+        remote_files = self.list_files(remote_path, host, user, password)
+        local_files = []
+        failed = [] if remote_files else [remote_path]
+        for remote_file in remote_files:
+            target = local_path
+            if os.path.isdir(local_path) or local_path.endswith('/'):
+                target = os.path.join(local_path, posixpath.basename(remote_file))
+            if os.path.dirname(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not hide_all:
+                print(f'[{host}] download: {target} <- {remote_file}')
+            if self._fetch(remote_file, target, host, user, password):
+                local_files.append(target)
+            else:
+                if os.path.exists(target):
+                    os.remove(target)
+                failed.append(remote_file)
+        result = RemoteFileList(local_files, failed)
+        if result.failed and not ignore_errors:
+            assert False, f'Downloading {", ".join(result.failed)} from {host} failed'
+        return result
+
+    def get_archive(self, files, host, user, password, compression='zstd', keep_path=None,
+                    hide_all=False, ignore_errors=False, remove=None):
+        """
+        Download many files at once with sudo privileges: one remote command packs them with tar,
+        compresses the archive with zstd (gzip if zstd is not installed on either side) and streams
+        it over stdout; it is decompressed and extracted while it is being received.
+
+        :param files: list of (remote absolute path or glob, local file or directory path)
+        :param compression: 'zstd', 'gzip' or 'none'
+        :param keep_path: if given, the compressed archive is stored at this path with suffix
+                          from ARCHIVE_SUFFIXES and files are not extracted
+        :param remove: remote path removed by the same command once the archive is sent
+        :return: RemoteFileList of local files (or of the archive), failed holds remote paths
+                 that did not match any file
+        """
+        if compression == 'zstd' and shutil.which('zstd') is None:
+            compression = 'gzip'
+        if compression == 'zstd':
+            cmd = 'c=gzip; command -v zstd >/dev/null 2>&1 && c=zstd\n'
+        else:
+            cmd = f'c={compression}\n'
+        # paths are given relative to / so that tar (GNU or busybox) does not complain about them
+        cmd += f'set --; for f in {" ".join(remote_path for remote_path, _ in files)}; do ' \
+               '[ -f "$f" ] && set -- "$@" "${f#/}"; done\n'
+        cmd += 'echo "forge-archive $c"\n'
+        cmd += 'if [ $# -eq 0 ]; then true\n'
+        cmd += 'elif [ $c = none ]; then tar -C / -cf - "$@"\n'
+        cmd += 'else tar -C / -cf - "$@" | $c -c; fi'
+        if remove is not None:
+            cmd += f'\nrm -rf {remove}'
+        if not hide_all:
+            for remote_path, local_path in files:
+                print(f'[{host}] download: {keep_path or local_path} <- {remote_path}')
+        sink = _ArchiveSink(files, keep_path)
+        try:
+            result = self.execute(cmd, host, user, password, sudo=True, hide_all=True, ignore_errors=True,
+                                  stdout_sink=sink)
+        finally:
+            sink.close()
+        # tar complains about logs that grow while being read, what made it into the archive is used anyway
+        if sink.compression is None or sink.error is not None:
+            log.warning('downloading archive from %s failed: %s %s', host, sink.error or '', result.stderr)
+            failed = [remote_path for remote_path, _ in files]
+        elif keep_path is None:
+            failed = [remote_path for remote_path, _ in files if remote_path not in sink.matched]
+        else:
+            # contents of the stored archive are not known without unpacking it
+            failed = []
+        result = RemoteFileList(sink.local_files, failed)
+        if result.failed and not ignore_errors:
+            assert False, f'Downloading {", ".join(result.failed)} from {host} failed'
+        return result
+
+
+class SSHTransport(_Transport):
+    """
+    Command execution and file transfer over pooled SSH connections.
+    """
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else SSHSessionPool()
+
+    def execute(self, cmd, host, user, password, sudo=False, sudo_user=None, pty=False,
+                hide_all=False, ignore_errors=False, stdout_sink=None, input_data=None, combine_stderr=False):
+        """
+        Execute command on remote host.
+
+        :param cmd: command to execute
+        :param host: management address of the remote system
+        :param user: ssh user name
+        :param password: ssh (and sudo) password
+        :param sudo: run with sudo
+        :param sudo_user: user sudo should switch to
+        :param pty: request pseudo terminal
+        :param hide_all: do not print command and its output
+        :param ignore_errors: do not fail on non zero exit code
+        :param stdout_sink: binary file object to write stdout to instead of capturing it
+        :param input_data: bytes written to stdin of the command, stdin is left open
+        :param combine_stderr: capture stderr together with stdout, as Fabric did by default
+        :return: RemoteResult
+        """
+        real_command = wrap_command(cmd, sudo=sudo, sudo_user=sudo_user)
+        if not hide_all:
+            print(f'[{host}] {"sudo" if sudo else "run"}: {cmd}')
+        channel = self.pool.open_channel(host, user, password)
+        try:
+            if pty:
+                channel.get_pty()
+            channel.set_combine_stderr(combine_stderr)
+            channel.exec_command(real_command)
+            if input_data is not None:
+                channel.sendall(input_data)
+            # without pty sudo asks for the password on stderr only
+            out = _OutputPump(channel.recv, channel.sendall, f'[{host}] out: ', not hide_all,
+                              password if sudo and (pty or combine_stderr) else None, stdout_sink)
+            err = _OutputPump(channel.recv_stderr, channel.sendall, f'[{host}] err: ', not hide_all, password)
+            err_thread = threading.Thread(target=err.run, daemon=True)
+            err_thread.start()
+            out.run()
+            err_thread.join()
+            return_code = channel.recv_exit_status()
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            self.pool.evict(host, user)
+            raise AssertionError(f'Network connection to {host} failed: {e}') from e
+        finally:
+            channel.close()
+
+        return self._check(RemoteResult(out.text(), err.text(), return_code, cmd, real_command), host, ignore_errors)
+
+    def stream(self, cmd, host, user, password, sink, sudo=False, stderr_sink=None):
+        """
+        Start command on remote host and pass its stdout to sink.write() in background,
+        stdin of the command is kept open until the stream is closed.
+        stderr is captured in the result, or passed to stderr_sink if it is given.
+
+        :return: RemoteStream, its result is RemoteResult without stdout once the command finished
+        """
+        real_command = wrap_command(cmd, sudo=sudo)
+        channel = self.pool.open_channel(host, user, password)
+        try:
+            channel.exec_command(real_command)
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            channel.close()
+            self.pool.evict(host, user)
+            raise AssertionError(f'Network connection to {host} failed: {e}') from e
+
+        def run():
+            try:
+                out = _OutputPump(channel.recv, channel.sendall, '', False, None, sink)
+                err = _OutputPump(channel.recv_stderr, channel.sendall, '', False, password, stderr_sink)
+                err_thread = threading.Thread(target=err.run, daemon=True)
+                err_thread.start()
+                out.run()
+                err_thread.join()
+                return RemoteResult('', err.text(), channel.recv_exit_status(), cmd, real_command)
+            except (paramiko.SSHException, socket.error, EOFError) as e:
+                raise AssertionError(f'Network connection to {host} failed: {e}') from e
+            finally:
+                channel.close()
+
+        def close_input():
+            try:
+                channel.shutdown_write()
+            except (paramiko.SSHException, socket.error, EOFError):
+                pass
+
+        def send(data):
+            try:
+                channel.sendall(data)
+            except (paramiko.SSHException, socket.error, EOFError):
+                pass
+
+        return RemoteStream(run, close_input, send)
+
+    def put(self, source, remote_path, host, user, password, mode=None):
+        """
+        Upload file (path or binary file object) and move it into place with sudo.
+
+        :param source: local path or file object
+        :param remote_path: remote destination file or directory
+        :param mode: remote file mode, int or octal string
+        """
+        sftp = self.pool.open_sftp(host, user, password)
+        try:
+            try:
+                if stat.S_ISDIR(sftp.stat(remote_path).st_mode) and isinstance(source, str):
+                    remote_path = posixpath.join(remote_path, os.path.basename(source))
+            except IOError:
+                pass
+            # bounce the file through user's home directory and sudo mv it into place
+            tmp_path = uuid.uuid4().hex
+            if isinstance(source, str):
+                sftp.put(source, tmp_path)
+            else:
+                source.seek(0)
+                sftp.putfo(source, tmp_path)
+        finally:
+            sftp.close()
+
+        cmd = ''
+        if mode is not None:
+            if isinstance(mode, str):
+                mode = int(mode, 8)
+            cmd = f'chmod {mode & 0o7777:o} "{tmp_path}" && '
+        cmd += f'mv "{tmp_path}" "{remote_path}"'
+        self.execute(cmd, host, user, password, sudo=True, hide_all=True)
+        return RemoteFileList([remote_path])
+
+
+class LocalTransport(_Transport):
+    """
+    Command execution and file transfer on the forge host itself, for setups where
+    the system under test runs on the same machine. Host and credentials are accepted
+    only to keep the interface of SSHTransport; commands run in the home directory
+    of the current user, as they would in an SSH session.
+    """
+    def __init__(self):
+        self.home = os.path.expanduser('~')
+        # sudo is not needed (and often not even installed) when forge runs as root
+        self.privileged = os.geteuid() == 0
+
+    def sudo_prefix(self, sudo_user=None):
+        if self.privileged and sudo_user is None:
+            return ''
+        return sudo_prefix(sudo_user)
+
+    def _path(self, path):
+        return os.path.join(self.home, os.path.expanduser(path))
+
+    def execute(self, cmd, host, user, password, sudo=False, sudo_user=None, pty=False,
+                hide_all=False, ignore_errors=False, stdout_sink=None, input_data=None, combine_stderr=False):
+        """
+        Execute command locally, parameters and result are the same as in SSHTransport.execute;
+        pty is ignored.
+        """
+        real_command = f'{SHELL} "{_shell_escape(cmd)}"'
+        if sudo:
+            real_command = self.sudo_prefix(sudo_user) + real_command
+        if not hide_all:
+            print(f'[{host}] {"sudo" if sudo else "run"}: {cmd}')
+        stdin_lock = threading.Lock()
+        with subprocess.Popen(real_command, shell=True, cwd=self.home, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT if combine_stderr else subprocess.PIPE) as proc:
+
+            def respond(data):
+                with stdin_lock:
+                    try:
+                        proc.stdin.write(data)
+                        proc.stdin.flush()
+                    except (BrokenPipeError, ValueError):
+                        pass
+
+            # stdin stays open until the command exits, like in SSH session, sudo reads the password from it
+            if input_data is not None:
+                # write from a thread, the command may produce output before it reads all its input
+                threading.Thread(target=respond, args=(input_data,), daemon=True).start()
+            out = _OutputPump(lambda n: os.read(proc.stdout.fileno(), n), respond, f'[{host}] out: ', not hide_all,
+                              password if sudo and combine_stderr else None, stdout_sink)
+            # sudo of a batch step asks as well, not only sudo of the whole command
+            err = _OutputPump(lambda n: os.read(proc.stderr.fileno(), n) if proc.stderr else b'', respond,
+                              f'[{host}] err: ', not hide_all, password)
+            err_thread = threading.Thread(target=err.run, daemon=True)
+            err_thread.start()
+            out.run()
+            err_thread.join()
+            return_code = proc.wait()
+            with stdin_lock:
+                proc.stdin.close()
+        return self._check(RemoteResult(out.text(), err.text(), return_code, cmd, real_command), host, ignore_errors)
+
+    def stream(self, cmd, host, user, password, sink, sudo=False, stderr_sink=None):
+        """
+        Start command locally, parameters and result are the same as in SSHTransport.stream.
+        """
+        real_command = f'{SHELL} "{_shell_escape(cmd)}"'
+        if sudo:
+            real_command = self.sudo_prefix() + real_command
+        stdin_lock = threading.Lock()
+        # the command is started by run() in the stream thread, input waits until it is
+        started = threading.Event()
+        proc = None
+
+        def respond(data):
+            started.wait()
+            with stdin_lock:
+                try:
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+                except (AttributeError, BrokenPipeError, ValueError):
+                    pass
+
+        def run():
+            nonlocal proc
+            try:
+                with subprocess.Popen(real_command, shell=True, cwd=self.home, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+                    started.set()
+                    out = _OutputPump(lambda n: os.read(proc.stdout.fileno(), n), respond, '', False, None, sink)
+                    err = _OutputPump(lambda n: os.read(proc.stderr.fileno(), n), respond, '', False,
+                                      password, stderr_sink)
+                    err_thread = threading.Thread(target=err.run, daemon=True)
+                    err_thread.start()
+                    out.run()
+                    err_thread.join()
+                    return_code = proc.wait()
+                    with stdin_lock:
+                        proc.stdin.close()
+            finally:
+                started.set()
+            return RemoteResult('', err.text(), return_code, cmd, real_command)
+
+        def close_input():
+            started.wait()
+            with stdin_lock:
+                if proc is not None:
+                    proc.stdin.close()
+
+        return RemoteStream(run, close_input, respond)
+
+    def put(self, source, remote_path, host, user, password, mode=None):
+        """
+        Copy file (path or binary file object) into place, with sudo mv if forge is not run by root.
+        """
+        remote_path = self._path(remote_path)
+        if os.path.isdir(remote_path) and isinstance(source, str):
+            remote_path = os.path.join(remote_path, os.path.basename(source))
+        if isinstance(mode, str):
+            mode = int(mode, 8)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(remote_path) if self.privileged else self.home)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if isinstance(source, str):
+                    with open(source, 'rb') as src:
+                        shutil.copyfileobj(src, tmp)
+                else:
+                    source.seek(0)
+                    shutil.copyfileobj(source, tmp)
+            # mkstemp creates the file with 0600, uploaded files get 0644 unless asked otherwise
+            os.chmod(tmp_path, (mode if mode is not None else 0o644) & 0o7777)
+            if self.privileged:
+                os.replace(tmp_path, remote_path)
+            else:
+                self.execute(f'mv "{tmp_path}" "{remote_path}"', host, user, password, sudo=True, hide_all=True)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return RemoteFileList([remote_path])
+
+    def get_archive(self, files, host, user, password, compression='zstd', keep_path=None,
+                    hide_all=False, ignore_errors=False, remove=None):
+        """
+        Same as _Transport.get_archive, but files which are not sent anywhere are just copied,
+        an archive is made only if it is to be stored.
+        """
+        if keep_path is not None:
+            return super().get_archive(files, host, user, password, compression, keep_path,
+                                       hide_all=hide_all, ignore_errors=ignore_errors, remove=remove)
+        local_files = RemoteFileList()
+        for remote_path, local_path in files:
+            result = self.get(remote_path, local_path, host, user, password, hide_all=hide_all, ignore_errors=True)
+            local_files.extend(result)
+            local_files.failed.extend(result.failed)
+        if remove is not None:
+            self.execute(f'rm -rf {remove}', host, user, password, sudo=True, hide_all=True, ignore_errors=True)
+        if local_files.failed and not ignore_errors:
+            assert False, f'Downloading {", ".join(local_files.failed)} from {host} failed'
+        return local_files
+
+    def list_files(self, remote_path, host, user, password):
+        if not self.privileged:
+            return super().list_files(remote_path, host, user, password)
+        files = []
+        for pattern in remote_path.split():
+            files += sorted(f for f in glob.glob(self._path(pattern)) if os.path.isfile(f))
+        return files
+
+    def _fetch(self, remote_file, target, host, user, password):
+        if not self.privileged:
+            return super()._fetch(remote_file, target, host, user, password)
+        try:
+            shutil.copyfile(remote_file, target)
+        except OSError:
+            return False
+        return True
+
+
+@dataclasses.dataclass
+class BatchEntry:
+    """
+    Command queued in RemoteBatch. .result is RemoteResult once the batch was executed,
+    it stays None if the batch was stopped by an earlier failing command or did not run at all.
+    """
+    cmd: str
+    sudo: bool
+    sudo_user: str
+    hide_all: bool
+    ignore_errors: bool
+    result: RemoteResult = None
+
+
+class RemoteBatch:
+    """
+    Commands queued for a single host and executed as one generated script in one round trip.
+
+    Each command runs in its own shell exactly as if it was executed separately, its stdout,
+    stderr and exit code are collected separately. Execution stops on the first failing
+    command that does not ignore errors, just like sequential execution would.
+    """
+    def __init__(self, transport, host, user, password):
+        self.transport = transport
+        self.host = host
+        self.user = user
+        self.password = password
+        self.entries = []
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        """
+        Register function called without arguments once the batch was executed successfully.
+        """
+        self.callbacks.append(callback)
+
+    def run(self, cmd, hide_all=False, ignore_errors=False):
+        entry = BatchEntry(cmd, False, None, hide_all, ignore_errors)
+        self.entries.append(entry)
+        return entry
+
+    def sudo(self, cmd, hide_all=False, ignore_errors=False, sudo_user=None):
+        entry = BatchEntry(cmd, True, sudo_user, hide_all, ignore_errors)
+        self.entries.append(entry)
+        return entry
+
+    def remove(self, remote_path, hide_all=True):
+        return self.sudo('rm -rf ' + remote_path, hide_all=hide_all)
+
+    def write(self, remote_path, content, mode=None):
+        """
+        Queue writing content (str or bytes) to a remote file with sudo privileges.
+        """
+        if isinstance(content, str):
+            content = content.encode()
+        data = base64.b64encode(content).decode()
+        cmd = f'echo {data} | base64 -d > "{remote_path}"'
+        if mode is not None:
+            if isinstance(mode, str):
+                mode = int(mode, 8)
+            cmd += f' && chmod {mode & 0o7777:o} "{remote_path}"'
+        return self.sudo(cmd, hide_all=True)
+
+    def _script(self, token):
+        lines = []
+        for i, entry in enumerate(self.entries):
+            # stdin is kept for sudo password prompts, commands themselves get /dev/null
+            cmd = 'exec </dev/null; ' + _double_quote_unescape(_shell_escape(entry.cmd))
+            prefix = self.transport.sudo_prefix(entry.sudo_user) if entry.sudo else ''
+            lines.append(f'c=$(echo {base64.b64encode(cmd.encode()).decode()} | base64 -d)')
+            lines.append(f'echo {token}-{i}-begin; echo {token}-{i}-begin >&2')
+            lines.append(f'{prefix}{SHELL} "$c"')
+            lines.append(f'rc=$?; echo; echo {token}-{i}-end-$rc; echo >&2; echo {token}-{i}-end >&2')
+            if not entry.ignore_errors:
+                lines.append('[ $rc -eq 0 ] || exit 0')
+        return '\n'.join(lines) + '\n'
+
+    def execute(self):
+        """
+        Execute all queued commands, print their output unless hidden and
+        fail on the first failing command that does not ignore errors. Failing batch
+        (e.g. lost connection) fails as well, callbacks are called only if all commands ran.
+
+        :return: list of RemoteResult
+        """
+        if not self.entries:
+            for callback in self.callbacks:
+                callback()
+            return []
+        token = f'__forge_batch_{uuid.uuid4().hex}'
+        script = self._script(token).encode()
+        result = self.transport.execute(f'eval "$(head -c {len(script)})"', self.host, self.user, self.password,
+                                        hide_all=True, ignore_errors=True, input_data=script)
+        for i, entry in enumerate(self.entries):
+            out = re.search(f'{token}-{i}-begin\n(.*)\n{token}-{i}-end-([0-9]+)\n', result.stdout + '\n', re.S)
+            if out is None:
+                break
+            err = re.search(f'{token}-{i}-begin\n(.*)\n{token}-{i}-end\n', result.stderr + '\n', re.S)
+            stderr = err.group(1).replace(SUDO_PROMPT, '').strip() if err else ''
+            return_code = int(out.group(2))
+            entry.result = RemoteResult(out.group(1).strip(), stderr, return_code, entry.cmd,
+                                        wrap_command(entry.cmd, entry.sudo, entry.sudo_user))
+            if not entry.hide_all:
+                print(f'[{self.host}] {"sudo" if entry.sudo else "run"}: {entry.cmd}')
+                for line in entry.result.splitlines():
+                    print(f'[{self.host}] out: {line}')
+                for line in stderr.splitlines():
+                    print(f'[{self.host}] err: {line}')
+            if entry.result.failed and not entry.ignore_errors:
+                assert False, f'Command "{entry.cmd}" failed on {self.host} with exit code {return_code}:\n' \
+                              f'{entry.result}\n{stderr}'
+        missing = [entry for entry in self.entries if entry.result is None]
+        if result.failed or missing:
+            cmd = missing[0].cmd if missing else self.entries[-1].cmd
+            assert False, f'Batch of commands failed on {self.host} at command "{cmd}":\n{result}\n{result.stderr}'
+        for callback in self.callbacks:
+            callback()
+        return [entry.result for entry in self.entries]
+
+
+session_pool = SSHSessionPool()
+ssh = SSHTransport(session_pool)
+local = LocalTransport()
@@ -18,6 +18,7 @@
 # pylint: disable=unused-argument
 # pylint: disable=useless-object-inheritance
 
+import os
 import random
 import json
 import importlib
@@ -30,6 +31,7 @@ from .forge_cfg import world, step
 from .protosupport import dns, multi_protocol_functions
 from .protosupport.multi_protocol_functions import test_define_value, substitute_vars
 from .softwaresupport.multi_server_functions import start_tcpdump, stop_tcpdump, download_tcpdump_capture
+from .protosupport.packet_log import packet_log, selected_directions
 
 log = logging.getLogger('forge')
 
@@ -687,6 +689,20 @@ def DORA(address=None, options=None, exchange='full', response_type='ACK', chadd
     return dhcpmsg.DORA(address, options, exchange, response_type, chaddr, init_reboot, subnet_mask, fqdn)
 
 
+async def dora(address=None, options=None, exchange='full', response_type='ACK', chaddr='ff:01:02:03:ff:04',
+               init_reboot=False, subnet_mask='255.255.255.0', fqdn=None, ctx=None):
+    """
+    DORA() as coroutine, client state is kept in ctx (ExchangeContext, new one if None)
+    instead of world, so many clients can run at once:
+        async def clients():
+            await asyncio.gather(*[srv_msg.dora(f'192.168.50.{i}', chaddr=f'ff:01:02:03:ff:{i:02x}')
+                                   for i in range(1, 51)])
+        asyncio.run(clients())
+    """
+    return await dhcpmsg.dora(address, options, exchange, response_type, chaddr, init_reboot, subnet_mask, fqdn,
+                              ctx=ctx)
+
+
 def check_IA_NA(address, status_code=DHCPv6_STATUS_CODES['Success'], expect=True):
     return dhcpmsg.check_IA_NA(address, status_code, expect)
 
@@ -710,6 +726,28 @@ def SARR(address=None, delegated_prefix=None, relay_information=False,
                         status_code, exchange, duid, iaid, linkaddr, ifaceid)
 
 
+async def sa(address=None, delegated_prefix=None, relay_information=False,
+             status_code=DHCPv6_STATUS_CODES['Success'], duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
+             linkaddr='2001:db8:1::1000', ifaceid='port1234', ctx=None):
+    """
+    SA() as coroutine, client state is kept in ctx (ExchangeContext, new one if None).
+    """
+    return await dhcpmsg.sa(address, delegated_prefix, relay_information, status_code, duid, iaid,
+                            linkaddr, ifaceid, ctx=ctx)
+
+
+async def sarr(address=None, delegated_prefix=None, relay_information=False,
+               status_code=DHCPv6_STATUS_CODES['Success'], exchange='full',
+               duid='00:03:00:01:f6:f5:f4:f3:f2:01', iaid=None,
+               linkaddr='2001:db8:1::1000', ifaceid='port1234', ctx=None):
+    """
+    SARR() as coroutine, client state is kept in ctx (ExchangeContext, new one if None)
+    instead of world, so many clients can run at once.
+    """
+    return await dhcpmsg.sarr(address, delegated_prefix, relay_information,
+                              status_code, exchange, duid, iaid, linkaddr, ifaceid, ctx=ctx)
+
+
 def BOOTP_REQUEST_and_BOOTP_REPLY(address: str,
                                   chaddr: str = 'ff:01:02:03:ff:04',
                                   client_id: str = None):
@@ -718,6 +756,19 @@ def BOOTP_REQUEST_and_BOOTP_REPLY(address: str,
                                                  client_id=client_id)
 
 
+async def bootp_request_and_bootp_reply(address: str,
+                                        chaddr: str = 'ff:01:02:03:ff:04',
+                                        client_id: str = None,
+                                        ctx=None):
+    """
+    BOOTP_REQUEST_and_BOOTP_REPLY() as coroutine, client state is kept in ctx (ExchangeContext, new one if None).
+    """
+    return await dhcpmsg.bootp_request_and_bootp_reply(address=address,
+                                                       chaddr=chaddr,
+                                                       client_id=client_id,
+                                                       ctx=ctx)
+
+
 def get_address_facing_remote_address(addr: str = world.f_cfg.mgmt_address):
     """
     Get address of an interface that is facing other address in forge setup
@@ -775,6 +826,27 @@ def get_tcpdump_capture(location, file_name):
     download_tcpdump_capture(location=location, file_name=file_name)
 
 
+def show_packets(dump: str = 'show', packets_from: str = 'both'):
+    """
+    Print packets exchanged by the test so far (up to PACKET_LOG_SIZE last ones).
+    :param dump: 'show' for scapy show() of each packet, 'hexdump' or 'summary'
+    :param packets_from: 'client', 'server' or 'both', like SHOW_PACKETS_FROM setting
+    """
+    print(packet_log.render(selected_directions(packets_from), dump=dump))
+
+
+def save_packets(file_name: str = 'packets.pcap', packets_from: str = 'both'):
+    """
+    Write packets exchanged by the test so far (up to PACKET_LOG_SIZE last ones) to pcap file
+    in tests results, without running tcpdump
+    :param file_name: name of capture file
+    :param packets_from: 'client', 'server' or 'both', like SHOW_PACKETS_FROM setting
+    :return: number of saved packets
+    """
+    return packet_log.write_pcap(os.path.join(world.cfg["test_result_dir"], file_name),
+                                 selected_directions(packets_from))
+
+
 def tcp_messages_include(**kwargs):
     dhcpmsg.tcp_messages_include(**kwargs)
 
@@ -14,8 +14,10 @@
 # pylint: disable=unused-import
 
 import os
+import glob
 import time
 import logging
+import functools
 from shutil import rmtree
 import subprocess
 import importlib
@@ -27,8 +29,16 @@ from scapy.layers.dhcp6 import DUID_LLT
 from . import dependencies
 from .forge_cfg import world
 from .softwaresupport.multi_server_functions import make_tarfile, archive_file_name, \
-    fabric_run_command, start_tcpdump, stop_tcpdump, download_tcpdump_capture
+    fabric_run_command, start_tcpdump, stop_tcpdump, download_tcpdump_capture, close_remote_connections, \
+    run_for_each_server, collect_downloads, artifacts_staging_dir
 from .softwaresupport import kea
+from .softwaresupport.remote_stats import remote_stats
+from .protosupport.log_follower import log_followers
+from .protosupport.log_mirror import log_mirrors
+from .protosupport.packet_endpoint import packet_endpoints
+from .protosupport.packet_log import packet_log, selected_directions
+from .protosupport.exchange_context import exchange_defaults
+from .protosupport.multi_protocol_functions import get_log_mirror
 from . import logging_facility
 from .srv_control import start_srv
 
@@ -219,15 +229,9 @@ def _define_software(dhcp_version):
 
 
 def declare_all(dhcp_version=None):
-    world.climsg = []  # Message(s) to be sent
-    world.srvmsg = []  # Server's response(s)
-    world.rlymsg = []  # Server's response(s) Relayed by Relay Agent
-    world.tmpmsg = []  # container for temporary stored messages
-    world.tcpmsg = []  # Server's response(s) via TCP
-    world.cliopts = []  # Option(s) to be included in the next message sent
-    world.relayopts = []  # option(s) to be included in Relay Forward message.
-    world.rsoo = []  # List of relay-supplied-options
-    world.savedmsg = {0: []}  # Saved option(s)
+    # messages and options of the current exchange
+    for name, value in exchange_defaults().items():
+        setattr(world, name, value)
     world.define = []  # temporary define variables
 
     proto = dhcp_version if dhcp_version else world.f_cfg.proto
@@ -235,13 +239,6 @@ def declare_all(dhcp_version=None):
     if proto == 'v4_bootp':
         proto = 'v4'
     world.proto = world.f_cfg.proto = proto
-    world.oro = None
-    world.vendor = []
-    world.iaad = []
-    world.iapd = []
-    world.opts = []
-    world.subopts = []
-    world.message_fields = []
     world.subnet_add = True
     world.control_channel = None  # last received response from any communication channel
     world.cfg = {}
@@ -344,13 +341,16 @@ def test_start():
             kea.db_setup(dest=world.f_cfg.mgmt_address_2)
 
 
+def _clear_server(remote_server):
+    for sut in world.f_cfg.software_under_test:
+        functions = importlib.import_module("src.softwaresupport.%s.functions" % sut)
+        # every software have something else to clear. Put in clear_all() whatever you need
+        functions.clear_all(destination_address=remote_server)
+
+
 def _clear_remainings():
     if not world.f_cfg.no_server_management:
-        for remote_server in world.f_cfg.multiple_tested_servers:
-            for sut in world.f_cfg.software_under_test:
-                functions = importlib.import_module("src.softwaresupport.%s.functions" % sut)
-                # every software have something else to clear. Put in clear_all() whatever you need
-                functions.clear_all(destination_address=remote_server)
+        run_for_each_server(_clear_server, world.f_cfg.multiple_tested_servers)
 
 
 # @before.each_scenario
@@ -435,6 +435,10 @@ def initialize(scenario):
     if not os.path.exists(world.cfg["test_result_dir"] + '/dns') and world.dns_enable:
         os.makedirs(world.cfg["test_result_dir"] + '/dns')
 
+    # packets of this test only
+    packet_log.resize(world.f_cfg.packet_log_size)
+    packet_log.clear()
+
     if world.f_cfg.tcpdump:
         start_tcpdump(auto_start_dns=True)
     if world.f_cfg.tcpdump_on_remote_system:
@@ -442,6 +446,42 @@ def initialize(scenario):
 
     _clear_remainings()
 
+    # logs are empty now, copy them to test results directory as they are written
+    if world.f_cfg.log_mirror and not world.f_cfg.no_server_management and world.proto and \
+            any('kea' in sut for sut in world.f_cfg.software_under_test):
+        for remote_server in world.f_cfg.multiple_tested_servers:
+            get_log_mirror(destination=remote_server)
+
+
+def _keep_artifacts(scenario):
+    """
+    Should logs, leases and captures of the test be saved in test results directory?
+    With ARTIFACTS = 'on-failure' only those of failed tests are.
+    """
+    return world.f_cfg.artifacts != 'on-failure' or bool(scenario.failed)
+
+
+def _cleanup_server(remote_server, keep_artifacts=True):
+    start_srv('DHCP', 'stopped', dest=remote_server)
+    # all artifacts of the server are downloaded at once, in one compressed archive,
+    # and the staging directory is removed by the same command
+    with collect_downloads(remote_server, remove=artifacts_staging_dir()):
+        for sut in world.f_cfg.software_under_test:
+            functions = importlib.import_module("src.softwaresupport.%s.functions" % sut)
+            # try:
+            if world.f_cfg.save_leases and keep_artifacts:
+                # save leases, if there is none leases in your software, just put "pass" in this function.
+                functions.save_leases(destination_address=remote_server)
+
+            if world.f_cfg.save_logs and keep_artifacts:
+                functions.save_logs(destination_address=remote_server)
+
+            if world.f_cfg.tcpdump_on_remote_system:
+                stop_tcpdump(location=remote_server)
+                if keep_artifacts:
+                    # it's not bullet proof it won't download anything from second HA system
+                    download_tcpdump_capture(location=remote_server, file_name='remote.pcap')
+
 
 # @after.each_scenario
 def cleanup(scenario):
@@ -452,26 +492,29 @@ def cleanup(scenario):
     if 'outline' not in info:
         world.result.append(info)
 
+    keep_artifacts = _keep_artifacts(scenario)
+    if scenario.failed and world.f_cfg.show_packets == 'on-failure' and len(packet_log) > 0:
+        directions = selected_directions(world.f_cfg.show_packets_from)
+        if directions:
+            print('\nPackets of the failed test:\n' + packet_log.render(directions))
+    if world.f_cfg.packet_capture and keep_artifacts and len(packet_log) > 0:
+        packet_log.write_pcap(os.path.join(world.cfg["test_result_dir"], 'packets.pcap'))
     if world.f_cfg.tcpdump:
         stop_tcpdump()
+        if not keep_artifacts:
+            for capture in glob.glob(os.path.join(world.cfg["test_result_dir"], 'capture*.pcap')):
+                os.remove(capture)
 
-    if not world.f_cfg.no_server_management:
-        for remote_server in world.f_cfg.multiple_tested_servers:
-            start_srv('DHCP', 'stopped', dest=remote_server)
-            for sut in world.f_cfg.software_under_test:
-                functions = importlib.import_module("src.softwaresupport.%s.functions" % sut)
-                # try:
-                if world.f_cfg.save_leases:
-                    # save leases, if there is none leases in your software, just put "pass" in this function.
-                    functions.save_leases(destination_address=remote_server)
+    # stop following logs before servers are stopped and logs collected
+    log_followers.close()
 
-                if world.f_cfg.save_logs:
-                    functions.save_logs(destination_address=remote_server)
+    if not world.f_cfg.no_server_management:
+        # servers are independent, stop them and collect their artifacts concurrently
+        run_for_each_server(functools.partial(_cleanup_server, keep_artifacts=keep_artifacts),
+                            world.f_cfg.multiple_tested_servers)
 
-                if world.f_cfg.tcpdump_on_remote_system:
-                    stop_tcpdump(location=remote_server)
-                    # it's not bullet proof it won't download anything from second HA system
-                    download_tcpdump_capture(location=remote_server, file_name='remote.pcap')
+    # logs were saved, stop mirroring them
+    log_mirrors.close(remove_copies=not keep_artifacts)
 
 
 # @after.all
@@ -495,6 +538,14 @@ def say_goodbye():
                 except BaseException:
                     pass
 
+    log_followers.close()
+    log_mirrors.close()
+    packet_endpoints.close()
+    close_remote_connections()
+
+    # where the time spent on remote calls went
+    remote_stats.write_report('tests_results')
+
     if world.f_cfg.auto_archive:
         name = ""
         if world.cfg["dhcp_under_test"] != "":
@@ -8,10 +8,13 @@
 # pylint: disable=too-many-arguments
 
 import random
+import asyncio
 from src import misc
 from src import srv_control
 from src import srv_msg
 from src.forge_cfg import world
+from src.protosupport.client_engine import VirtualClient, run_clients
+from src.softwaresupport.multi_server_functions import run_blocking
 
 
 # port 8000 is by default the one which is used, but if forge detects
@@ -122,14 +125,40 @@ def wait_until_ha_state(state, dest=world.f_cfg.mgmt_address, retry=20, sleep=1,
         srv_msg.forge_sleep(sleep, 'seconds')
         resp = send_heartbeat(dest=dest, dhcp_version=dhcp_version, channel=channel, verify=verify, cert=cert,
                               port=port)
-        if resp["arguments"]["state"] == "terminated":
-            assert False, "State reached terminated! Tests will fail"
-        elif resp["arguments"]["state"] == state:
+        if _ha_state_reached(resp, state):
             return resp
     assert False, f"After {retry} retries HA did NOT reach '{state}' state"
     return {}  # let's keep pylint error quiet
 
 
+async def wait_until_ha_state_async(state, dest=world.f_cfg.mgmt_address, retry=20, sleep=1, dhcp_version='v6',
+                                    channel='http', verify=None, cert=None, port=8000):
+    """
+    asyncio version of wait_until_ha_state, e.g. to wait for states of both HA peers at once:
+
+        await asyncio.gather(wait_until_ha_state_async('partner-down', dest=addr_1),
+                             wait_until_ha_state_async('waiting', dest=addr_2))
+
+    :return: last response
+    """
+    for _ in range(retry):
+        await asyncio.sleep(sleep)
+        resp = await run_blocking(send_heartbeat, dest=dest, dhcp_version=dhcp_version, channel=channel,
+                                  verify=verify, cert=cert, port=port)
+        if _ha_state_reached(resp, state):
+            return resp
+    assert False, f"After {retry} retries HA did NOT reach '{state}' state"
+    return {}  # let's keep pylint error quiet
+
+
+def _ha_state_reached(resp, state):
+    """
+    Is HA in the state according to ha-heartbeat response? Terminated state fails the test.
+    """
+    assert resp["arguments"]["state"] != "terminated", "State reached terminated! Tests will fail"
+    return resp["arguments"]["state"] == state
+
+
 def increase_mac(mac: str, rand: bool = False):
     """
     Recalculate mac address by: keep first octet unchanged (we can change it in test to make sure that
@@ -153,7 +182,7 @@ def increase_mac(mac: str, rand: bool = False):
 
 def generate_leases(leases_count: int = 1, iana: int = 1, iapd: int = 1,
                     dhcp_version: str = 'v6', mac: str = "01:02:0c:03:0a:00",
-                    expected_server_id: str = None):
+                    expected_server_id: str = None, in_flight: int = 1):
     """
     Function will perform message exchanges to get specified number of leases,
     will assert if at the end number of leases will be smaller
@@ -163,8 +192,13 @@ def generate_leases(leases_count: int = 1, iana: int = 1, iapd: int = 1,
     :param dhcp_version: version of dhcp
     :param mac: mac we will start increase, to get different set of macs increase just first octet
     :param expected_server_id: server id we expect in the all messages, checked if not None
+    :param in_flight: if more than 1, leases are generated by that many concurrent clients of ClientEngine
+                      (not for v4_bootp), messages are then not checked by step functions
     :return: list of leases generated
     """
+    if in_flight > 1 and dhcp_version in ['v4', 'v6']:
+        return _generate_leases_concurrently(leases_count, iana, iapd, dhcp_version, mac, expected_server_id,
+                                             in_flight)
     all_leases = []
     tmp = world.f_cfg.show_packets_from
     world.f_cfg.show_packets_from = ""
@@ -284,6 +318,32 @@ def generate_leases(leases_count: int = 1, iana: int = 1, iapd: int = 1,
     return all_leases
 
 
+def _generate_leases_concurrently(leases_count, iana, iapd, dhcp_version, mac, expected_server_id, in_flight):
+    """
+    generate_leases() done by ClientEngine: clients with the same MAC addresses, client-ids, DUIDs
+    and number of IAs as generate_leases() uses, in_flight of them exchanging messages at once.
+    """
+    clients = []
+    for _ in range(leases_count):
+        mac = increase_mac(mac)
+        if dhcp_version == 'v6':
+            ia_1 = random.randint(2000, 7000)
+            pd_1 = random.randint(7001, 9999)
+            clients.append(VirtualClient(mac, duid="00:03:00:01:" + mac, iaids=range(ia_1, ia_1 + iana),
+                                         pd_iaids=range(pd_1, pd_1 + iapd)))
+        else:
+            clients.append(VirtualClient(mac, client_id='11' + mac.replace(':', '')))
+    all_leases = run_clients(clients, ipv6=dhcp_version == 'v6', in_flight=in_flight)
+    failed = [client for client in clients if client.failed]
+    assert not failed, f"{len(failed)} of {len(clients)} clients got no lease, e.g. {failed[0].mac}: {failed[0].failed}"
+    if expected_server_id and dhcp_version == 'v6':
+        expected = expected_server_id.replace(':', '').lower()
+        for client in clients:
+            assert client.server_id.hex() == expected, \
+                f"{client.mac} got lease from {client.server_id.hex()}, expected {expected_server_id}"
+    return all_leases
+
+
 def send_increased_elapsed_time(msg_count, elapsed=3, dhcp_version='v6',
                                 mac="05:02:0c:03:0a:00", duid="00:03:00:01:05:02:0c:03:0a:00"):
     """
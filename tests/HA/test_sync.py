@@ -16,7 +16,7 @@ from src import srv_control
 from src import srv_msg
 
 from src.forge_cfg import world
-from src.protosupport.multi_protocol_functions import wait_for_message_in_log
+from src.protosupport.multi_protocol_functions import log_contains_message, wait_for_message_in_log
 from src.softwaresupport.cb_model import setup_server_with_radius
 from src.softwaresupport import radius
 
@@ -120,6 +120,8 @@ def test_HA_hot_standby_multiple_leases_v6(hook_order: str):
     wait_for_message_in_log('HA_STATE_TRANSITION server transitions from READY to '
                             'HOT-STANDBY state, partner state is HOT-STANDBY',
                             destination=world.f_cfg.mgmt_address_2)
+    # server2 went on only when the synchronization was done
+    log_contains_message('HA_STATE_TRANSITION', after='HA_SYNC_SUCCESSFUL', destination=world.f_cfg.mgmt_address_2)
 
     # More message exchanges
     set_of_leases_2 = generate_leases(leases_count=4, iana=3, iapd=2, mac="02:02:0c:03:0a:00")
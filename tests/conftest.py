@@ -22,14 +22,34 @@ def get_number_of_tests(request):
     world.test_count = len(request.node.items)
 
 
+def _is_unit_test(item):
+    """
+    Unit tests (marked with @pytest.mark.unit) test forge itself, they need no system under test.
+    """
+    return item.get_closest_marker('unit') is not None
+
+
 def pytest_runtest_setup(item):
+    if _is_unit_test(item):
+        return
     from src import terrain
     terrain.initialize(item)
 
 
+@pytest.hookimpl(tryfirst=True, hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    # keep reports of test phases, cleanup needs to know if the test failed
+    outcome = yield
+    report = outcome.get_result()
+    setattr(item, f'report_{report.when}', report)
+
+
 def pytest_runtest_teardown(item, nextitem):
+    if _is_unit_test(item):
+        return
     from src import terrain
-    item.failed = None
+    reports = [getattr(item, f'report_{when}', None) for when in ('setup', 'call')]
+    item.failed = any(report is not None and report.failed for report in reports)
     terrain.cleanup(item)
 
 
@@ -111,12 +131,19 @@ def pytest_generate_tests(metafunc):
         metafunc.parametrize('dhcp_version', dhcp_versions)
 
 
-def pytest_configure(config):
-    from src import terrain
-    terrain.test_start()
+def pytest_collection_finish(session):
+    # systems under test are prepared only if some collected test needs them and tests are going to run
+    if session.config.option.collectonly:
+        return
+    if any(not _is_unit_test(item) for item in session.items):
+        from src import terrain
+        terrain.test_start()
+        session.config.forge_started = True
 
 
 def pytest_unconfigure(config):
+    if not getattr(config, 'forge_started', False):
+        return
     from src import terrain
     terrain.say_goodbye()
 
@@ -124,6 +151,22 @@ def pytest_unconfigure(config):
 def pytest_addoption(parser):
     parser.addoption("--iters-factor", action="store", default=1,
                      help="iterations factor, initial iterations in tests are multiplied by this value, default 1")
+    parser.addoption("--remote-calls-top", action="store", default=0, type=int,
+                     help="print N slowest remote calls at the end of the session, default 0")
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    count = config.getoption("--remote-calls-top")
+    if not count:
+        return
+    from src.softwaresupport.remote_stats import remote_stats
+    terminalreporter.section(f'{count} slowest remote calls')
+    for call in remote_stats.slowest(count):
+        command = str(call['command']).replace('\n', '; ')
+        if len(command) > 80:
+            command = command[:77] + '...'
+        terminalreporter.write_line(f"{call['time']:8.3f}s {call['bytes']:>10}B {call['helper']:<26} "
+                                    f"{call['host']:<16} {call['test']}: {command}")
 
 
 @pytest.fixture
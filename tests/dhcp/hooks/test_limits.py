@@ -11,65 +11,58 @@
 # Author: Marcin Godzina
 
 """Kea Limits Hook tests"""
-import time
 import random
+import struct
 import pytest
 
 from src import misc
 from src import srv_control
 from src import srv_msg
 from src.forge_cfg import world
+from src.protosupport.client_engine import VirtualClient
+from src.protosupport.load_generator import generate_load
 
 
-def _get_address_v4(chaddr, vendor=None):
-    """
-    Local function used to send Discover and check if Offer is send back.
-    Can add vendor option to trigger client class in Kea.
-    :param chaddr: MAC address
-    :param vendor: Vendor name
-    :return: 1 if Offer is received.
-    """
-    misc.test_procedure()
-    srv_msg.client_sets_value('Client', 'chaddr', chaddr)
-    if vendor is not None:
-        srv_msg.client_does_include_with_value('vendor_class_id', vendor)
-    srv_msg.client_send_msg('DISCOVER')
+# exchanges started per second by the load generator, well above the rate limits of the tests
+OFFERED_RATE = 10
 
-    misc.pass_criteria()
-    try:
-        srv_msg.send_wait_for_message('MUST', 'OFFER')
-    except AssertionError as e:
-        if e.args[0] == 'No response received.':
-            return 0
-        raise AssertionError(e) from e
-    return 1
 
-
-def _get_address_v6(duid, vendor=None):
+def _offer_load(dhcp_version, duration, vendors=(None,)):
     """
-    Local function used to send Solicit and check if Advertise is send back.
-    Can add vendor option to trigger client class in Kea.
-    :param duid:  DUID address
-    :param vendor: Vendor name
-    :return: 1 if Advertise is received.
+    Local function used to start DO or SA exchanges at OFFERED_RATE for the duration and count answered ones.
+    Every exchange is made by the same client, exchanges take vendors in turn.
+    Vendor option triggers client class in Kea.
+    :param dhcp_version: v4 or v6
+    :param duration: time of sending in seconds
+    :param vendors: Vendor names, None for exchange without vendor option
+    :return: dict with number of Offers or Advertises received for each vendor.
     """
-    misc.test_procedure()
-    srv_msg.client_sets_value('Client', 'DUID', duid)
-    srv_msg.client_does_include('Client', 'client-id')
-    srv_msg.client_does_include('Client', 'IA-NA')
-    if vendor is not None:
-        srv_msg.client_sets_value('Client', 'vendor_class_data', vendor)
-        srv_msg.client_does_include('Client', 'vendor-class')
-    srv_msg.client_send_msg('SOLICIT')
-
-    misc.pass_criteria()
-    try:
-        srv_msg.send_wait_for_message('MUST', 'ADVERTISE')
-    except AssertionError as e:
-        if e.args[0] == 'No response received.':
-            return 0
-        raise AssertionError(e) from e
-    return 1
+    clients = []
+
+    def client_factory(number, ipv6):
+        vendor = vendors[number % len(vendors)]
+        options = []
+        if ipv6:
+            if vendor is not None:
+                options.append((16, struct.pack('!IH', world.cfg["values"]["enterprisenum"], len(vendor)) +
+                                vendor.encode()))
+            client = VirtualClient('ff:ff:ff:ff:ff:ff', duid='00:03:00:01:ff:ff:ff:ff:ff:ff', iaids=[1],
+                                   options=options)
+        else:
+            if vendor is not None:
+                options.append((60, vendor.encode()))
+            client = VirtualClient('ff:01:02:03:04:05', options=options)
+        clients.append((vendor, client))
+        return client
+
+    result = generate_load(dhcp_version, OFFERED_RATE, duration, mix={'DO' if dhcp_version == 'v4' else 'SA': 1},
+                           client_factory=client_factory)
+    print(f"Load {result.summary()}")
+    success = {vendor: 0 for vendor in vendors}
+    for vendor, client in clients:
+        if client.failed is None:
+            success[vendor] += 1
+    return success
 
 
 def _get_lease_v4(address, chaddr, vendor=None):
@@ -199,7 +192,7 @@ def _get_lease_v6(address, duid, vendor=None, ia_na=None, ia_pd=None):
 def test_rate_limits_subnet(dhcp_version, backend, unit):
     """
     Test of subnets limit of rate limiting in Limits Hook.
-    The test makes DO or SA exchange in the fastest way possible in a unit of time (second or minute)
+    The test makes DO or SA exchanges at constant rate above the limit for a unit of time (second or minute)
     and counts how many packets were sent, and how many packets were received from Kea.
     If the received packets is the same as limit, the test passes. Some error in number of packets is accounted for.
     :param unit:  Defines testing of limit per second or minute
@@ -233,39 +226,11 @@ def test_rate_limits_subnet(dhcp_version, backend, unit):
     srv_control.build_and_send_config_files()
     srv_control.start_srv('DHCP', 'started')
 
-    success = 0
-    packets = 0
-
     # Wait time for response for v4 and v6
     world.cfg['wait_interval'] = 0.1
-    if dhcp_version == 'v6':
-        world.cfg['wait_interval'] = 0.1
 
-    start = time.time()
-    elapsed = 0
-    if dhcp_version == 'v4':
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Discover and add 1 to success counter if Forge got Offer.
-            success += _get_address_v4(chaddr='ff:01:02:03:04:05')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-    else:
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Solicit and add 1 to success counter if Forge got Advertise.
-            success += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-
-    print(f"Runtime of the program is {elapsed} seconds")
-    print(f"Packets received {success} from {packets} sent")
-    if unit == 'second':
-        print(f"Average Packets per second {success / elapsed}")
-    else:
-        print(f"Average Packets per minute {success / elapsed * 60}")
+    # Send Discovers or Solicits at constant rate for the duration of the test, and count Offers or Advertises.
+    success = _offer_load(dhcp_version, duration)[None]
 
     # Set threshold to account for small errors in receiving packets.
     threshold = 1 if unit == 'second' else 5
@@ -283,7 +248,7 @@ def test_rate_limits_subnet(dhcp_version, backend, unit):
 def test_rate_limits_class(dhcp_version, backend, unit):
     """
     Test of class limit of rate limiting in Limits Hook..
-    The test makes DO or SA exchange in the fastest way possible in a unit of time (second or minute)
+    The test makes DO or SA exchanges at constant rate above the limit for a unit of time (second or minute)
     and counts how many packets were sent, and how many packets were received from Kea.
     If the received packets is the same as limit, the test passes. Some error in number of packets is accounted for.
     :param unit:  Defines testing of limit per second or minute
@@ -334,39 +299,12 @@ def test_rate_limits_class(dhcp_version, backend, unit):
     srv_control.build_and_send_config_files()
     srv_control.start_srv('DHCP', 'started')
 
-    success = 0
-    packets = 0
-
     # Wait time for response for v4 and v6
     world.cfg['wait_interval'] = 0.1
-    if dhcp_version == 'v6':
-        world.cfg['wait_interval'] = 0.1
 
-    start = time.time()
-    elapsed = 0
-    if dhcp_version == 'v4':
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Discover and add 1 to success counter if Forge got Offer.
-            success += _get_address_v4(chaddr='ff:01:02:03:04:05', vendor='PXE')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-    else:
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Solicit and add 1 to success counter if Forge got Advertise.
-            success += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff', vendor='eRouter2.0')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-
-    print(f"Runtime of the program is {elapsed} seconds")
-    print(f"Packets received {success} from {packets} sent")
-    if unit == 'second':
-        print(f"Average Packets per second {success / elapsed}")
-    else:
-        print(f"Average Packets per minute {success / elapsed * 60}")
+    # Send Discovers or Solicits at constant rate for the duration of the test, and count Offers or Advertises.
+    vendor = 'PXE' if dhcp_version == 'v4' else 'eRouter2.0'
+    success = _offer_load(dhcp_version, duration, vendors=[vendor])[vendor]
 
     # Set threshold to account for small errors in receiving packets.
     threshold = 1 if unit == 'second' else 5
@@ -384,7 +322,7 @@ def test_rate_limits_class(dhcp_version, backend, unit):
 def test_rate_limits_builtin_class(dhcp_version, backend, unit):
     """
     Test of rate limits for built-in classes in Limits Hook.
-    The test makes DO or SA exchange in the fastest way possible in a unit of time (second or minute)
+    The test makes DO or SA exchanges at constant rate above the limit for a unit of time (second or minute)
     and counts how many packets were sent, and how many packets were received from Kea.
     If the received packets is the same as limit, the test passes. Some error in number of packets is accounted for.
     :param unit:  Defines testing of limit per second or minute
@@ -434,39 +372,11 @@ def test_rate_limits_builtin_class(dhcp_version, backend, unit):
     srv_control.build_and_send_config_files()
     srv_control.start_srv('DHCP', 'started')
 
-    success = 0
-    packets = 0
-
     # Wait time for response for v4 and v6
     world.cfg['wait_interval'] = 0.1
-    if dhcp_version == 'v6':
-        world.cfg['wait_interval'] = 0.1
 
-    start = time.time()
-    elapsed = 0
-    if dhcp_version == 'v4':
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Discover and add 1 to success counter if Forge got Offer.
-            success += _get_address_v4(chaddr='ff:01:02:03:04:05')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-    else:
-        while elapsed < duration:  # Send packets for the duration of the test, and count them.
-            # Send Solicit and add 1 to success counter if Forge got Advertise.
-            success += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff')
-            # Add 1 to send packets counter
-            packets += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-
-    print(f"Runtime of the program is {elapsed} seconds")
-    print(f"Packets received {success} from {packets} sent")
-    if unit == 'second':
-        print(f"Average Packets per second {success / elapsed}")
-    else:
-        print(f"Average Packets per minute {success / elapsed * 60}")
+    # Send Discovers or Solicits at constant rate for the duration of the test, and count Offers or Advertises.
+    success = _offer_load(dhcp_version, duration)[None]
 
     # Set threshold to account for small errors in receiving packets.
     threshold = 1 if unit == 'second' else 5
@@ -483,7 +393,7 @@ def test_rate_limits_builtin_class(dhcp_version, backend, unit):
 def test_rate_limits_mix(dhcp_version, backend):
     """
     Test of subnet and class mixed limit of rate limiting in Limits Hook.
-    The test makes DO or SA exchange in the fastest way possible in a unit of time (second or minute)
+    The test makes DO or SA exchanges at constant rate above the limit for a unit of time (second or minute)
     and counts how many packets were sent, and how many packets were received from Kea in different classes.
     If the received packets is the same as limit, the test passes. Some error in number of packets is accounted for.
     """
@@ -554,62 +464,24 @@ def test_rate_limits_mix(dhcp_version, backend):
     srv_control.build_and_send_config_files()
     srv_control.start_srv('DHCP', 'started')
 
-    success_gold = 0
-    packets_gold = 0
-    success_silver = 0
-    packets_silver = 0
-    success_noclass = 0
-    packets_noclass = 0
-
     world.cfg['wait_interval'] = 0.1
-    if dhcp_version == 'v6':
-        world.cfg['wait_interval'] = 0.1
 
-    start = time.time()
-    elapsed = 0
     if dhcp_version == 'v4':
-        while elapsed < 1:  # Send packets for 1 second for gold limit.
-            # Send Discover and add 1 to success counter if Forge got Offer.
-            success_gold += _get_address_v4(chaddr='ff:01:02:03:04:05', vendor='PXE')
-            # Add 1 to send packets counter
-            packets_gold += 1
-            elapsed = time.time() - start
-        while elapsed < 60:  # Send packets for 59 seconds for silver limit.
-            # Send Discover and add 1 to success counter if Forge got Offer.
-            success_silver += _get_address_v4(chaddr='ff:01:02:03:04:05', vendor='PXA')
-            success_noclass += _get_address_v4(chaddr='ff:01:02:03:04:05')
-            # Add 1 to send packets counter
-            packets_silver += 1
-            packets_noclass += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
+        gold_vendor, silver_vendor = 'PXE', 'PXA'
     else:
-        while elapsed < 1:  # Send packets for 1 second for gold limit.
-            # Send Solicit and add 1 to success counter if Forge got Advertise.
-            success_gold += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff', vendor='eRouter2.0')
-            # Add 1 to send packets counter
-            packets_gold += 1
-            elapsed = time.time() - start
-        while elapsed < 60:  # Send packets for 59 seconds for silver limit.
-            # Send Solicit and add 1 to success counter if Forge got Advertise.
-            success_silver += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff', vendor='eRouter1.0')
-            success_noclass += _get_address_v6(duid='00:03:00:01:ff:ff:ff:ff:ff:ff')
-            # Add 1 to send packets counter
-            packets_silver += 1
-            packets_noclass += 1
-            # set timer to actual duration of test.
-            elapsed = time.time() - start
-
-    # Sum up all successes and sent packets for subnet test.
+        gold_vendor, silver_vendor = 'eRouter2.0', 'eRouter1.0'
+    # Send packets for 1 second for gold limit.
+    success_gold = _offer_load(dhcp_version, 1, vendors=[gold_vendor])[gold_vendor]
+    # Send packets for 59 seconds for silver limit, every other one without class.
+    success = _offer_load(dhcp_version, 59, vendors=[silver_vendor, None])
+    success_silver, success_noclass = success[silver_vendor], success[None]
+
+    # Sum up all successes for subnet test.
     all_success = success_gold + success_silver + success_noclass
-    all_packets = packets_gold + packets_silver + packets_noclass
-
-    print(f"Runtime of the program is {elapsed} seconds")
-    print(f"All packets received {all_success} from {all_packets} sent")
-    print(f"Gold Packets received {success_gold} from {packets_gold} sent")
-    print(f"Average Gold Packets per second {success_gold / elapsed * 60}")
-    print(f"Silver Packets received {success_silver} from {packets_silver} sent")
-    print(f"Average Silver Packets per minute {success_silver / elapsed * 60}")
+
+    print(f"All packets received {all_success}")
+    print(f"Gold Packets received {success_gold}")
+    print(f"Silver Packets received {success_silver}")
 
     # Set threshold to account for small errors in receiving packets.
     threshold_subnet = 5
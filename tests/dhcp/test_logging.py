@@ -15,7 +15,7 @@ from src import srv_msg
 from src import misc
 
 from src.forge_cfg import world
-from src.protosupport.multi_protocol_functions import log_contains, log_doesnt_contain
+from src.protosupport.multi_protocol_functions import log_contains, log_doesnt_contain, logs_contain_all
 
 
 @pytest.mark.v4
@@ -862,13 +862,13 @@ def test_v4_loggers_all():
     misc.pass_criteria()
     srv_msg.send_wait_for_message('MUST', 'OFFER')
 
-    log_contains(r'DEBUG \[kea-dhcp4\.packets')
-    log_contains(r'DEBUG \[kea-dhcp4\.dhcpsrv')
-    log_contains(r'DEBUG \[kea-dhcp4\.alloc-engine')
-    log_contains(r'DEBUG \[kea-dhcp4\.dhcp4')
-    log_contains(r'DEBUG \[kea-dhcp4\.options')
-    log_contains(r'DEBUG \[kea-dhcp4\.leases')
-    log_contains(r'INFO  \[kea-dhcp4\.leases')
+    logs_contain_all([(r'DEBUG \[kea-dhcp4\.packets', None),
+                      (r'DEBUG \[kea-dhcp4\.dhcpsrv', None),
+                      (r'DEBUG \[kea-dhcp4\.alloc-engine', None),
+                      (r'DEBUG \[kea-dhcp4\.dhcp4', None),
+                      (r'DEBUG \[kea-dhcp4\.options', None),
+                      (r'DEBUG \[kea-dhcp4\.leases', None),
+                      (r'INFO  \[kea-dhcp4\.leases', None)])
 
 
 @pytest.mark.v4
@@ -956,14 +956,14 @@ def test_v4_loggers_all_different_levels_same_file():
     misc.pass_criteria()
     srv_msg.send_wait_for_message('MUST', 'NAK')
 
-    log_contains(r'DEBUG \[kea-dhcp4\.packets')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp4\.leases')
-    log_contains(r'DEBUG \[kea-dhcp4\.alloc-engine')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp4\.dhcp4')
-    log_contains(r'INFO  \[kea-dhcp4\.dhcp4')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp4\.dhcpsrv')
-    log_contains(r'INFO  \[kea-dhcp4\.dhcpsrv')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp4\.options')
+    logs_contain_all([(r'DEBUG \[kea-dhcp4\.packets', None),
+                      (r'DEBUG \[kea-dhcp4\.leases', 0),
+                      (r'DEBUG \[kea-dhcp4\.alloc-engine', None),
+                      (r'DEBUG \[kea-dhcp4\.dhcp4', 0),
+                      (r'INFO  \[kea-dhcp4\.dhcp4', None),
+                      (r'DEBUG \[kea-dhcp4\.dhcpsrv', 0),
+                      (r'INFO  \[kea-dhcp4\.dhcpsrv', None),
+                      (r'DEBUG \[kea-dhcp4\.options', 0)])
 
 
 @pytest.mark.v4
@@ -1744,12 +1744,12 @@ def test_v6_loggers_all():
 
     misc.pass_criteria()
     srv_msg.send_wait_for_message('MUST', 'REPLY')
-    log_contains(r'DEBUG \[kea-dhcp6.packets')
-    log_contains(r'DEBUG \[kea-dhcp6.leases')
-    log_contains(r'DEBUG \[kea-dhcp6.dhcpsrv')
-    log_contains(r'DEBUG \[kea-dhcp6.alloc-engine')
-    log_contains(r'DEBUG \[kea-dhcp6.dhcp6')
-    log_contains(r'DEBUG \[kea-dhcp6.options')
+    logs_contain_all([(r'DEBUG \[kea-dhcp6.packets', None),
+                      (r'DEBUG \[kea-dhcp6.leases', None),
+                      (r'DEBUG \[kea-dhcp6.dhcpsrv', None),
+                      (r'DEBUG \[kea-dhcp6.alloc-engine', None),
+                      (r'DEBUG \[kea-dhcp6.dhcp6', None),
+                      (r'DEBUG \[kea-dhcp6.options', None)])
 
 
 @pytest.mark.v6
@@ -1806,14 +1806,14 @@ def test_v6_loggers_all_different_levels_same_file():
 
     srv_msg.send_dont_wait_for_message()
 
-    log_contains(r'DEBUG \[kea-dhcp6.packets')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp6.leases')
-    log_contains(r'DEBUG \[kea-dhcp6.alloc-engine')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp6.dhcp6')
-    log_contains(r'INFO  \[kea-dhcp6.dhcp6')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp6.dhcpsrv')
-    log_contains(r'INFO  \[kea-dhcp6.dhcpsrv')
-    log_doesnt_contain(r'DEBUG \[kea-dhcp6.options')
+    logs_contain_all([(r'DEBUG \[kea-dhcp6.packets', None),
+                      (r'DEBUG \[kea-dhcp6.leases', 0),
+                      (r'DEBUG \[kea-dhcp6.alloc-engine', None),
+                      (r'DEBUG \[kea-dhcp6.dhcp6', 0),
+                      (r'INFO  \[kea-dhcp6.dhcp6', None),
+                      (r'DEBUG \[kea-dhcp6.dhcpsrv', 0),
+                      (r'INFO  \[kea-dhcp6.dhcpsrv', None),
+                      (r'DEBUG \[kea-dhcp6.options', 0)])
 
 
 @pytest.mark.v6
@@ -0,0 +1,306 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Exchanges of virtual clients in ClientEngine.
+   The engine socket is replaced by one passing sent messages to a responder playing the server,
+   which answers with messages built by scapy. DHCPv4 frames sent by the engine are received back
+   as outgoing ones, like on a packet socket.
+"""
+
+# pylint: disable=protected-access
+
+import collections
+import queue
+import socket
+import time
+
+import pytest
+from scapy.compat import raw
+from scapy.layers.dhcp import BOOTP, DHCP
+from scapy.layers.dhcp6 import DUID_LL, DHCP6_Advertise, DHCP6_Reply, DHCP6OptClientId, DHCP6OptServerId
+from scapy.layers.dhcp6 import DHCP6OptIA_NA, DHCP6OptIAAddress, DHCP6OptStatusCode
+
+from src.forge_cfg import world
+from src.protosupport import client_engine
+from src.protosupport import dhcp_codec as codec
+from src.protosupport.client_engine import ClientEngine, VirtualClient
+
+pytestmark = [pytest.mark.unit]
+
+SERVER_ID = '192.168.50.1'
+SERVER_MAC = 'f6:f5:f4:f3:f2:01'
+SERVER_DUID = DUID_LL(lladdr=SERVER_MAC)
+
+
+class _FakeSocket:
+    """
+    Socket handing decoded messages to responder and receiving its replies.
+    """
+    def __init__(self, ipv6, responder):
+        self.ipv6 = ipv6
+        self.responder = responder
+        self.sent = []
+        self._received = queue.Queue()
+        # select() in run() waits on the socket pair
+        self._receiving, self._sending = socket.socketpair()
+
+    def fileno(self):
+        return self._receiving.fileno()
+
+    def _put(self, item):
+        self._received.put(item)
+        self._sending.send(b'.')
+
+    def send(self, frame):
+        msg = codec.decode_v4(codec.udp4_payload(frame, 67))
+        self.sent.append(msg)
+        self._put((frame, ('lo', codec.ETH_P_IP, client_engine.PACKET_OUTGOING, 1, b'')))
+        for reply in self.responder(msg):
+            frame = codec.udp4_frame(raw(reply), SERVER_MAC, 'ff:ff:ff:ff:ff:ff', SERVER_ID, '255.255.255.255',
+                                     67, 68)
+            self._put((frame, ('lo', codec.ETH_P_IP, 0, 1, b'')))
+
+    def sendto(self, data, destination):
+        assert destination[:2] == ('2001:db8:1::1', 547)
+        msg = codec.decode_v6(data)
+        self.sent.append(msg)
+        for reply in self.responder(msg):
+            self._put((raw(reply), destination))
+
+    def recvfrom(self, size):
+        try:
+            item = self._received.get_nowait()
+        except queue.Empty as e:
+            raise BlockingIOError from e
+        self._receiving.recv(1)
+        return item[0][:size], item[1]
+
+    def recv(self, size):
+        return self.recvfrom(size)[0]
+
+    def close(self):
+        self._receiving.close()
+        self._sending.close()
+
+
+@pytest.fixture(name='engine')
+def fixture_engine(monkeypatch):
+    """
+    Function making engine with the fake socket and the responder.
+    """
+    monkeypatch.setattr(world, 'cfg', {'iface': 'lo', 'source_port': 68, 'destination_port': 67,
+                                       'source_IP': '0.0.0.0', 'destination_IP': '255.255.255.255',
+                                       'wait_interval': 0.1}, raising=False)
+    engines = []
+
+    def make(ipv6, responder, **kwargs):
+        fake = _FakeSocket(ipv6, responder)
+
+        def _open(engine):
+            engine._hwaddr = '00:0c:01:02:03:ff'
+            engine._destination = ('2001:db8:1::1', 547, 0, 1)
+            return fake
+
+        monkeypatch.setattr(ClientEngine, '_open', _open)
+        kwargs.setdefault('timeout', 0.1)
+        engines.append(ClientEngine(ipv6, **kwargs))
+        return engines[-1]
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+
+def _clients(count, ipv6=False):
+    macs = [f'00:0c:01:02:03:{number:02x}' for number in range(1, count + 1)]
+    return [VirtualClient(mac, duid=raw(DUID_LL(lladdr=mac)).hex(':'), iaids=[number] if ipv6 else ())
+            for number, mac in enumerate(macs, 1)]
+
+
+def _address(mac):
+    return f'192.168.50.{int(mac[-2:], 16) + 10}'
+
+
+def _reply_v4(msg, msg_type, options=()):
+    return BOOTP(op=2, xid=msg.xid, chaddr=codec.hex_bytes(msg.chaddr), yiaddr=_address(msg.chaddr)) / \
+        DHCP(options=[('message-type', msg_type), ('server_id', SERVER_ID)] + list(options) + ['end'])
+
+
+def _server_v4(msg):
+    """
+    DHCPv4 server: OFFER to DISCOVER, ACK to REQUEST, nothing to RELEASE.
+    """
+    if msg.message_type == 'DISCOVER':
+        return [_reply_v4(msg, 'offer')]
+    if msg.message_type == 'REQUEST':
+        return [_reply_v4(msg, 'ack', [('lease_time', 4000)])]
+    return []
+
+
+def _reply_v6(layer, msg, *options):
+    reply = layer(trid=msg.trid) / DHCP6OptClientId(duid=DUID_LL(msg.client_id)) / DHCP6OptServerId(duid=SERVER_DUID)
+    for option in options:
+        reply /= option
+    return reply
+
+
+def _ia_na(iaid):
+    return DHCP6OptIA_NA(iaid=iaid, T1=1000, T2=2000,
+                         ianaopts=[DHCP6OptIAAddress(addr=f'2001:db8:1::{iaid:x}', preflft=3000, validlft=4000)])
+
+
+def _server_v6(msg):
+    """
+    DHCPv6 server: ADVERTISE to SOLICIT, REPLY with the same addresses to REQUEST.
+    """
+    iaids = [ia.iaid for ia in msg.ia_na]
+    if msg.message_type == 'SOLICIT':
+        return [_reply_v6(DHCP6_Advertise, msg, *[_ia_na(iaid) for iaid in iaids])]
+    return [_reply_v6(DHCP6_Reply, msg, *[_ia_na(iaid) for iaid in iaids])]
+
+
+@pytest.mark.v4
+def test_dora(engine):
+    clients = _clients(3)
+    engine = engine(False, _server_v4, in_flight=2)
+    engine.run(clients, ['DORA', 'renew', 'release'])
+    sent = engine.socket.sent
+
+    for client in clients:
+        assert client.failed is None and client.exchange.step is None
+        address = _address(client.mac)
+        assert client.leases == [{'hwaddr': client.mac, 'address': address, 'valid_lifetime': 4000,
+                                  'server_id': SERVER_ID}]
+        messages = [msg for msg in sent if msg.chaddr == client.mac]
+        assert [msg.message_type for msg in messages] == ['DISCOVER', 'REQUEST', 'REQUEST', 'RELEASE']
+        discover, request, renew, release = messages
+        # REQUEST of DORA keeps the transaction ID of DISCOVER and asks for the offered address
+        assert request.xid == discover.xid
+        assert request.options.get(codec.OPT4_REQUESTED_ADDR) == socket.inet_aton(address)
+        assert request.server_id == SERVER_ID and request.ciaddr == '0.0.0.0'
+        assert renew.xid != discover.xid and renew.ciaddr == address and renew.server_id is None
+        assert release.ciaddr == address and release.server_id == SERVER_ID
+    # own frames received back are not taken for answers, RELEASE has none
+    assert (engine.sent, engine.received) == (12, 9)
+    assert not engine._waiting
+
+
+@pytest.mark.v4
+def test_other_answers(engine):
+    def server(msg):
+        # ACK to DISCOVER and OFFER for other transaction are ignored, the right OFFER is taken
+        other = _reply_v4(msg, 'offer')
+        other.xid += 1
+        return [_reply_v4(msg, 'ack'), other] + _server_v4(msg)
+
+    clients = _clients(1)
+    engine = engine(False, server)
+    engine.run(clients, ['DO'])
+    assert clients[0].failed is None and clients[0].address == '192.168.50.11'
+    assert clients[0].leases == []
+    assert [msg.message_type for msg in engine.socket.sent] == ['DISCOVER']
+
+
+@pytest.mark.v4
+def test_retransmit(engine):
+    transmissions = collections.Counter()
+
+    def server(msg):
+        # answers only the second transmission of each message
+        transmissions[msg.xid, msg.message_type] += 1
+        return _server_v4(msg) if transmissions[msg.xid, msg.message_type] == 2 else []
+
+    clients = _clients(2)
+    engine = engine(False, server, retries=1)
+    engine.run(clients)
+    assert all(client.failed is None and client.leases for client in clients)
+    assert sorted(transmissions.values()) == [2, 2, 2, 2]
+    assert engine.sent == 8
+
+
+@pytest.mark.v4
+def test_give_up(engine):
+    clients = _clients(2)
+    engine = engine(False, lambda msg: [], retries=2)
+    start = time.monotonic()
+    engine.run(clients)
+    # first transmission and two retransmissions, each waiting for the timeout
+    assert time.monotonic() - start >= 0.3
+    assert [client.failed for client in clients] == ['no answer to DISCOVER'] * 2
+    assert [msg.xid for msg in engine.socket.sent].count(clients[0].exchange.xid) == 3
+    assert engine.sent == 6 and not engine._waiting
+
+    # nothing to renew without lease
+    client = _clients(1)[0]
+    engine.run([client], ['renew'])
+    assert client.failed == 'no lease to renew' and engine.sent == 6
+
+
+@pytest.mark.v4
+def test_nak(engine):
+    def server(msg):
+        if msg.message_type == 'REQUEST':
+            return [_reply_v4(msg, 'nak')]
+        return _server_v4(msg)
+
+    clients = _clients(1)
+    engine = engine(False, server)
+    engine.run(clients, ['DORA', 'renew'])
+    assert clients[0].failed == 'NAK' and clients[0].exchange.step is None
+    assert clients[0].leases == []
+    # the client stops, renew is not sent
+    assert [msg.message_type for msg in engine.socket.sent] == ['DISCOVER', 'REQUEST']
+
+
+@pytest.mark.v6
+def test_sarr(engine):
+    clients = _clients(2, ipv6=True)
+    engine = engine(True, _server_v6)
+    engine.run(clients, ['SARR', 'renew'])
+
+    for client in clients:
+        assert client.failed is None and client.exchange.step is None
+        iaid = client.iaids[0]
+        assert client.leases == [{'duid': client.duid, 'iaid': iaid, 'valid_lifetime': 4000,
+                                  'pref_lifetime': 3000, 'address': f'2001:db8:1::{iaid:x}', 'prefix_len': 0}]
+        messages = [msg for msg in engine.socket.sent if msg.client_id == codec.hex_bytes(client.duid)]
+        assert [msg.message_type for msg in messages] == ['SOLICIT', 'REQUEST', 'RENEW']
+        solicit, request, renew = messages
+        assert solicit.server_id is None and solicit.ia_na[0].addresses == []
+        # REQUEST is a new transaction with the server and addresses of ADVERTISE
+        assert request.trid != solicit.trid
+        assert request.server_id == raw(SERVER_DUID)
+        assert [addr.address for addr in request.ia_na[0].addresses] == [f'2001:db8:1::{iaid:x}']
+        assert renew.server_id == raw(SERVER_DUID) and renew.ia_na == request.ia_na
+    assert (engine.sent, engine.received) == (6, 6)
+
+
+@pytest.mark.v6
+@pytest.mark.parametrize('step', ['SOLICIT', 'REQUEST'])
+def test_status_code(engine, step):
+    def server(msg):
+        if msg.message_type == step:
+            return [_reply_v6(DHCP6_Advertise if step == 'SOLICIT' else DHCP6_Reply, msg,
+                              DHCP6OptStatusCode(statuscode=2, statusmsg='no addresses'))]
+        return _server_v6(msg)
+
+    clients = _clients(1, ipv6=True)
+    engine = engine(True, server)
+    engine.run(clients, ['SARR', 'renew'])
+    assert clients[0].failed == 'status code 2: no addresses' and clients[0].exchange.step is None
+    assert clients[0].leases == []
+    assert engine.socket.sent[-1].message_type == step
+
+
+@pytest.mark.parametrize('ipv6', [False, True])
+def test_options(engine, ipv6):
+    clients = _clients(1, ipv6=ipv6)
+    clients[0].options = [(60 if not ipv6 else 16, b'PXE')]
+    engine = engine(ipv6, _server_v6 if ipv6 else _server_v4)
+    engine.run(clients)
+    assert clients[0].failed is None
+    # vendor class goes in every message, e.g. to put the client in a class
+    assert [msg.options.get(60 if not ipv6 else 16) for msg in engine.socket.sent] == [b'PXE', b'PXE']
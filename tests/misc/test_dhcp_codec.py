@@ -0,0 +1,147 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Round trip of the fast DHCP codec against scapy.
+   Messages built by dhcp_codec have to be byte-identical to scapy builds of the same content
+   and views of server messages built by scapy have to return the same values as scapy dissection.
+"""
+
+# pylint: disable=invalid-name
+
+import pytest
+from scapy.layers.dhcp import BOOTP, DHCP
+from scapy.layers.dhcp6 import DUID_LL, DHCP6_Solicit, DHCP6_Advertise, DHCP6_Request, DHCP6_Renew
+from scapy.layers.dhcp6 import DHCP6_Release, DHCP6_Reply, DHCP6OptClientId, DHCP6OptServerId
+from scapy.layers.dhcp6 import DHCP6OptIA_NA, DHCP6OptIAAddress, DHCP6OptIA_PD, DHCP6OptIAPrefix
+from scapy.layers.dhcp6 import DHCP6OptElapsedTime, DHCP6OptOptReq, DHCP6OptStatusCode
+
+from src.protosupport import dhcp_codec as codec
+
+pytestmark = [pytest.mark.unit]
+
+CHADDR = '00:0c:01:02:03:04'
+CLIENT_DUID = DUID_LL(lladdr=CHADDR)
+SERVER_DUID = DUID_LL(lladdr='f6:f5:f4:f3:f2:01')
+
+
+def _chaddr():
+    return bytes.fromhex(CHADDR.replace(':', ''))
+
+
+@pytest.mark.v4
+@pytest.mark.parametrize('msg_type, fields, options, kwargs', [
+    ('DISCOVER', {}, [('param_req_list', [1, 3, 6])], {'param_req_list': [1, 3, 6]}),
+    ('REQUEST', {}, [('requested_addr', '192.168.50.10'), ('server_id', '192.168.50.1'),
+                     ('client_id', b'\x01' + bytes.fromhex('000c01020304'))],
+     {'requested_addr': '192.168.50.10', 'server_id': '192.168.50.1', 'client_id': '01:00:0c:01:02:03:04'}),
+    ('RELEASE', {'ciaddr': '192.168.50.10', 'flags': 0x8000, 'secs': 3},
+     [('server_id', '192.168.50.1'), (12, b'forge')],
+     {'ciaddr': '192.168.50.10', 'flags': 0x8000, 'secs': 3, 'server_id': '192.168.50.1',
+      'options': [(12, b'forge')]}),
+])
+def test_encode_v4(msg_type, fields, options, kwargs):
+    expected = BOOTP(chaddr=_chaddr(), xid=0x12345678, **fields) / \
+        DHCP(options=[('message-type', msg_type.lower())] + options + ['end'])
+
+    assert codec.encode_v4(msg_type, 0x12345678, CHADDR, **kwargs) == bytes(expected)
+
+
+@pytest.mark.v4
+@pytest.mark.parametrize('msg_type', ['offer', 'ack', 'nak'])
+def test_decode_v4(msg_type):
+    msg = BOOTP(op=2, chaddr=_chaddr(), xid=0x1234, yiaddr='192.168.50.10', siaddr='192.168.50.1',
+                giaddr='192.168.60.1', flags=0x8000) / \
+        DHCP(options=[('message-type', msg_type), ('server_id', '192.168.50.1'), ('lease_time', 4000),
+                      ('router', '192.168.50.1'), 'end', 'pad', 'pad'])
+
+    view = codec.decode_v4(bytes(msg))
+
+    assert view.op == 2
+    assert view.xid == 0x1234
+    assert view.flags == 0x8000
+    assert view.chaddr == CHADDR
+    assert (view.ciaddr, view.yiaddr, view.siaddr, view.giaddr) == \
+        ('0.0.0.0', '192.168.50.10', '192.168.50.1', '192.168.60.1')
+    assert view.message_type == msg_type.upper()
+    assert view.server_id == '192.168.50.1'
+    assert view.lease_time == 4000
+    assert view.options.get(3) == bytes([192, 168, 50, 1])
+    assert codec.OPT4_END not in view.options
+
+
+def _ia_na_scapy(ia):
+    return DHCP6OptIA_NA(iaid=ia.iaid, T1=ia.t1, T2=ia.t2,
+                         ianaopts=[DHCP6OptIAAddress(addr=addr.address, preflft=addr.preferred,
+                                                     validlft=addr.valid) for addr in ia.addresses])
+
+
+def _ia_pd_scapy(ia):
+    return DHCP6OptIA_PD(iaid=ia.iaid, T1=ia.t1, T2=ia.t2,
+                         iapdopt=[DHCP6OptIAPrefix(prefix=pref.prefix, plen=pref.length, preflft=pref.preferred,
+                                                   validlft=pref.valid) for pref in ia.prefixes])
+
+
+IA_NA = codec.IANA(1, 1000, 2000, [codec.IAAddress('2001:db8:1::10', 3000, 4000)], None)
+IA_PD = codec.IAPD(2, 1000, 2000, [codec.IAPrefix('2001:db8:2::', 64, 3000, 4000)], None)
+
+
+@pytest.mark.v6
+@pytest.mark.parametrize('msg_type, layer, server, ia_na, ia_pd', [
+    ('SOLICIT', DHCP6_Solicit, False, [1], [2]),
+    ('REQUEST', DHCP6_Request, True, [IA_NA], [IA_PD]),
+    ('RENEW', DHCP6_Renew, True, [IA_NA], []),
+    ('RELEASE', DHCP6_Release, True, [], [IA_PD]),
+])
+def test_encode_v6(msg_type, layer, server, ia_na, ia_pd):
+    expected = layer(trid=0xabcdef) / DHCP6OptClientId(duid=CLIENT_DUID)
+    if server:
+        expected /= DHCP6OptServerId(duid=SERVER_DUID)
+    for ia in ia_na:
+        expected /= _ia_na_scapy(codec.IANA(ia, 0, 0, [], None) if isinstance(ia, int) else ia)
+    for ia in ia_pd:
+        expected /= _ia_pd_scapy(codec.IAPD(ia, 0, 0, [], None) if isinstance(ia, int) else ia)
+    expected /= DHCP6OptElapsedTime(elapsedtime=10) / DHCP6OptOptReq(reqopts=[23, 24])
+
+    built = codec.encode_v6(msg_type, 0xabcdef, bytes(CLIENT_DUID), server_id=bytes(SERVER_DUID) if server else None,
+                            ia_na=ia_na, ia_pd=ia_pd, elapsed_time=10, oro=[23, 24])
+
+    assert built == bytes(expected)
+
+
+@pytest.mark.v6
+@pytest.mark.parametrize('layer', [DHCP6_Advertise, DHCP6_Reply])
+def test_decode_v6(layer):
+    msg = layer(trid=0x123456) / DHCP6OptClientId(duid=CLIENT_DUID) / DHCP6OptServerId(duid=SERVER_DUID) / \
+        DHCP6OptIA_NA(iaid=1, T1=1000, T2=2000,
+                      ianaopts=[DHCP6OptIAAddress(addr='2001:db8:1::10', preflft=3000, validlft=4000),
+                                DHCP6OptIAAddress(addr='2001:db8:1::11', preflft=3001, validlft=4001)]) / \
+        DHCP6OptIA_NA(iaid=3, T1=0, T2=0,
+                      ianaopts=[DHCP6OptStatusCode(statuscode=2, statusmsg='no addresses')]) / \
+        DHCP6OptIA_PD(iaid=2, T1=1000, T2=2000,
+                      iapdopt=[DHCP6OptIAPrefix(prefix='2001:db8:2::', plen=56, preflft=3000, validlft=4000)]) / \
+        DHCP6OptStatusCode(statuscode=0, statusmsg='all good')
+
+    view = codec.decode_v6(bytes(msg))
+    dissected = layer(bytes(msg))
+
+    assert view.message_type == layer.__name__.split('_')[1].upper()
+    assert view.trid == dissected.trid
+    assert view.client_id == bytes(dissected[DHCP6OptClientId].duid)
+    assert view.server_id == bytes(dissected[DHCP6OptServerId].duid)
+    status = dissected.lastlayer()
+    assert view.status == (status.statuscode, status.statusmsg.decode())
+    assert view.ia_na == [
+        codec.IANA(1, 1000, 2000, [codec.IAAddress('2001:db8:1::10', 3000, 4000),
+                                   codec.IAAddress('2001:db8:1::11', 3001, 4001)], None),
+        codec.IANA(3, 0, 0, [], (2, 'no addresses')),
+    ]
+    assert view.ia_pd == [codec.IAPD(2, 1000, 2000, [codec.IAPrefix('2001:db8:2::', 56, 3000, 4000)], None)]
+    # the same values as scapy dissected
+    ia_na = dissected[DHCP6OptIA_NA]
+    assert [addr.addr for addr in ia_na.ianaopts] == [addr.address for addr in view.ia_na[0].addresses]
+    ia_pd = dissected[DHCP6OptIA_PD]
+    assert (ia_pd.iapdopt[0].prefix, ia_pd.iapdopt[0].plen) == \
+        (view.ia_pd[0].prefixes[0].prefix, view.ia_pd[0].prefixes[0].length)
@@ -0,0 +1,136 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Exchanges of many clients running concurrently in asyncio.
+   Every client keeps its messages in its ExchangeContext, world has them only while the context
+   is active. Responses come from a stub of the packet endpoint, in a different order than the
+   requests went out.
+"""
+
+import asyncio
+import threading
+
+import pytest
+from scapy.layers.dhcp6 import DHCP6_Advertise, DHCP6_Solicit
+from scapy.layers.inet6 import IPv6, UDP
+
+from src import terrain
+from src.forge_cfg import world
+from src.protosupport.exchange_context import ExchangeContext, exchange_defaults
+from src.protosupport.v6 import srv_msg
+
+pytestmark = [pytest.mark.unit]
+
+
+def _solicit(trid):
+    return IPv6(dst='ff02::1:2') / UDP(sport=546, dport=547) / DHCP6_Solicit(trid=trid)
+
+
+def _advertise(trid):
+    return IPv6(src='fe80::1') / UDP(sport=547, dport=546) / DHCP6_Advertise(trid=trid)
+
+
+@pytest.fixture(name='outer')
+def fixture_outer(monkeypatch):
+    """
+    World of a test with exchange state of its own, contexts must leave it as it is.
+    """
+    for name, value in exchange_defaults().items():
+        monkeypatch.setattr(world, name, value, raising=False)
+    values = terrain.values_v6.copy()
+    values.update(cli_duid='outer', ia_id=1)
+    monkeypatch.setattr(world, 'cfg', {'values': values, 'tr_id': None, 'wait_interval': 1, 'iface': 'lo'},
+                        raising=False)
+    monkeypatch.setattr(world, 'loops', {'active': False}, raising=False)
+    monkeypatch.setattr(world.f_cfg, 'persistent_packet_socket', True)
+    return world.climsg, values
+
+
+def test_active_swaps_state(outer):
+    climsg, values = outer
+    ctx = ExchangeContext(cli_duid='client')
+    with ctx.active():
+        assert world.climsg == [] and world.climsg is not climsg
+        assert world.cfg['values']['cli_duid'] == 'client'
+        assert world.cfg['values']['ia_id'] == 1
+        world.climsg.append(_solicit(1))
+        world.cfg['values']['ia_id'] = 2
+        world.srvmsg = [_advertise(1)]
+        with pytest.raises(AssertionError, match='already active'):
+            with ctx.active():
+                pass
+    # the test's own state is back, the client's is kept in the context
+    assert world.climsg is climsg and world.srvmsg == []
+    assert world.cfg['values'] is values and values['ia_id'] == 1
+    assert 'relay' not in world.cfg
+    with ctx.active():
+        assert world.climsg[0].trid == 1 and world.srvmsg[0].trid == 1
+        assert world.cfg['values']['ia_id'] == 2
+
+
+def test_overlapping_exchanges(outer, monkeypatch):
+    climsg, _ = outer
+    # first client gets its response last
+    delays = {1: 0.2, 2: 0.1, 3: 0}
+    seen = []
+
+    async def exchange_packets_async(msgs, timeout, ipv6):
+        assert ipv6 and timeout == 1
+        trid = msgs[0].trid
+        await asyncio.sleep(delays[trid])
+        # nothing of any client is in world while the response is awaited
+        seen.append(world.climsg is climsg and world.srvmsg == [])
+        return [(msgs[0], _advertise(trid))], []
+
+    monkeypatch.setattr(srv_msg, 'exchange_packets_async', exchange_packets_async)
+
+    async def solicit(ctx, trid):
+        with ctx.active():
+            world.climsg = [_solicit(trid)]
+        responses = await srv_msg.send_wait_for_message_async(ctx, 'MUST', True, 'ADVERTISE')
+        with ctx.active():
+            assert world.srvmsg is responses
+            return [msg.trid for msg in world.srvmsg]
+
+    async def clients(contexts):
+        return await asyncio.gather(*[solicit(ctx, trid) for trid, ctx in contexts.items()])
+
+    contexts = {trid: ExchangeContext() for trid in delays}
+    results = asyncio.run(clients(contexts))
+
+    assert results == [[1], [2], [3]]
+    assert seen == [True] * 3
+    for trid, ctx in contexts.items():
+        assert [msg.trid for msg in ctx.attrs['climsg']] == [trid]
+        assert [msg.trid for msg in ctx.attrs['srvmsg']] == [trid]
+    assert world.climsg is climsg and world.srvmsg == []
+
+
+@pytest.mark.usefixtures('outer')
+def test_tcp_exchange_in_executor(monkeypatch):
+    loop_thread = threading.current_thread()
+    sent = []
+
+    def send_over_tcp(msg, address, port):
+        # blocking exchange runs outside of the event loop, with the configuration it needs
+        assert threading.current_thread() is not loop_thread
+        sent.append((msg, address, port, world.f_cfg.srv_ipv6_addr_global))
+        world.blq_trid = 1234
+        return [_advertise(1234)]
+
+    monkeypatch.setattr(srv_msg, 'send_over_tcp', send_over_tcp)
+    monkeypatch.setattr(world, 'blq_trid', None, raising=False)
+    ctx = ExchangeContext()
+    with ctx.active():
+        world.climsg = [_solicit(1)]
+    responses = asyncio.run(srv_msg.send_wait_for_message_async(ctx, 'MUST', True, 'ADVERTISE', protocol='TCP',
+                                                                address='2001:db8::1', port=5547))
+
+    assert sent == [(bytes(DHCP6_Solicit(trid=1)), '2001:db8::1', 5547, world.f_cfg.srv_ipv6_addr_global)]
+    assert [msg.trid for msg in responses] == [1234]
+    assert world.blq_trid == 1234
+    assert ctx.attrs['tcpmsg'] == responses
+    assert world.tcpmsg == []
@@ -0,0 +1,154 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Index of Kea log messages.
+   The same messages are indexed from kea.log text and from journalctl -o export output,
+   counts and first messages are then asked for within time and record bounds. The log
+   assertion built on the index is run with LocalTransport on a log in a temporary directory.
+"""
+
+import datetime
+
+import pytest
+
+from src.forge_cfg import world
+from src.protosupport import multi_protocol_functions
+from src.protosupport.kea_log import KeaLogIndex, parse_timestamp
+from src.softwaresupport.transport import LocalTransport
+
+pytestmark = [pytest.mark.unit]
+
+LOG = '''2023-06-01 10:00:00.100 INFO  [kea-dhcp4.dhcp4/1234.139] DHCP4_STARTED Kea DHCPv4 server version 2.3.8 started
+2023-06-01 10:00:01.000 INFO  [kea-dhcp4.ha-hooks/1234.139] HA_STATE_TRANSITION server transitions from WAITING to SYNCING state
+2023-06-01 10:00:02.000 INFO  [kea-dhcp4.ha-hooks/1234.139] HA_SYNC_SUCCESSFUL lease database synchronization with server1 completed successfully
+2023-06-01 10:00:03.000 INFO  [kea-dhcp4.ha-hooks/1234.139] HA_STATE_TRANSITION server transitions from SYNCING to READY state
+2023-06-01 10:00:02.900 DEBUG [kea-dhcp4.packets/1234.140] DHCP4_BUFFER_RECEIVED received buffer from 192.168.50.2:68
+2023-06-01 10:00:04.000 ERROR [kea-dhcp4.dhcp4/1234.139] DHCP4_CONFIG_LOAD_FAIL configuration error:
+    continuation of the multi line message
+2023-06-01 10:00:05.000 INFO  [kea-dhcp4.ha-hooks/1234.139] HA_STATE_TRANSITION server transitions from READY to HOT-STANDBY state
+'''
+
+
+def _seconds(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def _journal_export(log):
+    """
+    journalctl -o export of the log: Kea timestamps are not in the messages, entries have their own.
+    """
+    entries = []
+    for line in log.splitlines():
+        stamp, message = line[:23], line[24:]
+        if not stamp[0].isdigit():
+            # continuation lines are logged as parts of their messages
+            continue
+        entries.append(f'__CURSOR=s=1;i={len(entries)}\n'
+                       f'__REALTIME_TIMESTAMP={int(_seconds(stamp) * 1e6)}\n'
+                       f'_SYSTEMD_UNIT=isc-kea-dhcp4-server.service\n'
+                       f'MESSAGE={message}\n')
+    return '\n'.join(entries)
+
+
+@pytest.fixture(name='index', params=['text', 'journal'])
+def fixture_index(request):
+    if request.param == 'text':
+        return KeaLogIndex.from_text(LOG)
+    return KeaLogIndex.from_journal_export(_journal_export(LOG))
+
+
+def test_parse(index):
+    assert len(index) == 7
+    assert index.msgid_counts() == {'DHCP4_STARTED': 1, 'HA_STATE_TRANSITION': 3, 'HA_SYNC_SUCCESSFUL': 1,
+                                    'DHCP4_BUFFER_RECEIVED': 1, 'DHCP4_CONFIG_LOAD_FAIL': 1}
+    record = index.first('DHCP4_CONFIG_LOAD_FAIL')
+    assert (record.severity, record.logger, record.timestamp) == \
+        ('ERROR', 'kea-dhcp4.dhcp4', _seconds('2023-06-01 10:00:04'))
+    assert index.text(record).endswith('DHCP4_CONFIG_LOAD_FAIL configuration error:')
+    record = index.first('DHCP4_STARTED')
+    assert (record.row, record.offset, record.timestamp) == (0, 0, pytest.approx(_seconds('2023-06-01 10:00:00.1')))
+    assert index.first('NOT_LOGGED') is None and index.count('NOT_LOGGED') == 0
+
+
+def test_offsets():
+    index = KeaLogIndex.from_text(LOG)
+    data = LOG.encode()
+    for row in range(len(index)):
+        record = index.record(row)
+        assert data[record.offset:].startswith(index.text(record).encode())
+    # continuation line is not indexed, but counted in line numbers
+    assert index.last('HA_STATE_TRANSITION').line == 7
+
+
+def test_time_bounds(index):
+    assert index.count('HA_STATE_TRANSITION', after=_seconds('2023-06-01 10:00:01')) == 2
+    assert index.count('HA_STATE_TRANSITION', before=_seconds('2023-06-01 10:00:03')) == 1
+    assert index.count('HA_STATE_TRANSITION', after=datetime.datetime(2023, 6, 1, 10, 0, 0),
+                       before=datetime.datetime(2023, 6, 1, 10, 0, 4)) == 2
+    assert index.count('HA_STATE_TRANSITION', after=_seconds('2023-06-01 10:00:05')) == 0
+    assert index.first('HA_STATE_TRANSITION', after=_seconds('2023-06-01 10:00:02.5')).row == 3
+    # message logged by another thread out of order is not before the one logged earlier
+    assert index.count('DHCP4_BUFFER_RECEIVED', after=_seconds('2023-06-01 10:00:02.950')) == 1
+
+
+def test_record_bounds(index):
+    sync = index.first('HA_SYNC_SUCCESSFUL')
+    assert index.count('HA_STATE_TRANSITION', after=sync) == 2
+    assert index.count('HA_STATE_TRANSITION', before=sync) == 1
+    first = index.first('HA_STATE_TRANSITION', after=sync)
+    assert 'SYNCING to READY' in index.text(first)
+    assert index.first('HA_STATE_TRANSITION', after=first).row == 6
+    assert index.count('HA_STATE_TRANSITION', after=first, before=sync) == 0
+    assert [record.row for record in index.all('HA_STATE_TRANSITION', after=sync)] == [3, 6]
+
+
+def test_add_lines():
+    lines = LOG.splitlines()
+    index = KeaLogIndex(lines[:2])
+    index.add_lines()
+    assert index.count('HA_STATE_TRANSITION') == 1
+    index.lines.extend(lines[2:])
+    index.add_lines()
+    assert len(index) == 7
+    assert index.record(6).offset == LOG.encode().index(lines[-1].encode())
+
+
+def test_journal_timestamp():
+    now = datetime.datetime.now().replace(microsecond=0)
+    line = f'{now:%b %d %H:%M:%S}.250 host kea-dhcp4[1234]: INFO  [kea-dhcp4.dhcp4.1234] DHCP4_STARTED started'
+    assert parse_timestamp(line) == now.timestamp() + 0.25
+    assert parse_timestamp('no time') is None
+
+
+@pytest.fixture(name='log_file')
+def fixture_log_file(tmp_path, monkeypatch):
+    """
+    Log in a temporary directory, commands meant for the server run on this machine without sudo.
+    """
+    log_file = tmp_path / 'kea.log'
+    log_file.write_text(LOG)
+    local = LocalTransport()
+
+    def sudo_command(cmd, destination_host=None, hide_all=False, ignore_errors=False, combine_stderr=True):
+        return local.execute(cmd, destination_host, None, None, hide_all=hide_all, ignore_errors=ignore_errors,
+                             combine_stderr=combine_stderr)
+
+    monkeypatch.setattr(multi_protocol_functions, 'fabric_sudo_command', sudo_command)
+    monkeypatch.setattr(world.f_cfg, 'install_method', 'make')
+    monkeypatch.setattr(world.f_cfg, 'log_mirror', False)
+    return str(log_file)
+
+
+def test_log_contains_message(log_file):
+    multi_protocol_functions.log_contains_message('HA_STATE_TRANSITION', log_file=log_file, destination='localhost')
+    multi_protocol_functions.log_contains_message('HA_STATE_TRANSITION', 2, after='HA_SYNC_SUCCESSFUL',
+                                                  log_file=log_file, destination='localhost')
+    with pytest.raises(AssertionError, match='HA_STATE_TRANSITION after HA_SYNC_SUCCESSFUL a number of 3 times'):
+        multi_protocol_functions.log_contains_message('HA_STATE_TRANSITION', 3, after='HA_SYNC_SUCCESSFUL',
+                                                      log_file=log_file, destination='localhost')
+    with pytest.raises(AssertionError, match='contain message HA_MAINTENANCE_STARTED, but'):
+        multi_protocol_functions.log_contains_message('DHCP4_STARTED', after='HA_MAINTENANCE_STARTED',
+                                                      log_file=log_file, destination='localhost')
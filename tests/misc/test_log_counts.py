@@ -0,0 +1,81 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Counting many log patterns in one remote command.
+   The command is run on this machine with LocalTransport on a log in a temporary directory,
+   every count has to be the same as the count of grep -c with that pattern alone.
+"""
+
+import subprocess
+
+import pytest
+
+from src.forge_cfg import world
+from src.protosupport import multi_protocol_functions
+from src.softwaresupport.transport import LocalTransport
+
+pytestmark = [pytest.mark.unit]
+
+LOG = '''2023-06-01 10:00:00.001 INFO  [kea-dhcp4.dhcp4/1234.139] DHCP4_STARTED Kea DHCPv4 server version 2.3.8 started
+2023-06-01 10:00:01.002 INFO  [kea-dhcp4.leases/1234.139] DHCP4_LEASE_ALLOC [hwtype=1 ff:01:02:03:ff:04], cid=[no info], tid=0x1: lease 192.168.50.1 has been allocated
+2023-06-01 10:00:01.003 DEBUG [kea-dhcp4.packets/1234.139] DHCP4_PACKET_SEND [hwtype=1 ff:01:02:03:ff:04], cid=[no info], tid=0x1: trying to send packet DHCPOFFER (type 2)
+2023-06-01 10:00:02.004 INFO  [kea-dhcp4.leases/1234.139] DHCP4_LEASE_ALLOC [hwtype=1 ff:01:02:03:ff:05], cid=[no info], tid=0x2: lease 192.168.50.2 has been allocated
+2023-06-01 10:00:03.005 ERROR [kea-dhcp4.dhcp4/1234.139] DHCP4_CONFIG_LOAD_FAIL configuration error using file: /etc/kea/kea-dhcp4.conf, reason: "subnet" is missing
+'''
+
+PATTERNS = [
+    'DHCP4_LEASE_ALLOC',
+    'DHCP4_LEASE_ALLOC.*192.168.50.2',
+    r'tid=0x[0-9]\+: lease',
+    'DHCP4_LEASE_ALLOC [hwtype=1 ff:01:02:03:ff:04]',
+    r'\(DHCPOFFER\|DHCPACK\)',
+    'reason: "subnet" is missing',
+    'type 2)',
+    'not in the log',
+    '-x',
+]
+
+
+@pytest.fixture(name='log_file')
+def fixture_log_file(tmp_path, monkeypatch):
+    """
+    Log in a temporary directory, commands meant for the server run on this machine without sudo.
+    """
+    log_file = tmp_path / 'kea.log'
+    log_file.write_text(LOG)
+    local = LocalTransport()
+
+    def sudo_command(cmd, destination_host=None, hide_all=False, ignore_errors=False, combine_stderr=True):
+        return local.execute(cmd, destination_host, None, None, hide_all=hide_all, ignore_errors=ignore_errors,
+                             combine_stderr=combine_stderr)
+
+    monkeypatch.setattr(multi_protocol_functions, 'fabric_sudo_command', sudo_command)
+    monkeypatch.setattr(world.f_cfg, 'install_method', 'make')
+    monkeypatch.setattr(world.f_cfg, 'log_mirror', False)
+    return str(log_file)
+
+
+def _grep_count(pattern, log_file):
+    result = subprocess.run(['grep', '-c', '-e', pattern, log_file], capture_output=True, text=True, check=False)
+    return int(result.stdout or 0)
+
+
+def test_counts_like_grep(log_file):
+    counts = multi_protocol_functions.get_line_counts_in_log(PATTERNS, log_file, destination='localhost')
+    assert counts == [_grep_count(pattern, log_file) for pattern in PATTERNS]
+    assert counts[:3] == [2, 1, 2]
+
+
+def test_rejected_pattern(log_file):
+    # grep rejects the pattern, other patterns are still counted
+    patterns = ['DHCP4_LEASE_ALLOC', r'\(unmatched', 'DHCP4_STARTED']
+    assert multi_protocol_functions.get_line_counts_in_log(patterns, log_file, destination='localhost') == [2, 0, 1]
+
+
+def test_missing_log(log_file):
+    assert multi_protocol_functions.get_line_counts_in_log(['DHCP4'], log_file + '.missing',
+                                                           destination='localhost') == [0]
+    assert not multi_protocol_functions.get_line_counts_in_log([], log_file, destination='localhost')
@@ -0,0 +1,146 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Incremental counting of log lines.
+   Counting commands run on this machine with LocalTransport on logs in a temporary directory,
+   which are appended to, rotated and truncated between counts. journalctl is replaced by a script
+   giving entries of a file with their cursors.
+"""
+
+# pylint: disable=protected-access
+
+import os
+
+import pytest
+
+from src.protosupport import log_cursor
+from src.protosupport.log_cursor import LogCursors
+from src.softwaresupport.transport import LocalTransport
+
+pytestmark = [pytest.mark.unit]
+
+# entries are lines "cursor<TAB>message", --after-cursor shows only the ones after that cursor
+FAKE_JOURNALCTL = '''#!/bin/sh
+after=
+for a in "$@"; do
+    case "$a" in --after-cursor=*) after="${a#--after-cursor=}" ;; esac
+done
+awk -F '\\t' -v after="$after" '
+    after == "" || seen { print $2; last = $1; next }
+    $1 == after { seen = 1 }
+    END { if (last != "") print "-- cursor: " last }' "$(dirname "$0")/journal"
+'''
+
+
+class _Log:
+    """
+    Log file of the test and commands sent to count in it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.commands = []
+
+    def write(self, text, mode='a'):
+        with open(self.path, mode, encoding='utf-8') as f:
+            f.write(text)
+
+
+@pytest.fixture(name='log')
+def fixture_log(tmp_path, monkeypatch):
+    log = _Log(str(tmp_path / 'kea.log'))
+    journalctl = tmp_path / 'journalctl'
+    journalctl.write_text(FAKE_JOURNALCTL)
+    journalctl.chmod(0o755)
+    local = LocalTransport()
+
+    def sudo_command(cmd, destination_host=None, hide_all=False, ignore_errors=False, combine_stderr=True):
+        log.commands.append(cmd)
+        cmd = f'journalctl() {{ {journalctl} "$@"; }}\n{cmd}'
+        return local.execute(cmd, destination_host, None, None, hide_all=hide_all, ignore_errors=ignore_errors,
+                             combine_stderr=combine_stderr)
+
+    monkeypatch.setattr(log_cursor, 'fabric_sudo_command', sudo_command)
+    return log
+
+
+def _cursor(cursors, log, line):
+    return cursors._cursors[('localhost', log.path, line)]
+
+
+def test_incremental(log):
+    cursors = LogCursors()
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 0
+    log.write('DHCP4_LEASE_ALLOC 1\nDHCP4_STARTED\n')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 1
+    identity, offset, count = _cursor(cursors, log, 'ALLOC')
+    assert (offset, count) == (os.path.getsize(log.path), 1)
+    assert identity.startswith(f'{os.stat(log.path).st_ino}-')
+
+    # line being written is left for the next count
+    log.write('DHCP4_LEASE_ALLOC 2\nDHCP4_LEASE_AL')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 2
+    assert _cursor(cursors, log, 'ALLOC')[1] == os.path.getsize(log.path) - len('DHCP4_LEASE_AL')
+    log.write('LOC 3\n')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 3
+    assert f'o={offset}\n' in log.commands[-2]
+
+    # other patterns have their own cursors
+    assert cursors.count_in_file('STARTED', log.path, 'localhost') == 1
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 3
+
+
+def test_rotated(log):
+    cursors = LogCursors()
+    log.write('DHCP4_LEASE_ALLOC 1\nDHCP4_LEASE_ALLOC 2\n')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 2
+    os.rename(log.path, log.path + '.1')
+    # new file is as long as the old one, only its identity tells it is another file
+    log.write('DHCP4_LEASE_ALLOC 3\nDHCP4_STARTED     x\n')
+    assert os.path.getsize(log.path) == os.path.getsize(log.path + '.1')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 1
+    os.remove(log.path)
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 0
+
+
+def test_truncated(log):
+    cursors = LogCursors()
+    log.write('DHCP4_LEASE_ALLOC 1\nDHCP4_LEASE_ALLOC 2\n')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 2
+    log.write('DHCP4_LEASE_ALLOC 3\n', mode='w')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 1
+    # rewritten in place (same inode) and grown past the previous offset, its first line tells it changed
+    log.write('DHCP4_STARTED\n', mode='r+')
+    log.write('DHCP4_LEASE_ALLOC 4\nDHCP4_LEASE_ALLOC 5\n')
+    assert cursors.count_in_file('ALLOC', log.path, 'localhost') == 2
+
+
+def test_journal(log, tmp_path):
+    cursors = LogCursors()
+    journal = tmp_path / 'journal'
+    journal.write_text('s=1;i=1\tDHCP4_LEASE_ALLOC old\n'
+                       's=1;i=2\tDHCP4_STARTED\n')
+    # entries logged before the server was cleared are not counted
+    cursors.start_journal('s=1;i=2', 'localhost')
+    assert cursors.count_in_journal('ALLOC', 'kea-dhcp4', 'localhost') == 0
+    assert "--after-cursor='s=1;i=2'" in log.commands[-1]
+    # nothing new, the next count is still scoped
+    assert cursors.count_in_journal('ALLOC', 'kea-dhcp4', 'localhost') == 0
+    assert "--after-cursor='s=1;i=2'" in log.commands[-1]
+
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write('s=1;i=3\tDHCP4_LEASE_ALLOC new\n'
+                's=1;i=4\tDHCP4_LEASE_ALLOC new\n')
+    assert cursors.count_in_journal('ALLOC', 'kea-dhcp4', 'localhost') == 2
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write('s=1;i=5\tDHCP4_LEASE_ALLOC newer\n')
+    assert cursors.count_in_journal('ALLOC', 'kea-dhcp4', 'localhost') == 3
+    assert "--after-cursor='s=1;i=4'" in log.commands[-1]
+    assert cursors._cursors[('localhost', 'kea-dhcp4', 'ALLOC')] == ('s=1;i=5', 3)
+
+    # journal empty when the server was cleared is counted whole
+    cursors.start_journal(None, 'localhost')
+    assert cursors.journal_scope('localhost') == ''
+    assert cursors.count_in_journal('ALLOC', 'kea-dhcp4', 'localhost') == 4
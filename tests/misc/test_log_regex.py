@@ -0,0 +1,137 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Log patterns matched in log mirror against grep.
+   Patterns are passed to grep in a here-document, log mirror compiles them to python regular
+   expressions. Both have to match the same lines of a log and reject the same patterns.
+"""
+
+# pylint: disable=protected-access
+
+import subprocess
+
+import pytest
+
+from src.protosupport import log_mirror
+
+pytestmark = [pytest.mark.unit]
+
+LOG = r'''2023-06-01 10:00:00.001 INFO  [kea-dhcp4.dhcp4/1234.139] DHCP4_STARTED Kea DHCPv4 server version 2.3.8 started
+2023-06-01 10:00:01.002 DEBUG [kea-dhcp4.packets/1234.139] DHCP4_PACKET_SEND [hwtype=1 ff:01:02:03:ff:04], cid=[no info], tid=0x1: trying to send packet DHCPOFFER (type 2)
+2023-06-01 10:00:01.003 DEBUG [kea-dhcp4.packets/1234.139] DHCP4_PACKET_SEND [hwtype=1 ff:01:02:03:ff:04], cid=[no info], tid=0x1: trying to send packet DHCPACK (type 5)
+2023-06-01 10:00:01.004 INFO  [kea-dhcp4.leases/1234.139] DHCP4_LEASE_ALLOC [hwtype=1 ff:01:02:03:ff:04], cid=[no info], tid=0x1: lease 192.168.50.1 has been allocated for 4000 seconds
+2023-06-01 10:00:02.005 DEBUG [kea-dhcp6.dhcp6/1235.140] DHCP6_SUBNET_SELECTION_FAILED duid=[00:03:00:01:f6:f5:f4:f3:f2:01], tid=0x2: failed to select subnet for the client
+2023-06-01 10:00:02.006 DEBUG [kea-dhcp6.ddns/1235.140] DHCP6_DDNS_RESPONSE_FQDN_DATA duid=[00:03:00:01:f6:f5:f4:f3:f2:01], tid=0x2: including FQDN option in the server's response: type=OPTION_CLIENT_FQDN, flags: [N: 0][S: 1][O: 0], FQDN: [name1.example.com.]
+2023-06-01 10:00:03.007 INFO  [kea-dhcp6.ha-hooks/1235.140] HA_LEASES_SYNC_LEASE_PAGE_RECEIVED received 15 leases from server1
+2023-06-01 10:00:03.008 ERROR [kea-dhcp-ddns.d2-to-dns/1236.141] DHCP_DDNS_FORWARD_ADD_REJECTED DNS Request ID 0x1234 update message to add a forward DNS entry rejected by server 2001:db8::1 port:53
+[ { "result": 0, "text": "IPv4 lease added." } ]
+adding an RR at '0.5.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.1.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa' PTR sth6.six.example.com.
+*** starred line ***
+a+b a?b a|b a{2} aa
+tab	separated	line
+back\slash and $HOME and `quotes`
+'''
+
+PATTERNS = [
+    # used in tests
+    r'DEBUG \[kea-dhcp4\.packets',
+    r'INFO  \[kea-dhcp6.dhcp6',
+    r'ERROR \[kea-dhcp-ddns.d2-to-dns',
+    r'FQDN: \[name1\.example\.com\.\]',
+    r'HA_LEASES_SYNC_LEASE_PAGE_RECEIVED received [0-9][0-9]* leases ',
+    'DHCP6_SUBNET_SELECTION_FAILED.*failed to select subnet for the client',
+    r'\[ { "result": 0, "text": "IPv4 lease added\." } \]',
+    'adding an RR at \'0.5.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.1.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa\' '
+    'PTR sth6.six.example.com.',
+    'flags: [N: 0][S: 1][O: 0]',
+    # groups and alternatives
+    r'\(DHCPOFFER\|DHCPACK\)',
+    r'packet \(DHCPOFFER\|DHCPACK\) (type [25])',
+    r'\(kea-dhcp4\|kea-dhcp6\)\.\(leases\|ha-hooks\)',
+    r'DHCP4_STARTED\|DHCP6_DDNS',
+    r'\(0\.\)\{4\}',
+    # intervals
+    r'0x[0-9]\{4\}',
+    r'a\{2\}',
+    r'[0-9]\{3,\}\.[0-9]\{1,3\}',
+    r'ff:\(0[1-4]:\)\{3\}ff',
+    # star, anchors and other special characters
+    '*** starred',
+    r'\(*** starred\)',
+    'a**',
+    r'a*\{2\}',
+    r'\(a \)*\+',
+    r'[0-9]\{1\}\{2\}',
+    r'\+b',
+    r'\{2\}',
+    r'a\|\?b',
+    '^*',
+    'a*b',
+    'a+b',
+    'a?b',
+    'a|b',
+    r'a\+b',
+    r'a\?b',
+    '^2023-06-01 10:00:0[12]',
+    '^[[]',
+    'seconds$',
+    r'\(seconds$\|server1$\)',
+    'x$y',
+    # bracket expressions
+    '[]] ]$',
+    '[^0-9a-z ]',
+    r'[\]',
+    'tid=0x[[:xdigit:]]*:',
+    '[[:upper:]][[:upper:]]*_[[:upper:]_]*',
+    '[[:space:]]separated',
+    '[.]com',
+    '[a-]b',
+    # word boundaries and escapes
+    r'\<lease\>',
+    r'\bserver\w',
+    r'\w\+_FQDN',
+    r'\s\S*six',
+    # here-document expansions
+    r'back\\slash',
+    r'\$HOME',
+    'DHCP4_${FORGE_UNSET}STARTED',
+    r'\`quotes\`',
+    # rejected by grep
+    r'\(unmatched',
+    r'x\{2',
+    '[unclosed',
+]
+
+
+@pytest.fixture(name='log_file', scope='module')
+def fixture_log_file(tmp_path_factory):
+    log_file = tmp_path_factory.mktemp('log') / 'kea.log'
+    log_file.write_text(LOG)
+    return str(log_file)
+
+
+def _grep(pattern, log_file):
+    """
+    Numbers of lines matched by grep with the pattern passed like forge does it, None if grep rejects it.
+    """
+    cmd = f'grep -n -e "$(cat <<EOF\n{pattern}\nEOF\n)" {log_file}'
+    result = subprocess.run(['/bin/sh', '-c', cmd], capture_output=True, text=True, check=False)
+    if result.returncode > 1:
+        return None
+    return [int(line.split(':', 1)[0]) for line in result.stdout.splitlines()]
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_like_grep(pattern, log_file):
+    expected = _grep(pattern, log_file)
+    regex = log_mirror.grep_regex(pattern)
+    if expected is None:
+        assert regex is None
+        return
+    assert regex is not None, f'{pattern!r} compiled to {log_mirror._bre_to_re(pattern)!r}'
+    lines = LOG.splitlines()
+    assert [i + 1 for i, line in enumerate(lines) if regex.search(line)] == expected, \
+        f'{pattern!r} compiled to {regex.pattern!r}'
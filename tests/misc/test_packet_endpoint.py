@@ -0,0 +1,165 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Matching of answers on persistent packet endpoint.
+   The endpoint socket is replaced by one handing sent packets to a responder and receiving
+   its replies dissected from bytes, together with the sent packets themselves like on a real
+   interface.
+"""
+
+# pylint: disable=protected-access
+
+import asyncio
+import queue
+import socket
+import time
+
+import pytest
+from scapy.compat import raw
+from scapy.config import conf
+from scapy.layers.dhcp import BOOTP, DHCP
+from scapy.layers.dhcp6 import DHCP6_Advertise, DHCP6_Solicit
+from scapy.layers.inet import IP, UDP
+from scapy.layers.inet6 import IPv6
+from scapy.layers.l2 import Ether
+
+from src.protosupport import packet_endpoint
+from src.protosupport.packet_endpoint import PacketEndpoint
+
+pytestmark = [pytest.mark.unit]
+
+
+def _discover(xid):
+    return Ether(dst='ff:ff:ff:ff:ff:ff', src='00:0c:01:02:03:04') / IP(src='0.0.0.0', dst='255.255.255.255') / \
+        UDP(sport=68, dport=67) / BOOTP(chaddr=b'\x00\x0c\x01\x02\x03\x04', xid=xid) / \
+        DHCP(options=[('message-type', 'discover'), 'end'])
+
+
+def _offer(xid):
+    return Ether(dst='ff:ff:ff:ff:ff:ff', src='f6:f5:f4:f3:f2:01') / IP(src='192.168.50.1', dst='255.255.255.255') / \
+        UDP(sport=67, dport=68) / BOOTP(op=2, yiaddr='192.168.50.10', xid=xid) / \
+        DHCP(options=[('message-type', 'offer'), 'end'])
+
+
+def _solicit(trid):
+    return IPv6(src='fe80::2', dst='ff02::1:2') / UDP(sport=546, dport=547) / DHCP6_Solicit(trid=trid)
+
+
+def _advertise(trid):
+    return IPv6(src='fe80::1', dst='fe80::2') / UDP(sport=547, dport=546) / DHCP6_Advertise(trid=trid)
+
+
+class _FakeSocket:
+    """
+    Socket receiving sent packets and the replies of responder to them, as bytes dissected again.
+    """
+    def __init__(self, responder):
+        self.responder = responder
+        self.sent = []
+        self._packets = queue.Queue()
+        # select() of the receiver thread waits on the socket pair
+        self._receiving, self._sending = socket.socketpair()
+
+    def fileno(self):
+        return self._receiving.fileno()
+
+    def send(self, packet):
+        self.sent.append(packet)
+        for received in [packet] + self.responder(packet):
+            self._packets.put(type(received)(raw(received)))
+            self._sending.send(b'.')
+
+    def recv(self):
+        self._receiving.recv(1)
+        return self._packets.get_nowait()
+
+    def close(self):
+        self._receiving.close()
+        self._sending.close()
+
+
+@pytest.fixture(name='endpoint')
+def fixture_endpoint(monkeypatch):
+    """
+    Open endpoint with the fake socket, its responder is set by the test.
+    """
+    # as forge sets them in tests: DHCPv4 is sent from 0.0.0.0, DHCPv6 to multicast
+    monkeypatch.setattr(conf, 'checkIPaddr', False)
+    monkeypatch.setattr(conf, 'checkIPsrc', False)
+    fake = _FakeSocket(lambda packet: [])
+    monkeypatch.setattr(PacketEndpoint, '_open', lambda self: fake)
+    endpoint = PacketEndpoint('lo', False, packet_endpoint.DHCP_PORTS)
+    yield endpoint
+    endpoint.close()
+
+
+def test_expand():
+    packets, pending = packet_endpoint._expand([_discover([1, 2, 3]), _solicit(7)])
+    assert [packet[BOOTP].xid for packet in packets[:3]] == [1, 2, 3]
+    assert len(packets) == 4
+    assert sorted(len(group) for group in pending.values()) == [1, 1, 1, 1]
+    assert pending[_discover(2).hashret()] == [packets[1]]
+
+    # dissected packet is sent as it is, e.g. the one made from a template
+    dissected = Ether(raw(_discover(5)))
+    packets, pending = packet_endpoint._expand([dissected, dissected])
+    assert packets[0] is dissected and packets[1] is dissected
+    assert pending == {dissected.hashret(): [dissected, dissected]}
+
+
+@pytest.mark.parametrize('request_, reply, other', [
+    (_discover(0x1234), _offer(0x1234), _offer(0x1235)),
+    (_solicit(0x1234), _advertise(0x1234), _advertise(0x1235)),
+])
+def test_match(request_, reply, other, monkeypatch):
+    monkeypatch.setattr(conf, 'checkIPaddr', False)
+    monkeypatch.setattr(conf, 'checkIPsrc', False)
+    packets, pending = packet_endpoint._expand([request_])
+    answered = []
+    # own packet received back and reply with other transaction ID are not answers
+    for received in [request_, other]:
+        packet_endpoint._match(type(received)(raw(received)), pending, answered)
+        assert not answered and pending
+    packet_endpoint._match(type(reply)(raw(reply)), pending, answered)
+    assert answered == [(packets[0], answered[0][1])] and raw(answered[0][1]) == raw(reply)
+    assert not pending
+
+
+def test_exchange(endpoint):
+    endpoint.socket.responder = lambda packet: [_offer(packet[BOOTP].xid + 1), _offer(packet[BOOTP].xid)]
+    start = time.monotonic()
+    answered, unanswered = endpoint.exchange([_discover(10)], timeout=5)
+    # all answers are in, no waiting for the timeout
+    assert time.monotonic() - start < 1
+    assert not unanswered
+    assert [(sent[BOOTP].xid, reply[BOOTP].xid, reply[BOOTP].op) for sent, reply in answered] == [(10, 10, 2)]
+
+
+def test_exchange_timeout(endpoint):
+    # only odd transaction IDs are answered
+    endpoint.socket.responder = lambda packet: [_offer(packet[BOOTP].xid)] if packet[BOOTP].xid % 2 else []
+    start = time.monotonic()
+    answered, unanswered = endpoint.exchange([_discover([1, 2, 3, 4])], timeout=0.5)
+    assert time.monotonic() - start >= 0.5
+    assert sorted(sent[BOOTP].xid for sent, _ in answered) == [1, 3]
+    assert [packet[BOOTP].xid for packet in unanswered] == [2, 4]
+    assert len(endpoint.socket.sent) == 4
+
+
+def test_exchange_async(endpoint):
+    replies = []
+    endpoint.socket.responder = lambda packet: replies.pop(0) if replies else []
+
+    async def exchanges():
+        # the second exchange is answered first and the first one never
+        replies.extend([[], [_advertise(2)]])
+        return await asyncio.gather(endpoint.exchange_async([_solicit(1)], 0.5),
+                                    endpoint.exchange_async([_solicit(2)], 5))
+
+    (answered1, unanswered1), (answered2, unanswered2) = asyncio.run(exchanges())
+    assert not answered1 and [packet.trid for packet in unanswered1] == [1]
+    assert [(sent.trid, reply.trid) for sent, reply in answered2] == [(2, 2)] and not unanswered2
+    assert not endpoint._keyed_waiters
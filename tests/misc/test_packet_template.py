@@ -0,0 +1,144 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Messages made from packet templates against scapy.
+   A message filled in a template has to be byte-identical to the message scapy builds with the same
+   values, dissected to the same layers, and changes steps make after thaw() (message fields, raw data
+   appended) have to give the same message as the same changes of the message built by scapy.
+"""
+
+import struct
+
+import pytest
+from scapy.compat import raw
+from scapy.layers.dhcp import BOOTP, DHCP
+from scapy.layers.dhcp6 import DUID_LL, DHCP6_Solicit, DHCP6_Request, DHCP6OptClientId, DHCP6OptServerId
+from scapy.layers.dhcp6 import DHCP6OptIA_NA, DHCP6OptIA_PD, DHCP6OptElapsedTime, DHCP6OptOptReq
+from scapy.layers.inet import IP, UDP
+from scapy.layers.inet6 import IPv6
+from scapy.layers.l2 import Ether
+from scapy.packet import Raw
+from scapy.volatile import RandShort
+
+from src.protosupport import packet_template
+from src.protosupport.packet_template import NotTemplatable, PacketTemplates, thaw
+
+pytestmark = [pytest.mark.unit]
+
+HW = '00:0c:01:02:03:04'
+SERVER_DUID = DUID_LL(lladdr='f6:f5:f4:f3:f2:01')
+
+
+def _v4_message(xid, chaddr, options):
+    msg = Ether(dst='ff:ff:ff:ff:ff:ff', src=HW) / IP(src='0.0.0.0', dst='255.255.255.255') / UDP(sport=68, dport=67)
+    msg /= BOOTP(chaddr=chaddr, giaddr='0.0.0.0', flags=0, secs=0, hops=0, xid=xid)
+    msg /= DHCP(options=options + ['end'])
+    return msg
+
+
+def _v4_template(xid, chaddr, options):
+    key, values = packet_template.dhcp4_layout(('head',), options)
+    values['xid'] = struct.pack('!I', xid)
+    values['chaddr'] = (chaddr + b'\x00' * 16)[:16]
+    return key, values
+
+
+@pytest.mark.v4
+@pytest.mark.parametrize('options', [
+    [('message-type', 'discover')],
+    [('message-type', 'request'), ('requested_addr', '192.168.50.10'), ('server_id', '192.168.50.1'),
+     ('client_id', b'\x01\x00\x0c\x01\x02\x03\x04'), ('param_req_list', [1, 3, 6])],
+])
+def test_fill_v4(options):
+    templates = PacketTemplates()
+    first = _v4_message(0x1234, b'\x00\x0c\x01\x02\x03\x04', options)
+    key, values = _v4_template(0x1234, b'\x00\x0c\x01\x02\x03\x04', options)
+    templates.add(key, first, packet_template.dhcp4_offsets(raw(first)), values)
+    template = templates.get(key)
+    assert template is not None
+
+    # the same shape with other transaction ID, chaddr and client-id
+    options = [('client_id', b'\x01\x00\x0c\x0a\x0b\x0c\x0d') if option[0] == 'client_id' else option
+               for option in options]
+    other_key, other_values = _v4_template(0xabcdef, b'\x00\x0c\x0a\x0b\x0c\x0d', options)
+    assert other_key == key
+    filled = template.fill(other_values)
+    expected = _v4_message(0xabcdef, b'\x00\x0c\x0a\x0b\x0c\x0d', options)
+
+    assert raw(filled) == raw(expected)
+    assert filled.summary() == Ether(raw(expected)).summary()
+    assert filled.xid == 0xabcdef
+    assert filled[DHCP].options == Ether(raw(expected))[DHCP].options
+
+    # changed after thaw(), lengths and checksums are computed again
+    thaw(filled)
+    filled[BOOTP].secs = 5
+    expected[BOOTP].secs = 5
+    assert raw(filled / Raw(load=b'forge')) == raw(expected / Raw(load=b'forge'))
+
+
+def _v6_message(trid, duid, iaid, pd_iaid, server=False):
+    msg = IPv6(dst='ff02::1:2', src='fe80::1') / UDP(sport=546, dport=547)
+    msg /= DHCP6_Request() if server else DHCP6_Solicit()
+    msg.trid = trid
+    msg /= DHCP6OptClientId(duid=duid)
+    if server:
+        msg /= DHCP6OptServerId(duid=SERVER_DUID)
+    msg /= DHCP6OptIA_NA(iaid=iaid) / DHCP6OptIA_PD(iaid=pd_iaid)
+    msg /= DHCP6OptElapsedTime() / DHCP6OptOptReq(reqopts=[23, 24])
+    return msg
+
+
+def _v6_layout(trid, duid, iaid, pd_iaid, server=False):
+    options = [DHCP6OptClientId(duid=duid)]
+    if server:
+        options.append(DHCP6OptServerId(duid=SERVER_DUID))
+    options += [DHCP6OptIA_NA(iaid=iaid), DHCP6OptIA_PD(iaid=pd_iaid), DHCP6OptElapsedTime(),
+                DHCP6OptOptReq(reqopts=[23, 24])]
+    key, values = packet_template.dhcp6_layout(('head',), DHCP6_Request() if server else DHCP6_Solicit(), options)
+    values['trid'] = struct.pack('!I', trid)[1:]
+    return key, values
+
+
+@pytest.mark.v6
+@pytest.mark.parametrize('server', [False, True])
+def test_fill_v6(server):
+    templates = PacketTemplates()
+    first = _v6_message(0x123456, DUID_LL(lladdr=HW), 1, 2, server)
+    key, values = _v6_layout(0x123456, DUID_LL(lladdr=HW), 1, 2, server)
+    templates.add(key, first, packet_template.dhcp6_offsets(raw(first)), values)
+    template = templates.get(key)
+    assert template is not None
+
+    duid = DUID_LL(lladdr='00:0c:0a:0b:0c:0d')
+    other_key, other_values = _v6_layout(0xabcdef, duid, 7, 8, server)
+    assert other_key == key
+    filled = template.fill(other_values)
+    expected = _v6_message(0xabcdef, duid, 7, 8, server)
+
+    assert raw(filled) == raw(expected)
+    assert filled.summary() == IPv6(raw(expected)).summary()
+    assert filled.trid == 0xabcdef
+    assert (filled[DHCP6OptIA_NA].iaid, filled[DHCP6OptIA_PD].iaid) == (7, 8)
+    assert raw(filled[DHCP6OptClientId].duid) == raw(duid)
+
+    # changed after thaw(), lengths and checksums are computed again
+    thaw(filled)
+    filled.trid = 0x1234
+    expected.trid = 0x1234
+    assert raw(filled / Raw(load=b'forge')) == raw(expected / Raw(load=b'forge'))
+
+
+def test_not_templatable():
+    with pytest.raises(NotTemplatable):
+        packet_template.dhcp4_layout(('head',), [('message-type', 'discover'), ('max_dhcp_size', RandShort())])
+
+    # a message that is not UDP is remembered as built without template
+    templates = PacketTemplates()
+    msg = Ether() / IP() / BOOTP() / DHCP(options=['end'])
+    templates.add('key', msg, {}, {})
+    assert templates.known('key')
+    assert templates.get('key') is None
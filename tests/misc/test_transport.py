@@ -0,0 +1,183 @@
+# Copyright (C) 2023 Internet Systems Consortium, Inc. ("ISC")
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Remote execution layer run with LocalTransport.
+   Commands are wrapped, sudo password prompts answered and batch results split the same way
+   for SSH and local transport, so they are checked on this machine. sudo is replaced by a script
+   asking for the password like sudo -S -p does.
+"""
+
+# pylint: disable=protected-access
+
+import os
+import subprocess
+
+import pytest
+
+from src.forge_cfg import world
+from src.softwaresupport import transport
+from src.softwaresupport.transport import LocalTransport, RemoteBatch, SUDO_PROMPT
+
+pytestmark = [pytest.mark.unit]
+
+PASSWORD = 'forge-secret'
+
+FAKE_SUDO = f'''#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -S) shift ;;
+        -p) printf '%s' "$2" >&2; shift 2 ;;
+        -u) shift 2 ;;
+        *) break ;;
+    esac
+done
+read -r password
+[ "$password" = "{PASSWORD}" ] || {{ echo 'Sorry, try again.' >&2; exit 1; }}
+exec "$@"
+'''
+
+
+@pytest.fixture(name='local')
+def fixture_local(tmp_path):
+    """
+    LocalTransport of a user that is not root, with sudo asking for PASSWORD.
+    """
+    sudo = tmp_path / 'sudo'
+    sudo.write_text(FAKE_SUDO)
+    sudo.chmod(0o755)
+    local = LocalTransport()
+    local.privileged = False
+    local.home = str(tmp_path)
+    # login shells of batches set their own PATH, the script is called by its path
+    local.sudo_prefix = lambda sudo_user=None: f'{sudo} ' + transport.sudo_prefix(sudo_user)[len('sudo '):]
+    return local
+
+
+@pytest.mark.parametrize('cmd', [
+    'echo plain',
+    'echo "double $HOME" \'single $HOME\'',
+    'x=1; echo "${x}" `echo backticks` $(echo subshell)',
+    'printf "%s\\n" "back\\\\slash" \'tab\\t\'',
+])
+def test_wrap_command(cmd):
+    expected = subprocess.run(['/bin/bash', '-l', '-c', cmd], capture_output=True, check=True).stdout
+    wrapped = transport.wrap_command(cmd)
+    assert wrapped.startswith(transport.SHELL + ' "')
+    assert subprocess.run(wrapped, shell=True, capture_output=True, check=True).stdout == expected
+    assert transport.wrap_command(cmd, sudo=True, sudo_user='kea') == \
+        f"sudo -S -p '{SUDO_PROMPT}' -u \"kea\" {wrapped}"
+
+
+def _recv(chunks):
+    """
+    recv() of a stream giving the chunks and then EOF.
+    """
+    chunks = iter(chunks + [b''])
+    return lambda size: next(chunks)
+
+
+@pytest.mark.parametrize('chunks', [
+    [SUDO_PROMPT.encode(), b'output\n'],
+    [b'sudo pass', b'word:', b'output\n'],
+    [b'before ' + SUDO_PROMPT.encode(), b'output\n'],
+])
+def test_output_pump_answers_prompt(chunks):
+    answers = []
+    pump = transport._OutputPump(_recv(chunks), answers.append, '', False, PASSWORD)
+    pump.run()
+    assert answers == [f'{PASSWORD}\n'.encode()]
+    assert 'output' in pump.text()
+    assert SUDO_PROMPT not in pump.text()
+
+
+def test_output_pump_without_password():
+    answers = []
+    pump = transport._OutputPump(_recv([SUDO_PROMPT.encode(), b'out\n']), answers.append, '', False, None)
+    pump.run()
+    assert not answers
+    assert pump.text() == 'out'
+
+
+def test_sudo_prompt_answered(local):
+    result = local.execute('id -u; echo done', 'localhost', 'forge', PASSWORD, sudo=True, hide_all=True)
+    assert result.succeeded
+    assert result.splitlines() == [str(os.getuid()), 'done']
+    assert SUDO_PROMPT not in result.stderr
+
+    result = local.execute('echo done', 'localhost', 'forge', 'wrong', sudo=True, hide_all=True, ignore_errors=True)
+    assert result.failed
+    assert 'Sorry, try again.' in result.stderr
+
+
+def test_combine_stderr(local):
+    cmd = 'echo out; echo err >&2; exit 3'
+    result = local.execute(cmd, 'localhost', 'forge', PASSWORD, hide_all=True, ignore_errors=True)
+    # login shell may print its own warnings first
+    assert (str(result), result.stderr.splitlines()[-1], result.return_code) == ('out', 'err', 3)
+
+    result = local.execute(cmd, 'localhost', 'forge', PASSWORD, sudo=True, hide_all=True, ignore_errors=True,
+                           combine_stderr=True)
+    assert result.splitlines()[-2:] == ['out', 'err']
+    assert result.stderr == ''
+    assert result.return_code == 3
+
+
+def test_batch_script(local):
+    batch = RemoteBatch(local, 'localhost', 'forge', PASSWORD)
+    batch.run('echo "$HOME"')
+    batch.sudo('true', ignore_errors=True, sudo_user='kea')
+    script = batch._script('TOKEN')
+
+    assert script.count('TOKEN-0-begin') == 2
+    assert script.count('TOKEN-1-end') == 2
+    # only the command not ignoring errors stops the batch
+    assert script.count('[ $rc -eq 0 ] || exit 0') == 1
+    assert f"-S -p '{SUDO_PROMPT}' -u \"kea\" {transport.SHELL} \"$c\"" in script
+
+
+def test_batch_execute(local):
+    batch = RemoteBatch(local, 'localhost', 'forge', PASSWORD)
+    called = []
+    batch.add_callback(lambda: called.append(True))
+    first = batch.run('echo "one $((1 + 1))"; echo two; printf "no newline"', hide_all=True)
+    second = batch.sudo('echo out; echo err >&2; exit 5', hide_all=True, ignore_errors=True)
+    third = batch.sudo('cat; echo "after $((1 + 2))"', hide_all=True)
+    batch.execute()
+
+    assert first.result.splitlines() == ['one 2', 'two', 'no newline']
+    assert first.result.return_code == 0
+    assert (str(second.result), second.result.stderr.splitlines()[-1], second.result.return_code) == \
+        ('out', 'err', 5)
+    # commands get no input from the batch
+    assert str(third.result) == 'after 3'
+    assert called == [True]
+
+
+def test_batch_stops_on_failure(local):
+    batch = RemoteBatch(local, 'localhost', 'forge', PASSWORD)
+    batch.add_callback(lambda: pytest.fail('callback of failed batch called'))
+    first = batch.run('echo failing; exit 2', hide_all=True)
+    second = batch.run('echo never', hide_all=True)
+    with pytest.raises(AssertionError, match='exit code 2'):
+        batch.execute()
+    assert first.result.return_code == 2
+    assert second.result is None
+
+
+@pytest.mark.parametrize('address, local_address', [
+    ('127.0.0.1', True),
+    ('127.0.0.1:22', True),
+    ('127.0.0.1:2222', False),
+    ('localhost:2200', False),
+    ('192.0.2.254', False),
+])
+def test_is_local_transport(address, local_address, monkeypatch):
+    monkeypatch.setattr(world.f_cfg, 'transport', 'auto')
+    monkeypatch.setattr(world.f_cfg, '_local_transport', {})
+    monkeypatch.setattr(world.f_cfg, 'local_addresses', {'localhost', '127.0.0.1'})
+    monkeypatch.setattr(world.f_cfg, 'mgmt_username', 'forge')
+    monkeypatch.setattr(os, 'geteuid', lambda: 0)
+    assert world.f_cfg.is_local_transport(address) == local_address